@@ -0,0 +1,297 @@
+"""
+On-disk cache of Twitter API responses, for rerunning crawls without
+spending API calls
+"""
+
+# Standard Library modules
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+# Third party modules
+from twython import TwythonError
+
+# Local modules
+from crawler_metrics import get_default_registry
+from twitter_crawler import get_console_info_logger
+
+
+# Seconds responses are served from the cache, by endpoint
+DEFAULT_TTLS = {
+    'followers/ids': 7*24*60*60,
+    'friends/ids': 7*24*60*60,
+    'statuses/lookup': 30*24*60*60,
+    'statuses/user_timeline': 24*60*60,
+    'users/lookup': 7*24*60*60,
+}
+
+# Seconds responses from endpoints not in DEFAULT_TTLS are served from the cache
+DEFAULT_TTL = 24*60*60
+
+# Errors for a user or Tweet, rather than for the API call, are cached like responses
+CACHEABLE_ERROR_CODES = [401, 404]
+
+
+
+###  Functions  ###
+
+def add_api_cache_arguments(parser):
+    """
+    Adds the command line arguments used by open_api_response_cache()
+    to an argparse.ArgumentParser
+    """
+    parser.add_argument('--api-cache', dest='api_cache_file',
+                        help="SQLite file used to cache Twitter API responses")
+    parser.add_argument('--api-cache-mode', dest='api_cache_mode', default=ApiResponseCache.MODE_CACHE,
+                        choices=[ApiResponseCache.MODE_CACHE, ApiResponseCache.MODE_RECORD, ApiResponseCache.MODE_REPLAY],
+                        help="'cache' serves unexpired responses from the cache, 'record' always calls the API and "
+                        "saves the responses, 'replay' only serves responses from the cache (default: %(default)s)")
+    parser.add_argument('--api-cache-ttl', dest='api_cache_ttls', action='append', default=[],
+                        metavar='ENDPOINT=SECONDS', help="Override the number of seconds an endpoint's responses are cached")
+    parser.add_argument('--api-cache-max-mb', dest='api_cache_max_mb', type=float, default=1024,
+                        help="Maximum size of the compressed responses in the cache (default: %(default)s)")
+
+
+def open_api_response_cache(args, logger=None):
+    """
+    Returns an ApiResponseCache configured from the command line
+    arguments added by add_api_cache_arguments(), or None if no cache
+    file was specified
+    """
+    if not args.api_cache_file:
+        return None
+    ttls = dict(DEFAULT_TTLS)
+    for endpoint_ttl in args.api_cache_ttls:
+        endpoint, ttl = endpoint_ttl.split('=')
+        ttls[endpoint] = float(ttl)
+    return ApiResponseCache(args.api_cache_file, mode=args.api_cache_mode, ttls=ttls,
+                            max_bytes=int(args.api_cache_max_mb * 2**20), logger=logger)
+
+
+def get_request_key(endpoint, params):
+    """
+    Returns the cache key for an API call: a hash of the endpoint and
+    the parameters, normalized the way Twython sends them, so that
+    e.g. count=200 and count='200' have the same key
+    """
+    normalized_params = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = str(value).lower()
+        elif isinstance(value, (list, tuple)):
+            value = ','.join([unicode(item) for item in value])
+        normalized_params[name] = unicode(value)
+    request = endpoint + '\n' + json.dumps(normalized_params, sort_keys=True)
+    return hashlib.sha1(request.encode('utf8')).hexdigest()
+
+
+
+def _is_open_ended_request(params):
+    """
+    Returns True for API calls whose responses include every Tweet
+    newer than the since_id parameter
+    """
+    return params.get('since_id') is not None and params.get('max_id') is None
+
+
+
+###  Classes  ###
+
+class ApiResponseCache:
+    """
+    Twitter API responses stored in an SQLite database, keyed by the
+    endpoint and the (normalized) parameters of each API call.
+    Responses are stored as zlib compressed JSON.
+
+    The cache has three modes:
+
+      MODE_CACHE  - responses younger than their endpoint's TTL are
+                    served from the cache; other calls are made to the
+                    API, and their responses are saved
+      MODE_RECORD - every call is made to the API, and the responses
+                    are saved
+      MODE_REPLAY - every call is served from the cache, however old
+                    the response is.  Calls that aren't in the cache
+                    raise ApiResponseCacheMiss, so a replayed run never
+                    makes an API call.
+
+    In MODE_CACHE, calls that ask for everything newer than a since_id
+    (without a max_id) are always made to the API, because their
+    responses change whenever new Tweets are posted - a cached empty
+    timeline would hide a user's new Tweets until it expired.  Their
+    responses are still saved, so that they can be replayed.
+
+    HTTP 401 and 404 errors (protected or missing users and Tweets)
+    are cached like responses, and raised again as TwythonErrors with
+    the same error code.
+
+    When the compressed responses take up more than max_bytes, the
+    least recently used responses are evicted.
+
+    Usage:
+      response_cache = ApiResponseCache('api_responses.cache')
+      crawler = CrawlTwitterTimelines(twython, response_cache=response_cache)
+      ...
+      response_cache.close()
+    """
+    MODE_CACHE = 'cache'
+    MODE_RECORD = 'record'
+    MODE_REPLAY = 'replay'
+
+    def __init__(self, db_filename, mode=MODE_CACHE, ttls=None, default_ttl=DEFAULT_TTL, max_bytes=2**30,
+                 compression_level=6, logger=None, metrics=None):
+        """
+        ttls -- a dictionary mapping endpoints (e.g.
+        'statuses/user_timeline') to the number of seconds their
+        responses are served from the cache in MODE_CACHE.  Endpoints
+        that aren't in the dictionary use default_ttl.  Defaults to
+        DEFAULT_TTLS.
+
+        metrics -- an optional crawler_metrics.MetricsRegistry instance.
+        If not specified, the default registry is used.
+        """
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        if ttls is None:
+            ttls = DEFAULT_TTLS
+        self._ttls = ttls
+        self._default_ttl = default_ttl
+        self._mode = mode
+        self._max_bytes = max_bytes
+        self._compression_level = compression_level
+
+        if metrics is None:
+            metrics = get_default_registry()
+        self._requests_metric = metrics.counter('trawler_api_cache_requests_total',
+                                                "Twitter API calls looked up in the response cache",
+                                                ['endpoint', 'result'])
+        self._bytes_metric = metrics.gauge('trawler_api_cache_bytes',
+                                           "Size of the compressed responses in the response cache").labels()
+
+        # The connection is shared by every thread using the cache
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_filename, check_same_thread=False)
+        self._db.text_factory = str
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                              request_key TEXT PRIMARY KEY,
+                              endpoint TEXT NOT NULL,
+                              created REAL NOT NULL,
+                              last_used REAL NOT NULL,
+                              size INTEGER NOT NULL,
+                              response BLOB NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._db.commit()
+
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self._bytes_metric.set(self._total_bytes)
+
+    def get_or_fetch(self, endpoint, params, fetch):
+        """
+        Returns the response to an API call, either from the cache or
+        by calling fetch(**params) - depending on the cache mode
+        """
+        request_key = get_request_key(endpoint, params)
+
+        if self._mode == self.MODE_CACHE and _is_open_ended_request(params):
+            self._requests_metric.labels(endpoint, 'bypass').inc()
+        elif self._mode != self.MODE_RECORD:
+            entry = self._get_entry(request_key)
+            if entry is not None:
+                created, response = entry
+                if self._mode == self.MODE_REPLAY or time.time() - created < self._ttls.get(endpoint, self._default_ttl):
+                    self._requests_metric.labels(endpoint, 'hit').inc()
+                    if isinstance(response, dict) and '__twython_error__' in response:
+                        error = response['__twython_error__']
+                        raise TwythonError(error['message'], error_code=error['error_code'])
+                    return response
+                self._requests_metric.labels(endpoint, 'expired').inc()
+            else:
+                self._requests_metric.labels(endpoint, 'miss').inc()
+            if self._mode == self.MODE_REPLAY:
+                raise ApiResponseCacheMiss("No cached response for '%s' with parameters %s" % (endpoint, params))
+
+        try:
+            response = fetch(**params)
+        except TwythonError as e:
+            if e.error_code in CACHEABLE_ERROR_CODES:
+                self.put(request_key, endpoint,
+                         {'__twython_error__': {'message': unicode(e), 'error_code': e.error_code}})
+            raise
+        self.put(request_key, endpoint, response)
+        return response
+
+    def put(self, request_key, endpoint, response, now=None):
+        if now is None:
+            now = time.time()
+        compressed_response = zlib.compress(json.dumps(response), self._compression_level)
+        with self._lock:
+            row = self._db.execute("SELECT size FROM responses WHERE request_key=?", (request_key,)).fetchone()
+            if row is not None:
+                self._total_bytes -= row[0]
+            self._db.execute("INSERT OR REPLACE INTO responses (request_key, endpoint, created, last_used, size, response) "
+                             "VALUES (?, ?, ?, ?, ?, ?)",
+                             (request_key, endpoint, now, now, len(compressed_response), buffer(compressed_response)))
+            self._total_bytes += len(compressed_response)
+            if self._total_bytes > self._max_bytes:
+                self._evict()
+            self._db.commit()
+            self._bytes_metric.set(self._total_bytes)
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of cached responses
+        ('responses') and their compressed size in bytes ('bytes')
+        """
+        with self._lock:
+            response_count = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {'responses': response_count, 'bytes': self._total_bytes}
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def _evict(self):
+        # Evict down to 90% of the limit, so that eviction doesn't run for every new response
+        target_bytes = self._max_bytes * 0.9
+        evicted_count = 0
+        while self._total_bytes > target_bytes:
+            rows = self._db.execute("SELECT request_key, size FROM responses ORDER BY last_used LIMIT 1000").fetchall()
+            if not rows:
+                break
+            for request_key, size in rows:
+                if self._total_bytes <= target_bytes:
+                    break
+                self._db.execute("DELETE FROM responses WHERE request_key=?", (request_key,))
+                self._total_bytes -= size
+                evicted_count += 1
+        self._logger.info("Evicted %d responses from the API response cache" % evicted_count)
+
+    def _get_entry(self, request_key):
+        """
+        Returns a (created time, response) tuple for request_key, or
+        None if the response isn't cached
+        """
+        with self._lock:
+            row = self._db.execute("SELECT created, response FROM responses WHERE request_key=?",
+                                   (request_key,)).fetchone()
+            if row is None:
+                return None
+            # Written to disk with the next put() or close()
+            self._db.execute("UPDATE responses SET last_used=? WHERE request_key=?", (time.time(), request_key))
+        return (row[0], json.loads(zlib.decompress(row[1])))
+
+
+class ApiResponseCacheMiss(Exception):
+    """
+    Raised in replay mode for API calls whose responses aren't cached
+    """
+    pass
@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+
+"""
+Coordinator for crawls split across several worker processes or
+machines.
+
+The coordinator partitions a list of Twitter users into work units of
+unit_size users.  Workers (see crawl_worker.py) claim a unit, crawl its
+users with their own API credentials, and acknowledge the unit with
+the outcome for each user.  A claimed unit is leased to its worker for
+lease_seconds; if the worker crashes or loses its connection, the lease
+expires and the unit is handed to another worker, up to max_attempts
+times in total.
+
+Workers on the coordinator's machine can open the coordinator's SQLite
+database directly.  Workers on other machines connect to a
+CrawlCoordinatorServer, which serves the coordinator over TCP with one
+JSON request and one JSON response per line:
+
+  {"method": "claim_unit", "params": {"worker_id": "node1-1234"}}
+  {"result": {"unit_id": 7, "attempt": 1, "screen_names": [...], ...}}
+
+The server has no authentication, so it only listens on 127.0.0.1
+unless --host is specified.  To start a coordinator for the users in
+screen_names.txt that accepts workers from other machines:
+
+  crawl_coordinator.py crawl.coordinator --add-screen-names screen_names.txt --host 0.0.0.0 --port 9000
+"""
+
+# Standard Library modules
+import argparse
+import json
+import re
+import socket
+import sqlite3
+import SocketServer
+import threading
+import time
+
+# Local modules
+from twitter_crawler import get_console_info_logger, get_screen_names_from_file
+
+
+# Methods of CrawlCoordinator that can be called by a CrawlCoordinatorClient, and
+# the parameters they accept.  The clock is never set by a client: a 'now'
+# parameter far in the future would expire every other worker's lease.
+REMOTE_METHODS = {
+    'acknowledge_unit': ['unit_id', 'attempt', 'results'],
+    'claim_unit': ['worker_id'],
+    'fail_unit': ['unit_id', 'attempt', 'error'],
+    'get_status_counts': [],
+    'is_finished': [],
+    'renew_lease': ['unit_id', 'attempt'],
+}
+
+
+###  Functions  ###
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve work units of Twitter users to crawl workers")
+    parser.add_argument('db_file', help="SQLite database for the work units (created if it doesn't exist)")
+    parser.add_argument('--add-screen-names', dest='screen_name_file',
+                        help="File with one screen name per line to add to the crawl")
+    parser.add_argument('--unit-size', dest='unit_size', type=int, default=100,
+                        help="Number of users in each work unit")
+    parser.add_argument('--lease-seconds', dest='lease_seconds', type=float, default=30*60,
+                        help="Seconds a worker can hold a unit without renewing its lease")
+    parser.add_argument('--max-attempts', dest='max_attempts', type=int, default=3,
+                        help="Number of times a unit is handed out before it is marked as failed")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Address to listen on - use 0.0.0.0 to accept workers on other machines")
+    parser.add_argument('--port', type=int, default=9000)
+    args = parser.parse_args(argv)
+
+    logger = get_console_info_logger()
+    coordinator = CrawlCoordinator(args.db_file, lease_seconds=args.lease_seconds,
+                                   max_attempts=args.max_attempts, logger=logger)
+    if args.screen_name_file:
+        screen_names = get_screen_names_from_file(args.screen_name_file)
+        unit_count = coordinator.add_screen_names(screen_names, args.unit_size)
+        logger.info("Added %d users in %d work units" % (len(screen_names), unit_count))
+
+    server = CrawlCoordinatorServer(coordinator, args.host, args.port)
+    logger.info("Serving work units on %s:%d" % server.server_address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        coordinator.close()
+
+
+def open_crawl_coordinator(address, logger=None):
+    """
+    Returns a CrawlCoordinatorClient if address looks like
+    'host:port', or else a CrawlCoordinator for the SQLite database
+    file at address
+    """
+    match = re.match(r'^([\w.-]+):(\d+)$', address)
+    if match:
+        return CrawlCoordinatorClient(match.group(1), int(match.group(2)))
+    return CrawlCoordinator(address, logger=logger)
+
+
+
+###  Classes  ###
+
+class CrawlCoordinator:
+    """
+    Work units of Twitter users, and their leases, stored in an
+    SQLite database.
+
+    Each unit is 'queued' until a worker claims it, 'leased' while a
+    worker crawls it, and 'done' once the worker acknowledges it.  A
+    unit whose lease expires, or which a worker reports as failed, is
+    queued again - unless it has already been handed out max_attempts
+    times, in which case it is marked as 'failed'.
+
+    A lease is identified by the unit ID and the attempt number
+    returned by claim_unit().  Renewals and acknowledgments for a
+    lease that has expired and been handed to another worker are
+    rejected, so a unit is only ever acknowledged once.
+
+    Claims are made in 'BEGIN IMMEDIATE' transactions, so any number
+    of processes on the same machine can share the database file.
+
+    Usage:
+      coordinator = CrawlCoordinator('crawl.coordinator')
+      coordinator.add_screen_names(screen_names)
+      unit = coordinator.claim_unit('worker1')
+      ...
+      coordinator.acknowledge_unit(unit['unit_id'], unit['attempt'], results)
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_LEASED = 'leased'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, db_filename, lease_seconds=30*60, max_attempts=3, logger=None):
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        self._lease_seconds = lease_seconds
+        self._max_attempts = max_attempts
+
+        # The connection is shared by the threads of a CrawlCoordinatorServer
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_filename, timeout=60, isolation_level=None, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS units (
+                              unit_id INTEGER PRIMARY KEY,
+                              status TEXT NOT NULL,
+                              attempts INTEGER NOT NULL,
+                              worker_id TEXT,
+                              lease_expires REAL,
+                              error TEXT,
+                              updated REAL NOT NULL)""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS unit_users (
+                              unit_id INTEGER NOT NULL,
+                              screen_name TEXT NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS unit_users_unit ON unit_users (unit_id)")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS results (
+                              screen_name_key TEXT PRIMARY KEY,
+                              screen_name TEXT NOT NULL,
+                              unit_id INTEGER NOT NULL,
+                              worker_id TEXT,
+                              tweet_count INTEGER,
+                              error_code INTEGER,
+                              completed REAL NOT NULL)""")
+
+    def add_screen_names(self, screen_names, unit_size=100):
+        """
+        Partitions screen_names into queued work units of at most
+        unit_size users each.  Returns the number of units added.
+        """
+        now = time.time()
+        unit_count = 0
+        with self._lock:
+            self._begin()
+            try:
+                for start in range(0, len(screen_names), unit_size):
+                    unit_id = self._db.execute("INSERT INTO units (status, attempts, updated) VALUES (?, 0, ?)",
+                                               (self.STATUS_QUEUED, now)).lastrowid
+                    self._db.executemany("INSERT INTO unit_users (unit_id, screen_name) VALUES (?, ?)",
+                                         [(unit_id, screen_name) for screen_name in screen_names[start:start+unit_size]])
+                    unit_count += 1
+                self._db.execute("COMMIT")
+            except:
+                self._db.execute("ROLLBACK")
+                raise
+        return unit_count
+
+    def claim_unit(self, worker_id, now=None):
+        """
+        Leases the oldest queued unit to worker_id, and returns a
+        dictionary with the keys 'unit_id', 'attempt', 'screen_names'
+        and 'lease_expires'.  Returns None if no units are queued.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._begin()
+            try:
+                self._expire_leases(now)
+                row = self._db.execute("SELECT unit_id, attempts FROM units WHERE status=? ORDER BY unit_id LIMIT 1",
+                                       (self.STATUS_QUEUED,)).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                unit_id, attempts = row
+                lease_expires = now + self._lease_seconds
+                self._db.execute("UPDATE units SET status=?, attempts=?, worker_id=?, lease_expires=?, updated=? "
+                                 "WHERE unit_id=?",
+                                 (self.STATUS_LEASED, attempts + 1, worker_id, lease_expires, now, unit_id))
+                screen_names = [r[0] for r in self._db.execute(
+                    "SELECT screen_name FROM unit_users WHERE unit_id=? ORDER BY rowid", (unit_id,))]
+                self._db.execute("COMMIT")
+            except:
+                self._db.execute("ROLLBACK")
+                raise
+        self._logger.info("Leased unit %d (attempt %d) to worker '%s'" % (unit_id, attempts + 1, worker_id))
+        return {'unit_id': unit_id, 'attempt': attempts + 1, 'screen_names': screen_names,
+                'lease_expires': lease_expires}
+
+    def renew_lease(self, unit_id, attempt, now=None):
+        """
+        Extends the lease on a unit by lease_seconds.  Returns False
+        if the lease has been lost (i.e. the unit was handed to
+        another worker), in which case the worker should stop crawling
+        the unit.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return self._db.execute("UPDATE units SET lease_expires=?, updated=? "
+                                    "WHERE unit_id=? AND attempts=? AND status=?",
+                                    (now + self._lease_seconds, now, unit_id, attempt, self.STATUS_LEASED)).rowcount > 0
+
+    def acknowledge_unit(self, unit_id, attempt, results, now=None):
+        """
+        Marks a leased unit as done, and records the outcome for each
+        of its users.  Returns False if the lease has been lost.
+
+        results -- a list of (screen_name, tweet_count, error_code)
+        tuples.  Acknowledging the same lease twice is harmless, so
+        a worker can safely resend an acknowledgment.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._begin()
+            try:
+                row = self._db.execute("SELECT status, attempts, worker_id FROM units WHERE unit_id=?",
+                                       (unit_id,)).fetchone()
+                if row is None or row[1] != attempt or row[0] not in [self.STATUS_LEASED, self.STATUS_DONE]:
+                    self._db.execute("COMMIT")
+                    return False
+                status, attempts, worker_id = row
+                if status == self.STATUS_LEASED:
+                    self._db.execute("UPDATE units SET status=?, lease_expires=NULL, updated=? WHERE unit_id=?",
+                                     (self.STATUS_DONE, now, unit_id))
+                    self._db.executemany("INSERT OR REPLACE INTO results (screen_name_key, screen_name, unit_id, "
+                                         "worker_id, tweet_count, error_code, completed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                         [(screen_name.lower(), screen_name, unit_id, worker_id,
+                                           tweet_count, error_code, now)
+                                          for screen_name, tweet_count, error_code in results])
+                self._db.execute("COMMIT")
+            except:
+                self._db.execute("ROLLBACK")
+                raise
+        return True
+
+    def fail_unit(self, unit_id, attempt, error, now=None):
+        """
+        Releases a leased unit after an error, so that it can be
+        retried by any worker.  Returns False if the lease has been
+        lost.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._begin()
+            try:
+                row = self._db.execute("SELECT attempts FROM units WHERE unit_id=? AND attempts=? AND status=?",
+                                       (unit_id, attempt, self.STATUS_LEASED)).fetchone()
+                if row is not None:
+                    self._release_unit(unit_id, row[0], error, now)
+                self._db.execute("COMMIT")
+            except:
+                self._db.execute("ROLLBACK")
+                raise
+        return row is not None
+
+    def get_results(self):
+        """
+        Returns a dictionary mapping the screen name of every user in
+        an acknowledged unit to a (tweet_count, error_code) tuple
+        """
+        with self._lock:
+            return dict((row[0], row[1:]) for row in
+                        self._db.execute("SELECT screen_name, tweet_count, error_code FROM results"))
+
+    def get_status_counts(self):
+        """
+        Returns a dictionary mapping each unit status to the number of
+        units with that status
+        """
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM units GROUP BY status"))
+
+    def is_finished(self):
+        """
+        Returns True if every unit is either done or failed
+        """
+        counts = self.get_status_counts()
+        return counts.get(self.STATUS_QUEUED, 0) == 0 and counts.get(self.STATUS_LEASED, 0) == 0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _begin(self):
+        # Take the database write lock now, instead of at the first write, so
+        # that two processes can't both select the same queued unit
+        self._db.execute("BEGIN IMMEDIATE")
+
+    def _expire_leases(self, now):
+        for unit_id, attempts, worker_id in self._db.execute(
+                "SELECT unit_id, attempts, worker_id FROM units WHERE status=? AND lease_expires<?",
+                (self.STATUS_LEASED, now)).fetchall():
+            self._logger.warn("Lease on unit %d held by worker '%s' expired" % (unit_id, worker_id))
+            self._release_unit(unit_id, attempts, 'lease expired', now)
+
+    def _release_unit(self, unit_id, attempts, error, now):
+        if attempts >= self._max_attempts:
+            self._logger.warn("Unit %d failed after %d attempts: %s" % (unit_id, attempts, error))
+            status = self.STATUS_FAILED
+        else:
+            status = self.STATUS_QUEUED
+        self._db.execute("UPDATE units SET status=?, worker_id=NULL, lease_expires=NULL, error=?, updated=? "
+                         "WHERE unit_id=?", (status, error, now, unit_id))
+
+
+class CrawlCoordinatorClient:
+    """
+    Calls the methods of a CrawlCoordinator served by a
+    CrawlCoordinatorServer.  The client has the same claim_unit(),
+    renew_lease(), acknowledge_unit(), fail_unit(),
+    get_status_counts() and is_finished() methods as a
+    CrawlCoordinator.
+
+    If the connection to the server is lost, each call reconnects and
+    is resent once before the socket.error is raised.
+    """
+    def __init__(self, host, port, timeout=60):
+        self._address = (host, port)
+        self._timeout = timeout
+        self._socket = None
+        self._socket_file = None
+
+    def acknowledge_unit(self, unit_id, attempt, results):
+        return self._call('acknowledge_unit', {'unit_id': unit_id, 'attempt': attempt, 'results': results})
+
+    def claim_unit(self, worker_id):
+        return self._call('claim_unit', {'worker_id': worker_id})
+
+    def fail_unit(self, unit_id, attempt, error):
+        return self._call('fail_unit', {'unit_id': unit_id, 'attempt': attempt, 'error': error})
+
+    def get_status_counts(self):
+        return self._call('get_status_counts', {})
+
+    def is_finished(self):
+        return self._call('is_finished', {})
+
+    def renew_lease(self, unit_id, attempt):
+        return self._call('renew_lease', {'unit_id': unit_id, 'attempt': attempt})
+
+    def close(self):
+        if self._socket is not None:
+            self._socket_file.close()
+            self._socket.close()
+            self._socket = None
+            self._socket_file = None
+
+    def _call(self, method, params):
+        request = json.dumps({'method': method, 'params': params}) + '\n'
+        try:
+            response = self._send_request(request)
+        except socket.error:
+            self.close()
+            response = self._send_request(request)
+        if 'error' in response:
+            raise CrawlCoordinatorError(response['error'])
+        return response['result']
+
+    def _send_request(self, request):
+        if self._socket is None:
+            self._socket = socket.create_connection(self._address, self._timeout)
+            self._socket_file = self._socket.makefile('rb')
+        self._socket.sendall(request)
+        line = self._socket_file.readline()
+        if not line:
+            raise socket.error("Connection closed by the coordinator")
+        return json.loads(line)
+
+
+class CrawlCoordinatorError(Exception):
+    pass
+
+
+class CrawlCoordinatorServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    Multithreaded TCP server for a CrawlCoordinator.  Pass port=0 to
+    pick any free port.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, coordinator, host='127.0.0.1', port=0):
+        SocketServer.TCPServer.__init__(self, (host, port), _CoordinatorRequestHandler)
+        self.coordinator = coordinator
+        self._thread = None
+
+    def start(self):
+        """
+        Starts serving requests on a background thread
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+class _CoordinatorRequestHandler(SocketServer.StreamRequestHandler):
+    def handle(self):
+        while 1:
+            line = self.rfile.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                if request.get('method') not in REMOTE_METHODS:
+                    raise CrawlCoordinatorError("Unknown method '%s'" % request.get('method'))
+                params = dict((str(key), value) for key, value in request.get('params', {}).items())
+                unexpected_params = sorted(set(params) - set(REMOTE_METHODS[request['method']]))
+                if unexpected_params:
+                    raise CrawlCoordinatorError("Unexpected parameters for '%s': %s" %
+                                                (request['method'], ", ".join(unexpected_params)))
+                response = {'result': getattr(self.server.coordinator, request['method'])(**params)}
+            except Exception as e:
+                response = {'error': "%s: %s" % (e.__class__.__name__, e)}
+            self.wfile.write(json.dumps(response) + '\n')
+            self.wfile.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Persistent, deduplicated queue of Twitter users for multi-hop crawls
+"""
+
+# Standard Library modules
+import sqlite3
+import time
+
+# Local modules
+from twitter_crawler import get_console_info_logger
+
+
+class CrawlFrontier:
+    """
+    Breadth-first crawl frontier backed by an SQLite database.
+
+    Every user ever added to the frontier is remembered, along with
+    its distance (depth) from the nearest seed user, a priority, and
+    its crawl status.  A user is only ever queued once, no matter how
+    many other users it is reachable from.
+
+    Users are popped from the queue in ascending order of priority,
+    with ties broken by depth and then by the order users were added.
+    The default priority is the user's depth, which gives a
+    breadth-first crawl; callers can pass any other number (e.g. the
+    negated follower count) to crawl the most "important" users first.
+
+    Because the database is updated as the crawl progresses, a crawl
+    can be stopped at any time and resumed later with no repeated
+    work.  Users that were popped but never marked as done (e.g.
+    because the crawler was killed) are requeued when the frontier is
+    reopened.
+
+    Usage:
+      frontier = CrawlFrontier('crawl.frontier')
+      frontier.add_users(seed_screen_names, 0)
+      while 1:
+          next_user = frontier.pop_next_user()
+          if next_user is None:
+              break
+          screen_name, depth = next_user
+          ...
+          frontier.add_users(neighbor_screen_names, depth+1)
+          frontier.mark_done(screen_name)
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_IN_PROGRESS = 'in_progress'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    def __init__(self, db_filename, logger=None):
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        self._db = sqlite3.connect(db_filename)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS frontier (
+                              screen_name_key TEXT PRIMARY KEY,
+                              screen_name TEXT NOT NULL,
+                              depth INTEGER NOT NULL,
+                              priority REAL NOT NULL,
+                              status TEXT NOT NULL,
+                              error_code INTEGER,
+                              updated REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS frontier_queue ON frontier (status, priority, depth)")
+
+        # Requeue users whose crawl was interrupted
+        requeued = self._db.execute("UPDATE frontier SET status=? WHERE status=?",
+                                    (self.STATUS_QUEUED, self.STATUS_IN_PROGRESS)).rowcount
+        self._db.commit()
+        if requeued:
+            self._logger.info("Requeued %d users whose crawl was interrupted" % requeued)
+
+        # Load every known user once, so that deduplication doesn't need a query per user
+        self._known_screen_name_keys = set(row[0] for row in self._db.execute("SELECT screen_name_key FROM frontier"))
+
+    def add_user(self, screen_name, depth, priority=None):
+        """
+        Queues screen_name at the specified depth.  Returns False if
+        the user was already known to the frontier.
+        """
+        return self.add_users([screen_name], depth, [priority]) > 0
+
+    def add_users(self, screen_names, depth, priorities=None):
+        """
+        Queues every screen name in screen_names that is not already
+        known to the frontier, in a single transaction.  Returns the
+        number of users added.
+
+        priorities -- an optional list of priorities, one per screen
+        name.  A priority of None means "use the depth".
+        """
+        if priorities is None:
+            priorities = [None] * len(screen_names)
+
+        now = time.time()
+        rows = []
+        for screen_name, priority in zip(screen_names, priorities):
+            screen_name_key = screen_name.lower()
+            if screen_name_key in self._known_screen_name_keys:
+                continue
+            self._known_screen_name_keys.add(screen_name_key)
+            if priority is None:
+                priority = depth
+            rows.append((screen_name_key, screen_name, depth, priority, self.STATUS_QUEUED, now))
+
+        self._db.executemany("INSERT INTO frontier (screen_name_key, screen_name, depth, priority, status, updated) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._db.commit()
+        return len(rows)
+
+    def pop_next_user(self):
+        """
+        Returns a (screen_name, depth) tuple for the queued user with
+        the lowest priority, and marks the user as in progress.
+        Returns None if no users are queued.
+        """
+        row = self._db.execute("SELECT screen_name_key, screen_name, depth FROM frontier WHERE status=? "
+                               "ORDER BY priority, depth, rowid LIMIT 1", (self.STATUS_QUEUED,)).fetchone()
+        if row is None:
+            return None
+        screen_name_key, screen_name, depth = row
+        self._set_status(screen_name_key, self.STATUS_IN_PROGRESS)
+        return (screen_name, depth)
+
+    def mark_done(self, screen_name):
+        self._set_status(screen_name.lower(), self.STATUS_DONE)
+
+    def mark_failed(self, screen_name, error_code=None):
+        self._set_status(screen_name.lower(), self.STATUS_FAILED, error_code)
+
+    def is_known(self, screen_name):
+        return screen_name.lower() in self._known_screen_name_keys
+
+    def get_status(self, screen_name):
+        """
+        Returns the crawl status of screen_name, or None if the user
+        is not known to the frontier
+        """
+        row = self._db.execute("SELECT status FROM frontier WHERE screen_name_key=?", (screen_name.lower(),)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def get_status_counts(self):
+        """
+        Returns a dictionary mapping each crawl status to the number
+        of users with that status
+        """
+        return dict(self._db.execute("SELECT status, COUNT(*) FROM frontier GROUP BY status"))
+
+    def close(self):
+        self._db.close()
+
+    def _set_status(self, screen_name_key, status, error_code=None):
+        self._db.execute("UPDATE frontier SET status=?, error_code=?, updated=? WHERE screen_name_key=?",
+                         (status, error_code, time.time(), screen_name_key))
+        self._db.commit()
@@ -0,0 +1,211 @@
+"""
+SQLite manifest recording which Twitter users have been crawled
+"""
+
+# Standard Library modules
+import os
+import re
+import sqlite3
+import time
+
+# Local modules
+from tweet_segment_store import TweetSegmentStore
+from tweet_writer import COMPRESSION_EXTENSIONS
+from twitter_crawler import get_console_info_logger
+
+
+class CrawlManifest:
+    """
+    Records the outcome of crawling each Twitter user in an SQLite
+    database: the crawl status, the number of Tweets downloaded, the
+    largest Tweet ID seen, the time of the last crawl and the HTTP
+    error code (if any).
+
+    The whole manifest is loaded into memory when it is opened, so
+    checking whether a user has already been crawled is a dictionary
+    lookup instead of an os.path.exists() call per user.  Updates are
+    buffered and written to the database in batches of batch_size
+    records per transaction; call flush() or close() to write any
+    buffered updates.
+
+    Usage:
+      manifest = CrawlManifest('crawl.manifest')
+      if not manifest.has_user(screen_name):
+          ...
+          manifest.record_tweets(screen_name, tweets)
+      manifest.close()
+    """
+    STATUS_CRAWLED = 'crawled'
+    STATUS_TOO_FEW_TWEETS = 'too_few_tweets'
+    STATUS_UNAVAILABLE = 'unavailable'
+
+    def __init__(self, db_filename, batch_size=100, logger=None):
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        self._batch_size = batch_size
+        self._pending_rows = []
+
+        self._db = sqlite3.connect(db_filename)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS manifest (
+                              screen_name_key TEXT PRIMARY KEY,
+                              screen_name TEXT NOT NULL,
+                              status TEXT NOT NULL,
+                              tweet_count INTEGER,
+                              max_id INTEGER,
+                              last_crawled REAL,
+                              error_code INTEGER)""")
+        self._db.commit()
+
+        # screen_name_key -> (screen_name, status, tweet_count, max_id, last_crawled, error_code)
+        self._users = {}
+        for row in self._db.execute("SELECT * FROM manifest"):
+            self._users[row[0]] = row[1:]
+
+    def has_user(self, screen_name):
+        return screen_name.lower() in self._users
+
+    def get_status(self, screen_name):
+        """
+        Returns the crawl status of screen_name, or None if the user
+        has not been crawled
+        """
+        return self._get_field(screen_name, 1)
+
+    def get_tweet_count(self, screen_name):
+        return self._get_field(screen_name, 2)
+
+    def get_max_id(self, screen_name):
+        return self._get_field(screen_name, 3)
+
+    def get_last_crawled(self, screen_name):
+        return self._get_field(screen_name, 4)
+
+    def get_error_code(self, screen_name):
+        return self._get_field(screen_name, 5)
+
+    def get_screen_names(self, status=None):
+        """
+        Returns the screen names of all users in the manifest, or of
+        all users with the specified status
+        """
+        return [user[0] for user in self._users.itervalues() if status is None or user[1] == status]
+
+    def record_tweets(self, screen_name, tweets, status=STATUS_CRAWLED):
+        """
+        Records that the Tweets in the list tweets were downloaded for
+        screen_name.  If tweets is empty, the largest Tweet ID from any
+        previous crawl of the user is kept.
+        """
+        if tweets:
+            max_id = max(tweet['id'] for tweet in tweets)
+        else:
+            max_id = self.get_max_id(screen_name)
+        self._record(screen_name, status, len(tweets), max_id, None)
+
+    def record_error(self, screen_name, error_code):
+        """
+        Records that the Tweets for screen_name could not be downloaded
+        (e.g. because of an HTTP 404 or 401 error)
+        """
+        self._record(screen_name, self.STATUS_UNAVAILABLE, 0, self.get_max_id(screen_name), error_code)
+
+    def import_tweet_files(self, tweet_path):
+        """
+        Adds every [screen_name].tweets file (compressed or not) in
+        tweet_path that is not already in the manifest.  Empty files,
+        which earlier versions of these scripts used to mark
+        unavailable users, are recorded as unavailable.  The segment
+        files of a TweetSegmentStore are skipped - use
+        import_segment_store() for those.
+
+        This is meant to be run once, when a manifest is first created
+        for an existing crawl directory.
+        """
+        tweet_file_extensions = ['.tweets' + extension for extension in COMPRESSION_EXTENSIONS.values()]
+        imported = 0
+        for filename in os.listdir(tweet_path):
+            for extension in tweet_file_extensions:
+                if filename.endswith(extension):
+                    screen_name = filename[:-len(extension)]
+                    break
+            else:
+                continue
+            if re.match(TweetSegmentStore.SEGMENT_FILENAME_PATTERN, filename) or self.has_user(screen_name):
+                continue
+            if os.path.getsize(os.path.join(tweet_path, filename)) > 0:
+                self._record(screen_name, self.STATUS_CRAWLED, None, None, None)
+            else:
+                self._record(screen_name, self.STATUS_UNAVAILABLE, 0, None, None)
+            imported += 1
+        self.flush()
+        self._logger.info("Imported %d existing Tweet files from '%s' into crawl manifest" % (imported, tweet_path))
+
+    def import_segment_store(self, store):
+        """
+        Adds every user in the index of the TweetSegmentStore store
+        that is not already in the manifest, with the Tweet count and
+        largest Tweet ID from the index.
+
+        Like import_tweet_files(), this is meant to be run once, when a
+        manifest is first created for an existing store.
+        """
+        imported = 0
+        for screen_name in store.get_screen_names():
+            if self.has_user(screen_name):
+                continue
+            self._record(screen_name, self.STATUS_CRAWLED, store.get_tweet_count(screen_name),
+                         store.get_max_id(screen_name), None)
+            imported += 1
+        self.flush()
+        self._logger.info("Imported %d users from Tweet segment store into crawl manifest" % imported)
+
+    def flush(self):
+        if self._pending_rows:
+            self._db.executemany("INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?)", self._pending_rows)
+            self._db.commit()
+            self._pending_rows = []
+
+    def close(self):
+        self.flush()
+        self._db.close()
+
+    def _get_field(self, screen_name, field_index):
+        user = self._users.get(screen_name.lower())
+        if user is None:
+            return None
+        return user[field_index]
+
+    def _record(self, screen_name, status, tweet_count, max_id, error_code):
+        screen_name_key = screen_name.lower()
+        user = (screen_name, status, tweet_count, max_id, time.time(), error_code)
+        self._users[screen_name_key] = user
+        self._pending_rows.append((screen_name_key,) + user)
+        if len(self._pending_rows) >= self._batch_size:
+            self.flush()
+
+
+
+def open_crawl_manifest(tweet_path, manifest_filename=None, logger=None, store=None):
+    """
+    Opens the crawl manifest for the Tweet files in tweet_path.  If
+    manifest_filename is not specified, the manifest is stored in
+    tweet_path as 'crawl.manifest'.
+
+    When a new manifest is created, any existing [screen_name].tweets
+    files in tweet_path are imported into it.  If tweet_path is the
+    directory of the TweetSegmentStore store, the users in the store's
+    index are imported instead.
+    """
+    if manifest_filename is None:
+        manifest_filename = os.path.join(tweet_path, 'crawl.manifest')
+    is_new_manifest = not os.path.exists(manifest_filename)
+    manifest = CrawlManifest(manifest_filename, logger=logger)
+    if is_new_manifest:
+        if store is not None:
+            manifest.import_segment_store(store)
+        else:
+            manifest.import_tweet_files(tweet_path)
+    return manifest
@@ -0,0 +1,364 @@
+"""
+Stage-level profiling of crawl and filter runs
+"""
+
+# Standard Library modules
+import collections
+import os
+import sys
+import thread
+import threading
+import time
+
+
+# Stages recorded by the crawler, writer and filter classes
+STAGES = ['network', 'sleep', 'read', 'parse', 'filter', 'write']
+
+# Default number of seconds between stack samples
+DEFAULT_SAMPLE_INTERVAL = 0.01
+
+
+
+###  Functions  ###
+
+def add_profiler_arguments(parser):
+    """
+    Adds the command line arguments used by start_profiler() to an
+    argparse.ArgumentParser
+    """
+    parser.add_argument('--profile', metavar='PREFIX',
+                        help="Profile the run, and on exit write PREFIX.folded (sampled stacks for flamegraph.pl) "
+                        "and PREFIX.stages.txt (time spent in each stage) (default: disabled)")
+    parser.add_argument('--profile-interval', dest='profile_interval', type=float, default=DEFAULT_SAMPLE_INTERVAL,
+                        help="Seconds between stack samples with --profile (default: %(default)s)")
+
+
+def get_default_profiler():
+    """
+    Returns the StageProfiler used by the crawler, writer and filter
+    classes.  It records nothing until it is started.
+    """
+    return _default_profiler
+
+
+def start_profiler(args, profiler=None, logger=None):
+    """
+    Starts profiling if requested by the command line arguments added
+    by add_profiler_arguments(), and returns the StageProfiler, which
+    should be closed when the run ends
+    """
+    if profiler is None:
+        profiler = get_default_profiler()
+    if args.profile:
+        profiler.start(sample_interval=args.profile_interval, output_prefix=args.profile, logger=logger)
+    return profiler
+
+
+
+###  Classes  ###
+
+class StageProfiler:
+    """
+    Records how long a run spends in each stage of its work - e.g.
+    waiting for the network, sleeping for rate limits, parsing JSON,
+    filtering and writing files - without re-running it under an
+    external profiler.
+
+    Code marks its stages with spans:
+
+      with profiler.span('parse'):
+          tweet = json.loads(json_tweet_string)
+
+    The wall clock and CPU time of each span are added to its stage's
+    totals.  Spans can be nested, and the time spent in a nested span
+    only counts towards the nested span's stage.  CPU time is the
+    process's CPU time, so it is only exact for a stage when a single
+    thread is busy.
+
+    While the profiler is running, a background thread also samples
+    the stacks of every thread that is inside a span (and of the thread
+    that started the profiler) every sample_interval seconds.  The
+    samples are written in the "folded" format read by flamegraph.pl
+    and speedscope, with the stage as the root frame of each stack.
+
+    A sampler can only interrupt a thread between Python bytecodes, so
+    a long call into C code (such as json.loads() or cld.detect()) is
+    only sampled once.  The span times are exact; use the samples to
+    see where Python code spends its time within a stage.
+
+    While the profiler is running, each span costs a few microseconds,
+    which is a few percent of the time to filter a Tweet one at a time.
+    Filtering in blocks (see FilteredTweetReader) records one span per
+    block.  Until start() is called, span() returns a shared no-op
+    span, so instrumented code costs next to nothing when profiling is
+    off.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._module_names = {}
+        # stage -> _Span.  Spans keep their state in _ThreadState objects, so they can be shared.
+        self._spans = {}
+        self._reset()
+        self._sampler = None
+        self._main_thread_ident = None
+        self._output_prefix = None
+        self._logger = None
+        self._start_time = None
+        self._elapsed_seconds = 0.0
+
+    def close(self):
+        """
+        Stops the profiler and, if an output_prefix was passed to
+        start(), writes the sampled stacks to [output_prefix].folded and
+        the stage breakdown to [output_prefix].stages.txt
+        """
+        if self._start_time is None:
+            return
+        self.stop()
+        if self._output_prefix:
+            self.write_folded_stacks(self._output_prefix + '.folded')
+            report_file = open(self._output_prefix + '.stages.txt', 'w')
+            report_file.write(self.get_report())
+            report_file.close()
+            if self._logger:
+                self._logger.info("Wrote profile to '%s.folded' and '%s.stages.txt'" %
+                                  (self._output_prefix, self._output_prefix))
+
+    def get_folded_stacks(self):
+        """
+        Returns a dictionary mapping each sampled stack, as a string of
+        ';'-separated frames starting with the '[stage]', to the number
+        of times it was sampled
+        """
+        with self._lock:
+            return dict(self._stack_counts)
+
+    def get_report(self):
+        """
+        Returns a text table of the time spent in each stage
+        """
+        stage_times = self.get_stage_times()
+        elapsed_seconds = self.get_elapsed_seconds()
+        lines = ["%-10s %10s %12s %8s %12s %10s" % ('Stage', 'Spans', 'Wall (s)', 'Wall %', 'CPU (s)', 'Samples')]
+        stages = [stage for stage in STAGES if stage in stage_times] + \
+            sorted([stage for stage in stage_times if stage not in STAGES])
+        for stage in stages:
+            times = stage_times[stage]
+            lines.append("%-10s %10d %12.3f %7.1f%% %12.3f %10d" %
+                         (stage, times['spans'], times['wall_seconds'], 100.0 * times['wall_seconds'] / max(elapsed_seconds, 1e-9),
+                          times['cpu_seconds'], times['samples']))
+        lines.append("")
+        lines.append("Elapsed: %.3f seconds.  With several threads, the stages can add up to more than 100%%." %
+                     elapsed_seconds)
+        return "\n".join(lines) + "\n"
+
+    def get_elapsed_seconds(self):
+        if self.enabled:
+            return time.time() - self._start_time
+        return self._elapsed_seconds
+
+    def get_stage_times(self):
+        """
+        Returns a dictionary mapping each stage to a dictionary with the
+        number of spans ('spans'), the wall clock and CPU seconds spent
+        in the stage outside nested spans ('wall_seconds' and
+        'cpu_seconds'), and the number of stack samples taken in the
+        stage ('samples').  Samples of the thread that started the
+        profiler taken outside any span are counted as stage 'other'.
+        """
+        stage_times = {}
+        with self._lock:
+            thread_stage_totals = list(self._thread_stage_totals)
+        for stage_totals in thread_stage_totals:
+            for stage, (span_count, wall_seconds, cpu_seconds) in stage_totals.items():
+                times = stage_times.setdefault(stage, {'spans': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'samples': 0})
+                times['spans'] += span_count
+                times['wall_seconds'] += wall_seconds
+                times['cpu_seconds'] += cpu_seconds
+        for stack, count in self.get_folded_stacks().items():
+            stage = stack[1:stack.index(']')]
+            times = stage_times.setdefault(stage, {'spans': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'samples': 0})
+            times['samples'] += count
+        return stage_times
+
+    def span(self, stage):
+        """
+        Returns a context manager that records the time spent in the
+        with block as time spent in stage
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        try:
+            return self._spans[stage]
+        except KeyError:
+            span = self._spans[stage] = _Span(self, stage)
+            return span
+
+    def start(self, sample_interval=DEFAULT_SAMPLE_INTERVAL, output_prefix=None, logger=None):
+        """
+        Starts recording spans and, if sample_interval is greater than
+        zero, sampling stacks.  The results of any earlier run are
+        discarded.
+        """
+        self.stop()
+        self._reset()
+        self._main_thread_ident = thread.get_ident()
+        self._output_prefix = output_prefix
+        self._logger = logger
+        self._start_time = time.time()
+        self.enabled = True
+        if sample_interval > 0:
+            self._sampler = _StackSampler(self, sample_interval)
+            self._sampler.start()
+
+    def stop(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._elapsed_seconds = time.time() - self._start_time
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+
+    def write_folded_stacks(self, filename):
+        """
+        Writes the sampled stacks in the folded format ('frame;frame;...
+        count' lines) read by flamegraph.pl and speedscope
+        """
+        folded_file = open(filename, 'w')
+        for stack, count in sorted(self.get_folded_stacks().items()):
+            folded_file.write("%s %d\n" % (stack, count))
+        folded_file.close()
+
+    def _reset(self):
+        self._local = threading.local()
+        # thread ident -> stage of the thread's innermost span
+        self._thread_stages = {}
+        # One dictionary per thread, mapping stage -> [span count, wall seconds, CPU seconds].  Each
+        # thread only updates its own totals, so that spans don't take a lock (which, in Python 2,
+        # gives up the GIL).
+        self._thread_stage_totals = []
+        # folded stack -> sample count
+        self._stack_counts = collections.defaultdict(int)
+
+    def _get_thread_state(self):
+        try:
+            return self._local.state
+        except AttributeError:
+            state = self._local.state = _ThreadState()
+            with self._lock:
+                self._thread_stage_totals.append(state.stage_totals)
+            return state
+
+    def _get_module_name(self, filename):
+        module_name = self._module_names.get(filename)
+        if module_name is None:
+            module_name = self._module_names[filename] = os.path.splitext(os.path.basename(filename))[0]
+        return module_name
+
+    def _sample_stacks(self, sampler_thread_ident):
+        stacks = []
+        for thread_ident, frame in sys._current_frames().items():
+            if thread_ident == sampler_thread_ident:
+                continue
+            stage = self._thread_stages.get(thread_ident)
+            if stage is None:
+                if thread_ident != self._main_thread_ident:
+                    # Skip idle threads, such as metrics exporters
+                    continue
+                stage = 'other'
+            frames = []
+            while frame is not None:
+                frames.append("%s.%s" % (self._get_module_name(frame.f_code.co_filename), frame.f_code.co_name))
+                frame = frame.f_back
+            frames.append("[%s]" % stage)
+            frames.reverse()
+            stacks.append(";".join(frames))
+
+        with self._lock:
+            for stack in stacks:
+                self._stack_counts[stack] += 1
+
+
+class _NullSpan:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        return False
+
+
+class _Span:
+    def __init__(self, profiler, stage):
+        self._profiler = profiler
+        self._stage = stage
+
+    def __enter__(self):
+        state = self._profiler._get_thread_state()
+        # [stage, wall start, CPU start, wall seconds in nested spans, CPU seconds in nested spans]
+        state.span_stack.append([self._stage, time.time(), time.clock(), 0.0, 0.0])
+        self._profiler._thread_stages[state.thread_ident] = self._stage
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        wall_end = time.time()
+        cpu_end = time.clock()
+        state = self._profiler._get_thread_state()
+        span_stack = state.span_stack
+        if not span_stack:
+            # The span was entered before the profiler was restarted
+            return False
+        stage, wall_start, cpu_start, nested_wall_seconds, nested_cpu_seconds = span_stack.pop()
+        wall_seconds = wall_end - wall_start
+        cpu_seconds = cpu_end - cpu_start
+        if span_stack:
+            span_stack[-1][3] += wall_seconds
+            span_stack[-1][4] += cpu_seconds
+            self._profiler._thread_stages[state.thread_ident] = span_stack[-1][0]
+        else:
+            self._profiler._thread_stages.pop(state.thread_ident, None)
+
+        totals = state.stage_totals.get(stage)
+        if totals is None:
+            totals = state.stage_totals[stage] = [0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += wall_seconds - nested_wall_seconds
+        totals[2] += cpu_seconds - nested_cpu_seconds
+        return False
+
+
+class _ThreadState:
+    """
+    The open spans and stage totals of one thread
+    """
+    def __init__(self):
+        self.thread_ident = thread.get_ident()
+        self.span_stack = []
+        # stage -> [span count, wall seconds, CPU seconds]
+        self.stage_totals = {}
+
+
+class _StackSampler(threading.Thread):
+    def __init__(self, profiler, sample_interval):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._profiler = profiler
+        self._sample_interval = sample_interval
+        self._stopped = False
+
+    def run(self):
+        sampler_thread_ident = thread.get_ident()
+        # Plain sleeps, because in Python 2 waiting on an Event with a timeout polls for the GIL
+        while 1:
+            time.sleep(self._sample_interval)
+            if self._stopped:
+                return
+            self._profiler._sample_stacks(sampler_thread_ident)
+
+    def stop(self):
+        self._stopped = True
+        self.join()
+
+
+_NULL_SPAN = _NullSpan()
+_default_profiler = StageProfiler()
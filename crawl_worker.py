@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+"""
+This script downloads all available Tweets for the users in the work
+units handed out by a crawl coordinator (see crawl_coordinator.py).
+
+The script takes as input the address of the coordinator - either
+'host:port' for a coordinator served over TCP, or the filename of the
+coordinator's SQLite database - and the path of an output directory.
+The script creates a [username].tweets file in the directory for each
+user it crawls.
+
+Any number of workers can crawl from the same coordinator, each with
+the API credentials in its own twitter_oauth_settings.py file.  The
+worker renews the lease on its unit before crawling each user; if the
+worker is killed, the unit is handed to another worker once the lease
+expires.  Users in the worker's crawl manifest (by default
+'crawl.manifest' in the output directory) are not downloaded again
+when a unit is retried.
+
+The script exits once every unit is either done or has failed.
+
+Your Twitter OAuth credentials should be stored in the file
+twitter_oauth_settings.py.
+"""
+
+# Standard Library modules
+import argparse
+import codecs
+import functools
+import os
+import socket
+import sys
+import time
+
+# Third party modules
+from twython import TwythonError
+
+# Local modules
+from twitter_crawler import CrawlTwitterTimelines, get_app_auth_twython, get_console_info_logger
+from api_response_cache import add_api_cache_arguments, open_api_response_cache
+from crawl_coordinator import open_crawl_coordinator
+from crawl_manifest import CrawlManifest, open_crawl_manifest
+from crawl_profiler import add_profiler_arguments, start_profiler
+from crawler_metrics import add_metrics_arguments, start_metrics_exporters
+from tweet_writer import add_tweet_writer_arguments, create_tweet_writer
+try:
+    from twitter_oauth_settings import access_token, access_token_secret, consumer_key, consumer_secret
+except ImportError:
+    print "You must create a 'twitter_oauth_settings.py' file with your Twitter API credentials."
+    print "Please copy over the sample configuration file:"
+    print "  cp twitter_oauth_settings.sample.py twitter_oauth_settings.py"
+    print "and add your API credentials to the file."
+    sys.exit()
+
+
+def main(argv=None):
+    # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
+    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument('coordinator', help="'host:port' of a coordinator server, or a coordinator database file")
+    parser.add_argument('output_path')
+    parser.add_argument('--worker-id', dest='worker_id', default="%s-%d" % (socket.gethostname(), os.getpid()),
+                        help="Name of this worker in the coordinator's logs (default: [hostname]-[pid])")
+    parser.add_argument('--manifest', dest='manifest_file',
+                        help="SQLite crawl manifest (default: crawl.manifest in the output directory)")
+    parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=30,
+                        help="Seconds to wait before asking again when all remaining units are leased")
+    parser.add_argument('--pacing', action='store_true',
+                        help="Spread API calls evenly over each rate limit window instead of sleeping when it is used up")
+    add_tweet_writer_arguments(parser)
+    add_api_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profiler_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logger = get_console_info_logger()
+    metrics_exporters = start_metrics_exporters(args, logger=logger)
+    profiler = start_profiler(args, logger=logger)
+    response_cache = open_api_response_cache(args, logger)
+
+    if not os.path.exists(args.output_path):
+        os.makedirs(args.output_path)
+    tweet_writer = create_tweet_writer(args, logger)
+    manifest = open_crawl_manifest(args.output_path, args.manifest_file, logger)
+    coordinator = open_crawl_coordinator(args.coordinator, logger)
+
+    twython = get_app_auth_twython(consumer_key, consumer_secret)
+    crawler = CrawlTwitterTimelines(twython, logger, pacing=args.pacing, response_cache=response_cache)
+
+    try:
+        while 1:
+            unit = coordinator.claim_unit(args.worker_id)
+            if unit is None:
+                if coordinator.is_finished():
+                    logger.info("All work units have been crawled")
+                    break
+                # Units leased by other workers may still be handed back if their leases expire
+                time.sleep(args.poll_interval)
+                continue
+
+            logger.info("Crawling unit %d (attempt %d) with %d users" %
+                        (unit['unit_id'], unit['attempt'], len(unit['screen_names'])))
+            try:
+                results = crawl_unit(unit, coordinator, crawler, manifest, tweet_writer, args.output_path, logger)
+            except Exception as e:
+                coordinator.fail_unit(unit['unit_id'], unit['attempt'], "%s: %s" % (e.__class__.__name__, e))
+                raise
+            if results is None:
+                logger.warn("Lease on unit %d was lost - skipping the rest of the unit" % unit['unit_id'])
+                continue
+
+            # Tweets must be written before the coordinator is told that the unit is done
+            tweet_writer.flush()
+            manifest.flush()
+            if not coordinator.acknowledge_unit(unit['unit_id'], unit['attempt'], results):
+                logger.warn("Lease on unit %d was lost before the unit was acknowledged" % unit['unit_id'])
+    finally:
+        try:
+            tweet_writer.close()
+        finally:
+            manifest.close()
+            coordinator.close()
+            metrics_exporters.close()
+            profiler.close()
+            if response_cache is not None:
+                response_cache.close()
+
+
+def crawl_unit(unit, coordinator, crawler, manifest, tweet_writer, output_path, logger):
+    """
+    Downloads the timelines of the users in a work unit.  Returns a
+    list of (screen_name, tweet_count, error_code) tuples, or None if
+    the lease on the unit was lost.
+    """
+    results = []
+    for screen_name in unit['screen_names']:
+        if not coordinator.renew_lease(unit['unit_id'], unit['attempt']):
+            return None
+
+        if manifest.has_user(screen_name):
+            logger.info("User '%s' is already in the crawl manifest - will not attempt to download Tweets" % screen_name)
+            if manifest.get_status(screen_name) == CrawlManifest.STATUS_UNAVAILABLE:
+                results.append((screen_name, None, manifest.get_error_code(screen_name)))
+            else:
+                results.append((screen_name, manifest.get_tweet_count(screen_name), None))
+            continue
+
+        try:
+            tweets = crawler.get_all_timeline_tweets_for_screen_name(screen_name)
+        except TwythonError as e:
+            print "TwythonError: %s" % e
+            if e.error_code == 404:
+                logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
+            elif e.error_code == 401:
+                logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
+            else:
+                # Unhandled exception
+                raise e
+            manifest.record_error(screen_name, e.error_code)
+            results.append((screen_name, None, e.error_code))
+        else:
+            # The user is only recorded in the manifest once the file has been written
+            tweet_writer.save_tweets(tweets, os.path.join(output_path, "%s.tweets" % screen_name),
+                                     on_saved=functools.partial(manifest.record_tweets, screen_name, tweets))
+            results.append((screen_name, len(tweets), None))
+    return results
+
+
+if __name__ == "__main__":
+    main()
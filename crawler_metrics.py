@@ -0,0 +1,398 @@
+"""
+Counters, gauges and histograms for monitoring a running crawl
+"""
+
+# Standard Library modules
+import BaseHTTPServer
+import bisect
+import json
+import os
+import threading
+import time
+
+
+# Default histogram buckets (in seconds) for Twitter API call latency
+DEFAULT_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Default histogram buckets (in seconds) for the time taken to crawl one user
+DEFAULT_DURATION_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+
+###  Functions  ###
+
+def get_default_registry():
+    """
+    Returns the MetricsRegistry used by the crawler classes when no
+    registry is passed to their constructors
+    """
+    return _default_registry
+
+
+def add_metrics_arguments(parser):
+    """
+    Adds the command line arguments used by start_metrics_exporters()
+    to an argparse.ArgumentParser
+    """
+    parser.add_argument('--metrics-port', dest='metrics_port', type=int,
+                        help="Serve Prometheus metrics over HTTP on this port (default: disabled)")
+    parser.add_argument('--metrics-file', dest='metrics_file',
+                        help="Periodically write a JSON snapshot of the metrics to this file (default: disabled)")
+    parser.add_argument('--metrics-interval', dest='metrics_interval', type=float, default=60.0,
+                        help="Seconds between JSON metrics snapshots (default: %(default)s)")
+
+
+def start_metrics_exporters(args, registry=None, logger=None):
+    """
+    Starts the exporters requested by the command line arguments added
+    by add_metrics_arguments(), and returns a MetricsExporters object
+    that should be closed when the crawl ends
+    """
+    if registry is None:
+        registry = get_default_registry()
+    exporters = MetricsExporters()
+    if args.metrics_port is not None:
+        http_server = MetricsHTTPServer(registry, port=args.metrics_port)
+        if logger:
+            logger.info("Serving Prometheus metrics at http://%s:%d/metrics" % (http_server.host, http_server.get_port()))
+        exporters.add(http_server)
+    if args.metrics_file:
+        exporters.add(MetricsSnapshotWriter(registry, args.metrics_file, args.metrics_interval, logger))
+    return exporters
+
+
+
+###  Classes  ###
+
+class MetricsRegistry:
+    """
+    A collection of named metric families, which can be rendered in
+    the Prometheus text exposition format or as a JSON-serializable
+    snapshot.
+
+    Each family has a fixed list of label names, and one child metric
+    per combination of label values.  Looking up a child takes a lock,
+    so callers on a hot path should look up their children once and
+    keep references to them:
+
+      calls = registry.counter('trawler_api_calls_total', "API calls", ['endpoint'])
+      timeline_calls = calls.labels(endpoint='statuses/user_timeline')
+      ...
+      timeline_calls.inc()
+
+    Registering a family that already exists returns the existing
+    family, so that many objects can share the same metrics.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = {}
+        self._family_names = []
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._get_family(name, help_text, 'counter', labelnames, Counter, ())
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._get_family(name, help_text, 'gauge', labelnames, Gauge, ())
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_family(name, help_text, 'histogram', labelnames, Histogram, (buckets,))
+
+    def get_snapshot(self):
+        """
+        Returns a dictionary with the current value of every metric
+        """
+        snapshot = {'timestamp': time.time(), 'metrics': {}}
+        for family in self._get_families():
+            samples = []
+            for label_values, child in family.get_children():
+                samples.append({'labels': dict(zip(family.labelnames, label_values)),
+                                'value': child.get_value()})
+            snapshot['metrics'][family.name] = {'type': family.metric_type, 'help': family.help_text,
+                                                'samples': samples}
+        return snapshot
+
+    def render_prometheus_text(self):
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+        lines = []
+        for family in self._get_families():
+            lines.append("# HELP %s %s" % (family.name, family.help_text.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append("# TYPE %s %s" % (family.name, family.metric_type))
+            for label_values, child in family.get_children():
+                labels = zip(family.labelnames, label_values)
+                if family.metric_type == 'histogram':
+                    value = child.get_value()
+                    for upper_bound, count in value['buckets']:
+                        bucket_labels = labels + [('le', _format_value(upper_bound))]
+                        lines.append("%s_bucket%s %d" % (family.name, _format_labels(bucket_labels), count))
+                    lines.append("%s_sum%s %s" % (family.name, _format_labels(labels), _format_value(value['sum'])))
+                    lines.append("%s_count%s %d" % (family.name, _format_labels(labels), value['count']))
+                else:
+                    lines.append("%s%s %s" % (family.name, _format_labels(labels), _format_value(child.get_value())))
+        return "\n".join(lines) + "\n"
+
+    def _get_families(self):
+        self._lock.acquire()
+        families = [self._families[name] for name in self._family_names]
+        self._lock.release()
+        return families
+
+    def _get_family(self, name, help_text, metric_type, labelnames, child_class, child_args):
+        self._lock.acquire()
+        try:
+            family = self._families.get(name)
+            if family is None:
+                family = MetricFamily(name, help_text, metric_type, labelnames, child_class, child_args)
+                self._families[name] = family
+                self._family_names.append(name)
+            elif family.metric_type != metric_type or family.labelnames != tuple(labelnames):
+                raise ValueError("Metric '%s' is already registered with a different type or labels" % name)
+            return family
+        finally:
+            self._lock.release()
+
+
+class MetricFamily:
+    """
+    All of the child metrics that share a name.  Use labels() to get
+    the child for a combination of label values.
+    """
+    def __init__(self, name, help_text, metric_type, labelnames, child_class, child_args):
+        self.name = name
+        self.help_text = help_text
+        self.metric_type = metric_type
+        self.labelnames = tuple(labelnames)
+        self._child_class = child_class
+        self._child_args = child_args
+        self._lock = threading.Lock()
+        self._children = {}
+
+    def labels(self, *label_values, **label_kwargs):
+        """
+        Returns the child metric for the label values, which can be
+        given either positionally or as keyword arguments
+        """
+        if label_kwargs:
+            label_values = tuple([label_kwargs[labelname] for labelname in self.labelnames])
+        else:
+            label_values = tuple(label_values)
+        if len(label_values) != len(self.labelnames):
+            raise ValueError("Metric '%s' expects labels %s" % (self.name, self.labelnames))
+        label_values = tuple([unicode(value) for value in label_values])
+
+        self._lock.acquire()
+        try:
+            child = self._children.get(label_values)
+            if child is None:
+                child = self._child_class(*self._child_args)
+                self._children[label_values] = child
+            return child
+        finally:
+            self._lock.release()
+
+    def get_children(self):
+        self._lock.acquire()
+        children = sorted(self._children.items())
+        self._lock.release()
+        return children
+
+
+class Counter:
+    """
+    A value that only goes up, e.g. the number of API calls made
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("Counters can only be incremented by non-negative amounts")
+        self._lock.acquire()
+        self._value += amount
+        self._lock.release()
+
+    def get_value(self):
+        return self._value
+
+
+class Gauge:
+    """
+    A value that can go up and down, e.g. the current backoff depth
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        self._lock.acquire()
+        self._value += amount
+        self._lock.release()
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def get_value(self):
+        return self._value
+
+
+class Histogram:
+    """
+    Counts observed values (e.g. API call latencies) in buckets with
+    fixed upper bounds, and keeps their sum and count
+    """
+    def __init__(self, buckets):
+        self._upper_bounds = sorted(buckets)
+        self._lock = threading.Lock()
+        # One count per bucket, plus one for values above the largest bound
+        self._bucket_counts = [0] * (len(self._upper_bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        bucket = bisect.bisect_left(self._upper_bounds, value)
+        self._lock.acquire()
+        self._bucket_counts[bucket] += 1
+        self._sum += value
+        self._count += 1
+        self._lock.release()
+
+    def get_value(self):
+        """
+        Returns a dictionary with the cumulative count for each bucket
+        (as a list of [upper_bound, count] pairs), the sum and the count
+        """
+        self._lock.acquire()
+        bucket_counts = list(self._bucket_counts)
+        value_sum = self._sum
+        count = self._count
+        self._lock.release()
+
+        buckets = []
+        cumulative_count = 0
+        for upper_bound, bucket_count in zip(self._upper_bounds + [float('inf')], bucket_counts):
+            cumulative_count += bucket_count
+            buckets.append([upper_bound, cumulative_count])
+        return {'buckets': buckets, 'sum': value_sum, 'count': count}
+
+
+class MetricsExporters:
+    """
+    The exporters started by start_metrics_exporters()
+    """
+    def __init__(self):
+        self._exporters = []
+
+    def add(self, exporter):
+        self._exporters.append(exporter)
+
+    def close(self):
+        for exporter in self._exporters:
+            exporter.close()
+        self._exporters = []
+
+
+class MetricsHTTPServer(threading.Thread):
+    """
+    Serves the metrics in a MetricsRegistry in the Prometheus text
+    format at http://[host]:[port]/metrics, on a background thread.
+    If port is 0, an unused port is chosen (see get_port()).
+    """
+    def __init__(self, registry, host='127.0.0.1', port=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.host = host
+        self._server = BaseHTTPServer.HTTPServer((host, port), _MetricsRequestHandler)
+        self._server.registry = registry
+        self.start()
+
+    def get_port(self):
+        return self._server.server_address[1]
+
+    def run(self):
+        self._server.serve_forever()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self.join()
+
+
+class MetricsSnapshotWriter(threading.Thread):
+    """
+    Writes a JSON snapshot of the metrics in a MetricsRegistry to a
+    file every interval seconds, and once more when closed.  Each
+    snapshot is written to a temporary file and then renamed, so
+    readers never see a partially written file.
+    """
+    def __init__(self, registry, json_filename, interval=60.0, logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._registry = registry
+        self._json_filename = json_filename
+        self._interval = interval
+        self._logger = logger
+        self._closed = threading.Event()
+        self.start()
+
+    def write_snapshot(self):
+        temporary_filename = self._json_filename + '.tmp'
+        snapshot_file = open(temporary_filename, 'w')
+        json.dump(self._registry.get_snapshot(), snapshot_file)
+        snapshot_file.close()
+        os.rename(temporary_filename, self._json_filename)
+
+    def run(self):
+        while 1:
+            self._closed.wait(self._interval)
+            try:
+                self.write_snapshot()
+            except (IOError, OSError) as e:
+                if self._logger:
+                    self._logger.error("Unable to write metrics snapshot to '%s': %s" % (self._json_filename, e))
+            if self._closed.is_set():
+                return
+
+    def close(self):
+        self._closed.set()
+        self.join()
+
+
+class _MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't log every scrape to stderr
+        pass
+
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(['%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                              for name, value in labels])
+
+
+def _format_value(value):
+    if isinstance(value, (int, long)):
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+_default_registry = MetricsRegistry()
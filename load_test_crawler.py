@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+"""
+This script measures the throughput of the crawler classes against a
+local mock Twitter API server (see mock_twitter_server.py), without
+spending any real API quota.
+
+The script starts a mock server with synthetic users, crawls some of
+the users with one or more crawler threads, and then reports:
+
+  - elapsed time, and Tweets or users retrieved per second
+  - API calls per endpoint, broken down by HTTP status code
+  - API calls wasted on HTTP 429 and 5xx responses
+  - total time the crawlers spent sleeping
+  - the gaps between users' Tweets (or friends-and-followers) being
+    delivered, which show how bursty the crawl is
+  - peak memory use
+
+The mock server's rate limit windows are much shorter than Twitter's
+15 minutes, and RateLimitedTwitterEndpoint's sleep and backoff times
+are scaled down by the same factor.
+
+Running the same workload with and without '--pacing' shows the
+difference between burst-then-sleep and paced API calls: throughput
+should be about the same, but paced crawls have much shorter gaps
+between deliveries.
+
+The 'ff-timelines' workload finds the friends-and-followers of each
+user and then downloads their timelines, like
+save_ff_timelines_to_json.py.  With '--pipeline', the friends and
+followers workloads are run by a PipelinedFriendFollowerCrawler (with
+'--threads' threads per endpoint) instead of by sequential crawlers.
+
+The report also shows how many HTTP connections the crawlers opened
+and how many API calls reused a kept-alive connection, and the
+response bytes received compared to their decompressed size.  Use
+'--no-compression' to compare against uncompressed responses.
+"""
+
+# Standard Library modules
+import argparse
+import logging
+import math
+import os
+import resource
+import threading
+import time
+
+# Third party modules
+from twython import Twython, TwythonError
+
+# Local modules
+from crawl_profiler import add_profiler_arguments, start_profiler
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+from pipelined_crawler import PipelineResult, PipelinedFriendFollowerCrawler
+from twitter_crawler import CrawlTwitterTimelines, FindFriendFollowers, RateLimitedTwitterEndpoint
+from twitter_transport import DEFAULT_POOL_SIZE, configure_twython_transport
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the crawler against a mock Twitter API server")
+    parser.add_argument('--workload', choices=['timelines', 'ff', 'ff-timelines'], default='timelines',
+                        help="Crawl user timelines, friends-and-followers, or the timelines of "
+                        "friends-and-followers (default: %(default)s)")
+    parser.add_argument('--users', type=int, default=1000, help="Number of synthetic users on the server")
+    parser.add_argument('--max-tweets', dest='max_tweets', type=int, default=1000,
+                        help="Maximum number of Tweets in each synthetic user's timeline")
+    parser.add_argument('--crawl-users', dest='crawl_users', type=int, default=100, help="Number of users to crawl")
+    parser.add_argument('--threads', type=int, default=1,
+                        help="Number of crawler threads, each with its own rate limited endpoints")
+    parser.add_argument('--window-seconds', dest='window_seconds', type=float, default=10.0,
+                        help="Duration of each rate limit window on the mock server")
+    parser.add_argument('--rate-limit', dest='rate_limits', action='append', default=[], metavar='ENDPOINT=CALLS',
+                        help="Override the number of calls per window for an endpoint")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds of latency added to every response")
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0,
+                        help="Probability that a request starts a burst of HTTP 503 errors")
+    parser.add_argument('--pacing', action='store_true',
+                        help="Spread each endpoint's API calls evenly over the rate limit window")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Run the friends and followers workloads with a pipelined crawler")
+    parser.add_argument('--no-compression', dest='compression', action='store_false',
+                        help="Don't ask the server for gzip compressed responses")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="Log the crawlers' progress")
+    add_profiler_arguments(parser)
+    args = parser.parse_args()
+
+    logger = logging.getLogger('load_test_crawler')
+    logger.addHandler(logging.StreamHandler())
+    if args.verbose:
+        logger.setLevel(logging.INFO)
+    else:
+        logger.setLevel(logging.WARNING)
+
+    rate_limits = {}
+    for rate_limit in args.rate_limits:
+        endpoint, calls = rate_limit.split('=')
+        rate_limits[endpoint] = int(calls)
+
+    # requests-oauthlib refuses to send OAuth 2 bearer tokens over plain HTTP unless told otherwise
+    os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+    api = MockTwitterAPI(num_users=args.users, max_tweets_per_user=args.max_tweets, rate_limits=rate_limits, window_seconds=args.window_seconds,
+                         latency_seconds=args.latency, error_rate=args.error_rate, seed=args.seed)
+    server = MockTwitterServer(api)
+    server.start()
+
+    # Scale the crawler's sleep times to the mock server's rate limit windows
+    time_scale = args.window_seconds / 900.0
+    RateLimitedTwitterEndpoint.INITIAL_BACKOFF_SECONDS *= time_scale
+    RateLimitedTwitterEndpoint.MAX_BACKOFF_SECONDS *= time_scale
+    RateLimitedTwitterEndpoint.CIRCUIT_BREAKER_RESET_SECONDS *= time_scale
+    RateLimitedTwitterEndpoint.RATE_LIMIT_PADDING_SECONDS *= time_scale
+    RateLimitedTwitterEndpoint.RATE_LIMIT_EXPIRED_SLEEP_SECONDS *= time_scale
+
+    screen_names = ['user%d' % user_index for user_index in range(min(args.crawl_users, args.users))]
+    results = LoadTestResults()
+
+    transports = []
+    profiler = start_profiler(args, logger=logger)
+    start_time = time.time()
+    if args.pipeline and args.workload != 'timelines':
+        twython = Twython('app_key', access_token='access_token')
+        twython.api_url = server.get_api_url()
+        pool_size = max(DEFAULT_POOL_SIZE, len(PipelinedFriendFollowerCrawler.ENDPOINTS) * args.threads)
+        transports.append(configure_twython_transport(twython, pool_size=pool_size, compression=args.compression))
+        crawl_pipelined(args.workload, twython, screen_names, args.threads, args.pacing, results, logger)
+    else:
+        threads = []
+        for thread_number in range(args.threads):
+            twython = Twython('app_key', access_token='access_token')
+            twython.api_url = server.get_api_url()
+            transports.append(configure_twython_transport(twython, compression=args.compression))
+            thread_screen_names = screen_names[thread_number::args.threads]
+            thread = threading.Thread(target=crawl, args=(args.workload, twython, thread_screen_names, args.pacing,
+                                                          results, logger))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    elapsed_seconds = time.time() - start_time
+    profiler.close()
+
+    server.stop()
+    print_report(args, api.get_stats(), results, start_time, elapsed_seconds, transports,
+                 server.get_connection_count())
+    if args.profile:
+        print
+        print profiler.get_report(),
+
+
+def crawl(workload, twython, screen_names, pacing, results, logger):
+    timeline_crawler = CrawlTwitterTimelines(twython, logger, pacing=pacing)
+    ff_finder = FindFriendFollowers(twython, logger, pacing=pacing)
+
+    for screen_name in screen_names:
+        try:
+            if workload == 'timelines':
+                items = timeline_crawler.get_all_timeline_tweets_for_screen_name(screen_name)
+            elif workload == 'ff':
+                items = ff_finder.get_ff_screen_names_for_screen_name(screen_name)
+            else:
+                items = []
+                for ff_screen_name in ff_finder.get_ff_screen_names_for_screen_name(screen_name):
+                    items += timeline_crawler.get_all_timeline_tweets_for_screen_name(ff_screen_name)
+        except TwythonError as e:
+            logger.warning("TwythonError for '%s': %s" % (screen_name, e))
+            results.add(0, 0, 1)
+        else:
+            results.add(len(items), 1, 0)
+
+    endpoints = timeline_crawler.get_endpoints() + ff_finder.get_endpoints()
+    results.add_seconds_slept(sum(endpoint.get_seconds_slept() for endpoint in endpoints))
+
+    # Close kept-alive connections, so the server's handler threads exit before the server is stopped
+    twython.client.close()
+
+
+def crawl_pipelined(workload, twython, screen_names, threads_per_endpoint, pacing, results, logger):
+    crawler = PipelinedFriendFollowerCrawler(twython, logger, pacing=pacing, threads_per_endpoint=threads_per_endpoint)
+    for screen_name in screen_names:
+        crawler.submit_ff_users(screen_name, screen_name)
+
+    # seed screen name -> [timelines still expected, Tweets retrieved, failed]
+    seeds_in_progress = {}
+    while crawler.get_pending_count() > 0:
+        result = crawler.get_result()
+        if result.kind == PipelineResult.FF_USERS and workload == 'ff':
+            results.add(len(result.data), int(result.error_code is None), int(result.error_code is not None))
+        elif result.kind == PipelineResult.FF_USERS:
+            seed_progress = seeds_in_progress[result.tag] = [len(result.data), 0, result.error_code is not None]
+            for ff_user in result.data:
+                crawler.submit_timeline(ff_user[u'screen_name'], result.tag)
+        else:
+            seed_progress = seeds_in_progress[result.tag]
+            seed_progress[0] -= 1
+            seed_progress[1] += len(result.data)
+        if workload == 'ff-timelines' and seed_progress[0] == 0:
+            del seeds_in_progress[result.tag]
+            results.add(seed_progress[1], int(not seed_progress[2]), int(seed_progress[2]))
+
+    crawler.close()
+    results.add_seconds_slept(sum(endpoint.get_seconds_slept() for endpoint in crawler.get_endpoints()))
+
+    # Close kept-alive connections, so the server's handler threads exit before the server is stopped
+    twython.client.close()
+
+
+def print_report(args, server_stats, results, start_time, elapsed_seconds, transports, server_connection_count):
+    if args.workload == 'ff':
+        item_name = "friends-and-followers"
+    else:
+        item_name = "Tweets"
+
+    if args.pacing:
+        pacing = "paced"
+    else:
+        pacing = "unpaced"
+    if args.pipeline and args.workload != 'timelines':
+        threads = "pipelined, %d threads per endpoint" % args.threads
+    else:
+        threads = "%d threads" % args.threads
+    print "Workload:                %s (%s, %s)" % (args.workload, threads, pacing)
+    print "Users crawled:           %d (%d failed)" % (results.users_crawled, results.users_failed)
+    print "Retrieved:               %d %s" % (results.items_retrieved, item_name)
+    print "Elapsed time:            %.2f seconds" % elapsed_seconds
+    print "Throughput:              %.1f %s/second, %.2f users/second" % \
+        (results.items_retrieved / elapsed_seconds, item_name, results.users_crawled / elapsed_seconds)
+    print "Time spent sleeping:     %.2f seconds (summed over threads)" % results.seconds_slept
+    delivery_gaps = results.get_delivery_gaps(start_time)
+    print "Gaps between deliveries: p50 %.2f, p99 %.2f, max %.2f seconds" % \
+        (percentile(delivery_gaps, 50), percentile(delivery_gaps, 99), percentile(delivery_gaps, 100))
+    # ru_maxrss is in kilobytes on Linux
+    print "Peak memory:             %.1f MB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+    print
+    print "API calls by endpoint and HTTP status:"
+    total_calls = 0
+    wasted_calls = 0
+    for endpoint in sorted(server_stats):
+        counts = server_stats[endpoint]
+        print "  %-32s %s" % (endpoint, ", ".join("%s: %d" % (status, counts[status]) for status in sorted(counts)))
+        total_calls += sum(counts.values())
+        wasted_calls += sum(count for status, count in counts.items() if status == 429 or status >= 500)
+    print "Total API calls:         %d" % total_calls
+    print "Wasted API calls:        %d (HTTP 429 and 5xx)" % wasted_calls
+    print
+
+    transport_stats = {}
+    for transport in transports:
+        for name, value in transport.get_stats().items():
+            transport_stats[name] = transport_stats.get(name, 0) + value
+    print "HTTP connections opened: %d (%d accepted by the server)" % \
+        (transport_stats['connections_opened'], server_connection_count)
+    print "Connection reuse:        %d of %d requests (%.1f%%)" % \
+        (transport_stats['connections_reused'], transport_stats['requests'],
+         100.0 * transport_stats['connections_reused'] / max(transport_stats['requests'], 1))
+    if args.compression:
+        compression = "gzip"
+    else:
+        compression = "uncompressed"
+    print "Response bytes:          %.1f MB received, %.1f MB decoded (%s, ratio %.2f)" % \
+        (transport_stats['bytes_received'] / 1e6, transport_stats['bytes_decoded'] / 1e6, compression,
+         float(transport_stats['bytes_received']) / max(transport_stats['bytes_decoded'], 1))
+
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank percentile of a list of numbers, or 0 for
+    an empty list
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class LoadTestResults:
+    """
+    Thread safe totals for all of the crawler threads
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items_retrieved = 0
+        self.users_crawled = 0
+        self.users_failed = 0
+        self.seconds_slept = 0.0
+        self.delivery_times = []
+
+    def add(self, items_retrieved, users_crawled, users_failed):
+        self._lock.acquire()
+        self.delivery_times.append(time.time())
+        self.items_retrieved += items_retrieved
+        self.users_crawled += users_crawled
+        self.users_failed += users_failed
+        self._lock.release()
+
+    def add_seconds_slept(self, seconds_slept):
+        self._lock.acquire()
+        self.seconds_slept += seconds_slept
+        self._lock.release()
+
+    def get_delivery_gaps(self, start_time):
+        """
+        Returns the number of seconds between the start of the crawl
+        and the first delivery, and between each pair of consecutive
+        deliveries
+        """
+        delivery_times = [start_time] + sorted(self.delivery_times)
+        return [later - earlier for earlier, later in zip(delivery_times, delivery_times[1:])]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+
+"""
+Local stand-in for the parts of the Twitter REST API used by the
+crawler, for benchmarking and load testing without spending real
+API quota.
+
+The server emulates these endpoints for a population of synthetic
+users:
+
+  statuses/user_timeline
+  statuses/lookup
+  friends/ids
+  followers/ids
+  users/lookup
+  application/rate_limit_status
+
+Each endpoint has its own rate limit window, and requests beyond the
+limit get an HTTP 429 response.  The server can also add latency to
+every response, and return bursts of HTTP 503 errors.  Responses are
+gzip compressed for clients that send 'Accept-Encoding: gzip', and
+the server counts the connections clients open, so that connection
+reuse can be measured.
+
+To point a Twython instance at the server:
+
+  server = MockTwitterServer(MockTwitterAPI(num_users=1000))
+  server.start()
+  os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'  # The server uses plain HTTP
+  twython = Twython('app_key', access_token='token')
+  twython.api_url = server.get_api_url()
+
+The synthetic users have screen names 'user0', 'user1', ..., and
+user IDs starting at MockTwitterAPI.FIRST_USER_ID.
+"""
+
+# Standard Library modules
+import argparse
+import BaseHTTPServer
+import bisect
+import gzip
+import json
+import random
+import SocketServer
+import StringIO
+import threading
+import time
+import urlparse
+
+# Local modules
+from snowflake import TWITTER_EPOCH_MILLISECONDS
+
+
+# Twitter's default rate limits for application-only authentication
+#   https://dev.twitter.com/docs/rate-limiting/1.1/limits
+DEFAULT_RATE_LIMITS = {
+    'statuses/user_timeline': 1500,
+    'statuses/lookup': 300,
+    'friends/ids': 15,
+    'followers/ids': 15,
+    'users/lookup': 300,
+}
+
+
+class MockTwitterAPI:
+    """
+    Synthetic Twitter users and per-endpoint rate limit state.
+
+    All of the synthetic data is generated from the random seed, so
+    two instances created with the same arguments serve identical
+    users, Tweets and friend/follower graphs.
+    """
+    FIRST_USER_ID = 1000
+
+    def __init__(self, num_users=1000, max_tweets_per_user=1000, max_friends_per_user=200,
+                 reciprocal_fraction=0.5, rate_limits=None, window_seconds=900,
+                 latency_seconds=0.0, error_rate=0.0, error_burst_length=5, protected_users=(), bearer_token=None,
+                 seed=0):
+        """
+        num_users -- number of synthetic users
+
+        max_tweets_per_user, max_friends_per_user -- each user gets a
+        random number of Tweets and Friends up to these limits
+
+        reciprocal_fraction -- probability that a user follows back
+        each of its Friends
+
+        rate_limits -- dictionary mapping endpoint names to the number
+        of calls allowed per rate limit window
+
+        window_seconds -- duration of each rate limit window
+
+        latency_seconds -- delay added to every response
+
+        error_rate -- probability that any request starts a burst of
+        error_burst_length HTTP 503 responses
+
+        protected_users -- indices of users with protected Tweets,
+        whose timelines get an HTTP 401 response
+
+        bearer_token -- if specified, requests that are not
+        authenticated with this bearer token get an HTTP 401 response
+        """
+        self._num_users = num_users
+        self._protected_users = set(protected_users)
+        self._bearer_token = bearer_token
+        self._rate_limits = dict(DEFAULT_RATE_LIMITS)
+        if rate_limits:
+            self._rate_limits.update(rate_limits)
+        self._window_seconds = window_seconds
+        self._latency_seconds = latency_seconds
+        self._error_rate = error_rate
+        self._error_burst_length = error_burst_length
+
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._errors_remaining_in_burst = 0
+
+        # endpoint -> [calls remaining, time the window resets]
+        self._windows = {}
+
+        # endpoint -> {response status code -> count}
+        self._stats = {}
+
+        rng = random.Random(seed)
+        self._tweet_counts = [rng.randint(0, max_tweets_per_user) for i in range(num_users)]
+        # Each user posts at a constant rate, ending "now", so Tweet IDs are valid snowflakes
+        self._now_milliseconds = int(time.time() * 1000)
+        self._tweet_intervals = []
+        for tweet_count in self._tweet_counts:
+            # Keep the oldest Tweet after the snowflake epoch
+            longest_interval = (self._now_milliseconds - TWITTER_EPOCH_MILLISECONDS) / (tweet_count + 1)
+            self._tweet_intervals.append(min(rng.randint(60, 7 * 86400) * 1000, longest_interval))
+
+        self._friends = [set() for i in range(num_users)]
+        self._followers = [set() for i in range(num_users)]
+        for user_index in range(num_users):
+            num_friends = min(rng.randint(0, max_friends_per_user), num_users - 1)
+            for friend_index in rng.sample(xrange(num_users), num_friends):
+                if friend_index == user_index:
+                    continue
+                self._add_follow(user_index, friend_index)
+                if rng.random() < reciprocal_fraction:
+                    self._add_follow(friend_index, user_index)
+        self._friends = [sorted(friends) for friends in self._friends]
+        self._followers = [sorted(followers) for followers in self._followers]
+
+        self._tweet_id_cache = {}
+
+    def get_stats(self):
+        """
+        Returns a dictionary mapping each endpoint to a dictionary of
+        {HTTP status code: number of responses}
+        """
+        self._lock.acquire()
+        try:
+            return dict((endpoint, dict(counts)) for endpoint, counts in self._stats.items())
+        finally:
+            self._lock.release()
+
+    def handle_request(self, endpoint, params, authorization=None):
+        """
+        Returns a (HTTP status code, response headers, JSON-serializable
+        response) tuple for a request to endpoint.  authorization is
+        the value of the request's Authorization header.
+        """
+        if self._latency_seconds:
+            time.sleep(self._latency_seconds)
+
+        if self._bearer_token is not None and authorization != 'Bearer %s' % self._bearer_token:
+            status, headers, response = 401, {}, _error_response(89, "Invalid or expired token.")
+        elif endpoint == 'application/rate_limit_status':
+            status, headers, response = 200, {}, self._get_rate_limit_status(params)
+        elif endpoint not in self._rate_limits:
+            status, headers, response = 404, {}, _error_response(34, "Sorry, that page does not exist")
+        else:
+            status, headers, response = self._handle_rate_limited_request(endpoint, params)
+
+        self._lock.acquire()
+        counts = self._stats.setdefault(endpoint, {})
+        counts[status] = counts.get(status, 0) + 1
+        self._lock.release()
+        return status, headers, response
+
+    def _handle_rate_limited_request(self, endpoint, params):
+        self._lock.acquire()
+        try:
+            calls_remaining, reset = self._get_window(endpoint)
+            headers = {
+                'x-rate-limit-limit': str(self._rate_limits[endpoint]),
+                'x-rate-limit-remaining': str(max(calls_remaining - 1, 0)),
+                'x-rate-limit-reset': str(int(reset)),
+            }
+            if calls_remaining <= 0:
+                return 429, headers, _error_response(88, "Rate limit exceeded")
+            self._windows[endpoint][0] -= 1
+
+            if self._errors_remaining_in_burst == 0 and self._random.random() < self._error_rate:
+                self._errors_remaining_in_burst = self._error_burst_length
+            if self._errors_remaining_in_burst > 0:
+                self._errors_remaining_in_burst -= 1
+                return 503, headers, _error_response(130, "Over capacity")
+        finally:
+            self._lock.release()
+
+        try:
+            if endpoint == 'statuses/user_timeline':
+                if self._get_user_index(params) in self._protected_users:
+                    return 401, headers, {'request': '/1.1/statuses/user_timeline.json', 'error': "Not authorized."}
+                return 200, headers, self._get_user_timeline(params)
+            elif endpoint == 'friends/ids':
+                return 200, headers, self._get_ids(self._friends, params)
+            elif endpoint == 'followers/ids':
+                return 200, headers, self._get_ids(self._followers, params)
+            elif endpoint == 'users/lookup':
+                return 200, headers, self._lookup_users(params)
+            elif endpoint == 'statuses/lookup':
+                return 200, headers, self._lookup_tweets(params)
+        except (KeyError, ValueError):
+            return 404, headers, _error_response(34, "Sorry, that page does not exist")
+
+    def _get_window(self, endpoint):
+        now = time.time()
+        window = self._windows.get(endpoint)
+        if window is None or now >= window[1]:
+            window = [self._rate_limits[endpoint], now + self._window_seconds]
+            self._windows[endpoint] = window
+        return window
+
+    def _get_rate_limit_status(self, params):
+        self._lock.acquire()
+        try:
+            resources = {}
+            for endpoint in sorted(self._rate_limits):
+                resource = endpoint.split('/')[0]
+                if 'resources' in params and resource not in params['resources'].split(','):
+                    continue
+                calls_remaining, reset = self._get_window(endpoint)
+                resources.setdefault(resource, {})['/' + endpoint] = {
+                    'limit': self._rate_limits[endpoint],
+                    'remaining': calls_remaining,
+                    'reset': int(reset),
+                }
+            return {'resources': resources}
+        finally:
+            self._lock.release()
+
+    def _add_follow(self, follower_index, friend_index):
+        self._friends[follower_index].add(friend_index)
+        self._followers[friend_index].add(follower_index)
+
+    def _get_user_index(self, params):
+        """
+        Returns the index of the user named by the 'screen_name' or
+        'user_id' parameter.  Raises KeyError for unknown users.
+        """
+        if 'user_id' in params:
+            user_index = int(params['user_id']) - self.FIRST_USER_ID
+        elif params.get('screen_name', '').lower().startswith('user'):
+            user_index = int(params['screen_name'][len('user'):])
+        else:
+            raise KeyError(params.get('screen_name'))
+        if not 0 <= user_index < self._num_users:
+            raise KeyError(user_index)
+        return user_index
+
+    def _get_user(self, user_index):
+        return {
+            'id': self.FIRST_USER_ID + user_index,
+            'id_str': str(self.FIRST_USER_ID + user_index),
+            'screen_name': 'user%d' % user_index,
+            'followers_count': len(self._followers[user_index]),
+            'friends_count': len(self._friends[user_index]),
+            'statuses_count': self._tweet_counts[user_index],
+        }
+
+    def _get_tweet_ids(self, user_index):
+        """
+        Returns the sorted (oldest first) list of Tweet IDs for a user
+        """
+        tweet_ids = self._tweet_id_cache.get(user_index)
+        if tweet_ids is None:
+            tweet_ids = []
+            for tweet_number in range(self._tweet_counts[user_index]):
+                milliseconds_ago = (self._tweet_counts[user_index] - tweet_number) * self._tweet_intervals[user_index]
+                timestamp = self._now_milliseconds - milliseconds_ago
+                # Use the user index as the snowflake worker/sequence bits, so IDs are unique
+                tweet_ids.append(((timestamp - TWITTER_EPOCH_MILLISECONDS) << 22) + user_index % (1 << 22))
+            self._tweet_id_cache[user_index] = tweet_ids
+        return tweet_ids
+
+    def _get_user_timeline(self, params):
+        user_index = self._get_user_index(params)
+        user = self._get_user(user_index)
+        tweet_ids = self._get_tweet_ids(user_index)
+        count = min(int(params.get('count', 20)), 200)
+
+        # Tweet IDs in the half-open index range [first, last) are returned, newest first
+        last = len(tweet_ids)
+        if 'max_id' in params:
+            last = bisect.bisect_right(tweet_ids, int(params['max_id']))
+        first = max(last - count, 0)
+        if 'since_id' in params:
+            first = max(first, bisect.bisect_right(tweet_ids, int(params['since_id'])))
+
+        return [self._get_tweet(user, tweet_ids[tweet_index], tweet_index)
+                for tweet_index in range(last - 1, first - 1, -1)]
+
+    def _get_tweet(self, user, tweet_id, tweet_index):
+        timestamp = ((tweet_id >> 22) + TWITTER_EPOCH_MILLISECONDS) / 1000.0
+        tweet = {
+            'id': tweet_id,
+            'id_str': str(tweet_id),
+            'created_at': time.strftime('%a %b %d %H:%M:%S +0000 %Y', time.gmtime(timestamp)),
+            'text': 'Synthetic Tweet number %d from @%s #mock' % (tweet_index, user['screen_name']),
+            'lang': 'en',
+            'user': user,
+        }
+        if tweet_index % 10 == 0:
+            tweet['text'] = 'RT @user0: %s' % tweet['text']
+            tweet['retweeted_status'] = {'id': tweet_id - 1}
+        return tweet
+
+    def _lookup_tweet(self, tweet_id):
+        """
+        Returns the Tweet with the specified ID, or None if there is no
+        such Tweet.  The user is recovered from the low bits of the ID.
+        """
+        user_index = tweet_id % (1 << 22)
+        if not 0 <= user_index < self._num_users:
+            return None
+        tweet_ids = self._get_tweet_ids(user_index)
+        tweet_index = bisect.bisect_left(tweet_ids, tweet_id)
+        if tweet_index == len(tweet_ids) or tweet_ids[tweet_index] != tweet_id:
+            return None
+        return self._get_tweet(self._get_user(user_index), tweet_id, tweet_index)
+
+    def _lookup_tweets(self, params):
+        tweet_ids = [int(tweet_id) for tweet_id in params['id'].split(',')[:100]]
+        tweets = [self._lookup_tweet(tweet_id) for tweet_id in tweet_ids]
+        if params.get('map') == 'true':
+            # Missing Tweets are included as nulls
+            return {'id': dict((str(tweet_id), tweet) for tweet_id, tweet in zip(tweet_ids, tweets))}
+        return [tweet for tweet in tweets if tweet is not None]
+
+    def _get_ids(self, adjacency, params):
+        user_index = self._get_user_index(params)
+        ids = [self.FIRST_USER_ID + neighbor_index for neighbor_index in adjacency[user_index]]
+        count = min(int(params.get('count', 5000)), 5000)
+
+        # The cursor is the offset of the next page, with 0 meaning "no more pages"
+        cursor = int(params.get('cursor', -1))
+        if cursor == -1:
+            cursor = 0
+        next_cursor = cursor + count
+        if next_cursor >= len(ids):
+            next_cursor = 0
+        return {
+            'ids': ids[cursor:cursor + count],
+            'next_cursor': next_cursor,
+            'next_cursor_str': str(next_cursor),
+            'previous_cursor': 0,
+            'previous_cursor_str': '0',
+        }
+
+    def _lookup_users(self, params):
+        users = []
+        if 'user_id' in params:
+            for user_id in params['user_id'].split(',')[:100]:
+                try:
+                    users.append(self._get_user(self._get_user_index({'user_id': user_id})))
+                except KeyError:
+                    pass
+        if 'screen_name' in params:
+            for screen_name in params['screen_name'].split(',')[:100]:
+                try:
+                    users.append(self._get_user(self._get_user_index({'screen_name': screen_name})))
+                except (KeyError, ValueError):
+                    pass
+        if not users:
+            raise KeyError('No users found')
+        return users
+
+
+class MockTwitterRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # HTTP/1.1 allows clients to reuse connections
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+
+        if url.path == '/stats':
+            self._send_response(200, {}, self.server.api.get_stats())
+            return
+
+        # Paths look like '/1.1/statuses/user_timeline.json'
+        path = url.path.lstrip('/')
+        if path.startswith('1.1/'):
+            path = path[len('1.1/'):]
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
+
+        status, headers, response = self.server.api.handle_request(path, params, self.headers.get('Authorization'))
+        self._send_response(status, headers, response)
+
+    def log_message(self, format, *args):
+        # Don't log every request to stderr
+        pass
+
+    def _send_response(self, status, headers, response):
+        body = json.dumps(response)
+        accept_encodings = [encoding.split(';')[0].strip()
+                            for encoding in self.headers.get('Accept-Encoding', '').split(',')]
+        self.send_response(status)
+        if 'gzip' in accept_encodings:
+            body_buffer = StringIO.StringIO()
+            gzip_file = gzip.GzipFile(fileobj=body_buffer, mode='wb')
+            gzip_file.write(body)
+            gzip_file.close()
+            body = body_buffer.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in headers.items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockTwitterServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Multithreaded HTTP server for a MockTwitterAPI instance.  Pass
+    port=0 to pick any free port.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, api, host='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), MockTwitterRequestHandler)
+        self.api = api
+        self._thread = None
+        self._connection_count = 0
+        self._connection_lock = threading.Lock()
+
+    def get_api_url(self):
+        """
+        Returns a URL template suitable for Twython's api_url attribute
+        """
+        return 'http://%s:%d/%%s' % self.server_address
+
+    def get_connection_count(self):
+        """
+        Returns the number of connections that clients have opened
+        """
+        with self._connection_lock:
+            return self._connection_count
+
+    def process_request(self, request, client_address):
+        with self._connection_lock:
+            self._connection_count += 1
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def start(self):
+        """
+        Starts serving requests on a background thread
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+
+
+def _error_response(code, message):
+    return {'errors': [{'code': code, 'message': message}]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock Twitter API with synthetic users")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--users', type=int, default=1000, help="Number of synthetic users")
+    parser.add_argument('--window-seconds', dest='window_seconds', type=float, default=900,
+                        help="Duration of each rate limit window")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds of latency added to every response")
+    parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0,
+                        help="Probability that a request starts a burst of HTTP 503 errors")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    api = MockTwitterAPI(num_users=args.users, window_seconds=args.window_seconds,
+                         latency_seconds=args.latency, error_rate=args.error_rate, seed=args.seed)
+    server = MockTwitterServer(api, port=args.port)
+    print "Serving mock Twitter API at %s" % (server.get_api_url() % '')
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
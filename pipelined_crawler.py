@@ -0,0 +1,357 @@
+"""
+Pipelined crawler that keeps every API endpoint busy at once
+"""
+
+# Standard Library modules
+import Queue
+import threading
+
+# Third party modules
+from twython import TwythonError
+
+# Local modules
+from crawler_metrics import get_default_registry
+from twitter_crawler import CrawlTwitterTimelines, FindFriendFollowers, get_console_info_logger, grouper
+
+
+class PipelinedFriendFollowerCrawler:
+    """
+    Finds the friends-and-followers of many users, and downloads the
+    timelines of many users, at the same time.
+
+    FindFriendFollowers and CrawlTwitterTimelines make one API call at
+    a time, so while one endpoint is sleeping until its rate limit
+    window resets, the other endpoints - which have their own rate
+    limits - sit idle.  This class splits the work for each user into
+    tasks for the 'friends/ids', 'followers/ids', 'users/lookup' and
+    'statuses/user_timeline' endpoints, and runs the tasks for each
+    endpoint on that endpoint's own thread(s).  With enough users
+    submitted, every endpoint uses its full rate limit, and a crawl
+    takes about as long as the work for the most constrained endpoint.
+
+    Results are returned by get_result() in the order they complete,
+    so that the caller's thread can do all of the file, manifest and
+    frontier updates.  Each result is a PipelineResult.
+
+    Usage:
+      crawler = PipelinedFriendFollowerCrawler(twython)
+      for screen_name in screen_names:
+          crawler.submit_ff_users(screen_name)
+          crawler.submit_timeline(screen_name)
+      while crawler.get_pending_count() > 0:
+          result = crawler.get_result()
+          ...
+      crawler.close()
+    """
+    ENDPOINTS = ['friends/ids', 'followers/ids', 'users/lookup', 'statuses/user_timeline']
+
+    def __init__(self, twython, logger=None, ff_graph=None, metrics=None, pacing=False, response_cache=None,
+                 threads_per_endpoint=1, retry_policy=None):
+        """
+        ff_graph -- an optional twitter_graph.FriendFollowerGraph
+        instance (see FindFriendFollowers).  The graph is updated by
+        the endpoint threads, so while the crawler is running the graph
+        should only be saved with save_graph().
+
+        response_cache -- an optional api_response_cache.ApiResponseCache
+        instance (see RateLimitedTwitterEndpoint).
+
+        retry_policy -- an optional retry_policy.RetryPolicy instance
+        (see RateLimitedTwitterEndpoint).
+
+        threads_per_endpoint -- number of threads making API calls to
+        each endpoint.  One thread per endpoint uses the whole rate
+        limit unless the API's latency is high.  The threads share
+        twython, whose connection pool should hold a connection for
+        each of them (see twitter_transport.configure_twython_transport()).
+        """
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        if metrics is None:
+            metrics = get_default_registry()
+
+        self._ff_graph = ff_graph
+        self._graph_lock = threading.Lock()
+
+        # The graph is handled by this class, so that graph updates are made while holding the lock
+        self._ff_finder = FindFriendFollowers(twython, self._logger, metrics=metrics, pacing=pacing,
+                                              response_cache=response_cache, retry_policy=retry_policy)
+        self._timeline_crawler = CrawlTwitterTimelines(twython, self._logger, metrics=metrics, pacing=pacing,
+                                                       response_cache=response_cache, retry_policy=retry_policy)
+        self._friend_endpoint, self._follower_endpoint, self._user_lookup_endpoint = self._ff_finder.get_endpoints()
+
+        self._results = Queue.Queue()
+        self._pending_count = 0
+        self._pending_lock = threading.Lock()
+
+        queue_depth_metric = metrics.gauge('trawler_pipeline_queue_depth',
+                                           "Tasks waiting for each endpoint of a pipelined crawler", ['endpoint'])
+        self._stages = {}
+        for endpoint in self.ENDPOINTS:
+            self._stages[endpoint] = _PipelineStage(endpoint, threads_per_endpoint, self._report_failure,
+                                                    queue_depth_metric.labels(endpoint=endpoint), self._logger)
+
+    def close(self):
+        """
+        Stops the endpoint threads once their queued tasks are done
+        """
+        for stage in self._stages.values():
+            stage.close()
+
+    def get_endpoints(self):
+        """
+        Returns the RateLimitedTwitterEndpoint instances used by this class
+        """
+        return self._ff_finder.get_endpoints() + self._timeline_crawler.get_endpoints()
+
+    def get_pending_count(self):
+        """
+        Returns the number of submitted users whose results have not
+        yet been returned by get_result()
+        """
+        with self._pending_lock:
+            return self._pending_count
+
+    def get_result(self, timeout=None):
+        """
+        Returns the next PipelineResult to complete, waiting up to
+        timeout seconds (or forever, if timeout is None) for one.
+        Raises Queue.Empty if no result completes in time.
+
+        Unexpected exceptions raised by the endpoint threads (i.e.
+        anything but an HTTP 401 or 404 error for a user) are
+        re-raised here, once for each user whose task failed.
+        """
+        if timeout is None:
+            # Waiting with a timeout keeps the wait interruptible with Ctrl-C
+            while 1:
+                try:
+                    result = self._results.get(timeout=60)
+                    break
+                except Queue.Empty:
+                    pass
+        else:
+            result = self._results.get(timeout=timeout)
+        with self._pending_lock:
+            self._pending_count -= 1
+        if result.exception is not None:
+            raise result.exception
+        return result
+
+    def save_graph(self, graph_filename):
+        with self._graph_lock:
+            self._ff_graph.save(graph_filename)
+
+    def submit_ff_users(self, screen_name, tag=None):
+        """
+        Queues the tasks for finding the users who are both Friends
+        and Followers of screen_name.  The PipelineResult's data is a
+        list of user objects (as returned by 'users/lookup').
+
+        tag -- any value, returned as the PipelineResult's tag.
+        """
+        task = _FriendFollowerTask(screen_name, tag)
+        self._add_pending()
+
+        if self._ff_graph is not None:
+            with self._graph_lock:
+                user_id = self._ff_graph.get_user_id(screen_name)
+                if user_id is not None:
+                    ff_ids = [int(ff_id) for ff_id in self._ff_graph.get_reciprocal_ids(user_id)]
+            if user_id is not None:
+                self._logger.info("Friends and Followers for '%s' already crawled - will not refetch" % screen_name)
+                self._lookup_ff_users(task, ff_ids)
+                return
+
+        task.pending_calls = 2
+        self._stages['friends/ids'].put(self._get_ids, task, 'friend_ids')
+        self._stages['followers/ids'].put(self._get_ids, task, 'follower_ids')
+
+    def submit_timeline(self, screen_name, tag=None):
+        """
+        Queues the task for downloading the timeline of screen_name.
+        The PipelineResult's data is a list of Tweets.
+
+        tag -- any value, returned as the PipelineResult's tag.
+        """
+        self._add_pending()
+        self._stages['statuses/user_timeline'].put(self._get_timeline, _Task(PipelineResult.TIMELINE, screen_name, tag))
+
+    def _add_pending(self):
+        with self._pending_lock:
+            self._pending_count += 1
+
+    def _get_ids(self, task, attribute):
+        try:
+            if attribute == 'friend_ids':
+                ids = self._ff_finder.get_friend_ids_for_screen_name(task.screen_name)
+            else:
+                ids = self._ff_finder.get_follower_ids_for_screen_name(task.screen_name)
+        except TwythonError as e:
+            if e.error_code not in [401, 404]:
+                raise
+            with task.lock:
+                task.error_code = e.error_code
+        else:
+            setattr(task, attribute, ids)
+
+        with task.lock:
+            task.pending_calls -= 1
+            if task.pending_calls > 0:
+                return
+
+        # Both ID lists have been retrieved
+        if task.error_code is not None:
+            self._log_user_error(task.screen_name, task.error_code)
+            self._results.put(PipelineResult(PipelineResult.FF_USERS, task.screen_name, task.tag, [],
+                                             task.error_code))
+        elif self._ff_graph is not None:
+            # The ids endpoints don't return the ID of the user being crawled
+            self._stages['users/lookup'].put(self._lookup_user, task)
+        else:
+            self._lookup_ff_users(task, list(set(task.friend_ids).intersection(set(task.follower_ids))))
+
+    def _get_timeline(self, task):
+        try:
+            tweets = self._timeline_crawler.get_all_timeline_tweets_for_screen_name(task.screen_name)
+        except TwythonError as e:
+            if e.error_code not in [401, 404]:
+                raise
+            self._log_user_error(task.screen_name, e.error_code)
+            self._results.put(PipelineResult(PipelineResult.TIMELINE, task.screen_name, task.tag, [], e.error_code))
+        else:
+            self._results.put(PipelineResult(PipelineResult.TIMELINE, task.screen_name, task.tag, tweets))
+
+    def _log_user_error(self, screen_name, error_code):
+        if error_code == 404:
+            self._logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
+        else:
+            self._logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
+
+    def _lookup_ff_users(self, task, ff_ids):
+        # The Twitter API allows us to look up info for 100 users at a time
+        ff_id_subsets = list(grouper(ff_ids, 100))
+        if not ff_id_subsets:
+            self._results.put(PipelineResult(PipelineResult.FF_USERS, task.screen_name, task.tag, []))
+            return
+        task.pending_calls = len(ff_id_subsets)
+        for ff_id_subset in ff_id_subsets:
+            self._stages['users/lookup'].put(self._lookup_ff_user_subset, task, ff_id_subset)
+
+    def _lookup_ff_user_subset(self, task, ff_id_subset):
+        user_ids = ','.join([str(id) for id in ff_id_subset if id is not None])
+        ff_users = self._user_lookup_endpoint.get_data(user_id=user_ids, entities=False)
+        with task.lock:
+            task.ff_users += ff_users
+            task.pending_calls -= 1
+            if task.pending_calls > 0:
+                return
+        self._results.put(PipelineResult(PipelineResult.FF_USERS, task.screen_name, task.tag, task.ff_users))
+
+    def _report_failure(self, task, exception):
+        # Several of a task's API calls can fail (e.g. both of its ID calls), but each
+        # task adds one to the pending count, so only its first failure is returned
+        with task.lock:
+            if task.failed:
+                return
+            task.failed = True
+        self._results.put(PipelineResult(task.kind, task.screen_name, task.tag, None, exception=exception))
+
+    def _lookup_user(self, task):
+        user = self._user_lookup_endpoint.get_data(screen_name=task.screen_name, entities=False)[0]
+        with self._graph_lock:
+            self._ff_graph.add_user(user[u'id'], task.friend_ids, task.follower_ids, screen_name=user[u'screen_name'])
+            ff_ids = [int(ff_id) for ff_id in self._ff_graph.get_reciprocal_ids(user[u'id'])]
+        self._lookup_ff_users(task, ff_ids)
+
+
+class PipelineResult:
+    """
+    The outcome of a task submitted to a PipelinedFriendFollowerCrawler.
+
+    kind -- PipelineResult.FF_USERS or PipelineResult.TIMELINE
+    screen_name, tag -- as passed to submit_ff_users() or submit_timeline()
+    data -- a list of user objects or Tweets
+    error_code -- the HTTP error code (401 or 404) if the user's data
+      could not be retrieved, or else None
+    """
+    FF_USERS = 'ff_users'
+    TIMELINE = 'timeline'
+
+    def __init__(self, kind, screen_name, tag, data, error_code=None, exception=None):
+        self.kind = kind
+        self.screen_name = screen_name
+        self.tag = tag
+        self.data = data
+        self.error_code = error_code
+        self.exception = exception
+
+
+class _Task:
+    """
+    The work for one user submitted to a PipelinedFriendFollowerCrawler
+    """
+    def __init__(self, kind, screen_name, tag):
+        self.kind = kind
+        self.screen_name = screen_name
+        self.tag = tag
+        self.lock = threading.Lock()
+        self.failed = False
+
+
+class _FriendFollowerTask(_Task):
+    def __init__(self, screen_name, tag):
+        _Task.__init__(self, PipelineResult.FF_USERS, screen_name, tag)
+        self.pending_calls = 0
+        self.friend_ids = None
+        self.follower_ids = None
+        self.ff_users = []
+        self.error_code = None
+
+
+class _PipelineStage:
+    """
+    A queue of tasks for one API endpoint, and the threads that run them.
+
+    Each queued function is called with a _Task and any other
+    arguments.  Exceptions raised by the function are passed, with the
+    task, to report_failure.
+    """
+    def __init__(self, endpoint, thread_count, report_failure, queue_depth_metric, logger):
+        self._endpoint = endpoint
+        self._logger = logger
+        self._queue = Queue.Queue()
+        self._queue_depth_metric = queue_depth_metric
+        self._report_failure = report_failure
+        self._threads = []
+        for thread_number in range(thread_count):
+            thread = threading.Thread(target=self._run, name="%s-%d" % (endpoint, thread_number))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def put(self, function, task, *args):
+        self._queue.put((function, task, args))
+        self._queue_depth_metric.set(self._queue.qsize())
+
+    def _run(self):
+        while 1:
+            item = self._queue.get()
+            self._queue_depth_metric.set(self._queue.qsize())
+            if item is None:
+                return
+            function, task, args = item
+            try:
+                function(task, *args)
+            except Exception as e:
+                self._logger.error("Unexpected error in '%s' task for '%s': %s" % (self._endpoint, task.screen_name, e))
+                self._report_failure(task, e)
@@ -0,0 +1,236 @@
+"""
+Adaptive scheduling of incremental recrawls of Twitter user timelines
+"""
+
+# Standard Library modules
+import calendar
+import sqlite3
+import time
+
+# Local modules
+from twitter_crawler import get_console_info_logger
+
+
+class RecrawlScheduler:
+    """
+    Decides when each user's timeline should next be checked for new
+    Tweets, based on how often the user posts.
+
+    For each user, an SQLite database stores the most recent Tweet ID
+    downloaded (the since_id for the next crawl), an estimate of the
+    user's posting rate, and the time the user is next due to be
+    crawled.  The posting rate is an exponentially weighted moving
+    average of the rates observed in each crawl, where the rate of one
+    crawl is the number of new Tweets divided by the time since the
+    previous crawl.
+
+    After each crawl, the next crawl is scheduled for when the user is
+    expected to have posted target_backlog new Tweets - by default
+    half of the 200 Tweets returned by one 'statuses/user_timeline'
+    call - clamped to between min_interval and max_interval seconds.
+    Users who post often are checked often, and dormant users are
+    rarely checked, so most API calls return new Tweets.  The interval
+    between crawls of a user can at most double from one crawl to the
+    next, so a single quiet period doesn't push a user straight to
+    max_interval.  Users whose rate can't be estimated yet are crawled
+    again after min_interval seconds.
+
+    When more users are due than can be crawled, get_due_users()
+    returns the users with the largest expected backlog first.
+
+    Usage:
+      scheduler = RecrawlScheduler('recrawl.schedule')
+      scheduler.add_user(screen_name, since_id)
+      for screen_name, since_id in scheduler.get_due_users():
+          tweets = crawler.get_all_timeline_tweets_for_screen_name_since(screen_name, since_id)
+          scheduler.record_crawl(screen_name, tweets)
+    """
+    def __init__(self, db_filename, target_backlog=100, min_interval=15*60, max_interval=30*24*60*60,
+                 smoothing=0.5, logger=None):
+        """
+        smoothing -- weight (between 0 and 1) of the most recently
+        observed posting rate in the moving average.
+        """
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        self._target_backlog = target_backlog
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._smoothing = smoothing
+
+        self._db = sqlite3.connect(db_filename)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS schedule (
+                              screen_name_key TEXT PRIMARY KEY,
+                              screen_name TEXT NOT NULL,
+                              since_id INTEGER,
+                              tweet_rate REAL,
+                              last_crawled REAL,
+                              next_crawl REAL NOT NULL,
+                              crawl_count INTEGER NOT NULL DEFAULT 0,
+                              tweet_count INTEGER NOT NULL DEFAULT 0,
+                              error_code INTEGER)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS schedule_by_next_crawl ON schedule (next_crawl)")
+        self._db.commit()
+
+    def add_user(self, screen_name, since_id=None):
+        """
+        Adds screen_name to the schedule, due to be crawled
+        immediately.  If since_id is None, the user's whole timeline
+        will be crawled.  Returns False if the user was already in the
+        schedule.
+        """
+        if self.has_user(screen_name):
+            return False
+        self._db.execute("INSERT INTO schedule (screen_name_key, screen_name, since_id, next_crawl) VALUES (?, ?, ?, ?)",
+                         (screen_name.lower(), screen_name, since_id, time.time()))
+        self._db.commit()
+        return True
+
+    def has_user(self, screen_name):
+        return self._get_row(screen_name) is not None
+
+    def get_since_id(self, screen_name):
+        return self._get_field(screen_name, 'since_id')
+
+    def get_tweet_rate(self, screen_name):
+        """
+        Returns the estimated number of Tweets per second posted by
+        screen_name, or None if the rate is not known yet
+        """
+        return self._get_field(screen_name, 'tweet_rate')
+
+    def get_next_crawl(self, screen_name):
+        return self._get_field(screen_name, 'next_crawl')
+
+    def get_due_users(self, now=None, limit=None):
+        """
+        Returns a list of (screen_name, since_id) tuples for the users
+        who are due to be crawled.  Users who have never been crawled
+        come first, followed by the users with the most expected new
+        Tweets.
+        """
+        if now is None:
+            now = time.time()
+        if limit is None:
+            limit = -1
+        return self._db.execute("SELECT screen_name, since_id FROM schedule WHERE next_crawl <= ? "
+                                "ORDER BY last_crawled IS NOT NULL, "
+                                "COALESCE(tweet_rate, 0) * (? - COALESCE(last_crawled, 0)) DESC, next_crawl "
+                                "LIMIT ?", (now, now, limit)).fetchall()
+
+    def get_seconds_until_next_crawl(self, now=None):
+        """
+        Returns the number of seconds until the next user is due to
+        be crawled (0 if a user is already due), or None if the
+        schedule is empty
+        """
+        if now is None:
+            now = time.time()
+        next_crawl = self._db.execute("SELECT MIN(next_crawl) FROM schedule").fetchone()[0]
+        if next_crawl is None:
+            return None
+        return max(0.0, next_crawl - now)
+
+    def record_crawl(self, screen_name, tweets, crawl_time=None):
+        """
+        Records that the list of tweets was downloaded for
+        screen_name, updates the user's since_id and posting rate, and
+        schedules the user's next crawl
+        """
+        if crawl_time is None:
+            crawl_time = time.time()
+        row = self._get_row(screen_name)
+        since_id, tweet_rate, last_crawled = row[0], row[1], row[2]
+
+        if tweets:
+            since_id = max([since_id] + [tweet['id'] for tweet in tweets])
+
+        if last_crawled is not None and crawl_time > last_crawled:
+            observed_rate = len(tweets) / float(crawl_time - last_crawled)
+        else:
+            # First crawl - estimate the rate from the Tweets' timestamps instead
+            observed_rate = _get_tweet_rate_from_timestamps(tweets)
+
+        if tweet_rate is None:
+            tweet_rate = observed_rate
+        elif observed_rate is not None:
+            tweet_rate = self._smoothing * observed_rate + (1 - self._smoothing) * tweet_rate
+
+        crawl_interval = self._get_crawl_interval(tweet_rate)
+        if last_crawled is not None:
+            crawl_interval = min(crawl_interval, 2 * max(crawl_time - last_crawled, self._min_interval))
+        next_crawl = crawl_time + crawl_interval
+        self._db.execute("UPDATE schedule SET since_id=?, tweet_rate=?, last_crawled=?, next_crawl=?, "
+                         "crawl_count=crawl_count+1, tweet_count=tweet_count+?, error_code=NULL "
+                         "WHERE screen_name_key=?",
+                         (since_id, tweet_rate, crawl_time, next_crawl, len(tweets), screen_name.lower()))
+        self._db.commit()
+
+    def record_error(self, screen_name, error_code, crawl_time=None):
+        """
+        Records that the Tweets for screen_name could not be downloaded
+        (e.g. because of an HTTP 404 or 401 error).  The user is not
+        crawled again until max_interval seconds have passed.
+        """
+        if crawl_time is None:
+            crawl_time = time.time()
+        self._db.execute("UPDATE schedule SET last_crawled=?, next_crawl=?, crawl_count=crawl_count+1, error_code=? "
+                         "WHERE screen_name_key=?",
+                         (crawl_time, crawl_time + self._max_interval, error_code, screen_name.lower()))
+        self._db.commit()
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of users, crawls and
+        Tweets in the schedule, and the average number of new Tweets
+        per crawl
+        """
+        users, crawls, tweets = self._db.execute("SELECT COUNT(*), COALESCE(SUM(crawl_count), 0), "
+                                                 "COALESCE(SUM(tweet_count), 0) FROM schedule").fetchone()
+        if crawls:
+            tweets_per_crawl = tweets / float(crawls)
+        else:
+            tweets_per_crawl = 0.0
+        return {'users': users, 'crawls': crawls, 'tweets': tweets, 'tweets_per_crawl': tweets_per_crawl}
+
+    def close(self):
+        self._db.close()
+
+    def _get_crawl_interval(self, tweet_rate):
+        if tweet_rate is None:
+            return self._min_interval
+        if tweet_rate == 0:
+            return self._max_interval
+        return min(self._max_interval, max(self._min_interval, self._target_backlog / tweet_rate))
+
+    def _get_field(self, screen_name, field):
+        row = self._db.execute("SELECT %s FROM schedule WHERE screen_name_key=?" % field,
+                               (screen_name.lower(),)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def _get_row(self, screen_name):
+        return self._db.execute("SELECT since_id, tweet_rate, last_crawled FROM schedule WHERE screen_name_key=?",
+                                (screen_name.lower(),)).fetchone()
+
+
+
+def _get_tweet_rate_from_timestamps(tweets):
+    """
+    Returns the number of Tweets per second implied by the
+    'created_at' timestamps of a list of Tweets, or None if there are
+    too few Tweets (or timestamps) to estimate a rate
+    """
+    timestamps = []
+    for tweet in tweets:
+        try:
+            timestamps.append(calendar.timegm(time.strptime(tweet['created_at'], '%a %b %d %H:%M:%S +0000 %Y')))
+        except (KeyError, ValueError):
+            pass
+    if len(timestamps) < 2 or max(timestamps) == min(timestamps):
+        return None
+    return (len(timestamps) - 1) / float(max(timestamps) - min(timestamps))
@@ -0,0 +1,193 @@
+"""
+Retry policy and circuit breaker for Twitter API calls
+"""
+
+# Standard Library modules
+import httplib
+import random
+import socket
+import threading
+import time
+
+# Third party modules
+import requests
+from twython import TwythonAuthError, TwythonError, TwythonRateLimitError
+
+
+class RetryPolicy:
+    """
+    Decides which failed Twitter API calls are retried, and how long
+    to wait before each retry.
+
+    Errors are classified by exception type and HTTP status code:
+
+      'rate_limit'       - HTTP 429 (TwythonRateLimitError)
+      'server_error'     - HTTP 500, 502, 503 and 504
+      'connection_error' - the request got no HTTP response at all,
+                           e.g. a refused connection, a timeout or an
+                           empty response (httplib.BadStatusLine).
+                           Twython re-raises the Requests library's
+                           exceptions as a TwythonError without a status
+                           code; unwrapped Requests, httplib and socket
+                           exceptions are also recognized.
+
+    Every other error (e.g. HTTP 401 and 404 errors for protected and
+    missing users) is not retried.
+
+    The wait before retry number n (counting from 0) uses "full
+    jitter": a random number of seconds between 0 and
+    min(max_backoff, initial_backoff * 2**n).  The cap keeps waits
+    short enough to notice quickly when an outage ends, and the jitter
+    stops threads that failed at the same moment from retrying in
+    lockstep.
+
+    The policy also holds the settings for the CircuitBreaker that
+    each RateLimitedTwitterEndpoint creates.  A policy can be shared
+    by many endpoints.
+    """
+    # HTTP status codes of transient errors, and the reason they are retried
+    RETRYABLE_STATUS_CODES = {
+        429: 'rate_limit',
+        500: 'server_error',
+        502: 'server_error',
+        503: 'server_error',
+        504: 'server_error',
+    }
+
+    def __init__(self, initial_backoff=60, max_backoff=900, max_attempts=None, failure_threshold=5,
+                 reset_seconds=60, seed=None):
+        """
+        max_attempts -- the maximum number of times a call is made
+        before the error is re-raised, or None to retry transient
+        errors forever.
+
+        failure_threshold, reset_seconds -- see CircuitBreaker.
+
+        seed -- an optional seed for the jitter, for reproducible tests.
+        """
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    def get_backoff_seconds(self, attempt):
+        """
+        Returns the number of seconds to wait after the failure of
+        attempt number attempt (counting from 0)
+        """
+        # Exponent capped so that the multiplication can't overflow
+        ceiling = min(self.max_backoff, self.initial_backoff * 2**min(attempt, 32))
+        with self._random_lock:
+            return self._random.uniform(0, ceiling)
+
+    def get_retry_reason(self, exception):
+        """
+        Returns the reason a failed call should be retried (see the
+        class docstring), or None if the exception isn't transient
+        """
+        if isinstance(exception, TwythonRateLimitError):
+            return 'rate_limit'
+        if isinstance(exception, (requests.RequestException, httplib.HTTPException, socket.error)):
+            return 'connection_error'
+        if not isinstance(exception, TwythonError) or isinstance(exception, TwythonAuthError):
+            return None
+        if exception.error_code is None:
+            return 'connection_error'
+        return self.RETRYABLE_STATUS_CODES.get(exception.error_code)
+
+    def make_circuit_breaker(self):
+        return CircuitBreaker(self.failure_threshold, self.reset_seconds)
+
+    def should_retry(self, attempt):
+        """
+        Returns True if a call can be made again after attempt number
+        attempt (counting from 0) failed with a transient error
+        """
+        return self.max_attempts is None or attempt + 1 < self.max_attempts
+
+
+class CircuitBreaker:
+    """
+    Stops all of the threads using an API endpoint from calling it
+    while it is failing.
+
+    The breaker starts "closed", and calls are made as usual.  After
+    failure_threshold consecutive transient errors, the breaker
+    "opens", and acquire() makes every caller wait reset_seconds.
+    When the wait is over the breaker is "half open": a single caller
+    is allowed to make a probe call while the others keep waiting.  If
+    the probe succeeds, the breaker closes and every caller proceeds;
+    if it fails, the breaker opens again.
+
+    During an outage, the endpoint is called about once every
+    reset_seconds, however many threads are waiting, and the waiting
+    threads all resume as soon as one probe succeeds.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_seconds=60):
+        self._failure_threshold = failure_threshold
+        self._reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failure_count = 0
+        self._open_until = None
+        self._probe_started = None
+
+    def acquire(self, now=None):
+        """
+        Returns 0 if the caller can make an API call now, and otherwise
+        the number of seconds the caller should wait before calling
+        acquire() again
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if self._state == self.CLOSED:
+                return 0
+            if self._state == self.OPEN:
+                if now < self._open_until:
+                    return self._open_until - now
+                self._state = self.HALF_OPEN
+                self._probe_started = now
+                return 0
+            # Half open - a probe that never reported back (e.g. its thread died) is replaced
+            if now - self._probe_started >= self._reset_seconds:
+                self._probe_started = now
+                return 0
+            # Poll often, so that waiting threads resume soon after the probe succeeds
+            return min(self._reset_seconds - (now - self._probe_started), self._reset_seconds / 10.0)
+
+    def get_state(self):
+        with self._lock:
+            return self._state
+
+    def record_failure(self, now=None):
+        """
+        Records a transient error.  Returns True if the error opened
+        the breaker.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._failure_count += 1
+            if self._state == self.HALF_OPEN or \
+                    (self._state == self.CLOSED and self._failure_count >= self._failure_threshold):
+                self._state = self.OPEN
+                self._open_until = now + self._reset_seconds
+                return True
+            return False
+
+    def record_success(self):
+        """
+        Records a call that got a response from the API (including
+        responses with non-transient errors, such as HTTP 404)
+        """
+        with self._lock:
+            self._state = self.CLOSED
+            self._failure_count = 0
@@ -8,6 +8,14 @@ The script takes as input a text file which lists one Twitter username
 per line of the file.  The script creates a [username].tweets file for
 each username specified in the directory.
 
+The outcome of each download is recorded in a crawl manifest (by
+default 'crawl.manifest' in the current directory), and users already
+in the manifest are skipped.
+
+Tweet files can be gzip or zstd compressed with the '--compression'
+argument.  Tweets are serialized, compressed and written on a
+background thread while the crawl continues.
+
 Your Twitter OAuth credentials should be stored in the file
 twitter_oauth_settings.py.
 """
@@ -15,15 +23,20 @@ twitter_oauth_settings.py.
 # Standard Library modules
 import argparse
 import codecs
-import os
+import functools
 import sys
 
 # Third party modules
-from twython import Twython, TwythonError
+from twython import TwythonError
 
 # Local modules
-from twitter_crawler import (CrawlTwitterTimelines, RateLimitedTwitterEndpoint, 
-                             get_console_info_logger, get_screen_names_from_file, save_tweets_to_json_file)
+from twitter_crawler import (CrawlTwitterTimelines, RateLimitedTwitterEndpoint, get_app_auth_twython,
+                             get_console_info_logger, get_screen_names_from_file)
+from api_response_cache import add_api_cache_arguments, open_api_response_cache
+from crawl_manifest import open_crawl_manifest
+from crawl_profiler import add_profiler_arguments, start_profiler
+from crawler_metrics import add_metrics_arguments, start_metrics_exporters
+from tweet_writer import add_tweet_writer_arguments, create_tweet_writer
 try:
     from twitter_oauth_settings import access_token, access_token_secret, consumer_key, consumer_secret
 except ImportError:
@@ -34,42 +47,70 @@ except ImportError:
     sys.exit()
 
 
-def main():
+def main(argv=None):
     # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
     sys.stdout = codecs.getwriter('utf8')(sys.stdout)
 
     parser = argparse.ArgumentParser(description="")
     parser.add_argument('screen_name_file')
-    args = parser.parse_args()
+    parser.add_argument('--manifest', dest='manifest_file',
+                        help="SQLite crawl manifest (default: crawl.manifest)")
+    parser.add_argument('--pacing', action='store_true',
+                        help="Spread API calls evenly over each rate limit window instead of sleeping when it is used up")
+    add_tweet_writer_arguments(parser)
+    add_api_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profiler_arguments(parser)
+    args = parser.parse_args(argv)
 
     logger = get_console_info_logger()
+    tweet_writer = create_tweet_writer(args, logger)
+    metrics_exporters = start_metrics_exporters(args, logger=logger)
+    profiler = start_profiler(args, logger=logger)
+    response_cache = open_api_response_cache(args, logger)
 
-    ACCESS_TOKEN = Twython(consumer_key, consumer_secret, oauth_version=2).obtain_access_token()
-    twython = Twython(consumer_key, access_token=ACCESS_TOKEN)
+    twython = get_app_auth_twython(consumer_key, consumer_secret)
 
-    crawler = RateLimitedTwitterEndpoint(twython, "statuses/user_timeline", logger)
+    crawler = RateLimitedTwitterEndpoint(twython, "statuses/user_timeline", logger, pacing=args.pacing,
+                                         response_cache=response_cache)
 
     screen_names = get_screen_names_from_file(args.screen_name_file)
+    manifest = open_crawl_manifest('.', args.manifest_file, logger)
 
-    for screen_name in screen_names:
-        tweet_filename = "%s.tweets" % screen_name
-        if os.path.exists(tweet_filename):
-            logger.info("File '%s' already exists - will not attempt to download Tweets for '%s'" % (tweet_filename, screen_name))
-        else:
-            try:
-                logger.info("Retrieving Tweets for user '%s'" % screen_name)
-                tweets = crawler.get_data(screen_name=screen_name, count=200)
-            except TwythonError as e:
-                print "TwythonError: %s" % e
-                if e.error_code == 404:
-                    logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
-                elif e.error_code == 401:
-                    logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
-                else:
-                    # Unhandled exception
-                    raise e
+    try:
+        for screen_name in screen_names:
+            tweet_filename = "%s.tweets" % screen_name
+            if manifest.has_user(screen_name):
+                logger.info("User '%s' is already in the crawl manifest - will not attempt to download Tweets" % screen_name)
             else:
-                save_tweets_to_json_file(tweets, "%s.tweets" % screen_name)
+                try:
+                    logger.info("Retrieving Tweets for user '%s'" % screen_name)
+                    tweets = crawler.get_data(screen_name=screen_name, count=200)
+                except TwythonError as e:
+                    print "TwythonError: %s" % e
+                    if e.error_code == 404:
+                        logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
+                        manifest.record_error(screen_name, e.error_code)
+                    elif e.error_code == 401:
+                        logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
+                        manifest.record_error(screen_name, e.error_code)
+                    else:
+                        # Unhandled exception
+                        raise e
+                else:
+                    # The user is only recorded in the manifest once the file has been written
+                    tweet_writer.save_tweets(tweets, tweet_filename,
+                                             on_saved=functools.partial(manifest.record_tweets, screen_name, tweets))
+    finally:
+        # Write any queued Tweets and buffered manifest updates, even if the crawl is interrupted
+        try:
+            tweet_writer.close()
+        finally:
+            manifest.close()
+            metrics_exporters.close()
+            profiler.close()
+            if response_cache is not None:
+                response_cache.close()
 
 
 if __name__ == "__main__":
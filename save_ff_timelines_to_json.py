@@ -14,6 +14,34 @@ The script creates a [username].tweets file containing the Tweets (one
 JSON object per line) for each user who is a friend-and-follower of
 one of the provided users..
 
+The '--max-depth' argument expands the crawl breadth-first beyond the
+one-hop network: with a depth of 2, the friends-and-followers of the
+friends-and-followers are crawled too, and so on.  The crawl state is
+kept in a frontier database (see crawl_frontier.py), so an interrupted
+crawl picks up where it left off when the script is rerun, and no user
+is crawled twice.  With '--priority followers', users with the most
+followers are crawled first instead of the users closest to a seed.
+
+Downloaded timelines are recorded in a crawl manifest (see
+crawl_manifest.py), so timelines downloaded by earlier crawls are not
+downloaded again.
+
+Tweet files can be gzip or zstd compressed with the '--compression'
+argument.  Tweets are serialized, compressed and written on a
+background thread while the crawl continues.
+
+If the optional '--graph' argument is given, the complete Friends and
+Followers lists of every crawled user are stored in a compact graph
+file, and users already in the graph file are not recrawled.  The
+graph file is saved every '--graph-save-interval' users and when the
+crawl ends.
+
+With '--pipeline N', up to N users are crawled at once, with the API
+calls for each endpoint made on that endpoint's own thread (see
+pipelined_crawler.py).  While one endpoint is sleeping until its rate
+limit resets, the other endpoints keep working, so large crawls finish
+much sooner.
+
 Your Twitter OAuth credentials should be stored in the file
 twitter_oauth_settings.py.
 """
@@ -21,16 +49,23 @@ twitter_oauth_settings.py.
 # Standard Library modules
 import argparse
 import codecs
-import os
+import functools
 import sys
 
 # Third party modules
-from twython import Twython, TwythonError
+from twython import TwythonError
 
 # Local modules
 from twitter_crawler import (CrawlTwitterTimelines, FindFriendFollowers, RateLimitedTwitterEndpoint,
-                             get_console_info_logger, get_screen_names_from_file, 
-                             save_screen_names_to_file, save_tweets_to_json_file)
+                             get_app_auth_twython, get_console_info_logger, get_screen_names_from_file,
+                             save_screen_names_to_file)
+from api_response_cache import add_api_cache_arguments, open_api_response_cache
+from crawl_frontier import CrawlFrontier
+from crawl_manifest import open_crawl_manifest
+from crawl_profiler import add_profiler_arguments, start_profiler
+from crawler_metrics import add_metrics_arguments, start_metrics_exporters
+from tweet_writer import add_tweet_writer_arguments, create_tweet_writer
+from twitter_transport import DEFAULT_POOL_SIZE
 try:
     from twitter_oauth_settings import access_token, access_token_secret, consumer_key, consumer_secret
 except ImportError:
@@ -41,47 +76,232 @@ except ImportError:
     sys.exit()
 
 
-def main():
+def main(argv=None):
     # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
     sys.stdout = codecs.getwriter('utf8')(sys.stdout)
 
     parser = argparse.ArgumentParser(description="")
     parser.add_argument('screen_name_file')
-    args = parser.parse_args()
+    parser.add_argument('--graph', dest='graph_file',
+                        help="NumPy .npz file used to store the Friend/Follower graph")
+    parser.add_argument('--graph-save-interval', dest='graph_save_interval', type=int, default=100, metavar='USERS',
+                        help="Save the graph file after crawling the Friends and Followers of this many users, "
+                        "and when the crawl ends (default: %(default)s)")
+    parser.add_argument('--frontier', dest='frontier_file', default='ff_crawl.frontier',
+                        help="SQLite database used to store the crawl frontier (default: %(default)s)")
+    parser.add_argument('--manifest', dest='manifest_file',
+                        help="SQLite crawl manifest (default: crawl.manifest)")
+    parser.add_argument('--max-depth', dest='max_depth', type=int, default=1,
+                        help="Number of friend-and-follower hops to crawl from each seed user (default: %(default)s)")
+    parser.add_argument('--priority', choices=['depth', 'followers'], default='depth',
+                        help="Crawl users closest to a seed first, or users with the most followers first")
+    parser.add_argument('--pipeline', dest='pipeline_users', type=int, default=0, metavar='USERS',
+                        help="Crawl up to USERS users at once, with a thread for each API endpoint")
+    parser.add_argument('--pipeline-threads', dest='pipeline_threads', type=int, default=1,
+                        help="Number of threads making API calls to each endpoint with '--pipeline' (default: %(default)s)")
+    parser.add_argument('--pacing', action='store_true',
+                        help="Spread API calls evenly over each rate limit window instead of sleeping when it is used up")
+    add_tweet_writer_arguments(parser)
+    add_api_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profiler_arguments(parser)
+    args = parser.parse_args(argv)
 
     logger = get_console_info_logger()
+    tweet_writer = create_tweet_writer(args, logger)
+    metrics_exporters = start_metrics_exporters(args, logger=logger)
+    profiler = start_profiler(args, logger=logger)
+    response_cache = open_api_response_cache(args, logger)
 
-    ACCESS_TOKEN = Twython(consumer_key, consumer_secret, oauth_version=2).obtain_access_token()
-    twython = Twython(consumer_key, access_token=ACCESS_TOKEN)
+    # The graph (which needs NumPy) and the pipelined crawler are only
+    # imported when they are used, so plain crawls start faster
+    if args.pipeline_users > 0:
+        from pipelined_crawler import PipelinedFriendFollowerCrawler
+        # Each pipeline thread needs its own connection to the API
+        pool_size = max(DEFAULT_POOL_SIZE, len(PipelinedFriendFollowerCrawler.ENDPOINTS) * args.pipeline_threads)
+    else:
+        pool_size = DEFAULT_POOL_SIZE
+    twython = get_app_auth_twython(consumer_key, consumer_secret, pool_size=pool_size)
 
-    timeline_crawler = CrawlTwitterTimelines(twython, logger)
-    ff_finder = FindFriendFollowers(twython, logger)
+    if args.graph_file:
+        from twitter_graph import FriendFollowerGraph
+        ff_graph = FriendFollowerGraph()
+        ff_graph.load_if_exists(args.graph_file)
+    else:
+        ff_graph = None
 
-    screen_names = get_screen_names_from_file(args.screen_name_file)
+    frontier = CrawlFrontier(args.frontier_file, logger)
+    frontier.add_users(get_screen_names_from_file(args.screen_name_file), 0)
+    manifest = open_crawl_manifest('.', args.manifest_file, logger)
 
-    for screen_name in screen_names:
-        ff_screen_names = ff_finder.get_ff_screen_names_for_screen_name(screen_name)
-        save_screen_names_to_file(ff_screen_names, "%s.ff" % screen_name, logger)
+    if args.pipeline_users > 0:
+        pipelined_crawler = PipelinedFriendFollowerCrawler(twython, logger, ff_graph=ff_graph, pacing=args.pacing,
+                                                           response_cache=response_cache,
+                                                           threads_per_endpoint=args.pipeline_threads)
+        try:
+            run_pipelined_crawl(args, pipelined_crawler, frontier, manifest, tweet_writer, logger)
+        finally:
+            pipelined_crawler.close()
+            try:
+                tweet_writer.close()
+            finally:
+                manifest.close()
+                metrics_exporters.close()
+                profiler.close()
+                if response_cache is not None:
+                    response_cache.close()
+                if args.graph_file:
+                    pipelined_crawler.save_graph(args.graph_file)
+        logger.info("Crawl finished: %s" % frontier.get_status_counts())
+        frontier.close()
+        return
 
-        for ff_screen_name in ff_screen_names:
-            tweet_filename = "%s.tweets" % ff_screen_name
-            if os.path.exists(tweet_filename):
-                logger.info("File '%s' already exists - will not attempt to download Tweets for '%s'" % (tweet_filename, ff_screen_name))
-            else:
-                try:
-                    tweets = timeline_crawler.get_all_timeline_tweets_for_screen_name(ff_screen_name)
-                except TwythonError as e:
-                    print "TwythonError: %s" % e
-                    if e.error_code == 404:
-                        logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % ff_screen_name)
-                    elif e.error_code == 401:
-                        logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % ff_screen_name)
+    timeline_crawler = CrawlTwitterTimelines(twython, logger, pacing=args.pacing, response_cache=response_cache)
+    ff_finder = FindFriendFollowers(twython, logger, ff_graph=ff_graph, pacing=args.pacing,
+                                    response_cache=response_cache)
+
+    ff_users_crawled = 0
+    try:
+        while 1:
+            next_user = frontier.pop_next_user()
+            if next_user is None:
+                break
+            screen_name, depth = next_user
+
+            # Seed users are only used to find friends-and-followers, their Tweets are not downloaded
+            if depth > 0:
+                tweet_filename = "%s.tweets" % screen_name
+                if manifest.has_user(screen_name):
+                    logger.info("User '%s' is already in the crawl manifest - will not attempt to download Tweets" % screen_name)
+                else:
+                    try:
+                        tweets = timeline_crawler.get_all_timeline_tweets_for_screen_name(screen_name)
+                    except TwythonError as e:
+                        print "TwythonError: %s" % e
+                        if e.error_code == 404:
+                            logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
+                            manifest.record_error(screen_name, e.error_code)
+                        elif e.error_code == 401:
+                            logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
+                            manifest.record_error(screen_name, e.error_code)
+                        else:
+                            # Unhandled exception
+                            raise e
+                        frontier.mark_failed(screen_name, e.error_code)
+                        continue
                     else:
-                        # Unhandled exception
-                        raise e
+                        # The user is only recorded in the manifest once the file has been written
+                        tweet_writer.save_tweets(tweets, tweet_filename,
+                                                 on_saved=functools.partial(manifest.record_tweets, screen_name, tweets))
+
+            if depth < args.max_depth:
+                ff_users = ff_finder.get_ff_users_for_screen_name(screen_name)
+                ff_screen_names = [ff_user[u'screen_name'] for ff_user in ff_users]
+                save_screen_names_to_file(ff_screen_names, "%s.ff" % screen_name, logger)
+                ff_users_crawled += 1
+                if ff_graph is not None and ff_users_crawled % args.graph_save_interval == 0:
+                    ff_graph.save(args.graph_file)
+
+                if args.priority == 'followers':
+                    priorities = [-ff_user[u'followers_count'] for ff_user in ff_users]
                 else:
-                    save_tweets_to_json_file(tweets, tweet_filename)
+                    priorities = None
+                frontier.add_users(ff_screen_names, depth+1, priorities)
+
+            frontier.mark_done(screen_name)
+    finally:
+        # Write any queued Tweets and buffered manifest updates, even if the crawl is interrupted
+        try:
+            tweet_writer.close()
+        finally:
+            manifest.close()
+            metrics_exporters.close()
+            profiler.close()
+            if response_cache is not None:
+                response_cache.close()
+            if ff_graph is not None:
+                ff_graph.save(args.graph_file)
+
+    logger.info("Crawl finished: %s" % frontier.get_status_counts())
+    frontier.close()
+
 
+def run_pipelined_crawl(args, crawler, frontier, manifest, tweet_writer, logger):
+    """
+    Crawls the users in the frontier with a
+    PipelinedFriendFollowerCrawler, keeping up to args.pipeline_users
+    users in the pipeline.  The frontier, manifest and output files are
+    only updated by the calling thread.
+    """
+    from pipelined_crawler import PipelineResult
+
+    # screen_name.lower() -> [number of results still expected, error code]
+    users_in_progress = {}
+    ff_users_crawled = 0
+
+    while 1:
+        while crawler.get_pending_count() < args.pipeline_users:
+            next_user = frontier.pop_next_user()
+            if next_user is None:
+                break
+            screen_name, depth = next_user
+            expected_results = 0
+
+            # Seed users are only used to find friends-and-followers, their Tweets are not downloaded
+            if depth > 0:
+                if manifest.has_user(screen_name):
+                    logger.info("User '%s' is already in the crawl manifest - will not attempt to download Tweets" % screen_name)
+                else:
+                    # As in the serial crawl, users whose timelines can't be downloaded are not
+                    # expanded, so their friends-and-followers are submitted with the timeline result
+                    crawler.submit_timeline(screen_name, depth)
+                    expected_results += 1
+            if depth < args.max_depth and expected_results == 0:
+                crawler.submit_ff_users(screen_name, depth)
+                expected_results += 1
+
+            if expected_results == 0:
+                frontier.mark_done(screen_name)
+            else:
+                users_in_progress[screen_name.lower()] = [expected_results, None]
+
+        if crawler.get_pending_count() == 0:
+            break
+
+        result = crawler.get_result()
+        screen_name = result.screen_name
+        user_progress = users_in_progress[screen_name.lower()]
+        if result.kind == PipelineResult.TIMELINE:
+            if result.error_code is not None:
+                manifest.record_error(screen_name, result.error_code)
+                user_progress[1] = result.error_code
+            else:
+                tweet_writer.save_tweets(result.data, "%s.tweets" % screen_name,
+                                         on_saved=functools.partial(manifest.record_tweets, screen_name, result.data))
+                if result.tag < args.max_depth:
+                    crawler.submit_ff_users(screen_name, result.tag)
+                    user_progress[0] += 1
+        else:
+            ff_users = result.data
+            ff_screen_names = [ff_user[u'screen_name'] for ff_user in ff_users]
+            save_screen_names_to_file(ff_screen_names, "%s.ff" % screen_name, logger)
+            ff_users_crawled += 1
+            if args.graph_file and ff_users_crawled % args.graph_save_interval == 0:
+                crawler.save_graph(args.graph_file)
+
+            if args.priority == 'followers':
+                priorities = [-ff_user[u'followers_count'] for ff_user in ff_users]
+            else:
+                priorities = None
+            frontier.add_users(ff_screen_names, result.tag+1, priorities)
+
+        user_progress[0] -= 1
+        if user_progress[0] == 0:
+            del users_in_progress[screen_name.lower()]
+            if user_progress[1] is not None:
+                frontier.mark_failed(screen_name, user_progress[1])
+            else:
+                frontier.mark_done(screen_name)
 
 
 if __name__ == "__main__":
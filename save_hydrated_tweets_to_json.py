@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+"""
+This script downloads the complete Tweet objects ("hydrates" the
+Tweets) for lists of Tweet IDs, e.g. from a shared Twitter dataset.
+
+The script takes as input one or more text files which list one Tweet
+ID per line (the files can be gzip or zstd compressed), and the path
+of an output directory.  The Tweet IDs are streamed from the files and
+looked up 100 at a time using the 'statuses/lookup' API, at the
+maximum rate the API allows.
+
+The output directory contains:
+
+  hydrated-[time].tweets - the Tweets downloaded by each run of the
+                           script, one JSON object per line
+  hydrated.ids           - the IDs of every Tweet downloaded so far
+  missing.ids            - the IDs of Tweets that could not be
+                           downloaded because they have been deleted,
+                           or their users are suspended or protected
+
+Tweets are written to the output files as they are downloaded.  IDs
+that are listed more than once in the input files, or that are already
+listed in 'hydrated.ids' or 'missing.ids', are skipped - so an
+interrupted run can be resumed by running the script again with the
+same arguments.
+
+Tweet files can be gzip or zstd compressed with the '--compression'
+argument.
+
+Your Twitter OAuth credentials should be stored in the file
+twitter_oauth_settings.py.
+"""
+
+# Standard Library modules
+import argparse
+import codecs
+import os
+import sys
+import time
+
+# Local modules
+from twitter_crawler import HydrateTweets, get_app_auth_twython, get_console_info_logger
+from api_response_cache import add_api_cache_arguments, open_api_response_cache
+from crawl_profiler import add_profiler_arguments, start_profiler
+from crawler_metrics import add_metrics_arguments, start_metrics_exporters
+from tweet_id_set import TweetIDSet, iter_tweet_ids_from_file
+from tweet_writer import TweetWriter, add_compression_extension, add_tweet_writer_arguments
+try:
+    from twitter_oauth_settings import access_token, access_token_secret, consumer_key, consumer_secret
+except ImportError:
+    print "You must create a 'twitter_oauth_settings.py' file with your Twitter API credentials."
+    print "Please copy over the sample configuration file:"
+    print "  cp twitter_oauth_settings.sample.py twitter_oauth_settings.py"
+    print "and add your API credentials to the file."
+    sys.exit()
+
+
+def main(argv=None):
+    # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
+    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+
+    parser = argparse.ArgumentParser(description="")
+    parser.add_argument('output_path')
+    parser.add_argument('tweet_id_files', nargs='+')
+    parser.add_argument('--pacing', action='store_true',
+                        help="Spread API calls evenly over each rate limit window instead of sleeping when it is used up")
+    add_tweet_writer_arguments(parser)
+    add_api_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profiler_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logger = get_console_info_logger()
+    metrics_exporters = start_metrics_exporters(args, logger=logger)
+    profiler = start_profiler(args, logger=logger)
+    response_cache = open_api_response_cache(args, logger)
+
+    twython = get_app_auth_twython(consumer_key, consumer_secret)
+
+    hydrator = HydrateTweets(twython, logger, pacing=args.pacing, response_cache=response_cache)
+
+    if not os.path.exists(args.output_path):
+        os.makedirs(args.output_path)
+    hydrated_ids_filename = os.path.join(args.output_path, 'hydrated.ids')
+    missing_ids_filename = os.path.join(args.output_path, 'missing.ids')
+
+    # IDs that have already been downloaded or found to be missing
+    seen_ids = TweetIDSet()
+    for id_filename in [hydrated_ids_filename, missing_ids_filename]:
+        if os.path.exists(id_filename):
+            logger.info("Read %d Tweet IDs from '%s'" % (seen_ids.add_ids_from_file(id_filename), id_filename))
+
+    # A run that starts in the same second as an earlier run must not overwrite its Tweets
+    run_name = "hydrated-%s" % time.strftime("%Y%m%d-%H%M%S")
+    tweet_filename = add_compression_extension(os.path.join(args.output_path, run_name + ".tweets"), args.compression)
+    run_number = 1
+    while os.path.exists(tweet_filename):
+        run_number += 1
+        tweet_filename = add_compression_extension(os.path.join(args.output_path, "%s-%d.tweets" % (run_name, run_number)),
+                                                   args.compression)
+    tweet_writer = TweetWriter(tweet_filename, args.compression, args.compression_level, json_encoder=args.json_encoder)
+    hydrated_ids_file = open(hydrated_ids_filename, 'a')
+    missing_ids_file = open(missing_ids_filename, 'a')
+
+    hydrated_count = 0
+    missing_count = 0
+    try:
+        for tweets, missing_ids in hydrator.hydrate_tweet_ids(iter_new_tweet_ids(args.tweet_id_files, seen_ids)):
+            # The Tweets are written before their IDs, so that an ID is never recorded for an unsaved Tweet
+            tweet_writer.write_tweets(tweets)
+            tweet_writer.flush()
+            hydrated_ids_file.write("".join(["%d\n" % tweet['id'] for tweet in tweets]))
+            missing_ids_file.write("".join(["%d\n" % tweet_id for tweet_id in missing_ids]))
+
+            hydrated_count += len(tweets)
+            missing_count += len(missing_ids)
+            logger.info("Hydrated %d Tweets, %d Tweets missing" % (hydrated_count, missing_count))
+    finally:
+        try:
+            tweet_writer.close()
+        finally:
+            hydrated_ids_file.close()
+            missing_ids_file.close()
+            metrics_exporters.close()
+            profiler.close()
+            if response_cache is not None:
+                response_cache.close()
+
+
+def iter_new_tweet_ids(tweet_id_filenames, seen_ids):
+    """
+    Generates the Tweet IDs from a list of files that are not in the
+    TweetIDSet seen_ids, adding each generated ID to seen_ids
+    """
+    for tweet_id_filename in tweet_id_filenames:
+        for tweet_id in iter_tweet_ids_from_file(tweet_id_filename):
+            if tweet_id not in seen_ids:
+                seen_ids.add(tweet_id)
+                yield tweet_id
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,31 @@ The script takes as input:
 For each username, the script opens the '[old_path]/[username].tweets'
 file, determines the most recently downloaded Tweet, and then creates
 a new '[new_path]/[username].tweets' file containing any new Tweets
-from the user.
+from the user.  New Tweet files can be compressed with the
+'--compression' argument, and compressed older Tweet files are read
+transparently.
+
+The outcome of each download is recorded in a crawl manifest (by
+default 'crawl.manifest' in the new path), and users already in the
+manifest are skipped.
+
+If the optional '--store' argument is given, the most recently
+downloaded Tweet for each user is looked up in a TweetSegmentStore
+(see tweet_segment_store.py), and the new Tweets are appended to the
+store as a new record for the user instead of being written to
+'[new_path]/[username].tweets'.  Running the store's compact() method
+merges the new records into each user's existing record.
+
+If the optional '--schedule' argument is given, the script instead
+runs as an incremental refresh service.  Each user's most recent
+Tweet ID and posting rate are stored in a RecrawlScheduler database
+(see recrawl_scheduler.py), and each user is recrawled when they are
+expected to have posted about 100 new Tweets, so API calls are spent
+on active users instead of dormant ones.  The older Tweet files (or
+the store) are only read the first time a user is added to the
+schedule.  New Tweets are saved as '[new_path]/[username].[time].tweets'
+files (or appended to the store).  The service runs until it is
+interrupted, or with '--once', until no more users are due.
 
 Your Twitter OAuth credentials should be stored in the file
 twitter_oauth_settings.py.
@@ -21,16 +45,25 @@ twitter_oauth_settings.py.
 # Standard Library modules
 import argparse
 import codecs
+import functools
 import json
 import os
 import sys
+import time
 
 # Third party modules
-from twython import Twython, TwythonError
+from twython import TwythonError
 
 # Local modules
-from twitter_crawler import (CrawlTwitterTimelines, RateLimitedTwitterEndpoint,
-                             get_console_info_logger, get_screen_names_from_file, save_tweets_to_json_file)
+from twitter_crawler import (CrawlTwitterTimelines, RateLimitedTwitterEndpoint, get_app_auth_twython,
+                             get_console_info_logger, get_screen_names_from_file)
+from api_response_cache import add_api_cache_arguments, open_api_response_cache
+from crawl_manifest import open_crawl_manifest
+from crawl_profiler import add_profiler_arguments, start_profiler
+from crawler_metrics import add_metrics_arguments, start_metrics_exporters
+from recrawl_scheduler import RecrawlScheduler
+from tweet_writer import add_compression_extension, add_tweet_writer_arguments, create_tweet_writer, open_tweet_file
+from tweet_segment_store import TweetSegmentStore
 try:
     from twitter_oauth_settings import access_token, access_token_secret, consumer_key, consumer_secret
 except ImportError:
@@ -41,7 +74,7 @@ except ImportError:
     sys.exit()
 
 
-def main():
+def main(argv=None):
     # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
     sys.stdout = codecs.getwriter('utf8')(sys.stdout)
 
@@ -49,50 +82,189 @@ def main():
     parser.add_argument('screen_name_file')
     parser.add_argument('old_tweet_path')
     parser.add_argument('new_tweet_path')
-    args = parser.parse_args()
+    parser.add_argument('--manifest', dest='manifest_file',
+                        help="SQLite crawl manifest for the new Tweets (default: [new_tweet_path]/crawl.manifest)")
+    parser.add_argument('--store', dest='store_path',
+                        help="Directory of a segment store to read the old Tweets from and append the new Tweets to")
+    parser.add_argument('--schedule', dest='schedule_file',
+                        help="SQLite recrawl schedule - run as an incremental refresh service")
+    parser.add_argument('--once', action='store_true',
+                        help="With '--schedule', exit when no more users are due instead of waiting")
+    parser.add_argument('--pacing', action='store_true',
+                        help="Spread API calls evenly over each rate limit window instead of sleeping when it is used up")
+    add_tweet_writer_arguments(parser)
+    add_api_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_profiler_arguments(parser)
+    args = parser.parse_args(argv)
 
     logger = get_console_info_logger()
+    tweet_writer = create_tweet_writer(args, logger)
+    metrics_exporters = start_metrics_exporters(args, logger=logger)
+    profiler = start_profiler(args, logger=logger)
+    response_cache = open_api_response_cache(args, logger)
 
-    ACCESS_TOKEN = Twython(consumer_key, consumer_secret, oauth_version=2).obtain_access_token()
-    twython = Twython(consumer_key, access_token=ACCESS_TOKEN)
+    twython = get_app_auth_twython(consumer_key, consumer_secret)
 
-    crawler = CrawlTwitterTimelines(twython, logger)
+    crawler = CrawlTwitterTimelines(twython, logger, pacing=args.pacing, response_cache=response_cache)
 
     screen_names = get_screen_names_from_file(args.screen_name_file)
+    if args.store_path:
+        store = TweetSegmentStore(args.store_path, logger=logger)
+    else:
+        store = None
 
-    for screen_name in screen_names:
-        old_tweet_filename = os.path.join(args.old_tweet_path, "%s.tweets" % screen_name)
-        new_tweet_filename = os.path.join(args.new_tweet_path, "%s.tweets" % screen_name)
+    if args.schedule_file:
+        scheduler = RecrawlScheduler(args.schedule_file, logger=logger)
+        try:
+            run_recrawl_schedule(args, crawler, scheduler, screen_names, store, tweet_writer, logger)
+        finally:
+            try:
+                tweet_writer.close()
+            finally:
+                scheduler.close()
+                if store is not None:
+                    store.close()
+                metrics_exporters.close()
+                profiler.close()
+                if response_cache is not None:
+                    response_cache.close()
+        return
 
-        if not os.path.exists(old_tweet_filename):
-            logger.error("Older Tweet file '%s' does not exist - will not attempt to download Tweets for '%s'" % (old_tweet_filename, screen_name))
-            continue
-        if os.path.exists(new_tweet_filename):
-            logger.info("File '%s' already exists - will not attempt to download Tweets for '%s'" % (new_tweet_filename, screen_name))
-            continue
+    manifest = open_crawl_manifest(args.new_tweet_path, args.manifest_file, logger)
+    try:
+        for screen_name in screen_names:
+            old_tweet_filename = os.path.join(args.old_tweet_path, "%s.tweets" % screen_name)
+            new_tweet_filename = os.path.join(args.new_tweet_path, "%s.tweets" % screen_name)
 
-        most_recent_tweet_id = get_most_recent_tweet_id_from_json_tweet_file(old_tweet_filename)
+            if manifest.has_user(screen_name):
+                logger.info("User '%s' is already in the crawl manifest - will not attempt to download Tweets" % screen_name)
+                continue
 
-        try:
-            tweets = crawler.get_all_timeline_tweets_for_screen_name_since(screen_name, most_recent_tweet_id)
-        except TwythonError as e:
-            print "TwythonError: %s" % e
-            if e.error_code == 404:
-                logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
-            elif e.error_code == 401:
-                logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
+            if store is not None and store.has_user(screen_name):
+                most_recent_tweet_id = store.get_max_id(screen_name)
+                if most_recent_tweet_id is None:
+                    logger.error("No Tweets stored for user '%s' - will not attempt to download Tweets" % screen_name)
+                    continue
+            else:
+                try:
+                    most_recent_tweet_id = get_most_recent_tweet_id_from_json_tweet_file(old_tweet_filename)
+                except IOError:
+                    logger.error("Older Tweet file '%s' does not exist - will not attempt to download Tweets for '%s'" % (old_tweet_filename, screen_name))
+                    continue
+
+            try:
+                tweets = crawler.get_all_timeline_tweets_for_screen_name_since(screen_name, most_recent_tweet_id)
+            except TwythonError as e:
+                print "TwythonError: %s" % e
+                if e.error_code == 404:
+                    logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
+                    manifest.record_error(screen_name, e.error_code)
+                elif e.error_code == 401:
+                    logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
+                    manifest.record_error(screen_name, e.error_code)
+                else:
+                    # Unhandled exception
+                    raise e
             else:
-                # Unhandled exception
-                raise e
+                if store is not None:
+                    store.append_tweets(screen_name, tweets)
+                    manifest.record_tweets(screen_name, tweets)
+                else:
+                    # The user is only recorded in the manifest once the file has been written
+                    tweet_writer.save_tweets(tweets, new_tweet_filename,
+                                             on_saved=functools.partial(manifest.record_tweets, screen_name, tweets))
+    finally:
+        # Write any queued Tweets and buffered manifest updates, even if the crawl is interrupted
+        try:
+            tweet_writer.close()
+        finally:
+            manifest.close()
+            if store is not None:
+                store.close()
+            metrics_exporters.close()
+            profiler.close()
+            if response_cache is not None:
+                response_cache.close()
+
+
+def run_recrawl_schedule(args, crawler, scheduler, screen_names, store, tweet_writer, logger):
+    """
+    Adds any new users to the recrawl schedule, and then crawls each
+    user as they become due
+    """
+    for screen_name in screen_names:
+        if scheduler.has_user(screen_name):
+            continue
+        if store is not None and store.has_user(screen_name):
+            since_id = store.get_max_id(screen_name)
         else:
-            save_tweets_to_json_file(tweets, new_tweet_filename)
+            try:
+                since_id = get_most_recent_tweet_id_from_json_tweet_file(
+                    os.path.join(args.old_tweet_path, "%s.tweets" % screen_name))
+            except IOError:
+                # The user's whole timeline will be downloaded
+                since_id = None
+        scheduler.add_user(screen_name, since_id)
+
+    while 1:
+        due_users = scheduler.get_due_users()
+        if not due_users:
+            seconds_until_next_crawl = scheduler.get_seconds_until_next_crawl()
+            if args.once or seconds_until_next_crawl is None:
+                break
+            logger.info("No users due - sleeping for %.0f seconds" % seconds_until_next_crawl)
+            time.sleep(seconds_until_next_crawl)
+            continue
+
+        for screen_name, since_id in due_users:
+            try:
+                if since_id is None:
+                    tweets = crawler.get_all_timeline_tweets_for_screen_name(screen_name)
+                else:
+                    tweets = crawler.get_all_timeline_tweets_for_screen_name_since(screen_name, since_id)
+            except TwythonError as e:
+                print "TwythonError: %s" % e
+                if e.error_code == 404:
+                    logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
+                    scheduler.record_error(screen_name, e.error_code)
+                elif e.error_code == 401:
+                    logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
+                    scheduler.record_error(screen_name, e.error_code)
+                else:
+                    # Unhandled exception
+                    raise e
+            else:
+                if tweets and store is None:
+                    # The crawl is only recorded once the file has been written, so a failed write is recrawled
+                    new_tweet_filename = os.path.join(args.new_tweet_path,
+                                                      "%s.%d.tweets" % (screen_name, int(time.time())))
+                    tweet_writer.save_tweets(tweets, new_tweet_filename,
+                                             on_saved=functools.partial(scheduler.record_crawl, screen_name, tweets))
+                else:
+                    if tweets:
+                        store.append_tweets(screen_name, tweets)
+                    scheduler.record_crawl(screen_name, tweets)
+
+        # Wait for the crawls to be recorded, so that the users aren't due again
+        tweet_writer.flush()
+        logger.info("Recrawl schedule: %s" % scheduler.get_stats())
 
 
 def get_most_recent_tweet_id_from_json_tweet_file(json_tweet_filename):
     """
-    Assumes that Tweets in file are ordered newest to oldest
+    Assumes that Tweets in file are ordered newest to oldest.
+
+    If json_tweet_filename does not exist, compressed versions of the
+    file (e.g. '[username].tweets.gz') are tried instead.
     """
-    json_tweet_file = codecs.open(json_tweet_filename, "r", encoding="utf-8")
+    for compression in [None, 'gzip', 'zstd']:
+        # Only existing files are opened, because opening a zstd file needs the optional 'zstandard' library
+        if os.path.exists(add_compression_extension(json_tweet_filename, compression)):
+            json_tweet_file = open_tweet_file(add_compression_extension(json_tweet_filename, compression))
+            break
+    else:
+        raise IOError("Tweet file '%s' does not exist" % json_tweet_filename)
     first_tweet_json = json_tweet_file.readline()
     first_tweet = json.loads(first_tweet_json)
     most_recent_tweet_id = first_tweet['id']
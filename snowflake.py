@@ -0,0 +1,61 @@
+"""
+Functions for the timestamps encoded in Twitter's "snowflake" IDs
+
+Since November 2010, Tweet IDs have been 64-bit snowflakes: the top
+41 bits are the number of milliseconds since TWITTER_EPOCH_MILLISECONDS,
+and the low 22 bits identify the worker and sequence number.  The time
+a Tweet was posted can therefore be computed from its ID with integer
+arithmetic, without parsing its 'created_at' string:
+
+  https://github.com/twitter-archive/snowflake
+"""
+
+# Standard Library modules
+import calendar
+import time
+
+
+# Snowflake IDs count milliseconds since this epoch (2010-11-04 01:42:54.657 UTC)
+TWITTER_EPOCH_MILLISECONDS = 1288834974657
+
+# Number of worker and sequence bits below the timestamp
+TIMESTAMP_SHIFT = 22
+
+# The first snowflake Tweet ID.  Older (sequential) Tweet IDs don't encode a timestamp.
+FIRST_SNOWFLAKE_TWEET_ID = 29700859247
+
+
+def get_min_tweet_id_for_time(timestamp):
+    """
+    Returns the smallest snowflake ID that could be assigned to a
+    Tweet posted at or after timestamp (seconds since the UNIX epoch)
+    """
+    milliseconds = int(timestamp * 1000) - TWITTER_EPOCH_MILLISECONDS
+    return max(milliseconds, 0) << TIMESTAMP_SHIFT
+
+
+def get_time_for_tweet_id(tweet_id):
+    """
+    Returns the time (in seconds since the UNIX epoch, with millisecond
+    precision) that the Tweet with a snowflake ID was posted, or None
+    for Tweet IDs that are older than snowflake IDs
+    """
+    tweet_id = int(tweet_id)
+    if tweet_id < FIRST_SNOWFLAKE_TWEET_ID:
+        return None
+    return ((tweet_id >> TIMESTAMP_SHIFT) + TWITTER_EPOCH_MILLISECONDS) / 1000.0
+
+
+def parse_utc_time(time_string):
+    """
+    Returns the number of seconds since the UNIX epoch for a UTC time
+    string formatted as 'YYYY-MM-DD', 'YYYY-MM-DD HH:MM' or
+    'YYYY-MM-DD HH:MM:SS' (a 'T' can be used instead of the space)
+    """
+    time_string = time_string.replace('T', ' ')
+    for time_format in ['%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S']:
+        try:
+            return calendar.timegm(time.strptime(time_string, time_format))
+        except ValueError:
+            pass
+    raise ValueError("Unable to parse time '%s' - expected 'YYYY-MM-DD [HH:MM[:SS]]'" % time_string)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+# Third party modules
+from twython import Twython, TwythonError
+
+# Local modules
+from api_response_cache import *
+from crawler_metrics import MetricsRegistry
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+from twitter_crawler import CrawlTwitterTimelines
+
+
+class TestApiResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.cache_filename = os.path.join(self.temp_path, 'api_responses.cache')
+        self.logger = logging.getLogger('test_api_response_cache')
+        self.metrics = MetricsRegistry()
+        self.fetched = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def fetch(self, **params):
+        self.fetched.append(params)
+        if params.get('screen_name') == 'deleted':
+            raise TwythonError("Not Found", error_code=404)
+        if params.get('screen_name') == 'unavailable':
+            raise TwythonError("Service Unavailable", error_code=503)
+        return {'params': params}
+
+    def open_cache(self, **kwargs):
+        return ApiResponseCache(self.cache_filename, logger=self.logger, metrics=self.metrics, **kwargs)
+
+    def test_request_keys_are_normalized(self):
+        self.assertEqual(get_request_key('users/lookup', {'user_id': [1, 2], 'entities': False, 'cursor': None}),
+                         get_request_key('users/lookup', {'entities': 'false', 'user_id': '1,2'}))
+        self.assertNotEqual(get_request_key('friends/ids', {'screen_name': 'charman'}),
+                            get_request_key('followers/ids', {'screen_name': 'charman'}))
+
+    def test_cache_mode_and_ttls(self):
+        response_cache = self.open_cache(ttls={'friends/ids': 1000}, default_ttl=-1)
+        first_response = response_cache.get_or_fetch('friends/ids', {'screen_name': 'charman', 'count': 200}, self.fetch)
+        second_response = response_cache.get_or_fetch('friends/ids', {'screen_name': 'charman', 'count': '200'}, self.fetch)
+        self.assertEqual(first_response, second_response)
+        self.assertEqual(len(self.fetched), 1)
+
+        # Responses from endpoints with an expired TTL are fetched again
+        response_cache.get_or_fetch('users/lookup', {'screen_name': 'charman'}, self.fetch)
+        response_cache.get_or_fetch('users/lookup', {'screen_name': 'charman'}, self.fetch)
+        self.assertEqual(len(self.fetched), 3)
+        response_cache.close()
+
+    def test_since_id_calls_are_not_served_from_the_cache(self):
+        response_cache = self.open_cache()
+        since_id_params = {'screen_name': 'charman', 'since_id': 100, 'count': 200}
+        for attempt in range(2):
+            response_cache.get_or_fetch('statuses/user_timeline', since_id_params, self.fetch)
+        self.assertEqual(len(self.fetched), 2)
+
+        # Pages older than a max_id don't change, so they are served from the cache
+        page_params = {'screen_name': 'charman', 'since_id': 100, 'max_id': 200, 'count': 200}
+        for attempt in range(2):
+            response_cache.get_or_fetch('statuses/user_timeline', page_params, self.fetch)
+        self.assertEqual(len(self.fetched), 3)
+        response_cache.close()
+
+        # The responses are still saved for replaying
+        response_cache = self.open_cache(mode=ApiResponseCache.MODE_REPLAY)
+        self.assertEqual(response_cache.get_or_fetch('statuses/user_timeline', since_id_params, self.fetch),
+                         {'params': since_id_params})
+        self.assertEqual(len(self.fetched), 3)
+        response_cache.close()
+
+    def test_errors_for_users_are_cached(self):
+        response_cache = self.open_cache()
+        for attempt in range(2):
+            with self.assertRaises(TwythonError) as context:
+                response_cache.get_or_fetch('friends/ids', {'screen_name': 'deleted'}, self.fetch)
+            self.assertEqual(context.exception.error_code, 404)
+            self.assertRaises(TwythonError, response_cache.get_or_fetch, 'friends/ids',
+                              {'screen_name': 'unavailable'}, self.fetch)
+        self.assertEqual([params['screen_name'] for params in self.fetched], ['deleted', 'unavailable', 'unavailable'])
+        response_cache.close()
+
+    def test_record_replay_and_eviction(self):
+        response_cache = self.open_cache(mode=ApiResponseCache.MODE_RECORD, max_bytes=2000)
+        for user_number in range(100):
+            response_cache.get_or_fetch('friends/ids', {'screen_name': 'user%d' % user_number}, self.fetch)
+        stats = response_cache.get_stats()
+        self.assertTrue(0 < stats['responses'] < 100)
+        self.assertTrue(stats['bytes'] <= 2000)
+        response_cache.close()
+
+        response_cache = self.open_cache(mode=ApiResponseCache.MODE_REPLAY)
+        self.assertEqual(response_cache.get_or_fetch('friends/ids', {'screen_name': 'user99'}, self.fetch),
+                         {'params': {'screen_name': 'user99'}})
+        # The least recently used responses were evicted
+        self.assertRaises(ApiResponseCacheMiss, response_cache.get_or_fetch, 'friends/ids',
+                          {'screen_name': 'user0'}, self.fetch)
+        self.assertEqual(len(self.fetched), 100)
+        response_cache.close()
+
+    def test_replayed_crawl_makes_no_api_calls(self):
+        # The mock server uses plain HTTP
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        server = MockTwitterServer(MockTwitterAPI(num_users=10))
+        server.start()
+        twython = Twython('app_key', access_token='access_token')
+        twython.api_url = server.get_api_url()
+        try:
+            response_cache = self.open_cache(mode=ApiResponseCache.MODE_RECORD)
+            crawler = CrawlTwitterTimelines(twython, self.logger, metrics=self.metrics, response_cache=response_cache)
+            recorded_tweets = crawler.get_all_timeline_tweets_for_screen_name('user1')
+            response_cache.close()
+        finally:
+            twython.client.close()
+            server.stop()
+
+        # The server has been stopped, so any API call would fail
+        response_cache = self.open_cache(mode=ApiResponseCache.MODE_REPLAY)
+        crawler = CrawlTwitterTimelines(twython, self.logger, metrics=self.metrics, response_cache=response_cache)
+        self.assertEqual(crawler.get_all_timeline_tweets_for_screen_name('user1'), recorded_tweets)
+        response_cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
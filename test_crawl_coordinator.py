@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from crawl_coordinator import *
+
+
+class TestCrawlCoordinator(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.db_filename = os.path.join(self.temp_path, 'crawl.coordinator')
+        self.logger = logging.getLogger('test_crawl_coordinator')
+        self.coordinator = CrawlCoordinator(self.db_filename, lease_seconds=60, max_attempts=2, logger=self.logger)
+
+    def tearDown(self):
+        self.coordinator.close()
+        shutil.rmtree(self.temp_path)
+
+    def test_claim_and_acknowledge(self):
+        self.assertEqual(self.coordinator.add_screen_names(['a', 'b', 'c', 'd', 'e'], unit_size=2), 3)
+        units = [self.coordinator.claim_unit('worker%d' % i) for i in range(3)]
+        self.assertEqual([unit['screen_names'] for unit in units], [['a', 'b'], ['c', 'd'], ['e']])
+        self.assertEqual(self.coordinator.claim_unit('worker3'), None)
+        self.assertFalse(self.coordinator.is_finished())
+
+        for unit in units:
+            results = [(screen_name, 10, None) for screen_name in unit['screen_names']]
+            self.assertTrue(self.coordinator.acknowledge_unit(unit['unit_id'], unit['attempt'], results))
+        # A resent acknowledgment is accepted
+        self.assertTrue(self.coordinator.acknowledge_unit(units[0]['unit_id'], units[0]['attempt'], []))
+
+        self.assertTrue(self.coordinator.is_finished())
+        self.assertEqual(self.coordinator.get_status_counts(), {'done': 3})
+        self.assertEqual(self.coordinator.get_results()['e'], (10, None))
+
+    def test_expired_lease_is_handed_to_another_worker(self):
+        self.coordinator.add_screen_names(['a', 'b'], unit_size=2)
+        crashed = self.coordinator.claim_unit('crashed', now=0.0)
+        self.assertTrue(self.coordinator.renew_lease(crashed['unit_id'], crashed['attempt'], now=50.0))
+        self.assertEqual(self.coordinator.claim_unit('worker', now=100.0), None)
+
+        retry = self.coordinator.claim_unit('worker', now=111.0)
+        self.assertEqual((retry['unit_id'], retry['attempt']), (crashed['unit_id'], 2))
+        # The first worker's lease is no longer valid
+        self.assertFalse(self.coordinator.renew_lease(crashed['unit_id'], crashed['attempt']))
+        self.assertFalse(self.coordinator.acknowledge_unit(crashed['unit_id'], crashed['attempt'], []))
+        self.assertTrue(self.coordinator.acknowledge_unit(retry['unit_id'], retry['attempt'], [('a', 1, None)]))
+        self.assertEqual(self.coordinator.get_results(), {'a': (1, None)})
+
+    def test_unit_fails_after_max_attempts(self):
+        self.coordinator.add_screen_names(['a'])
+        unit = self.coordinator.claim_unit('worker')
+        self.assertTrue(self.coordinator.fail_unit(unit['unit_id'], unit['attempt'], 'TwythonError'))
+        unit = self.coordinator.claim_unit('worker', now=0.0)
+        self.assertEqual(unit['attempt'], 2)
+        self.assertEqual(self.coordinator.claim_unit('worker', now=1000.0), None)
+        self.assertEqual(self.coordinator.get_status_counts(), {'failed': 1})
+        self.assertTrue(self.coordinator.is_finished())
+
+    def test_client_and_server(self):
+        self.coordinator.add_screen_names(['a', 'b', 'c'], unit_size=2)
+        server = CrawlCoordinatorServer(self.coordinator)
+        server.start()
+        try:
+            client = open_crawl_coordinator('%s:%d' % server.server_address)
+            unit = client.claim_unit('remote')
+            self.assertEqual(unit['screen_names'], ['a', 'b'])
+            self.assertTrue(client.renew_lease(unit['unit_id'], unit['attempt']))
+            self.assertTrue(client.acknowledge_unit(unit['unit_id'], unit['attempt'], [('a', 5, None), ('b', None, 404)]))
+            self.assertEqual(client.get_status_counts(), {'done': 1, 'queued': 1})
+            self.assertRaises(CrawlCoordinatorError, client._call, 'close', {})
+            # Clients can't move the coordinator's clock forward to expire other workers' leases
+            self.assertRaises(CrawlCoordinatorError, client._call, 'claim_unit', {'worker_id': 'remote', 'now': 1e12})
+            self.assertEqual(client.get_status_counts(), {'done': 1, 'queued': 1})
+            client.close()
+        finally:
+            server.stop()
+        self.assertEqual(self.coordinator.get_results()['b'], (None, 404))
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from crawl_frontier import *
+
+
+class TestCrawlFrontier(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.frontier_filename = os.path.join(self.temp_path, 'test.frontier')
+        self.logger = logging.getLogger('test_crawl_frontier')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_breadth_first_order(self):
+        frontier = CrawlFrontier(self.frontier_filename, self.logger)
+        frontier.add_users([u'charman'], 0)
+        self.assertEqual(frontier.pop_next_user(), (u'charman', 0))
+        frontier.add_users([u'PHonyDoc', u'jhu'], 1)
+        frontier.mark_done(u'charman')
+        frontier.add_user(u'seed2', 0)
+        self.assertEqual(frontier.pop_next_user(), (u'seed2', 0))
+        self.assertEqual(frontier.pop_next_user()[1], 1)
+        self.assertEqual(frontier.pop_next_user()[1], 1)
+        self.assertEqual(frontier.pop_next_user(), None)
+        frontier.close()
+
+    def test_users_are_only_queued_once(self):
+        frontier = CrawlFrontier(self.frontier_filename, self.logger)
+        self.assertEqual(frontier.add_users([u'charman', u'PHonyDoc'], 0), 2)
+        self.assertEqual(frontier.add_users([u'CHARMAN', u'jhu'], 1), 1)
+        self.assertFalse(frontier.add_user(u'jhu', 2))
+        self.assertTrue(frontier.is_known(u'phonydoc'))
+        self.assertEqual(frontier.get_status_counts(), {u'queued': 3})
+        frontier.close()
+
+    def test_priority_overrides_depth(self):
+        frontier = CrawlFrontier(self.frontier_filename, self.logger)
+        frontier.add_users([u'few_followers', u'many_followers'], 1, [-10, -5000])
+        frontier.add_user(u'seed', 0)
+        self.assertEqual(frontier.pop_next_user(), (u'many_followers', 1))
+        self.assertEqual(frontier.pop_next_user(), (u'few_followers', 1))
+        self.assertEqual(frontier.pop_next_user(), (u'seed', 0))
+        frontier.close()
+
+    def test_resume_after_interruption(self):
+        frontier = CrawlFrontier(self.frontier_filename, self.logger)
+        frontier.add_users([u'charman', u'PHonyDoc', u'jhu'], 0)
+        frontier.mark_done(frontier.pop_next_user()[0])
+        frontier.pop_next_user()
+        frontier.close()
+
+        # The user that was in progress when the frontier was closed is crawled again
+        frontier = CrawlFrontier(self.frontier_filename, self.logger)
+        self.assertEqual(frontier.get_status(u'charman'), CrawlFrontier.STATUS_DONE)
+        self.assertEqual(frontier.get_status(u'PHonyDoc'), CrawlFrontier.STATUS_QUEUED)
+        self.assertFalse(frontier.add_user(u'charman', 1))
+        self.assertEqual(frontier.pop_next_user(), (u'PHonyDoc', 0))
+        frontier.mark_failed(u'PHonyDoc', 404)
+        self.assertEqual(frontier.pop_next_user(), (u'jhu', 0))
+        self.assertEqual(frontier.get_status_counts(),
+                         {u'done': 1, u'failed': 1, u'in_progress': 1})
+        frontier.close()
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from crawl_manifest import *
+from tweet_segment_store import TweetSegmentStore
+
+
+class TestCrawlManifest(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.manifest_filename = os.path.join(self.temp_path, 'crawl.manifest')
+        self.logger = logging.getLogger('test_crawl_manifest')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_record_tweets_and_errors(self):
+        manifest = CrawlManifest(self.manifest_filename, logger=self.logger)
+        self.assertFalse(manifest.has_user(u'charman'))
+        manifest.record_tweets(u'charman', [{'id': 5}, {'id': 3}])
+        manifest.record_error(u'PHonyDoc', 404)
+
+        self.assertTrue(manifest.has_user(u'CHARMAN'))
+        self.assertEqual(manifest.get_status(u'charman'), CrawlManifest.STATUS_CRAWLED)
+        self.assertEqual(manifest.get_tweet_count(u'charman'), 2)
+        self.assertEqual(manifest.get_max_id(u'charman'), 5)
+        self.assertEqual(manifest.get_status(u'PHonyDoc'), CrawlManifest.STATUS_UNAVAILABLE)
+        self.assertEqual(manifest.get_error_code(u'PHonyDoc'), 404)
+        self.assertEqual(manifest.get_status(u'jhu'), None)
+        manifest.close()
+
+    def test_empty_recrawl_keeps_max_id(self):
+        manifest = CrawlManifest(self.manifest_filename, logger=self.logger)
+        manifest.record_tweets(u'charman', [{'id': 5}])
+        manifest.record_tweets(u'charman', [])
+        self.assertEqual(manifest.get_max_id(u'charman'), 5)
+        self.assertEqual(manifest.get_tweet_count(u'charman'), 0)
+        manifest.close()
+
+    def test_updates_are_batched(self):
+        manifest = CrawlManifest(self.manifest_filename, batch_size=2, logger=self.logger)
+        manifest.record_tweets(u'charman', [{'id': 1}])
+        self.assertFalse(CrawlManifest(self.manifest_filename, logger=self.logger).has_user(u'charman'))
+        manifest.record_tweets(u'PHonyDoc', [{'id': 2}])
+        self.assertTrue(CrawlManifest(self.manifest_filename, logger=self.logger).has_user(u'charman'))
+        manifest.record_tweets(u'jhu', [{'id': 3}])
+        manifest.close()
+
+        reopened_manifest = CrawlManifest(self.manifest_filename, logger=self.logger)
+        self.assertEqual(sorted(reopened_manifest.get_screen_names()), [u'PHonyDoc', u'charman', u'jhu'])
+        self.assertEqual(reopened_manifest.get_max_id(u'jhu'), 3)
+        reopened_manifest.close()
+
+    def test_import_existing_tweet_files(self):
+        open(os.path.join(self.temp_path, 'charman.tweets'), 'w').write('{"id": 1}\n')
+        open(os.path.join(self.temp_path, 'PHonyDoc.tweets'), 'w').close()
+        open(os.path.join(self.temp_path, 'charman.ff'), 'w').close()
+
+        manifest = open_crawl_manifest(self.temp_path, logger=self.logger)
+        self.assertEqual(manifest.get_status(u'charman'), CrawlManifest.STATUS_CRAWLED)
+        self.assertEqual(manifest.get_status(u'PHonyDoc'), CrawlManifest.STATUS_UNAVAILABLE)
+        self.assertEqual(len(manifest.get_screen_names()), 2)
+        self.assertEqual(manifest.get_screen_names(CrawlManifest.STATUS_CRAWLED), [u'charman'])
+        manifest.close()
+
+    def test_import_segment_store(self):
+        store = TweetSegmentStore(self.temp_path, logger=self.logger)
+        store.append_tweets(u'charman', [make_tweet(5, u'charman'), make_tweet(3, u'charman')])
+        store.append_tweets(u'PHonyDoc', [make_tweet(7, u'PHonyDoc')])
+        store.close()
+        self.assertTrue(os.path.exists(os.path.join(self.temp_path, TweetSegmentStore.SEGMENT_FILENAME_FORMAT % 0)))
+
+        # The store's segment files are not mistaken for users' Tweet files
+        manifest = open_crawl_manifest(self.temp_path, logger=self.logger)
+        self.assertEqual(manifest.get_screen_names(), [])
+        manifest.close()
+        os.remove(self.manifest_filename)
+
+        store = TweetSegmentStore(self.temp_path, logger=self.logger)
+        manifest = open_crawl_manifest(self.temp_path, logger=self.logger, store=store)
+        store.close()
+        self.assertEqual(sorted(manifest.get_screen_names(CrawlManifest.STATUS_CRAWLED)), [u'PHonyDoc', u'charman'])
+        self.assertEqual(manifest.get_tweet_count(u'charman'), 2)
+        self.assertEqual(manifest.get_max_id(u'charman'), 5)
+        self.assertEqual(manifest.get_max_id(u'phonydoc'), 7)
+        manifest.close()
+
+
+
+def make_tweet(tweet_id, screen_name):
+    return {'id': tweet_id, 'id_str': str(tweet_id), 'text': u'Tweet %d' % tweet_id, 'user': {'screen_name': screen_name}}
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
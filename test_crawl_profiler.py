@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+# Local modules
+from crawl_profiler import *
+from tweet_filter import FilteredTweetReader, TweetFilterNotARetweet
+from tweet_writer import TweetWriter
+
+
+class TestStageProfiler(unittest.TestCase):
+    def test_disabled_profiler_records_nothing(self):
+        profiler = StageProfiler()
+        with profiler.span('parse'):
+            pass
+        self.assertEqual(profiler.get_stage_times(), {})
+
+    def test_nested_spans_count_towards_innermost_stage(self):
+        profiler = StageProfiler()
+        profiler.start(sample_interval=0)
+        with profiler.span('filter'):
+            time.sleep(0.05)
+            with profiler.span('network'):
+                time.sleep(0.1)
+        profiler.stop()
+
+        stage_times = profiler.get_stage_times()
+        self.assertEqual(stage_times['filter']['spans'], 1)
+        self.assertEqual(stage_times['network']['spans'], 1)
+        self.assertTrue(0.04 < stage_times['filter']['wall_seconds'] < 0.09)
+        self.assertTrue(0.09 < stage_times['network']['wall_seconds'] < 0.15)
+        # Sleeping uses (almost) no CPU
+        self.assertTrue(stage_times['network']['cpu_seconds'] < 0.05)
+
+    def test_exceptions_close_spans(self):
+        profiler = StageProfiler()
+        profiler.start(sample_interval=0)
+        try:
+            with profiler.span('parse'):
+                raise ValueError
+        except ValueError:
+            pass
+        with profiler.span('filter'):
+            pass
+        profiler.stop()
+        self.assertEqual(sorted(profiler.get_stage_times()), ['filter', 'parse'])
+
+    def test_threads_and_samples(self):
+        profiler = StageProfiler()
+        profiler.start(sample_interval=0.001)
+
+        def busy_wait(stage):
+            with profiler.span(stage):
+                end_time = time.time() + 0.2
+                while time.time() < end_time:
+                    pass
+        threads = [threading.Thread(target=busy_wait, args=(stage,)) for stage in ['parse', 'write']]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        profiler.stop()
+
+        stage_times = profiler.get_stage_times()
+        self.assertEqual(stage_times['parse']['spans'], 1)
+        self.assertEqual(stage_times['write']['spans'], 1)
+        folded_stacks = profiler.get_folded_stacks()
+        self.assertTrue(any(stack.startswith('[parse];') and 'test_crawl_profiler.busy_wait' in stack
+                            for stack in folded_stacks))
+        self.assertTrue(stage_times['write']['samples'] > 0)
+
+    def test_restart_discards_earlier_results(self):
+        profiler = StageProfiler()
+        profiler.start(sample_interval=0)
+        with profiler.span('read'):
+            pass
+        profiler.start(sample_interval=0)
+        with profiler.span('parse'):
+            pass
+        profiler.stop()
+        self.assertEqual(sorted(profiler.get_stage_times()), ['parse'])
+
+
+
+class TestProfiledRuns(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        get_default_profiler().stop()
+        shutil.rmtree(self.temp_path)
+
+    def test_start_profiler_writes_profile(self):
+        parser = argparse.ArgumentParser()
+        add_profiler_arguments(parser)
+        profile_prefix = os.path.join(self.temp_path, 'run')
+        profiler = start_profiler(parser.parse_args(['--profile', profile_prefix, '--profile-interval', '0.001']))
+
+        filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()])
+        filtered_reader.open('testdata/shears.txt')
+        tweet_writer = TweetWriter(os.path.join(self.temp_path, 'shears.tweets'))
+        for json_tweet_string in filtered_reader:
+            tweet_writer.write_tweet(json_tweet_string)
+        tweet_writer.close()
+        filtered_reader.close()
+        profiler.close()
+
+        stage_times = profiler.get_stage_times()
+        self.assertEqual(stage_times['read']['spans'], 33)
+        self.assertEqual(stage_times['parse']['spans'], 32)
+        self.assertEqual(stage_times['filter']['spans'], 32)
+        self.assertEqual(stage_times['write']['spans'], 31)
+
+        report = open(profile_prefix + '.stages.txt').read()
+        for stage in ['read', 'parse', 'filter', 'write']:
+            self.assertIn(stage, report)
+        for line in open(profile_prefix + '.folded'):
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(stack.startswith('['))
+            self.assertTrue(int(count) > 0)
+
+    def test_profiling_is_off_by_default(self):
+        parser = argparse.ArgumentParser()
+        add_profiler_arguments(parser)
+        profiler = start_profiler(parser.parse_args([]))
+        filtered_reader = FilteredTweetReader(block_size=10)
+        filtered_reader.open('testdata/shears.txt')
+        self.assertEqual(len(list(filtered_reader)), 32)
+        filtered_reader.close()
+        profiler.close()
+        self.assertTrue(profiler is get_default_profiler())
+        self.assertFalse(profiler.enabled)
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import logging
+import os
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+# Local modules
+from crawl_coordinator import CrawlCoordinator, CrawlCoordinatorServer
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+
+
+# Runs crawl_worker.py against the mock server, without a twitter_oauth_settings.py file
+WORKER_SCRIPT = """
+import os, sys, types
+oauth_settings = types.ModuleType('twitter_oauth_settings')
+oauth_settings.access_token = oauth_settings.access_token_secret = None
+oauth_settings.consumer_key = oauth_settings.consumer_secret = None
+sys.modules['twitter_oauth_settings'] = oauth_settings
+os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+from twython import Twython
+import crawl_worker
+
+def get_app_auth_twython(consumer_key, consumer_secret):
+    twython = Twython('app_key', access_token='access_token')
+    twython.api_url = %r
+    return twython
+
+crawl_worker.get_app_auth_twython = get_app_auth_twython
+crawl_worker.main(sys.argv[1:])
+"""
+
+
+class TestCrawlWorker(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.logger = logging.getLogger('test_crawl_worker')
+        self.api = MockTwitterAPI(num_users=6, max_tweets_per_user=50, latency_seconds=0.2)
+        self.twitter_server = MockTwitterServer(self.api)
+        self.twitter_server.start()
+        self.db_filename = os.path.join(self.temp_path, 'crawl.coordinator')
+        self.coordinator = CrawlCoordinator(self.db_filename, lease_seconds=2, max_attempts=3, logger=self.logger)
+        self.coordinator_server = CrawlCoordinatorServer(self.coordinator)
+        self.coordinator_server.start()
+        self.workers = []
+
+    def tearDown(self):
+        for worker in self.workers:
+            if worker.poll() is None:
+                worker.kill()
+                worker.wait()
+        self.coordinator_server.stop()
+        self.coordinator.close()
+        self.twitter_server.stop()
+        shutil.rmtree(self.temp_path)
+
+    def start_worker(self, worker_id):
+        output_path = os.path.join(self.temp_path, worker_id)
+        log_file = open(os.path.join(self.temp_path, '%s.log' % worker_id), 'w')
+        worker = subprocess.Popen([sys.executable, '-c', WORKER_SCRIPT % self.twitter_server.get_api_url(),
+                                   '%s:%d' % self.coordinator_server.server_address, output_path,
+                                   '--worker-id', worker_id, '--poll-interval', '0.1'],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)), stdout=log_file, stderr=log_file)
+        log_file.close()
+        self.workers.append(worker)
+        return worker
+
+    def get_units(self):
+        db = sqlite3.connect(self.db_filename)
+        try:
+            return db.execute("SELECT unit_id, status, attempts, worker_id FROM units ORDER BY unit_id").fetchall()
+        finally:
+            db.close()
+
+    def test_killed_worker_unit_is_completed_by_another_worker(self):
+        screen_names = ['user%d' % user_index for user_index in range(6)]
+        self.coordinator.add_screen_names(screen_names, unit_size=3)
+
+        killed_worker = self.start_worker('killed')
+        # Wait until the worker is part way through its first unit
+        deadline = time.time() + 30
+        while self.api.get_stats().get('statuses/user_timeline', {}).get(200, 0) < 1:
+            self.assertTrue(time.time() < deadline, "Worker never started crawling")
+            self.assertEqual(killed_worker.poll(), None)
+            time.sleep(0.05)
+        os.kill(killed_worker.pid, signal.SIGKILL)
+        killed_worker.wait()
+        self.assertEqual(self.get_units()[0], (1, CrawlCoordinator.STATUS_LEASED, 1, u'killed'))
+
+        worker = self.start_worker('worker')
+        self.assertEqual(worker.wait(), 0, open(os.path.join(self.temp_path, 'worker.log')).read())
+
+        # The killed worker's unit was handed to the other worker once its lease expired
+        self.assertEqual(self.get_units(), [(1, CrawlCoordinator.STATUS_DONE, 2, u'worker'),
+                                            (2, CrawlCoordinator.STATUS_DONE, 1, u'worker')])
+        results = self.coordinator.get_results()
+        self.assertEqual(sorted(results), screen_names)
+        for screen_name in screen_names:
+            tweet_count, error_code = results[screen_name]
+            self.assertEqual(error_code, None)
+            tweet_filename = os.path.join(self.temp_path, 'worker', '%s.tweets' % screen_name)
+            self.assertEqual(len(open(tweet_filename).readlines()), tweet_count)
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
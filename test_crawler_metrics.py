@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urllib2
+
+# Local modules
+from crawler_metrics import *
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_counter_and_gauge_text_format(self):
+        registry = MetricsRegistry()
+        calls = registry.counter('trawler_api_calls_total', "API calls", ['endpoint'])
+        calls.labels(endpoint='friends/ids').inc()
+        calls.labels('friends/ids').inc(2)
+        calls.labels(endpoint='followers/ids').inc()
+        registry.gauge('trawler_api_backoff_depth', "Backoff depth").labels().set(3)
+
+        text = registry.render_prometheus_text()
+        self.assertIn('# TYPE trawler_api_calls_total counter', text)
+        self.assertIn('trawler_api_calls_total{endpoint="friends/ids"} 3', text)
+        self.assertIn('trawler_api_calls_total{endpoint="followers/ids"} 1', text)
+        self.assertIn('trawler_api_backoff_depth 3', text)
+
+    def test_registering_a_family_twice_shares_it(self):
+        registry = MetricsRegistry()
+        registry.counter('calls', "Calls", ['endpoint']).labels('a').inc()
+        registry.counter('calls', "Calls", ['endpoint']).labels('a').inc()
+        self.assertEqual(registry.counter('calls', "Calls", ['endpoint']).labels('a').get_value(), 2)
+        self.assertRaises(ValueError, registry.gauge, 'calls', "Calls", ['endpoint'])
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = MetricsRegistry()
+        latency = registry.histogram('latency_seconds', "Latency", buckets=(0.1, 1.0)).labels()
+        for value in [0.05, 0.1, 0.5, 5.0]:
+            latency.observe(value)
+
+        value = latency.get_value()
+        self.assertEqual(value['buckets'], [[0.1, 2], [1.0, 3], [float('inf'), 4]])
+        self.assertEqual(value['count'], 4)
+        self.assertAlmostEqual(value['sum'], 5.65)
+
+        text = registry.render_prometheus_text()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 4', text)
+        self.assertIn('latency_seconds_count 4', text)
+
+
+class TestMetricsExporters(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.registry = MetricsRegistry()
+        self.registry.counter('trawler_tweets_retrieved_total', "Tweets").labels().inc(200)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_http_server(self):
+        server = MetricsHTTPServer(self.registry)
+        try:
+            response = urllib2.urlopen('http://127.0.0.1:%d/metrics' % server.get_port())
+            self.assertIn('trawler_tweets_retrieved_total 200', response.read())
+        finally:
+            server.close()
+
+    def test_snapshot_writer_writes_final_snapshot_on_close(self):
+        json_filename = os.path.join(self.temp_path, 'metrics.json')
+        writer = MetricsSnapshotWriter(self.registry, json_filename, interval=3600)
+        writer.close()
+        snapshot = json.load(open(json_filename))
+        samples = snapshot['metrics']['trawler_tweets_retrieved_total']['samples']
+        self.assertEqual(samples, [{'labels': {}, 'value': 200}])
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
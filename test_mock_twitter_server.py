@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import json
+import logging
+import os
+import unittest
+import urllib2
+
+# Third party modules
+from twython import Twython
+
+# Local modules
+from load_test_crawler import LoadTestResults, crawl
+from mock_twitter_server import *
+
+
+class TestMockTwitterServer(unittest.TestCase):
+    def setUp(self):
+        self.api = MockTwitterAPI(num_users=10, max_tweets_per_user=50, rate_limits={'statuses/user_timeline': 3})
+        self.server = MockTwitterServer(self.api)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get(self, endpoint, **params):
+        """
+        Returns the (HTTP status code, headers, parsed JSON response)
+        of a request to the mock server
+        """
+        url = self.server.get_api_url() % ('1.1/%s.json?%s' % (endpoint, '&'.join(['%s=%s' % item for item in params.items()])))
+        try:
+            response = urllib2.urlopen(url)
+        except urllib2.HTTPError as e:
+            response = e
+        try:
+            return response.getcode(), response.info(), json.loads(response.read())
+        finally:
+            response.close()
+
+    def test_rate_limit_headers_and_429(self):
+        for calls_remaining in [2, 1, 0]:
+            status, headers, tweets = self.get('statuses/user_timeline', screen_name='user1')
+            self.assertEqual(status, 200)
+            self.assertEqual(headers['x-rate-limit-limit'], '3')
+            self.assertEqual(headers['x-rate-limit-remaining'], str(calls_remaining))
+            self.assertTrue(int(headers['x-rate-limit-reset']) > 0)
+
+        status, headers, response = self.get('statuses/user_timeline', screen_name='user1')
+        self.assertEqual(status, 429)
+        self.assertEqual(response['errors'][0]['code'], 88)
+        self.assertEqual(headers['x-rate-limit-remaining'], '0')
+
+        # The rate limit status reports the used up window, without using it
+        status, headers, response = self.get('application/rate_limit_status', resources='statuses')
+        self.assertEqual(response['resources']['statuses']['/statuses/user_timeline']['remaining'], 0)
+        self.assertEqual(self.api.get_stats()['statuses/user_timeline'], {200: 3, 429: 1})
+
+    def test_unknown_users_and_endpoints(self):
+        status, headers, response = self.get('statuses/user_timeline', screen_name='charman')
+        self.assertEqual(status, 404)
+        self.assertEqual(response['errors'][0]['code'], 34)
+        status, headers, response = self.get('friends/ids', user_id=MockTwitterAPI.FIRST_USER_ID + 10)
+        self.assertEqual(status, 404)
+        status, headers, response = self.get('statuses/no_such_endpoint')
+        self.assertEqual(status, 404)
+
+    def test_load_test_crawl(self):
+        # requests-oauthlib refuses to send OAuth 2 bearer tokens over plain HTTP unless told otherwise
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        twython = Twython('app_key', access_token='access_token')
+        twython.api_url = self.server.get_api_url()
+        results = LoadTestResults()
+        crawl('timelines', twython, ['user1', 'user2', 'charman'], False, results, logging.getLogger('test_mock_twitter_server'))
+        self.assertEqual(results.users_crawled, 2)
+        self.assertEqual(results.users_failed, 1)
+        self.assertEqual(len(results.get_delivery_gaps(0)), 3)
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
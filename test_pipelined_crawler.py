@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import logging
+import os
+import Queue
+import unittest
+
+# Third party modules
+from twython import Twython, TwythonError
+
+# Local modules
+from crawler_metrics import MetricsRegistry
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+from pipelined_crawler import *
+from retry_policy import RetryPolicy
+from twitter_crawler import FindFriendFollowers
+from twitter_graph import FriendFollowerGraph
+
+
+class TestPipelinedFriendFollowerCrawler(unittest.TestCase):
+    def setUp(self):
+        # The mock server uses plain HTTP
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        self.server = MockTwitterServer(MockTwitterAPI(num_users=50, max_tweets_per_user=300))
+        self.server.start()
+        self.twython = Twython('app_key', access_token='access_token')
+        self.twython.api_url = self.server.get_api_url()
+        self.logger = logging.getLogger('test_pipelined_crawler')
+        self.metrics = MetricsRegistry()
+
+    def tearDown(self):
+        self.twython.client.close()
+        self.server.stop()
+
+    def test_results_match_sequential_crawl(self):
+        screen_names = ['user0', 'user1', 'user2', 'nosuchuser']
+        ff_finder = FindFriendFollowers(self.twython, self.logger, metrics=self.metrics)
+        expected_ff = dict((screen_name, sorted(ff_finder.get_ff_screen_names_for_screen_name(screen_name)))
+                           for screen_name in screen_names)
+
+        crawler = PipelinedFriendFollowerCrawler(self.twython, self.logger, metrics=self.metrics)
+        for screen_name in screen_names:
+            crawler.submit_ff_users(screen_name, 'tag')
+            crawler.submit_timeline(screen_name)
+        results = get_all_results(crawler)
+        crawler.close()
+
+        self.assertEqual(len(results), 8)
+        for result in results:
+            if result.kind == PipelineResult.FF_USERS:
+                self.assertEqual(result.tag, 'tag')
+                self.assertEqual(sorted(user['screen_name'] for user in result.data), expected_ff[result.screen_name])
+            elif result.screen_name == 'nosuchuser':
+                self.assertEqual((result.data, result.error_code), ([], 404))
+            else:
+                self.assertTrue(len(result.data) > 0)
+                self.assertEqual(result.error_code, None)
+
+    def test_graph_is_updated_and_reused(self):
+        ff_graph = FriendFollowerGraph()
+        crawler = PipelinedFriendFollowerCrawler(self.twython, self.logger, ff_graph=ff_graph, metrics=self.metrics)
+        crawler.submit_ff_users('user3')
+        first_result = get_all_results(crawler)[0]
+        self.assertNotEqual(ff_graph.get_user_id('user3'), None)
+
+        # The second crawl is answered from the graph, apart from the 'users/lookup' calls
+        crawler.submit_ff_users('user3')
+        second_result = get_all_results(crawler)[0]
+        crawler.close()
+        self.assertEqual(sorted(user['id'] for user in first_result.data),
+                         sorted(user['id'] for user in second_result.data))
+        stats = self.server.api.get_stats()
+        self.assertEqual(sum(stats['friends/ids'].values()), 1)
+
+    def test_failed_tasks_are_returned_once(self):
+        self.server.stop()
+        self.server = MockTwitterServer(MockTwitterAPI(num_users=50, error_rate=1.0, error_burst_length=1000))
+        self.server.start()
+        self.twython.api_url = self.server.get_api_url()
+
+        # Both of the ID calls for each user fail
+        crawler = PipelinedFriendFollowerCrawler(self.twython, self.logger, metrics=self.metrics,
+                                                 retry_policy=RetryPolicy(max_attempts=1))
+        crawler.submit_ff_users('user0')
+        crawler.submit_ff_users('user1')
+        crawler.submit_timeline('user2')
+        for failure in range(3):
+            self.assertRaises(TwythonError, crawler.get_result, 30)
+        self.assertEqual(crawler.get_pending_count(), 0)
+        crawler.close()
+        self.assertRaises(Queue.Empty, crawler.get_result, 0)
+        stats = self.server.api.get_stats()
+        self.assertEqual(stats['friends/ids'], {503: 2})
+        self.assertEqual(stats['followers/ids'], {503: 2})
+
+
+
+def get_all_results(crawler):
+    results = []
+    while crawler.get_pending_count() > 0:
+        results.append(crawler.get_result(timeout=30))
+    return results
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# Local modules
+from recrawl_scheduler import *
+
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+
+class TestRecrawlScheduler(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.db_filename = os.path.join(self.temp_path, 'recrawl.schedule')
+        self.logger = logging.getLogger('test_recrawl_scheduler')
+        self.scheduler = RecrawlScheduler(self.db_filename, logger=self.logger)
+
+    def tearDown(self):
+        self.scheduler.close()
+        shutil.rmtree(self.temp_path)
+
+    def test_active_users_are_crawled_more_often(self):
+        self.scheduler.add_user('busy', 100)
+        self.scheduler.add_user('dormant', 100)
+        start = 1000000.0
+        self.scheduler.record_crawl('busy', [], start)
+        self.scheduler.record_crawl('dormant', [], start)
+
+        # 'busy' posts 100 Tweets a day, 'dormant' posts nothing
+        crawl_time = start + DAY
+        self.scheduler.record_crawl('busy', make_tweets(101, 100), crawl_time)
+        self.scheduler.record_crawl('dormant', [], crawl_time)
+
+        self.assertAlmostEqual(self.scheduler.get_tweet_rate('busy'), 100.0 / DAY)
+        self.assertEqual(self.scheduler.get_since_id('busy'), 200)
+        self.assertAlmostEqual(self.scheduler.get_next_crawl('busy'), crawl_time + DAY)
+        # The interval for a dormant user at most doubles after each crawl
+        self.assertAlmostEqual(self.scheduler.get_next_crawl('dormant'), crawl_time + 2*DAY)
+
+    def test_intervals_are_clamped(self):
+        self.scheduler.add_user('firehose', 100)
+        self.scheduler.record_crawl('firehose', [], 0.0)
+        self.scheduler.record_crawl('firehose', make_tweets(101, 1000), 60.0)
+        self.assertAlmostEqual(self.scheduler.get_next_crawl('firehose'), 60.0 + 15*60)
+
+    def test_due_users_are_ordered_by_expected_backlog(self):
+        for screen_name in ['slow', 'fast', 'new']:
+            self.scheduler.add_user(screen_name, 100)
+        self.scheduler.record_crawl('slow', [], 0.0)
+        self.scheduler.record_crawl('fast', [], 0.0)
+        self.scheduler.record_crawl('slow', make_tweets(101, 10), DAY)
+        self.scheduler.record_crawl('fast', make_tweets(101, 50), DAY)
+
+        # 'new' was added (and became due) at the current time
+        due_users = self.scheduler.get_due_users(now=time.time() + DAY)
+        self.assertEqual([screen_name for screen_name, since_id in due_users], ['new', 'fast', 'slow'])
+        self.assertEqual(due_users[1], ('fast', 150))
+        self.assertEqual(self.scheduler.get_due_users(now=2*DAY), [])
+
+    def test_errors_and_reopening(self):
+        self.scheduler.add_user('charman', 100)
+        self.assertFalse(self.scheduler.add_user('CHARMAN', 200))
+        self.scheduler.record_error('charman', 404, 0.0)
+        self.assertEqual(self.scheduler.get_next_crawl('charman'), 30*DAY)
+        self.scheduler.close()
+
+        self.scheduler = RecrawlScheduler(self.db_filename, logger=self.logger)
+        self.assertTrue(self.scheduler.has_user('Charman'))
+        self.assertEqual(self.scheduler.get_since_id('charman'), 100)
+        self.assertEqual(self.scheduler.get_stats()['crawls'], 1)
+
+
+
+def make_tweets(first_id, count):
+    return [{'id': tweet_id} for tweet_id in range(first_id + count - 1, first_id - 1, -1)]
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import httplib
+import logging
+import os
+import unittest
+
+# Third party modules
+from twython import Twython, TwythonAuthError, TwythonError, TwythonRateLimitError
+
+# Local modules
+from crawler_metrics import MetricsRegistry
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+from retry_policy import *
+from twitter_crawler import RateLimitedTwitterEndpoint
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_backoff_is_capped_and_jittered(self):
+        retry_policy = RetryPolicy(initial_backoff=1, max_backoff=8, seed=1)
+        for attempt in range(100):
+            backoffs = [retry_policy.get_backoff_seconds(attempt) for i in range(20)]
+            self.assertTrue(min(backoffs) >= 0)
+            self.assertTrue(max(backoffs) <= min(8, 2**attempt))
+            # Full jitter spreads the retries of threads that failed together
+            self.assertTrue(len(set(backoffs)) > 1)
+
+    def test_retry_reasons(self):
+        retry_policy = RetryPolicy()
+        self.assertEqual(retry_policy.get_retry_reason(TwythonRateLimitError("Too Many Requests", 429)), 'rate_limit')
+        self.assertEqual(retry_policy.get_retry_reason(TwythonError("Over capacity", error_code=503)), 'server_error')
+        # Twython re-raises connection errors (e.g. an empty response) without a status code
+        self.assertEqual(retry_policy.get_retry_reason(TwythonError("Connection aborted")), 'connection_error')
+        self.assertEqual(retry_policy.get_retry_reason(httplib.BadStatusLine("''")), 'connection_error')
+        self.assertEqual(retry_policy.get_retry_reason(TwythonError("Not Found", error_code=404)), None)
+        self.assertEqual(retry_policy.get_retry_reason(TwythonAuthError("Invalid bearer token")), None)
+        self.assertEqual(retry_policy.get_retry_reason(ValueError()), None)
+
+    def test_max_attempts(self):
+        self.assertTrue(RetryPolicy().should_retry(1000))
+        self.assertTrue(RetryPolicy(max_attempts=3).should_retry(1))
+        self.assertFalse(RetryPolicy(max_attempts=3).should_retry(2))
+
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_open_and_close(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=3, reset_seconds=60)
+        self.assertEqual(circuit_breaker.acquire(now=0), 0)
+        self.assertFalse(circuit_breaker.record_failure(now=0))
+        circuit_breaker.record_success()
+        self.assertFalse(circuit_breaker.record_failure(now=0))
+        self.assertFalse(circuit_breaker.record_failure(now=0))
+        self.assertTrue(circuit_breaker.record_failure(now=10))
+        self.assertEqual(circuit_breaker.get_state(), CircuitBreaker.OPEN)
+        self.assertEqual(circuit_breaker.acquire(now=40), 30)
+
+        # One caller probes the endpoint, while the others keep waiting
+        self.assertEqual(circuit_breaker.acquire(now=70), 0)
+        self.assertEqual(circuit_breaker.get_state(), CircuitBreaker.HALF_OPEN)
+        self.assertEqual(circuit_breaker.acquire(now=71), 6)
+
+        # A failed probe opens the breaker again
+        self.assertTrue(circuit_breaker.record_failure(now=72))
+        self.assertEqual(circuit_breaker.acquire(now=72), 60)
+        self.assertEqual(circuit_breaker.acquire(now=132), 0)
+        circuit_breaker.record_success()
+        self.assertEqual(circuit_breaker.get_state(), CircuitBreaker.CLOSED)
+        self.assertEqual(circuit_breaker.acquire(now=133), 0)
+
+    def test_lost_probe_is_replaced(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=1, reset_seconds=60)
+        circuit_breaker.record_failure(now=0)
+        self.assertEqual(circuit_breaker.acquire(now=60), 0)
+        self.assertTrue(circuit_breaker.acquire(now=100) > 0)
+        self.assertEqual(circuit_breaker.acquire(now=120), 0)
+
+
+
+class TestRateLimitedTwitterEndpointRetries(unittest.TestCase):
+    def setUp(self):
+        # The mock server uses plain HTTP
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        self.api = MockTwitterAPI(num_users=10, max_tweets_per_user=50, error_rate=0.5, error_burst_length=3)
+        self.server = MockTwitterServer(self.api)
+        self.server.start()
+        self.twython = Twython('app_key', access_token='access_token')
+        self.twython.api_url = self.server.get_api_url()
+        self.logger = logging.getLogger('test_retry_policy')
+        self.metrics = MetricsRegistry()
+
+    def tearDown(self):
+        self.twython.client.close()
+        self.server.stop()
+
+    def test_server_errors_are_retried(self):
+        retry_policy = RetryPolicy(initial_backoff=0.01, max_backoff=0.02, failure_threshold=2, reset_seconds=0.05, seed=1)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'statuses/user_timeline', logger=self.logger,
+                                              metrics=self.metrics, retry_policy=retry_policy)
+        for user_index in range(10):
+            self.assertTrue(endpoint.get_data(screen_name='user%d' % user_index, count=200) is not None)
+        self.assertTrue(self.api.get_stats()['statuses/user_timeline'][503] > 0)
+        self.assertTrue('trawler_api_retries_total{endpoint="statuses/user_timeline",reason="server_error"}'
+                        in self.metrics.render_prometheus_text())
+
+        # Errors for missing users aren't retried
+        self.assertRaises(TwythonError, endpoint.get_data, screen_name='nobody')
+
+    def test_max_attempts(self):
+        self.api = MockTwitterAPI(num_users=10, error_rate=1.0, error_burst_length=1000)
+        self.server.api = self.api
+        retry_policy = RetryPolicy(initial_backoff=0.01, max_backoff=0.01, max_attempts=3, failure_threshold=100)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'statuses/user_timeline', logger=self.logger,
+                                              metrics=self.metrics, retry_policy=retry_policy)
+        try:
+            endpoint.get_data(screen_name='user0')
+        except TwythonError as e:
+            self.assertEqual(e.error_code, 503)
+        else:
+            self.fail("The call did not fail")
+        self.assertEqual(self.api.get_stats()['statuses/user_timeline'][503], 3)
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
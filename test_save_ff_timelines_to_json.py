@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import types
+import unittest
+
+# Third party modules
+from twython import Twython
+
+# Local modules
+from crawl_manifest import CrawlManifest
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+# Imported by the script when it is used, after the test has changed to the crawl's directory
+import pipelined_crawler
+
+# The script reads the Twitter API credentials when it is imported
+if 'twitter_oauth_settings' not in sys.modules:
+    oauth_settings = types.ModuleType('twitter_oauth_settings')
+    oauth_settings.access_token = oauth_settings.access_token_secret = None
+    oauth_settings.consumer_key = oauth_settings.consumer_secret = None
+    sys.modules['twitter_oauth_settings'] = oauth_settings
+import save_ff_timelines_to_json
+
+
+class TestSaveFFTimelinesToJSON(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.real_cwd = os.getcwd()
+        # Users with odd indices have protected Tweets
+        self.server = MockTwitterServer(MockTwitterAPI(num_users=30, max_tweets_per_user=50, max_friends_per_user=10,
+                                                       rate_limits={'friends/ids': 1000, 'followers/ids': 1000},
+                                                       protected_users=range(1, 30, 2)))
+        self.server.start()
+        # requests-oauthlib refuses to send OAuth 2 bearer tokens over plain HTTP unless told otherwise
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        self.twython = Twython('app_key', access_token='access_token')
+        self.twython.api_url = self.server.get_api_url()
+
+        self.real_get_app_auth_twython = save_ff_timelines_to_json.get_app_auth_twython
+        save_ff_timelines_to_json.get_app_auth_twython = lambda consumer_key, consumer_secret, **kwargs: self.twython
+        self.real_stdout = sys.stdout
+        self.screen_name_filename = os.path.join(self.temp_path, 'seeds.txt')
+        open(self.screen_name_filename, 'w').write("user0\nuser2\n")
+
+    def tearDown(self):
+        sys.stdout = self.real_stdout
+        os.chdir(self.real_cwd)
+        save_ff_timelines_to_json.get_app_auth_twython = self.real_get_app_auth_twython
+        self.twython.client.close()
+        self.server.stop()
+        shutil.rmtree(self.temp_path)
+
+    def run_crawl(self, name, *extra_args):
+        """
+        Runs a crawl in its own directory, and returns the screen names
+        with .ff files and the crawl manifest's {screen_name: error_code}
+        """
+        crawl_path = os.path.join(self.temp_path, name)
+        os.mkdir(crawl_path)
+        os.chdir(crawl_path)
+        save_ff_timelines_to_json.main([self.screen_name_filename, '--max-depth', '2'] + list(extra_args))
+        os.chdir(self.real_cwd)
+
+        ff_screen_names = sorted(os.path.basename(ff_filename)[:-len('.ff')]
+                                 for ff_filename in glob.glob(os.path.join(crawl_path, '*.ff')))
+        manifest = CrawlManifest(os.path.join(crawl_path, 'crawl.manifest'))
+        error_codes = dict((screen_name, manifest.get_error_code(screen_name))
+                           for screen_name in manifest.get_screen_names())
+        manifest.close()
+        return ff_screen_names, error_codes
+
+    def test_pipelined_crawl_matches_serial_crawl(self):
+        serial_ff_screen_names, serial_error_codes = self.run_crawl('serial')
+        protected_screen_names = [screen_name for screen_name, error_code in serial_error_codes.items()
+                                  if error_code == 401]
+        self.assertTrue(protected_screen_names)
+        # Users whose timelines can't be downloaded are not expanded
+        for screen_name in protected_screen_names:
+            self.assertFalse(screen_name in serial_ff_screen_names)
+
+        pipelined_ff_screen_names, pipelined_error_codes = self.run_crawl('pipelined', '--pipeline', '5')
+        self.assertEqual(pipelined_ff_screen_names, serial_ff_screen_names)
+        self.assertEqual(pipelined_error_codes, serial_error_codes)
+
+    def test_graph_and_pipeline_modules_are_imported_when_used(self):
+        script = ("import sys, types\n"
+                  "sys.modules['twitter_oauth_settings'] = types.ModuleType('twitter_oauth_settings')\n"
+                  "sys.modules['twitter_oauth_settings'].__dict__.update(access_token=None, access_token_secret=None,"
+                  " consumer_key=None, consumer_secret=None)\n"
+                  "import save_ff_timelines_to_json\n"
+                  "sys.stdout.write(repr(sorted(set(['numpy', 'twitter_graph', 'pipelined_crawler']) & set(sys.modules))))\n")
+        process = subprocess.Popen([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   stdout=subprocess.PIPE)
+        self.assertEqual(process.communicate()[0], '[]')
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
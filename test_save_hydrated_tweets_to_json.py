@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+# Third party modules
+from twython import Twython
+
+# Local modules
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+
+# The script reads the Twitter API credentials when it is imported
+if 'twitter_oauth_settings' not in sys.modules:
+    oauth_settings = types.ModuleType('twitter_oauth_settings')
+    oauth_settings.access_token = oauth_settings.access_token_secret = None
+    oauth_settings.consumer_key = oauth_settings.consumer_secret = None
+    sys.modules['twitter_oauth_settings'] = oauth_settings
+import save_hydrated_tweets_to_json
+
+
+class TestSaveHydratedTweetsToJSON(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.temp_path, 'hydrated')
+        self.api = MockTwitterAPI(num_users=10, max_tweets_per_user=200)
+        self.server = MockTwitterServer(self.api)
+        self.server.start()
+        # requests-oauthlib refuses to send OAuth 2 bearer tokens over plain HTTP unless told otherwise
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        self.twython = Twython('app_key', access_token='access_token')
+        self.twython.api_url = self.server.get_api_url()
+
+        self.real_get_app_auth_twython = save_hydrated_tweets_to_json.get_app_auth_twython
+        save_hydrated_tweets_to_json.get_app_auth_twython = lambda consumer_key, consumer_secret: self.twython
+        self.real_stdout = sys.stdout
+        self.tweet_ids = []
+        for user_index in range(10):
+            self.tweet_ids += [tweet['id'] for tweet in self.twython.get('statuses/user_timeline',
+                                                                         params={'screen_name': 'user%d' % user_index,
+                                                                                 'count': 200})]
+
+    def tearDown(self):
+        sys.stdout = self.real_stdout
+        save_hydrated_tweets_to_json.get_app_auth_twython = self.real_get_app_auth_twython
+        self.twython.client.close()
+        self.server.stop()
+        shutil.rmtree(self.temp_path)
+
+    def write_id_file(self, name, tweet_ids):
+        id_filename = os.path.join(self.temp_path, name)
+        open(id_filename, 'w').write("".join(["%d\n" % tweet_id for tweet_id in tweet_ids]))
+        return id_filename
+
+    def read_ids(self, name):
+        return [int(line) for line in open(os.path.join(self.output_path, name))]
+
+    def read_hydrated_tweet_ids(self):
+        tweet_ids = []
+        for tweet_filename in glob.glob(os.path.join(self.output_path, 'hydrated-*.tweets')):
+            tweet_ids += [json.loads(line)['id'] for line in open(tweet_filename)]
+        return tweet_ids
+
+    def get_lookup_count(self):
+        return sum(self.api.get_stats().get('statuses/lookup', {}).values())
+
+    def test_resume_and_dedupe(self):
+        # The mock server has no Tweets from users with an index of 100 or more
+        missing_ids = [tweet_id + 100 for tweet_id in self.tweet_ids[:20]]
+        first_ids = self.tweet_ids[:150] + missing_ids + self.tweet_ids[:10]
+        save_hydrated_tweets_to_json.main([self.output_path, self.write_id_file('first.ids', first_ids)])
+
+        self.assertEqual(self.read_ids('hydrated.ids'), self.tweet_ids[:150])
+        self.assertEqual(self.read_ids('missing.ids'), missing_ids)
+        self.assertEqual(self.read_hydrated_tweet_ids(), self.tweet_ids[:150])
+        # The 170 unique IDs are looked up in batches of 100
+        self.assertEqual(self.get_lookup_count(), 2)
+
+        # A resumed run only looks up the IDs that weren't hydrated or found missing by the first run
+        second_ids = self.tweet_ids[100:250] + missing_ids
+        save_hydrated_tweets_to_json.main([self.output_path, self.write_id_file('second.ids', second_ids),
+                                           self.write_id_file('third.ids', self.tweet_ids[:300])])
+        self.assertEqual(self.read_ids('hydrated.ids'), self.tweet_ids[:300])
+        self.assertEqual(self.read_ids('missing.ids'), missing_ids)
+        self.assertEqual(sorted(self.read_hydrated_tweet_ids()), sorted(self.tweet_ids[:300]))
+        self.assertEqual(len(glob.glob(os.path.join(self.output_path, 'hydrated-*.tweets'))), 2)
+        self.assertEqual(self.get_lookup_count(), 4)
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import unittest
+
+# Local modules
+from snowflake import *
+
+
+class TestSnowflake(unittest.TestCase):
+    def test_time_for_tweet_id(self):
+        # A Tweet posted at 2015-03-01 12:00:00.123 UTC
+        tweet_id = ((1425211200123 - TWITTER_EPOCH_MILLISECONDS) << TIMESTAMP_SHIFT) + 4095
+        self.assertEqual(get_time_for_tweet_id(tweet_id), 1425211200.123)
+        self.assertEqual(get_time_for_tweet_id(str(tweet_id)), 1425211200.123)
+        self.assertEqual(get_time_for_tweet_id(12345), None)
+
+    def test_min_tweet_id_for_time(self):
+        min_id = get_min_tweet_id_for_time(1425211200)
+        self.assertEqual(get_time_for_tweet_id(min_id), 1425211200.0)
+        self.assertEqual(get_time_for_tweet_id(min_id - 1), 1425211199.999)
+        self.assertEqual(get_min_tweet_id_for_time(0), 0)
+
+    def test_parse_utc_time(self):
+        self.assertEqual(parse_utc_time('2015-03-01'), 1425168000)
+        self.assertEqual(parse_utc_time('2015-03-01 12:00'), 1425211200)
+        self.assertEqual(parse_utc_time('2015-03-01T12:00:30'), 1425211230)
+        self.assertRaises(ValueError, parse_utc_time, 'March 2015')
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
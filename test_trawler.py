@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import imp
+import os
+import subprocess
+import sys
+import types
+import unittest
+
+# Local modules
+import trawler
+
+
+class TestTrawler(unittest.TestCase):
+    def setUp(self):
+        self.real_commands = trawler.COMMANDS
+        self.real_program_name = sys.argv[0]
+        self.command_argvs = []
+        command_module = types.ModuleType('trawler_test_command')
+        command_module.main = self.command_argvs.append
+        sys.modules['trawler_test_command'] = command_module
+        trawler.COMMANDS = dict(self.real_commands)
+        trawler.COMMANDS['test'] = ('trawler_test_command', "Record the arguments")
+
+    def tearDown(self):
+        trawler.COMMANDS = self.real_commands
+        sys.argv[0] = self.real_program_name
+        del sys.modules['trawler_test_command']
+
+    def test_dispatch(self):
+        trawler.main(['test', '--flag', 'value'])
+        self.assertEqual(self.command_argvs, [['--flag', 'value']])
+        self.assertEqual(sys.argv[0], 'trawler.py test')
+
+    def test_usage(self):
+        for argv, exit_status in [([], 2), (['no-such-command'], 2), (['--help'], 0), (['-h'], 0)]:
+            try:
+                trawler.main(argv)
+                self.fail("SystemExit not raised")
+            except SystemExit as e:
+                self.assertEqual(e.code, exit_status)
+        self.assertEqual(self.command_argvs, [])
+
+    def test_commands_have_main_functions(self):
+        for module_name, description in self.real_commands.values():
+            # The save_* scripts need twitter_oauth_settings.py, so the modules are not imported
+            module_file, module_filename, module_description = imp.find_module(module_name)
+            module_source = module_file.read()
+            module_file.close()
+            self.assertTrue('\ndef main(argv=None):' in module_source, module_name)
+
+    def test_only_the_command_module_is_imported(self):
+        script = ("import sys, trawler\n"
+                  "try:\n"
+                  "    trawler.main(['sample', '--help'])\n"
+                  "except SystemExit:\n"
+                  "    pass\n"
+                  "sys.stderr.write(repr(sorted(set(['tweet_sampler', 'tweet_query_server', 'tweet_inverted_index', 'crawl_worker']) & set(sys.modules))))\n")
+        process = subprocess.Popen([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(trawler.__file__)),
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, errors = process.communicate()
+        self.assertTrue('usage: trawler.py sample' in output, output)
+        self.assertEqual(errors, "['tweet_sampler']")
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import copy
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from tweet_aggregation import *
+
+
+def get_value(value):
+    return value
+
+
+
+class TestAggregators(unittest.TestCase):
+    def test_count_and_histogram_merge(self):
+        counts = [CountAggregator(), CountAggregator()]
+        histograms = [HistogramAggregator(get_value, bucket_width=10), HistogramAggregator(get_value, bucket_width=10)]
+        for value in range(25):
+            counts[value % 2].add_tweet(value)
+            histograms[value % 2].add_tweet(value)
+        counts[0].merge(counts[1])
+        histograms[0].merge(histograms[1])
+        self.assertEqual(counts[0].get_result(), 25)
+        self.assertEqual(histograms[0].get_result(), [[0, 10], [10, 10], [20, 5]])
+
+    def test_hyperloglog_estimates(self):
+        small_sketch = HyperLogLogAggregator(get_value)
+        for day in range(100):
+            small_sketch.add_tweet('2015-03-%02d' % (day % 31 + 1))
+        self.assertEqual(small_sketch.get_result(), 31)
+
+        sketches = [HyperLogLogAggregator(get_value), HyperLogLogAggregator(get_value)]
+        for value in range(20000):
+            sketches[value % 2].add_tweet(u'user%d' % value)
+        # Overlapping values are only counted once
+        for value in range(5000):
+            sketches[1].add_tweet(u'user%d' % value)
+        merged_sketch = copy.deepcopy(sketches[0])
+        merged_sketch.merge(sketches[1])
+        self.assertTrue(abs(merged_sketch.get_result() - 20000) < 20000 * 0.05)
+
+        # Merging sparse sketches into a dense sketch, and the reverse, gives the same registers
+        merged_sketch.merge(small_sketch)
+        small_sketch.merge(sketches[0])
+        small_sketch.merge(sketches[1])
+        self.assertEqual(merged_sketch.get_result(), small_sketch.get_result())
+
+        self.assertRaises(ValueError, HyperLogLogAggregator, get_value, 20)
+
+    def test_top_k(self):
+        top_k = TopKAggregator(get_value, 2, capacity=5)
+        for value in ['a', 'b', 'a', 'c', 'a', 'b']:
+            top_k.add_tweet(value)
+        self.assertEqual(top_k.get_result(), [['a', 3], ['b', 2]])
+
+        # Frequent values survive a stream with many more distinct values than the capacity
+        top_k = TopKAggregator(get_value, 2, capacity=10)
+        for value in range(1000):
+            top_k.add_tweet(['python', 'hopkins', 'rare%d' % value])
+        self.assertEqual([value for value, count in top_k.get_result()], ['hopkins', 'python'])
+
+        other_top_k = TopKAggregator(get_value, 2, capacity=10)
+        for value in range(300):
+            other_top_k.add_tweet('python')
+        top_k.merge(other_top_k)
+        self.assertEqual(top_k.get_result()[0], ['python', 1300])
+
+
+
+class TestTweetAggregation(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.logger = logging.getLogger('test_tweet_aggregation')
+        self.tweet_filenames = []
+        for name in ['shears', 'shears_copy']:
+            tweet_filename = os.path.join(self.temp_path, name + '.tweets')
+            shutil.copy('testdata/shears.txt', tweet_filename)
+            self.tweet_filenames.append(tweet_filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_aggregate_files(self):
+        aggregation = TweetAggregation(make_default_aggregators(), processes=2, logger=self.logger)
+        partial_results = aggregation.aggregate_files(self.tweet_filenames)
+        aggregation.close()
+
+        results = get_default_results(partial_results[self.tweet_filenames[0]])
+        self.assertEqual(results['tweets'], 32)
+        self.assertEqual(results['retweets'], 2)
+        self.assertEqual(results['retweet_ratio'], 2 / 32.0)
+        self.assertEqual(results['languages'][0], ['en', 27])
+        self.assertEqual(sum([count for hour, count in results['hour_of_day']]), 32)
+
+        totals = get_default_results(aggregation.merge(partial_results.values()))
+        self.assertEqual(totals['tweets'], 64)
+        self.assertEqual(totals['users'], results['users'])
+        self.assertEqual(totals['active_days'], results['active_days'])
+        self.assertEqual(totals['languages'][0], ['en', 54])
+
+        # A single process gives the same results, and doesn't change the aggregators it was given
+        aggregators = make_default_aggregators()
+        aggregation = TweetAggregation(aggregators, processes=1, logger=self.logger)
+        serial_results = aggregation.aggregate_files(self.tweet_filenames)
+        self.assertEqual(get_default_results(aggregation.merge(serial_results.values())), totals)
+        self.assertEqual(aggregators['tweets'].get_result(), 0)
+
+    def test_unchanged_files_are_cached(self):
+        cache_filename = os.path.join(self.temp_path, 'aggregates.cache')
+        aggregation = TweetAggregation(make_default_aggregators(), cache_filename=cache_filename, processes=2,
+                                       logger=self.logger)
+        first_results = get_results(aggregation.merge(aggregation.aggregate_files(self.tweet_filenames).values()))
+        aggregation.close()
+        self.assertEqual(aggregation.get_stats(), {'files_read': 2, 'files_cached': 0})
+
+        # Append a Tweet to one of the files
+        tweet_file = open(self.tweet_filenames[1], 'a')
+        tweet_file.write(open('testdata/shears.txt').readline())
+        tweet_file.close()
+        os.utime(self.tweet_filenames[1], (0, 0))
+
+        aggregation = TweetAggregation(make_default_aggregators(), cache_filename=cache_filename, processes=2,
+                                       logger=self.logger)
+        second_results = get_results(aggregation.merge(aggregation.aggregate_files(self.tweet_filenames).values()))
+        aggregation.close()
+        self.assertEqual(aggregation.get_stats(), {'files_read': 1, 'files_cached': 1})
+        self.assertEqual(second_results['tweets'], first_results['tweets'] + 1)
+
+        # Different aggregators don't use the cached results
+        aggregation = TweetAggregation(make_default_aggregators(top_k=5), cache_filename=cache_filename,
+                                       logger=self.logger)
+        aggregation.aggregate_files(self.tweet_filenames)
+        aggregation.close()
+        self.assertEqual(aggregation.get_stats(), {'files_read': 2, 'files_cached': 0})
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
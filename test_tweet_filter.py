@@ -4,9 +4,14 @@
 """
 
 # Standard Library modules
+import json
+import os
+import subprocess
+import sys
 import unittest
 
 # Local modules
+from snowflake import get_time_for_tweet_id
 from tweet_filter import *
 
 
@@ -136,6 +141,76 @@ class TestFilterTweetIDNotInSet(unittest.TestCase):
 
 
 
+class TestFilterTweetIDTimeRange(unittest.TestCase):
+    def test_time_range(self):
+        # Snowflake IDs for Tweets posted at 2015-03-01 00:00:00 and 2015-04-01 00:00:00 UTC
+        march_id = (1425168000000 - 1288834974657) << 22
+        april_id = (1427846400000 - 1288834974657) << 22
+        time_filter = TweetFilterTweetIDTimeRange(1425168000, 1427846400)
+        self.assertFalse(time_filter.filter('{"id": %d}' % (march_id - 1)))
+        self.assertTrue(time_filter.filter('{"id": %d}' % march_id))
+        self.assertTrue(time_filter.filter('{"id": %d}' % (april_id - 1)))
+        self.assertFalse(time_filter.filter('{"id": %d}' % april_id))
+        # Pre-snowflake IDs are older than any start time
+        self.assertFalse(time_filter.filter('{"id": 12345}'))
+
+    def test_open_ended_range(self):
+        april_id = (1427846400000 - 1288834974657) << 22
+        self.assertTrue(TweetFilterTweetIDTimeRange(end_time=1427846400).filter('{"id": 12345}'))
+        self.assertFalse(TweetFilterTweetIDTimeRange(end_time=1427846400).filter('{"id": %d}' % april_id))
+        self.assertTrue(TweetFilterTweetIDTimeRange(start_time=1427846400).filter('{"id": %d}' % april_id))
+
+
+
+class TestFilterBlocks(unittest.TestCase):
+    def setUp(self):
+        self.json_tweet_strings = [line for line in open("testdata/shears.txt")]
+        self.tweets = [json.loads(json_tweet_string) for json_tweet_string in self.json_tweet_strings]
+
+    def test_block_filters_match_tweet_filters(self):
+        tweet_ids = [self.tweets[0]['id'], self.tweets[5]['id_str'], 12345]
+        filter_classes = [
+            TweetFilterNoURLs,
+            TweetFilterNotARetweet,
+            TweetFilterOneTweetPerScreenName,
+            lambda: TweetFilterFieldMatchesRegEx('text', r'\bmy shears\b'),
+            lambda: TweetFilterTweetIDTimeRange(start_time=get_time_for_tweet_id(self.tweets[10]['id'])),
+        ]
+        for filter_class in filter_classes:
+            tweet_filter = filter_class()
+            self.assertEqual(list(filter_class().filter_block(self.json_tweet_strings, self.tweets)),
+                             [tweet_filter.filter(json_tweet_string) for json_tweet_string in self.json_tweet_strings])
+
+        for filter_class in [TweetFilterTweetIDInSet, TweetFilterTweetIDNotInSet]:
+            block_filter = filter_class()
+            block_filter.add_tweet_ids(tweet_ids)
+            tweet_filter = filter_class()
+            tweet_filter.add_tweet_ids(tweet_ids)
+            self.assertEqual(list(block_filter.filter_block(self.json_tweet_strings, self.tweets)),
+                             [tweet_filter.filter(json_tweet_string) for json_tweet_string in self.json_tweet_strings])
+
+    def test_id_set_changes_between_blocks(self):
+        id_filter = TweetFilterTweetIDNotInSet()
+        self.assertTrue(all(id_filter.filter_block(self.json_tweet_strings, self.tweets)))
+        id_filter.add_tweets(self.json_tweet_strings[:3])
+        self.assertEqual(list(id_filter.filter_block(self.json_tweet_strings[:4], self.tweets[:4])),
+                         [False, False, False, True])
+
+    def test_one_tweet_per_screen_name_across_blocks(self):
+        screen_name_filter = TweetFilterOneTweetPerScreenName()
+        first_block = screen_name_filter.filter_block(self.json_tweet_strings[:10], self.tweets[:10])
+        second_block = screen_name_filter.filter_block(self.json_tweet_strings[10:], self.tweets[10:])
+        tweet_filter = TweetFilterOneTweetPerScreenName()
+        self.assertEqual(list(first_block) + list(second_block),
+                         [tweet_filter.filter(json_tweet_string) for json_tweet_string in self.json_tweet_strings])
+
+    def test_empty_block(self):
+        for block_filter in [TweetFilterNoURLs(), TweetFilterNotARetweet(), TweetFilterOneTweetPerScreenName(),
+                             TweetFilterTweetIDInSet(), TweetFilterTweetIDTimeRange(end_time=0)]:
+            self.assertEqual(len(block_filter.filter_block([], [])), 0)
+
+
+
 class TestFilteredTweetReader(unittest.TestCase):
     def test_add_filter_when_reader_crated(self):
         filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()])
@@ -202,6 +277,72 @@ class TestFilteredTweetReader(unittest.TestCase):
         self.assertEqual(total_tweets_passed_through_filters(filtered_reader), 0)
         filtered_reader.close()
 
+    def test_lookahead_preserves_order_and_results(self):
+        filtered_reader = FilteredTweetReader()
+        filtered_reader.add_filter(TweetFilterNotARetweet())
+        filtered_reader.add_filter(TweetFilterOneTweetPerScreenName())
+        filtered_reader.open("testdata/shears.txt")
+        expected_tweets = list(filtered_reader)
+        filtered_reader.close()
+
+        prefetching_filter = TweetFilterRecordPrefetches()
+        filtered_reader = FilteredTweetReader(lookahead=5)
+        filtered_reader.add_filter(TweetFilterNotARetweet())
+        filtered_reader.add_filter(prefetching_filter)
+        filtered_reader.add_filter(TweetFilterOneTweetPerScreenName())
+        filtered_reader.open("testdata/shears.txt")
+        self.assertEqual(list(filtered_reader), expected_tweets)
+        filtered_reader.close()
+
+        # Only Tweets that passed the filters before the prefetching filter are prefetched, in order
+        self.assertEqual(prefetching_filter.prefetched, prefetching_filter.filtered)
+        self.assertEqual(len(prefetching_filter.prefetched), 30)
+
+    def test_blocks_preserve_order_and_results(self):
+        def make_filters():
+            # TweetFilterRecordPrefetches only implements filter(), so is called once per Tweet
+            return [TweetFilterNotARetweet(), TweetFilterRecordPrefetches(), TweetFilterNoURLs(),
+                    TweetFilterOneTweetPerScreenName()]
+
+        filtered_reader = FilteredTweetReader(make_filters())
+        filtered_reader.open("testdata/shears.txt")
+        expected_tweets = list(filtered_reader)
+        filtered_reader.close()
+        self.assertTrue(len(expected_tweets) > 0)
+
+        for block_size in [1, 7, DEFAULT_BLOCK_SIZE]:
+            filters = make_filters()
+            filtered_reader = FilteredTweetReader(filters, block_size=block_size)
+            filtered_reader.open("testdata/shears.txt")
+            self.assertEqual(list(filtered_reader), expected_tweets)
+            filtered_reader.close()
+            self.assertEqual(filters[1].prefetched, filters[1].filtered)
+            self.assertEqual(len(filters[1].filtered), 30)
+
+    def test_blocks_skip_invalid_json(self):
+        filtered_reader = FilteredTweetReader(block_size=2)
+        filtered_reader.open("testdata/bad_json_tweets_x3")
+        self.assertEqual(total_tweets_passed_through_filters(filtered_reader), 0)
+        filtered_reader.close()
+
+    def test_blocks_short_circuit_after_first_rejection(self):
+        filtered_reader = FilteredTweetReader(block_size=DEFAULT_BLOCK_SIZE)
+        filtered_reader.add_filter(TweetFilterAlwaysReject())
+        filtered_reader.add_filter(TweetFilterAlwaysRaiseException())
+        filtered_reader.open("testdata/shears.txt")
+        self.assertEqual(total_tweets_passed_through_filters(filtered_reader), 0)
+        filtered_reader.close()
+
+
+class TestLazyImports(unittest.TestCase):
+    def test_module_imports_only_standard_library(self):
+        script = ("import sys, tweet_filter\n"
+                  "sys.stdout.write(repr(sorted(set(['numpy', 'crawl_profiler', 'snowflake', 'tweet_id_set', 'tweet_writer'])"
+                  " & set(sys.modules))))\n")
+        process = subprocess.Popen([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                   stdout=subprocess.PIPE)
+        self.assertEqual(process.communicate()[0], '[]')
+
 
 def total_tweets_passed_through_filters(filtered_reader):
     tweets = []
@@ -220,6 +361,22 @@ class TweetFilterAlwaysReject(TweetFilter):
         return False
 
 
+class TweetFilterRecordPrefetches(TweetFilter):
+    prefetches = True
+
+    def __init__(self):
+        TweetFilter.__init__(self)
+        self.filtered = []
+        self.prefetched = []
+
+    def filter(self, json_tweet_string):
+        self.filtered.append(json_tweet_string)
+        return True
+
+    def prefetch(self, json_tweet_string):
+        self.prefetched.append(json_tweet_string)
+
+
 
 if __name__ == '__main__':
     unittest.main(buffer=True)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+# Third party modules
+from twython import Twython
+
+# Local modules
+from crawl_manifest import CrawlManifest
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+from tweet_filter_timeline_downloadable import *
+
+
+def make_json_tweet(screen_name):
+    return json.dumps({'id': 1, 'id_str': '1', 'text': 'foo', 'user': {'screen_name': screen_name}})
+
+
+
+class TestTweetFilterTimelineDownloadable(unittest.TestCase):
+    # user3 has protected Tweets, and charman is not one of the mock server's users
+    SCREEN_NAMES = ['user%d' % user_index for user_index in range(10)] + ['charman']
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.logger = logging.getLogger('test_tweet_filter_timeline_downloadable')
+        self.api = MockTwitterAPI(num_users=10, max_tweets_per_user=50, protected_users=[3])
+        self.server = MockTwitterServer(self.api)
+        self.server.start()
+        # requests-oauthlib refuses to send OAuth 2 bearer tokens over plain HTTP unless told otherwise
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        self.twython = Twython('app_key', access_token='access_token')
+        self.twython.api_url = self.server.get_api_url()
+        self.manifest = CrawlManifest(os.path.join(self.temp_path, 'manifest.db'))
+
+    def tearDown(self):
+        self.manifest.close()
+        self.twython.client.close()
+        self.server.stop()
+        shutil.rmtree(self.temp_path)
+
+    def filter_screen_names(self, download_path, manifest=None, prefetch_threads=0):
+        """
+        Returns {screen_name: verdict} for SCREEN_NAMES, prefetching
+        every timeline before filtering if prefetch_threads is set
+        """
+        if not os.path.exists(download_path):
+            os.mkdir(download_path)
+        timeline_filter = TweetFilterTimelineDownloadable(self.twython, download_path, 20, logger=self.logger,
+                                                          manifest=manifest, prefetch_threads=prefetch_threads)
+        try:
+            if prefetch_threads:
+                for screen_name in self.SCREEN_NAMES:
+                    timeline_filter.prefetch(make_json_tweet(screen_name))
+            return dict((screen_name, timeline_filter.filter(make_json_tweet(screen_name)))
+                        for screen_name in self.SCREEN_NAMES)
+        finally:
+            timeline_filter.close()
+
+    def get_timeline_requests(self):
+        return sum(self.api.get_stats().get('statuses/user_timeline', {}).values())
+
+    def test_prefetched_verdicts_match_synchronous_verdicts(self):
+        expected_verdicts = self.filter_screen_names(os.path.join(self.temp_path, 'synchronous'))
+        self.assertFalse(expected_verdicts['user3'])
+        self.assertFalse(expected_verdicts['charman'])
+        self.assertTrue(True in expected_verdicts.values())
+        self.assertTrue(False in [expected_verdicts['user%d' % user_index] for user_index in range(10) if user_index != 3])
+
+        download_path = os.path.join(self.temp_path, 'prefetched')
+        self.assertEqual(self.filter_screen_names(download_path, prefetch_threads=4), expected_verdicts)
+        self.assertEqual(self.api.get_stats()['statuses/user_timeline'], {200: 18, 401: 2, 404: 2})
+
+        # Without a manifest, users whose timelines aren't downloadable get empty files
+        for screen_name, verdict in expected_verdicts.items():
+            path_to_tweetfile = os.path.join(download_path, '%s.tweets' % screen_name)
+            self.assertEqual(os.path.getsize(path_to_tweetfile) > 0, verdict)
+
+        # A new filter doesn't download the timelines again, and gives the same verdicts
+        timeline_requests = self.get_timeline_requests()
+        self.assertEqual(self.filter_screen_names(download_path, prefetch_threads=4), expected_verdicts)
+        self.assertEqual(self.get_timeline_requests(), timeline_requests)
+
+    def test_verdicts_are_cached(self):
+        timeline_filter = TweetFilterTimelineDownloadable(self.twython, self.temp_path, 20, logger=self.logger,
+                                                          manifest=self.manifest, prefetch_threads=4)
+        try:
+            verdicts = {}
+            for repeat in range(3):
+                for screen_name in self.SCREEN_NAMES:
+                    timeline_filter.prefetch(make_json_tweet(screen_name))
+                for screen_name in self.SCREEN_NAMES:
+                    verdict = timeline_filter.filter(make_json_tweet(screen_name.upper()))
+                    self.assertEqual(verdicts.setdefault(screen_name, verdict), verdict)
+        finally:
+            timeline_filter.close()
+
+        # Each timeline is downloaded once, including those that are rejected or raise errors
+        self.assertEqual(self.get_timeline_requests(), len(self.SCREEN_NAMES))
+        self.assertFalse(verdicts['user3'])
+        self.assertFalse(verdicts['charman'])
+
+    def test_manifest_recording(self):
+        verdicts = self.filter_screen_names(self.temp_path, manifest=self.manifest, prefetch_threads=4)
+        self.manifest.flush()
+
+        self.assertEqual(self.manifest.get_status('user3'), CrawlManifest.STATUS_UNAVAILABLE)
+        self.assertEqual(self.manifest.get_error_code('user3'), 401)
+        self.assertEqual(self.manifest.get_status('charman'), CrawlManifest.STATUS_UNAVAILABLE)
+        self.assertEqual(self.manifest.get_error_code('charman'), 404)
+        for user_index in range(10):
+            screen_name = 'user%d' % user_index
+            path_to_tweetfile = os.path.join(self.temp_path, '%s.tweets' % screen_name)
+            if verdicts[screen_name]:
+                self.assertEqual(self.manifest.get_status(screen_name), CrawlManifest.STATUS_CRAWLED)
+                self.assertTrue(os.path.exists(path_to_tweetfile))
+            else:
+                # No empty files are created when a manifest is used
+                self.assertFalse(os.path.exists(path_to_tweetfile))
+                if user_index != 3:
+                    self.assertEqual(self.manifest.get_status(screen_name), CrawlManifest.STATUS_TOO_FEW_TWEETS)
+                    self.assertTrue(self.manifest.get_tweet_count(screen_name) < 20)
+
+        # Users in the manifest, including rejected users, are not downloaded again
+        timeline_requests = self.get_timeline_requests()
+        self.assertEqual(self.filter_screen_names(self.temp_path, manifest=self.manifest, prefetch_threads=4), verdicts)
+        self.assertEqual(self.get_timeline_requests(), timeline_requests)
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
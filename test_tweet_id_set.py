@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from tweet_id_set import *
+
+
+class TestTweetIDSet(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_add_and_contains(self):
+        tweet_id_set = TweetIDSet(merge_threshold=3)
+        for tweet_id in [5, 3, 2**62, 3, 7]:
+            tweet_id_set.add(tweet_id)
+        self.assertIn(2**62, tweet_id_set)
+        self.assertIn(7, tweet_id_set)
+        self.assertNotIn(4, tweet_id_set)
+        self.assertEqual(len(tweet_id_set), 4)
+
+    def test_bulk_update_and_contains(self):
+        tweet_id_set = TweetIDSet(range(0, 1000, 2), merge_threshold=100)
+        tweet_id_set.add(1)
+        self.assertEqual(list(tweet_id_set.contains([0, 1, 3, 998, 1000])), [True, True, False, True, False])
+        self.assertEqual(len(tweet_id_set), 501)
+
+    def test_many_merges_match_a_set(self):
+        rng = random.Random(0)
+        tweet_id_set = TweetIDSet(merge_threshold=16)
+        expected_ids = set()
+        for step in range(200):
+            if step % 10 == 0:
+                tweet_ids = [rng.randint(0, 5000) for i in range(rng.randint(16, 200))]
+                tweet_id_set.update(tweet_ids)
+                expected_ids.update(tweet_ids)
+            else:
+                for i in range(rng.randint(0, 40)):
+                    tweet_id = rng.randint(0, 5000)
+                    tweet_id_set.add(tweet_id)
+                    expected_ids.add(tweet_id)
+        self.assertEqual(len(tweet_id_set), len(expected_ids))
+        self.assertEqual(list(tweet_id_set.contains(range(5001))), [tweet_id in expected_ids for tweet_id in range(5001)])
+        self.assertEqual([tweet_id in tweet_id_set for tweet_id in range(5001)], [tweet_id in expected_ids for tweet_id in range(5001)])
+        # Merging runs of similar sizes keeps the number of runs logarithmic
+        self.assertTrue(len(tweet_id_set._runs) <= 10, len(tweet_id_set._runs))
+
+    def test_add_ids_from_compressed_file(self):
+        id_filename = os.path.join(self.temp_path, 'tweets.ids.gz')
+        id_file = gzip.open(id_filename, 'wb')
+        id_file.write("10\n20\n\n20\n390522946498244608\n")
+        id_file.close()
+
+        tweet_id_set = TweetIDSet()
+        self.assertEqual(tweet_id_set.add_ids_from_file(id_filename, chunk_size=2), 4)
+        self.assertEqual(len(tweet_id_set), 3)
+        self.assertIn(390522946498244608, tweet_id_set)
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from tweet_filter import FilteredTweetReader, TweetFilterNotARetweet
+from tweet_inverted_index import *
+
+
+class TestPostings(unittest.TestCase):
+    def test_encode_and_decode(self):
+        doc_ids = [1, 2, 3, 130, 131, 20000, 2**40]
+        data = encode_postings(doc_ids)
+        # Differences under 128 take one byte each
+        self.assertEqual(len(encode_postings([1, 2, 3, 100])), 4)
+        self.assertEqual(decode_postings(data), doc_ids)
+        self.assertEqual(decode_postings(encode_postings([])), [])
+
+    def test_boolean_operations(self):
+        self.assertEqual(intersect_postings([1, 3, 5, 7, 9], [3, 4, 9]), [3, 9])
+        self.assertEqual(intersect_postings([2], range(1000)), [2])
+        self.assertEqual(intersect_postings([1000], range(1000)), [])
+        self.assertEqual(union_postings([1, 5], [2, 5, 7]), [1, 2, 5, 7])
+        self.assertEqual(difference_postings([1, 2, 3], [2]), [1, 3])
+
+    def test_parse_query(self):
+        self.assertEqual(parse_query('#Python @charman -from:jhu OR hopkins'),
+                         [(['#python', '@charman'], ['from:jhu']), (['hopkins'], [])])
+        self.assertRaises(ValueError, parse_query, '-jhu')
+
+    def test_tweet_terms(self):
+        tweet = make_tweet(1, u'charman', u'Crawling the #Twitter API with @PHonyDoc http://t.co/abc',
+                           hashtags=[u'Twitter'], user_mentions=[u'PHonyDoc'], urls=[u'http://www.jhu.edu/x'])
+        self.assertEqual(get_tweet_terms(tweet),
+                         set([u'#twitter', u'@phonydoc', u'url:jhu.edu', u'from:charman', u'crawling', u'the', u'api',
+                              u'with']))
+        # Without entities, hashtags and mentions are found in the text
+        self.assertEqual(get_tweet_terms({'id': 1, 'text': u'#Python @jhu'}), set([u'#python', u'@jhu']))
+
+
+
+class TestTweetInvertedIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.index_filename = os.path.join(self.temp_path, 'tweets.search')
+        self.logger = logging.getLogger('test_tweet_inverted_index')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_search(self):
+        charman_filename = self.write_tweet_file('charman.tweets', [
+            make_tweet(3, u'charman', u'Python crawler #python', hashtags=[u'python']),
+            make_tweet(2, u'charman', u'Hello @jhu', user_mentions=[u'jhu']),
+            make_tweet(1, u'charman', u'Hello world')])
+        gzip_filename = self.write_tweet_file('jhu.tweets.gz', [
+            make_tweet(5, u'jhu', u'#Python at Hopkins', hashtags=[u'Python']),
+            make_tweet(4, u'jhu', u'Hello Baltimore')])
+
+        inverted_index = TweetInvertedIndex(self.index_filename, logger=self.logger)
+        inverted_index.add_files([charman_filename, gzip_filename])
+        self.assertFalse(inverted_index.add_file(charman_filename))
+        self.assertEqual(inverted_index.get_document_count(), 5)
+
+        self.assertEqual(get_tweet_ids(inverted_index, '#python'), [3, 5])
+        self.assertEqual(get_tweet_ids(inverted_index, 'hello'), [1, 2, 4])
+        self.assertEqual(get_tweet_ids(inverted_index, 'hello -@jhu'), [1, 4])
+        self.assertEqual(get_tweet_ids(inverted_index, 'Hello from:charman'), [1, 2])
+        self.assertEqual(get_tweet_ids(inverted_index, '@jhu OR hopkins'), [2, 5])
+        self.assertEqual(get_tweet_ids(inverted_index, 'nonexistent hello'), [])
+        inverted_index.close()
+
+    def test_incremental_update(self):
+        filename = self.write_tweet_file('charman.tweets', [make_tweet(1, u'charman', u'Hello world')])
+        inverted_index = TweetInvertedIndex(self.index_filename, logger=self.logger)
+        inverted_index.add_file(filename)
+        inverted_index.close()
+
+        # A recrawl adds a newer Tweet to the file
+        self.write_tweet_file('charman.tweets', [make_tweet(2, u'charman', u'Hello again'),
+                                                 make_tweet(1, u'charman', u'Hello world')])
+        inverted_index = TweetInvertedIndex(self.index_filename, logger=self.logger)
+        self.assertTrue(inverted_index.add_file(filename))
+        self.assertEqual(get_tweet_ids(inverted_index, 'hello'), [1, 2])
+        self.assertEqual(get_tweet_ids(inverted_index, 'world'), [1])
+        # The postings for the first version of the file point to deleted documents
+        self.assertEqual(len(inverted_index.get_postings('hello')), 3)
+
+        inverted_index.optimize()
+        self.assertEqual(len(inverted_index.get_postings('hello')), 2)
+        self.assertEqual(get_tweet_ids(inverted_index, 'hello'), [1, 2])
+        inverted_index.close()
+
+    def test_filtered_tweet_reader(self):
+        inverted_index = TweetInvertedIndex(self.index_filename, logger=self.logger)
+        inverted_index.add_file('testdata/shears.txt')
+        filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()])
+        filtered_reader.open_file(inverted_index.open('shears'))
+        tweets = [json.loads(json_tweet_string) for json_tweet_string in filtered_reader]
+        filtered_reader.close()
+        self.assertTrue(tweets)
+        for tweet in tweets:
+            self.assertTrue('shears' in tweet['text'].lower())
+        inverted_index.close()
+
+    def write_tweet_file(self, basename, tweets):
+        filename = os.path.join(self.temp_path, basename)
+        if filename.endswith('.gz'):
+            tweet_file = gzip.open(filename, 'wb')
+        else:
+            tweet_file = open(filename, 'wb')
+        for tweet in tweets:
+            tweet_file.write(json.dumps(tweet) + '\n')
+        tweet_file.close()
+        return filename
+
+
+
+def make_tweet(tweet_id, screen_name, text, hashtags=[], user_mentions=[], urls=[]):
+    return {'id': tweet_id, 'id_str': str(tweet_id), 'text': text, 'user': {'screen_name': screen_name},
+            'entities': {'hashtags': [{'text': hashtag} for hashtag in hashtags],
+                         'user_mentions': [{'screen_name': screen_name} for screen_name in user_mentions],
+                         'urls': [{'url': u'http://t.co/abc', 'expanded_url': url} for url in urls]}}
+
+
+def get_tweet_ids(inverted_index, query):
+    return sorted([json.loads(line)['id'] for line in inverted_index.iter_tweet_lines(query)])
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import urllib
+import urllib2
+
+# Local modules
+from crawler_metrics import MetricsRegistry
+from snowflake import get_min_tweet_id_for_time
+from tweet_inverted_index import TweetInvertedIndex
+from tweet_query_server import *
+
+
+# 2015-03-01 00:00:00 UTC
+MARCH_1 = 1425168000
+
+DAY = 24*60*60
+
+
+class TestTweetQueryServer(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.logger = logging.getLogger('test_tweet_query_server')
+
+        index_filename = os.path.join(self.temp_path, 'tweets.search')
+        inverted_index = TweetInvertedIndex(index_filename, logger=self.logger)
+        inverted_index.add_files([
+            self.write_tweet_file('charman.tweets', [
+                make_tweet(MARCH_1 + 3*DAY, u'charman', u'RT @jhu: Crawling #python'),
+                make_tweet(MARCH_1 + 2*DAY, u'charman', u'Crawling the Twitter API with #python'),
+                make_tweet(MARCH_1 + DAY, u'charman', u'Hello world')]),
+            self.write_tweet_file('jhu.tweets', [
+                make_tweet(MARCH_1 + 2*DAY, u'jhu', u'Hello Baltimore'),
+                make_tweet(MARCH_1 - DAY, u'jhu', u'#python at Hopkins')])])
+        inverted_index.close()
+
+        self.service = TweetQueryService(index_filename, logger=self.logger, metrics=MetricsRegistry())
+        self.server = TweetQueryServer(self.service, port=0, worker_count=2)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.temp_path)
+
+    def test_queries(self):
+        self.assertEqual(self.get_texts(q='#python'), [u'#python at Hopkins', u'Crawling the Twitter API with #python',
+                                                       u'RT @jhu: Crawling #python'])
+        self.assertEqual(self.get_texts(q='#python', filter='not_retweet'),
+                         [u'#python at Hopkins', u'Crawling the Twitter API with #python'])
+        self.assertEqual(self.get_texts(user='charman', start='2015-03-02', end='2015-03-04'),
+                         [u'Crawling the Twitter API with #python', u'Hello world'])
+        self.assertEqual(self.get_texts(user=['charman', 'jhu'], pattern='^Hello'), [u'Hello Baltimore', u'Hello world'])
+        self.assertEqual(self.get_texts(start=str(MARCH_1 + 2*DAY)),
+                         [u'Crawling the Twitter API with #python', u'Hello Baltimore', u'RT @jhu: Crawling #python'])
+        self.assertEqual(self.get_texts(ids='%d,%d' % (get_tweet_id(MARCH_1 + DAY), get_tweet_id(MARCH_1 - DAY))),
+                         [u'#python at Hopkins', u'Hello world'])
+        self.assertEqual(len(self.get_texts(q='#python', limit='1')), 1)
+
+    def test_result_cache(self):
+        self.get_texts(q='hello')
+        self.get_texts(q='hello', filter='not_retweet')
+        self.get_texts(q='world')
+        stats = json.loads(urllib2.urlopen(self.server.get_url() + '/stats').read())
+        self.assertEqual(stats['tweets'], 5)
+        self.assertEqual(stats['cache_hits'], 1)
+        self.assertEqual(stats['cache_misses'], 2)
+
+    def test_invalid_queries(self):
+        for params in [{}, {'q': '-hello'}, {'start': 'March'}, {'q': 'hello', 'filter': 'unknown'},
+                       {'q': 'hello', 'pattern': '('}]:
+            try:
+                urllib2.urlopen(self.server.get_url() + '/tweets?' + urllib.urlencode(params))
+            except urllib2.HTTPError as e:
+                self.assertEqual(e.code, 400)
+                self.assertTrue('error' in json.loads(e.read()))
+            else:
+                self.fail("Query %s did not fail" % params)
+
+    def get_texts(self, **params):
+        response = urllib2.urlopen(self.server.get_url() + '/tweets?' + urllib.urlencode(params, doseq=True))
+        self.assertEqual(response.info()['Content-Type'], 'application/x-ndjson;charset=utf-8')
+        return sorted([json.loads(line)['text'] for line in response.read().splitlines()])
+
+    def write_tweet_file(self, basename, tweets):
+        filename = os.path.join(self.temp_path, basename)
+        tweet_file = open(filename, 'wb')
+        for tweet in tweets:
+            tweet_file.write(json.dumps(tweet) + '\n')
+        tweet_file.close()
+        return filename
+
+
+
+def get_tweet_id(tweet_time):
+    return get_min_tweet_id_for_time(tweet_time) + 1
+
+
+def make_tweet(tweet_time, screen_name, text):
+    tweet_id = get_tweet_id(tweet_time)
+    return {'id': tweet_id, 'id_str': str(tweet_id), 'text': text, 'user': {'screen_name': screen_name}}
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import json
+import unittest
+
+# Local modules
+from snowflake import get_min_tweet_id_for_time
+from tweet_filter import FilteredTweetReader, TweetFilterNotARetweet
+from tweet_sampler import *
+
+
+class TestReservoirSampler(unittest.TestCase):
+    def test_small_input(self):
+        sampler = ReservoirSampler(10, seed=1)
+        sampler.add_tweets(['a', 'b', 'c'])
+        self.assertEqual(sampler.get_sample(), ['a', 'b', 'c'])
+        self.assertEqual(sampler.get_seen_count(), 3)
+
+    def test_reproducible(self):
+        samples = []
+        for seed in [1, 1, 2]:
+            sampler = ReservoirSampler(10, seed=seed)
+            sampler.add_tweets([str(i) for i in range(1000)])
+            samples.append(sampler.get_sample())
+        self.assertEqual(len(samples[0]), 10)
+        self.assertEqual(samples[0], samples[1])
+        self.assertNotEqual(samples[0], samples[2])
+        # Sampled Tweets are returned in the order they were added
+        self.assertEqual(samples[0], sorted(samples[0], key=int))
+
+    def test_uniform(self):
+        # Each of 100 Tweets should be sampled in about 10% of 2000 samples of size 10
+        counts = [0] * 100
+        for seed in range(2000):
+            sampler = ReservoirSampler(10, seed=seed)
+            sampler.add_tweets(range(100))
+            for tweet in sampler.get_sample():
+                counts[tweet] += 1
+        self.assertTrue(min(counts) > 140, counts)
+        self.assertTrue(max(counts) < 260, counts)
+        # The first and last Tweets aren't favored
+        self.assertTrue(abs(sum(counts[:50]) - sum(counts[50:])) < 400)
+
+    def test_filtered_tweet_reader(self):
+        sampler = ReservoirSampler(5, seed=1)
+        filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()])
+        filtered_reader.open('testdata/shears.txt')
+        sampler.add_tweets(filtered_reader)
+        filtered_reader.close()
+        self.assertEqual(sampler.get_seen_count(), 30)
+        self.assertEqual(len(sampler.get_sample()), 5)
+
+
+
+class TestStratifiedReservoirSampler(unittest.TestCase):
+    def test_per_user(self):
+        tweets = [make_tweet(i, u'user%d' % (i % 3), 1425168000 + i) for i in range(30)]
+        sampler = StratifiedReservoirSampler(2, get_screen_name_key, seed=1)
+        sampler.add_tweets(tweets)
+        samples = sampler.get_samples_by_stratum()
+        self.assertEqual(sorted(samples.keys()), [u'user0', u'user1', u'user2'])
+        for screen_name, user_tweets in samples.items():
+            self.assertEqual(len(user_tweets), 2)
+            for json_tweet_string in user_tweets:
+                self.assertEqual(json.loads(json_tweet_string)['user']['screen_name'], screen_name)
+        self.assertEqual(sampler.get_seen_counts_by_stratum()[u'user0'], 10)
+        self.assertEqual(len(sampler.get_sample()), 6)
+
+        other_sampler = StratifiedReservoirSampler(2, get_screen_name_key, seed=1)
+        other_sampler.add_tweets(tweets)
+        self.assertEqual(other_sampler.get_sample(), sampler.get_sample())
+
+    def test_time_buckets(self):
+        # 10 Tweets an hour for two days
+        tweets = [make_tweet(i, u'charman', 1425168000 + i*360) for i in range(480)]
+        sampler = StratifiedReservoirSampler(3, make_time_bucket_key(24*60*60), seed=1)
+        sampler.add_tweets(tweets)
+        self.assertEqual(sorted(sampler.get_seen_counts_by_stratum().items()), [(1425168000, 240), (1425254400, 240)])
+        self.assertEqual(len(sampler.get_sample()), 6)
+
+    def test_language(self):
+        self.assertEqual(get_language_key('{"lang": "en"}'), 'en')
+        self.assertEqual(get_language_key('{"text": "?"}'), 'und')
+
+
+
+def make_tweet(index, screen_name, tweet_time):
+    tweet_id = get_min_tweet_id_for_time(tweet_time) + index
+    return json.dumps({'id': tweet_id, 'id_str': str(tweet_id), 'text': u'Tweet %d' % index,
+                       'user': {'screen_name': screen_name}}) + '\n'
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
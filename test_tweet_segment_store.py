@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from tweet_filter import FilteredTweetReader, TweetFilterNotARetweet
+from tweet_segment_store import *
+
+
+class TestTweetSegmentStore(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.store_path = os.path.join(self.temp_path, 'store')
+        self.logger = logging.getLogger('test_tweet_segment_store')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_append_and_read(self):
+        store = TweetSegmentStore(self.store_path, logger=self.logger)
+        store.append_tweets(u'charman', [make_tweet(2, u'charman'), make_tweet(1, u'charman')])
+        store.append_tweets(u'PHonyDoc', [make_tweet(3, u'PHonyDoc')])
+
+        self.assertTrue(store.has_user(u'CHARMAN'))
+        self.assertFalse(store.has_user(u'jhu'))
+        self.assertEqual(get_tweet_ids(store, u'charman'), [2, 1])
+        self.assertEqual(get_tweet_ids(store, u'PHonyDoc'), [3])
+        self.assertEqual(store.get_max_id(u'charman'), 2)
+        self.assertEqual(sorted(store.get_screen_names()), [u'PHonyDoc', u'charman'])
+        store.close()
+
+    def test_segments_roll_over(self):
+        store = TweetSegmentStore(self.store_path, max_segment_size=100, logger=self.logger)
+        for tweet_id in range(5):
+            store.append_tweets(u'user%d' % tweet_id, [make_tweet(tweet_id, u'user%d' % tweet_id)])
+        store.close()
+
+        segment_filenames = [filename for filename in os.listdir(self.store_path) if filename.startswith('segment-')]
+        self.assertEqual(len(segment_filenames), 5)
+
+        # Reopened stores keep appending to the last segment
+        store = TweetSegmentStore(self.store_path, max_segment_size=100, logger=self.logger)
+        for tweet_id in range(5):
+            self.assertEqual(get_tweet_ids(store, u'user%d' % tweet_id), [tweet_id])
+        store.close()
+
+    def test_incremental_records_and_compaction(self):
+        store = TweetSegmentStore(self.store_path, max_segment_size=200, logger=self.logger)
+        store.append_tweets(u'charman', [make_tweet(2, u'charman'), make_tweet(1, u'charman')])
+        store.append_tweets(u'PHonyDoc', [make_tweet(10, u'PHonyDoc')])
+        store.append_tweets(u'charman', [make_tweet(4, u'charman'), make_tweet(3, u'charman'), make_tweet(2, u'charman')])
+
+        # Newest record first, duplicates included before compaction
+        self.assertEqual(get_tweet_ids(store, u'charman'), [4, 3, 2, 2, 1])
+        self.assertEqual(store.get_tweet_count(u'charman'), 5)
+
+        store.compact()
+        self.assertEqual(get_tweet_ids(store, u'charman'), [4, 3, 2, 1])
+        self.assertEqual(get_tweet_ids(store, u'PHonyDoc'), [10])
+        self.assertEqual(store.get_tweet_count(u'charman'), 4)
+        self.assertEqual(store.get_max_id(u'charman'), 4)
+
+        store.append_tweets(u'charman', [make_tweet(5, u'charman')])
+        self.assertEqual(get_tweet_ids(store, u'charman'), [5, 4, 3, 2, 1])
+        store.close()
+
+    def test_filtered_tweet_reader(self):
+        store = TweetSegmentStore(self.store_path, logger=self.logger)
+        store.import_tweet_file(u'shears', 'testdata/shears.txt')
+        self.assertEqual(store.get_tweet_count(u'shears'), 32)
+
+        filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()])
+        filtered_reader.open_file(store.open(u'shears'))
+        self.assertEqual(len(list(filtered_reader)), 30)
+        filtered_reader.close()
+        store.close()
+
+
+
+def make_tweet(tweet_id, screen_name):
+    return {'id': tweet_id, 'id_str': str(tweet_id), 'text': u'Tweet %d' % tweet_id, 'user': {'screen_name': screen_name}}
+
+
+def get_tweet_ids(store, screen_name):
+    return [json.loads(line)['id'] for line in store.iter_tweet_lines(screen_name)]
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from snowflake import get_min_tweet_id_for_time
+from tweet_time_index import *
+
+
+# 2015-03-01 00:00:00 UTC
+MARCH_1 = 1425168000
+
+HOUR = 60*60
+DAY = 24*HOUR
+
+
+class TestTweetTimeIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.index_filename = os.path.join(self.temp_path, 'tweets.index')
+        self.logger = logging.getLogger('test_tweet_time_index')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_blocks_and_bucket_counts(self):
+        # Newest to oldest, like a timeline: two Tweets on March 3rd, three on March 1st
+        times = [MARCH_1 + 2*DAY + 2*HOUR, MARCH_1 + 2*DAY + HOUR, MARCH_1 + 3*HOUR, MARCH_1 + 2*HOUR, MARCH_1 + HOUR]
+        filename = self.write_tweet_file('charman.tweets', times)
+
+        time_index = TweetTimeIndex(self.index_filename, logger=self.logger)
+        self.assertTrue(time_index.add_file(filename))
+        self.assertFalse(time_index.add_file(filename))
+        self.assertEqual(time_index.get_bucket_counts(), [(MARCH_1, 3), (MARCH_1 + 2*DAY, 2)])
+        self.assertEqual(len(time_index._get_blocks(os.path.abspath(filename))), 2)
+        time_index.close()
+
+        self.assertRaises(ValueError, TweetTimeIndex, self.index_filename, bucket_seconds=HOUR, logger=self.logger)
+
+    def test_iter_tweet_lines(self):
+        times = [MARCH_1 + 2*DAY + 2*HOUR, MARCH_1 + 2*DAY + HOUR, MARCH_1 + 3*HOUR, MARCH_1 + 2*HOUR, MARCH_1 + HOUR]
+        filename = self.write_tweet_file('charman.tweets', times)
+        gzip_filename = self.write_tweet_file('PHonyDoc.tweets.gz', [MARCH_1 + 5*DAY, MARCH_1 + 2*DAY + 3*HOUR])
+        old_filename = self.write_tweet_file('jhu.tweets', [MARCH_1 - 10*DAY])
+
+        time_index = TweetTimeIndex(self.index_filename, logger=self.logger)
+        time_index.add_files([filename, gzip_filename, old_filename])
+
+        self.assertEqual(get_tweet_times(time_index, None, None), sorted(times + [MARCH_1 + 5*DAY, MARCH_1 + 2*DAY + 3*HOUR,
+                                                                                  MARCH_1 - 10*DAY]))
+        # Whole buckets
+        self.assertEqual(get_tweet_times(time_index, MARCH_1, MARCH_1 + DAY), [MARCH_1 + HOUR, MARCH_1 + 2*HOUR, MARCH_1 + 3*HOUR])
+        self.assertEqual(get_tweet_times(time_index, MARCH_1 + 2*DAY, MARCH_1 + 3*DAY),
+                         [MARCH_1 + 2*DAY + HOUR, MARCH_1 + 2*DAY + 2*HOUR, MARCH_1 + 2*DAY + 3*HOUR])
+        # Part of a bucket - the start time is inclusive and the end time exclusive
+        self.assertEqual(get_tweet_times(time_index, MARCH_1 + 2*HOUR, MARCH_1 + 3*HOUR), [MARCH_1 + 2*HOUR])
+        self.assertEqual(get_tweet_times(time_index, MARCH_1 + 5*DAY, None), [MARCH_1 + 5*DAY])
+
+        self.assertEqual(time_index.get_filenames(MARCH_1 + 2*DAY, MARCH_1 + 3*DAY),
+                         sorted([os.path.abspath(gzip_filename), os.path.abspath(filename)]))
+        self.assertEqual(time_index.get_filenames(None, MARCH_1), [os.path.abspath(old_filename)])
+        time_index.close()
+
+    def test_reindex_changed_file(self):
+        filename = self.write_tweet_file('charman.tweets', [MARCH_1 + HOUR])
+        time_index = TweetTimeIndex(self.index_filename, logger=self.logger)
+        time_index.add_file(filename)
+
+        # Appending a line changes the file's size
+        tweet_file = open(filename, 'ab')
+        tweet_file.write(json.dumps(make_tweet(MARCH_1 + 2*DAY)) + '\n')
+        tweet_file.close()
+
+        self.assertEqual(get_tweet_times(time_index, MARCH_1, None), [MARCH_1 + HOUR, MARCH_1 + 2*DAY])
+        self.assertEqual(time_index.get_bucket_counts(), [(MARCH_1, 1), (MARCH_1 + 2*DAY, 1)])
+        time_index.close()
+
+    def write_tweet_file(self, basename, times):
+        filename = os.path.join(self.temp_path, basename)
+        if filename.endswith('.gz'):
+            tweet_file = gzip.open(filename, 'wb')
+        else:
+            tweet_file = open(filename, 'wb')
+        for tweet_time in times:
+            tweet_file.write(json.dumps(make_tweet(tweet_time)) + '\n')
+        tweet_file.close()
+        return filename
+
+
+
+def make_tweet(tweet_time):
+    tweet_id = get_min_tweet_id_for_time(tweet_time) + 1
+    return {'id': tweet_id, 'id_str': str(tweet_id), 'text': u'Tweet at %d' % tweet_time}
+
+
+def get_tweet_times(time_index, start_time, end_time):
+    return sorted([int(json.loads(line)['text'].split()[-1]) for line in time_index.iter_tweet_lines(start_time, end_time)])
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
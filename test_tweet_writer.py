@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import functools
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# Third party modules
+try:
+    import zstandard
+except ImportError:
+    # zstd compression is optional
+    zstandard = None
+
+# Local modules
+from tweet_filter import FilteredTweetReader
+from tweet_writer import *
+
+
+class TestTweetWriter(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.tweets = [{'id': tweet_id, 'id_str': str(tweet_id), 'text': u'caf\xe9 %d' % tweet_id,
+                        'user': {'screen_name': 'charman'}} for tweet_id in range(100)]
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_uncompressed_file_with_small_buffer(self):
+        json_filename = os.path.join(self.temp_path, 'charman.tweets')
+        writer = TweetWriter(json_filename, buffer_size=64)
+        writer.write_tweets(self.tweets)
+        writer.close()
+        self.assertEqual(read_tweet_ids(json_filename), range(100))
+
+    def test_gzip_file(self):
+        json_filename = os.path.join(self.temp_path, 'charman.tweets.gz')
+        writer = TweetWriter(json_filename, compression='gzip', compression_level=9)
+        writer.write_tweets(self.tweets)
+        writer.close()
+        self.assertEqual(read_tweet_ids(json_filename), range(100))
+
+        # FilteredTweetReader decompresses files transparently
+        filtered_reader = FilteredTweetReader()
+        filtered_reader.open(json_filename)
+        self.assertEqual(len(list(filtered_reader)), 100)
+        filtered_reader.close()
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zstd_file(self):
+        json_filename = os.path.join(self.temp_path, 'charman.tweets.zst')
+        writer = TweetWriter(json_filename, compression='zstd', compression_level=3)
+        writer.write_tweets(self.tweets)
+        writer.close()
+        self.assertEqual(open(json_filename, 'rb').read(4), '\x28\xb5\x2f\xfd')
+        self.assertEqual(read_tweet_ids(json_filename), range(100))
+
+        filtered_reader = FilteredTweetReader()
+        filtered_reader.open(json_filename)
+        self.assertEqual(len(list(filtered_reader)), 100)
+        filtered_reader.close()
+
+        # Byte ranges are offsets in the uncompressed file
+        uncompressed_file = open_compressed_file(json_filename, 'rb', 'zstd')
+        uncompressed_bytes = uncompressed_file.read()
+        uncompressed_file.close()
+        line_length = uncompressed_bytes.index('\n') + 1
+        self.assertEqual(list(read_byte_ranges(json_filename, [(line_length, line_length)])),
+                         [uncompressed_bytes[line_length:2*line_length]])
+
+    def test_unknown_encoder(self):
+        self.assertRaises(ValueError, get_json_encoder, 'marshal')
+
+
+class TestBackgroundTweetWriter(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_save_tweets(self):
+        tweet_writer = BackgroundTweetWriter(compression='gzip', max_queued_files=2)
+        for file_number in range(10):
+            tweets = [{'id': file_number * 10 + tweet_id} for tweet_id in range(10)]
+            tweet_writer.save_tweets(tweets, os.path.join(self.temp_path, '%d.tweets' % file_number))
+        tweet_writer.close()
+
+        for file_number in range(10):
+            json_filename = os.path.join(self.temp_path, '%d.tweets.gz' % file_number)
+            self.assertEqual(read_tweet_ids(json_filename), range(file_number * 10, file_number * 10 + 10))
+
+    def test_background_exception_is_reraised(self):
+        tweet_writer = BackgroundTweetWriter()
+        tweet_writer.save_tweets([{'id': 1}], os.path.join(self.temp_path, 'no_such_directory', 'x.tweets'))
+        self.assertRaises(IOError, tweet_writer.close)
+
+    def test_on_saved_is_only_called_for_written_files(self):
+        tweet_writer = BackgroundTweetWriter()
+        saved_filenames = []
+        for filename in ['first.tweets', os.path.join('no_such_directory', 'second.tweets')]:
+            tweet_writer.save_tweets([{'id': 1}], os.path.join(self.temp_path, filename),
+                                     on_saved=functools.partial(saved_filenames.append, filename))
+        # Files written before the failure are still reported by close()
+        self.assertRaises(IOError, tweet_writer.close)
+        self.assertEqual(saved_filenames, ['first.tweets'])
+
+    def test_flush_waits_for_queued_tweets(self):
+        tweet_writer = BackgroundTweetWriter()
+        json_filename = os.path.join(self.temp_path, 'charman.tweets')
+        tweet_writer.save_tweets([{'id': 1}, {'id': 2}], json_filename)
+        tweet_writer.flush()
+        self.assertEqual(read_tweet_ids(json_filename), [1, 2])
+        tweet_writer.close()
+
+
+
+def read_tweet_ids(json_filename):
+    tweet_file = open_tweet_file(json_filename)
+    tweet_ids = [json.loads(line)['id'] for line in tweet_file]
+    tweet_file.close()
+    return tweet_ids
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+# Third party modules
+from twython import Twython
+
+# Local modules
+from crawler_metrics import MetricsRegistry
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+import twitter_crawler
+from twitter_crawler import *
+
+
+class FakeClock:
+    """
+    Replaces the time module used by twitter_crawler, so that sleeps
+    return immediately and advance the clock
+    """
+    def __init__(self):
+        self.now = 1400000000.0
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def time(self):
+        return self.now
+
+
+class FakeTwython:
+    """
+    Serves empty timelines with Twitter's rate limits, using a
+    FakeClock.  Rate limit windows start with the first call.
+    """
+    def __init__(self, clock, calls_per_window, window_seconds=900):
+        self.clock = clock
+        self.call_times = []
+        self._calls_per_window = calls_per_window
+        self._window_seconds = window_seconds
+        self._window_ends = None
+        self._calls_remaining = None
+
+    def get(self, endpoint, params=None):
+        self._update_window()
+        if self._calls_remaining <= 0:
+            raise TwythonRateLimitError("Rate limit exceeded", 429)
+        self._calls_remaining -= 1
+        self.call_times.append(self.clock.now)
+        return []
+
+    def get_application_rate_limit_status(self, resources):
+        self._update_window()
+        return {'resources': {resources: {'/statuses/user_timeline': {'remaining': self._calls_remaining,
+                                                                      'reset': self._window_ends}}}}
+
+    def _update_window(self):
+        if self._window_ends is None or self.clock.now >= self._window_ends:
+            self._window_ends = self.clock.now + self._window_seconds
+            self._calls_remaining = self._calls_per_window
+
+
+
+class FakeTokenServer:
+    """
+    Replaces twitter_crawler._obtain_bearer_token(), returning the
+    tokens 'token1', 'token2', ...
+    """
+    def __init__(self):
+        self.tokens_obtained = 0
+
+    def obtain_bearer_token(self, consumer_key, consumer_secret):
+        self.tokens_obtained += 1
+        return 'token%d' % self.tokens_obtained
+
+
+
+class TestBearerTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.token_cache_filename = os.path.join(self.temp_path, 'trawler', 'bearer_tokens.json')
+        self.token_server = FakeTokenServer()
+        self.real_obtain_bearer_token = twitter_crawler._obtain_bearer_token
+        twitter_crawler._obtain_bearer_token = self.token_server.obtain_bearer_token
+
+    def tearDown(self):
+        twitter_crawler._obtain_bearer_token = self.real_obtain_bearer_token
+        shutil.rmtree(self.temp_path)
+
+    def get_cached_tokens(self):
+        return json.load(open(self.token_cache_filename))
+
+    def test_token_is_cached_and_reused(self):
+        twython = get_app_auth_twython('app_key', 'app_secret', self.token_cache_filename)
+        self.assertEqual(twython.access_token, 'token1')
+        self.assertEqual(self.get_cached_tokens(), {'app_key': 'token1'})
+        self.assertEqual(stat.S_IMODE(os.stat(self.token_cache_filename).st_mode), 0600)
+
+        # The next run reuses the token, and other consumer keys get their own tokens
+        self.assertEqual(get_app_auth_twython('app_key', 'app_secret', self.token_cache_filename).access_token, 'token1')
+        self.assertEqual(get_app_auth_twython('other_key', 'app_secret', self.token_cache_filename).access_token, 'token2')
+        self.assertEqual(self.token_server.tokens_obtained, 2)
+        self.assertEqual(self.get_cached_tokens(), {'app_key': 'token1', 'other_key': 'token2'})
+        self.assertEqual(stat.S_IMODE(os.stat(self.token_cache_filename).st_mode), 0600)
+
+        # Without a cache, a new token is always obtained
+        self.assertEqual(get_app_auth_twython('app_key', 'app_secret', None).access_token, 'token3')
+
+    def test_corrupt_cache_is_replaced(self):
+        for corrupt_contents in ['{"app_key": "tok', '["token"]']:
+            os.makedirs(os.path.dirname(self.token_cache_filename))
+            open(self.token_cache_filename, 'w').write(corrupt_contents)
+            twython = get_app_auth_twython('app_key', 'app_secret', self.token_cache_filename)
+            self.assertEqual(self.get_cached_tokens(), {'app_key': twython.access_token})
+            shutil.rmtree(os.path.dirname(self.token_cache_filename))
+        self.assertEqual(self.token_server.tokens_obtained, 2)
+
+    def test_unreadable_cache_is_ignored(self):
+        # A directory can be neither read nor replaced as a file
+        os.makedirs(self.token_cache_filename)
+        self.assertEqual(get_app_auth_twython('app_key', 'app_secret', self.token_cache_filename).access_token, 'token1')
+        self.assertEqual(get_app_auth_twython('app_key', 'app_secret', self.token_cache_filename).access_token, 'token2')
+        self.assertTrue(os.path.isdir(self.token_cache_filename))
+
+
+
+class TestRateLimitStatus(unittest.TestCase):
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.token_cache_filename = os.path.join(self.temp_path, 'bearer_tokens.json')
+        self.token_server = FakeTokenServer()
+        self.real_obtain_bearer_token = twitter_crawler._obtain_bearer_token
+        twitter_crawler._obtain_bearer_token = self.token_server.obtain_bearer_token
+        self.logger = logging.getLogger('test_twitter_crawler')
+        self.server = None
+        self.twython = None
+        # requests-oauthlib refuses to send OAuth 2 bearer tokens over plain HTTP unless told otherwise
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+    def tearDown(self):
+        if self.twython is not None:
+            self.twython.client.close()
+        if self.server is not None:
+            self.server.stop()
+        twitter_crawler._obtain_bearer_token = self.real_obtain_bearer_token
+        shutil.rmtree(self.temp_path)
+
+    def start_server(self, api):
+        self.api = api
+        self.server = MockTwitterServer(api)
+        self.server.start()
+
+    def get_app_auth_twython(self):
+        self.twython = get_app_auth_twython('app_key', 'app_secret', self.token_cache_filename)
+        self.twython.api_url = self.server.get_api_url()
+        return self.twython
+
+    def test_rate_limit_status_is_requested_by_first_call(self):
+        self.start_server(MockTwitterAPI(num_users=10, max_tweets_per_user=50))
+        endpoint = RateLimitedTwitterEndpoint(self.get_app_auth_twython(), 'statuses/user_timeline',
+                                              logger=self.logger, metrics=MetricsRegistry())
+        self.assertEqual(self.api.get_stats(), {})
+
+        endpoint.get_data(screen_name='user1')
+        endpoint.get_data(screen_name='user2')
+        self.assertEqual(self.api.get_stats(), {'application/rate_limit_status': {200: 1},
+                                                'statuses/user_timeline': {200: 2}})
+
+    def test_rejected_bearer_token_is_renewed(self):
+        self.start_server(MockTwitterAPI(num_users=10, max_tweets_per_user=50, bearer_token='token1'))
+        open(self.token_cache_filename, 'w').write(json.dumps({'app_key': 'stale_token', 'other_key': 'other_token'}))
+        endpoint = RateLimitedTwitterEndpoint(self.get_app_auth_twython(), 'statuses/user_timeline',
+                                              logger=self.logger, metrics=MetricsRegistry())
+        self.assertEqual(self.twython.access_token, 'stale_token')
+
+        endpoint.get_data(screen_name='user1')
+        self.assertEqual(self.twython.access_token, 'token1')
+        self.assertEqual(json.load(open(self.token_cache_filename)), {'app_key': 'token1', 'other_key': 'other_token'})
+        self.assertEqual(self.api.get_stats(), {'application/rate_limit_status': {200: 1, 401: 1},
+                                                'statuses/user_timeline': {200: 1}})
+
+    def test_auth_error_names_token_cache_file(self):
+        self.start_server(MockTwitterAPI(num_users=10, max_tweets_per_user=50, bearer_token='unobtainable_token'))
+        endpoint = RateLimitedTwitterEndpoint(self.get_app_auth_twython(), 'statuses/user_timeline',
+                                              logger=self.logger, metrics=MetricsRegistry())
+        try:
+            endpoint.get_data(screen_name='user1')
+            self.fail("TwythonAuthError not raised")
+        except TwythonAuthError as e:
+            self.assertTrue(self.token_cache_filename in str(e), str(e))
+            self.assertEqual(e.error_code, None)
+        # The token is renewed once, and no timelines are requested
+        self.assertEqual(self.token_server.tokens_obtained, 2)
+        self.assertEqual(self.api.get_stats(), {'application/rate_limit_status': {401: 2}})
+
+
+
+class TestHydrateTweets(unittest.TestCase):
+    def setUp(self):
+        self.api = MockTwitterAPI(num_users=10, max_tweets_per_user=200)
+        self.server = MockTwitterServer(self.api)
+        self.server.start()
+        # requests-oauthlib refuses to send OAuth 2 bearer tokens over plain HTTP unless told otherwise
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        self.twython = Twython('app_key', access_token='access_token')
+        self.twython.api_url = self.server.get_api_url()
+        self.hydrator = HydrateTweets(self.twython, logging.getLogger('test_twitter_crawler'), metrics=MetricsRegistry())
+        self.tweet_ids = get_mock_tweet_ids(self.twython, ['user%d' % user_index for user_index in range(10)])
+
+    def tearDown(self):
+        self.twython.client.close()
+        self.server.stop()
+
+    def test_get_tweets_for_ids(self):
+        # The mock server has no Tweets from users with an index of 100 or more
+        missing_ids = [tweet_id + 100 for tweet_id in self.tweet_ids[:40]]
+        tweet_ids = [tweet_id for id_pair in zip(self.tweet_ids[40:80], missing_ids) for tweet_id in id_pair]
+        tweets, returned_missing_ids = self.hydrator.get_tweets_for_ids(tweet_ids)
+        self.assertEqual([tweet['id'] for tweet in tweets], self.tweet_ids[40:80])
+        self.assertEqual(returned_missing_ids, missing_ids)
+
+        self.assertRaises(ValueError, self.hydrator.get_tweets_for_ids, self.tweet_ids[:101])
+
+    def test_ids_are_looked_up_in_batches_of_100(self):
+        tweet_ids = self.tweet_ids[:230] + [1]
+        batches = list(self.hydrator.hydrate_tweet_ids(iter(tweet_ids)))
+        self.assertEqual([len(tweets) + len(missing_ids) for tweets, missing_ids in batches], [100, 100, 31])
+        self.assertEqual([tweet['id'] for tweets, missing_ids in batches for tweet in tweets], self.tweet_ids[:230])
+        self.assertEqual(batches[-1][1], [1])
+        self.assertEqual(self.api.get_stats()['statuses/lookup'], {200: 3})
+
+
+
+class TestPacing(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.real_time_module = twitter_crawler.time
+        twitter_crawler.time = self.clock
+        self.twython = FakeTwython(self.clock, calls_per_window=90)
+        self.endpoint = RateLimitedTwitterEndpoint(self.twython, 'statuses/user_timeline',
+                                                   logger=logging.getLogger('test_twitter_crawler'),
+                                                   metrics=MetricsRegistry(), pacing=True)
+
+    def tearDown(self):
+        twitter_crawler.time = self.real_time_module
+
+    def test_burst_then_steady_rate(self):
+        burst_size = RateLimitedTwitterEndpoint.PACING_BURST_SIZE
+        start_time = self.clock.now
+        for i in range(90):
+            self.endpoint.get_data(screen_name='charman')
+        call_times = self.twython.call_times
+
+        # The first calls are made back-to-back...
+        self.assertEqual(call_times[:burst_size], [start_time] * burst_size)
+        # ...and the rest are spread evenly over the rest of the window (900 seconds / 90 calls)
+        gaps = [later - earlier for earlier, later in zip(call_times[burst_size:], call_times[burst_size+1:])]
+        for gap in gaps:
+            self.assertTrue(9.5 < gap < 11.0, gap)
+        # The last call is made as the window ends
+        self.assertAlmostEqual(call_times[-1], start_time + 900, places=3)
+        self.assertEqual(self.endpoint.get_seconds_slept(), sum(self.clock.sleeps))
+
+    def test_new_window_allows_a_new_burst(self):
+        for i in range(90):
+            self.endpoint.get_data(screen_name='charman')
+        first_window_ends = self.twython.call_times[0] + 900
+
+        for i in range(10):
+            self.endpoint.get_data(screen_name='charman')
+        call_times = self.twython.call_times[90:]
+
+        # The crawler sleeps until the window (plus padding) has ended, and the tokens saved
+        # up while sleeping allow a burst, capped at PACING_BURST_SIZE calls
+        burst_size = RateLimitedTwitterEndpoint.PACING_BURST_SIZE
+        self.assertEqual(call_times[0], first_window_ends + RateLimitedTwitterEndpoint.RATE_LIMIT_PADDING_SECONDS)
+        self.assertEqual(call_times[:burst_size], [call_times[0]] * burst_size)
+        self.assertTrue(call_times[burst_size] > call_times[0] + 9)
+
+    def test_pacing_is_off_by_default(self):
+        endpoint = RateLimitedTwitterEndpoint(FakeTwython(self.clock, calls_per_window=90), 'statuses/user_timeline',
+                                              logger=logging.getLogger('test_twitter_crawler'), metrics=MetricsRegistry())
+        for i in range(90):
+            endpoint.get_data(screen_name='charman')
+        self.assertEqual(self.clock.sleeps, [])
+
+
+
+def get_mock_tweet_ids(twython, screen_names):
+    """
+    Returns the IDs of the (up to 200) most recent Tweets of each of
+    the mock server's users in screen_names
+    """
+    tweet_ids = []
+    for screen_name in screen_names:
+        tweet_ids += [tweet['id'] for tweet in twython.get('statuses/user_timeline',
+                                                           params={'screen_name': screen_name, 'count': 200})]
+    return tweet_ids
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
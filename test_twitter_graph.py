@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import os
+import shutil
+import tempfile
+import unittest
+
+# Local modules
+from twitter_graph import *
+
+
+class TestFriendFollowerGraph(unittest.TestCase):
+    def setUp(self):
+        # User 1 follows 2, 3 and 4.  Users 2 and 3 follow 1 back, user 5 follows 1.
+        self.graph = FriendFollowerGraph()
+        self.graph.add_user(1, [2, 3, 4], [2, 3, 5], screen_name=u'charman')
+
+    def test_friends_and_followers(self):
+        self.assertEqual(list(self.graph.get_friend_ids(1)), [2, 3, 4])
+        self.assertEqual(list(self.graph.get_follower_ids(1)), [2, 3, 5])
+        self.assertEqual(list(self.graph.get_follower_ids(4)), [1])
+        self.assertEqual(list(self.graph.get_friend_ids(99)), [])
+
+    def test_reciprocal_ids(self):
+        self.assertEqual(list(self.graph.get_reciprocal_ids(1)), [2, 3])
+
+    def test_large_user_ids(self):
+        big_id = 2**62 + 7
+        self.graph.add_user(big_id, [1], [1])
+        self.assertEqual(list(self.graph.get_reciprocal_ids(big_id)), [1])
+        self.assertEqual(list(self.graph.get_follower_ids(1)), [2, 3, 5, big_id])
+
+    def test_duplicate_edges_are_merged(self):
+        self.graph.add_user(2, [1], [1])
+        self.assertEqual(self.graph.num_edges(), 6)
+
+    def test_crawled_users(self):
+        self.assertTrue(self.graph.has_user(1))
+        self.assertFalse(self.graph.has_user(2))
+        self.assertEqual(self.graph.get_user_id(u'CHarman'), 1)
+        self.assertEqual(self.graph.get_user_id(u'PHonyDoc'), None)
+
+    def test_overlap(self):
+        self.graph.add_user(6, [3, 4, 7], [])
+        self.assertEqual(list(self.graph.get_friend_overlap(1, 6)), [3, 4])
+        self.assertAlmostEqual(self.graph.get_friend_jaccard_similarity(1, 6), 2 / 4.0)
+        self.assertEqual(list(self.graph.get_follower_overlap(3, 4)), [1, 6])
+
+    def test_k_core(self):
+        # Add a reciprocal triangle 1-2-3, with 4 hanging off of 3
+        self.graph.add_user(2, [1, 3], [1, 3])
+        self.graph.add_user(3, [1, 2, 4], [1, 2, 4])
+        self.assertEqual(list(self.graph.get_reciprocal_k_core_ids(1)), [1, 2, 3, 4])
+        self.assertEqual(list(self.graph.get_reciprocal_k_core_ids(2)), [1, 2, 3])
+        self.assertEqual(list(self.graph.get_reciprocal_k_core_ids(3)), [])
+
+    def test_queries_see_buffered_edges(self):
+        self.graph.COMPACT_MIN_PENDING_EDGES = 10
+        self.graph.add_user(5, [1, 6], [])
+        # Edges are buffered until there are at least as many as in the CSR arrays
+        self.assertEqual(self.graph._pending_count, 8)
+        self.graph.add_user(6, [5], [5, 7])
+        self.assertEqual(list(self.graph.get_friend_ids(5)), [1, 6])
+        self.assertEqual(list(self.graph.get_follower_ids(5)), [6])
+        self.assertEqual(list(self.graph.get_reciprocal_ids(6)), [5])
+        self.assertEqual(self.graph.get_user_id(u'PHonyDoc'), None)
+        self.assertTrue(self.graph.has_user(6))
+
+        for user_id in range(10, 20):
+            self.graph.add_user(user_id, [1], [1])
+        # The buffered edges were merged into the CSR arrays
+        self.assertTrue(len(self.graph._out_indices) > 6)
+        self.assertEqual(list(self.graph.get_reciprocal_ids(1))[-3:], [17, 18, 19])
+        self.assertEqual(self.graph.num_users(), 17)
+
+    def test_save_and_load(self):
+        temp_path = tempfile.mkdtemp()
+        try:
+            graph_filename = os.path.join(temp_path, 'crawl.graph')
+            self.graph.save(graph_filename)
+
+            loaded_graph = FriendFollowerGraph()
+            loaded_graph.load(graph_filename)
+            loaded_graph.add_user(6, [1], [])
+            self.assertEqual(list(loaded_graph.get_reciprocal_ids(1)), [2, 3])
+            self.assertEqual(list(loaded_graph.get_follower_ids(1)), [2, 3, 5, 6])
+            self.assertEqual(loaded_graph.get_user_id(u'charman'), 1)
+        finally:
+            shutil.rmtree(temp_path)
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
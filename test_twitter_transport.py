@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""
+"""
+
+# Standard Library modules
+import logging
+import os
+import threading
+import unittest
+
+# Third party modules
+from twython import Twython
+
+# Local modules
+from crawler_metrics import MetricsRegistry
+from mock_twitter_server import MockTwitterAPI, MockTwitterServer
+from twitter_crawler import RateLimitedTwitterEndpoint
+from twitter_transport import *
+
+
+class TestTwitterTransport(unittest.TestCase):
+    def setUp(self):
+        # The mock server uses plain HTTP
+        os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+        self.api = MockTwitterAPI(num_users=10, max_tweets_per_user=200)
+        self.server = MockTwitterServer(self.api)
+        self.server.start()
+        self.twython = Twython('app_key', access_token='access_token')
+        self.twython.api_url = self.server.get_api_url()
+        self.logger = logging.getLogger('test_twitter_transport')
+        self.metrics = MetricsRegistry()
+
+    def tearDown(self):
+        self.twython.client.close()
+        self.server.stop()
+
+    def test_connections_are_reused(self):
+        transport = configure_twython_transport(self.twython, metrics=self.metrics)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'statuses/user_timeline', logger=self.logger,
+                                              metrics=self.metrics)
+        for user_index in range(10):
+            endpoint.get_data(screen_name='user%d' % user_index, count=200)
+
+        # One call to 'application/rate_limit_status', and one per user
+        stats = transport.get_stats()
+        self.assertEqual(stats['requests'], 11)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 10)
+        self.assertEqual(self.server.get_connection_count(), 1)
+        self.assertTrue('trawler_http_connections_opened_total 1' in self.metrics.render_prometheus_text())
+
+    def test_pool_is_shared_by_threads(self):
+        transport = configure_twython_transport(self.twython, pool_size=4, metrics=self.metrics)
+        endpoint = RateLimitedTwitterEndpoint(self.twython, 'statuses/user_timeline', logger=self.logger,
+                                              metrics=self.metrics)
+
+        def crawl(screen_name):
+            for i in range(10):
+                endpoint.get_data(screen_name=screen_name, count=10)
+        threads = [threading.Thread(target=crawl, args=('user%d' % user_index,)) for user_index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # No more connections than threads, and every connection returned to the pool is kept open
+        stats = transport.get_stats()
+        self.assertEqual(stats['requests'], 41)
+        self.assertTrue(stats['connections_opened'] <= 4)
+        self.assertEqual(self.server.get_connection_count(), stats['connections_opened'])
+
+    def test_responses_are_compressed(self):
+        transport = configure_twython_transport(self.twython, metrics=self.metrics)
+        tweets = self.twython.get_user_timeline(screen_name='user0', count=200)
+        self.assertTrue(len(tweets) > 0)
+        stats = transport.get_stats()
+        self.assertTrue(stats['bytes_received'] * 2 < stats['bytes_decoded'])
+
+        transport = configure_twython_transport(self.twython, compression=False, metrics=self.metrics)
+        self.assertEqual(self.twython.get_user_timeline(screen_name='user0', count=200), tweets)
+        stats = transport.get_stats()
+        self.assertEqual(stats['bytes_received'], stats['bytes_decoded'])
+
+
+
+if __name__ == '__main__':
+    unittest.main(buffer=True)
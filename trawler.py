@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""
+Single entry point for the trawler scripts:
+
+  trawler.py timelines    ...  - save_timelines_to_json.py
+  trawler.py 200          ...  - save_200_tweets_to_json.py
+  trawler.py ff           ...  - save_ff_timelines_to_json.py
+  trawler.py recent       ...  - save_recent_tweets_to_json.py
+  trawler.py hydrate      ...  - save_hydrated_tweets_to_json.py
+  trawler.py coordinator  ...  - crawl_coordinator.py
+  trawler.py worker       ...  - crawl_worker.py
+  trawler.py time-index   ...  - tweet_time_index.py
+  trawler.py search       ...  - tweet_inverted_index.py
+  trawler.py serve        ...  - tweet_query_server.py
+  trawler.py sample       ...  - tweet_sampler.py
+
+The remaining arguments are passed to the script, e.g.:
+
+  trawler.py recent --help
+
+Only the module for the selected command is imported, so short jobs
+do not pay for loading the dependencies of the other scripts.
+"""
+
+# Standard Library modules
+import importlib
+import sys
+
+
+# Command name -> (module name, description)
+COMMANDS = {
+    '200': ('save_200_tweets_to_json', "Save the 200 most recent Tweets of each user"),
+    'coordinator': ('crawl_coordinator', "Serve work units of users to crawl workers"),
+    'ff': ('save_ff_timelines_to_json', "Save the timelines of users and their friends and followers"),
+    'hydrate': ('save_hydrated_tweets_to_json', "Download the Tweets for lists of Tweet IDs"),
+    'recent': ('save_recent_tweets_to_json', "Save the Tweets posted since the last crawl of each user"),
+    'sample': ('tweet_sampler', "Write a random (optionally stratified) sample of the Tweets in files"),
+    'search': ('tweet_inverted_index', "Index the hashtags, mentions and words in Tweet files, and search them"),
+    'serve': ('tweet_query_server', "Serve queries over indexed Tweets as streams of JSON lines"),
+    'time-index': ('tweet_time_index', "Index Tweet files by time, and select the Tweets in a time range"),
+    'timelines': ('save_timelines_to_json', "Save the complete timelines of users"),
+    'worker': ('crawl_worker', "Save the complete timelines of users in work units from a coordinator"),
+}
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if not argv or argv[0] not in COMMANDS:
+        print_usage()
+        sys.exit(0 if argv and argv[0] in ['-h', '--help'] else 2)
+
+    command = argv[0]
+    module_name = COMMANDS[command][0]
+    module = importlib.import_module(module_name)
+
+    # argparse uses sys.argv[0] as the program name in usage messages
+    sys.argv[0] = "trawler.py %s" % command
+    module.main(argv[1:])
+
+
+def print_usage():
+    print "usage: trawler.py COMMAND [ARGS...]"
+    print
+    print "commands:"
+    for command in sorted(COMMANDS):
+        print "  %-12s %s" % (command, COMMANDS[command][1])
+    print
+    print "Run 'trawler.py COMMAND --help' for the arguments of each command."
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,649 @@
+#!/usr/bin/env python
+
+"""
+Parallel aggregation of JSON Tweet files, with mergeable aggregators
+and a cache of per-file results.
+
+Usage:
+  tweet_aggregation.py *.tweets > totals.json
+  tweet_aggregation.py --cache aggregates.cache --processes 8 *.tweets > totals.json
+  tweet_aggregation.py --cache aggregates.cache --per-file --top-k 10 *.tweets > per_user.json
+
+The output has one JSON object per line: with --per-file, one for
+each file, followed by one with the totals for every file.  Each
+object has the number of Tweets and retweets, the retweet ratio, the
+(estimated) number of distinct users and active days, the most common
+hashtags and languages and the number of Tweets posted in each hour
+of the day (UTC).
+
+With --cache, the results for each file are stored, and files whose
+size and modification time haven't changed since the last run are
+not read again.
+"""
+
+# Standard Library modules
+import argparse
+import calendar
+import copy
+import cPickle as pickle
+import hashlib
+import heapq
+import json
+import logging
+import math
+import multiprocessing
+import os
+import re
+import sqlite3
+import struct
+import time
+
+# Local modules
+from snowflake import get_time_for_tweet_id
+from tweet_filter import TweetFilterValidJSON
+from tweet_writer import open_tweet_file
+from twitter_crawler import get_console_info_logger
+
+
+# Number of hashtags and languages reported by the default aggregators
+DEFAULT_TOP_K = 20
+
+# Number of files aggregated between commits to the cache
+CACHE_COMMIT_INTERVAL = 100
+
+
+
+###  Functions  ###
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count Tweets, retweets, users, active days, hashtags and languages "
+                                     "in JSON Tweet files")
+    parser.add_argument('tweet_files', nargs='+', metavar='TWEET_FILE')
+    parser.add_argument('--cache', dest='cache_file',
+                        help="SQLite file of per-file results, so that unchanged files are only read once")
+    parser.add_argument('--processes', type=int,
+                        help="Number of worker processes (default: the number of CPUs)")
+    parser.add_argument('--top-k', dest='top_k', type=int, default=DEFAULT_TOP_K,
+                        help="Number of hashtags and languages to report (default: %(default)s)")
+    parser.add_argument('--per-file', dest='per_file', action='store_true',
+                        help="Also print the results for each file")
+    args = parser.parse_args(argv)
+
+    logger = get_console_info_logger()
+    aggregation = TweetAggregation(make_default_aggregators(args.top_k), cache_filename=args.cache_file,
+                                   processes=args.processes, logger=logger)
+    try:
+        partial_results = aggregation.aggregate_files(args.tweet_files)
+    finally:
+        aggregation.close()
+
+    if args.per_file:
+        for filename in args.tweet_files:
+            results = get_default_results(partial_results[filename])
+            results['file'] = filename
+            print json.dumps(results, sort_keys=True)
+    results = get_default_results(aggregation.merge(partial_results.values()))
+    results['files'] = len(partial_results)
+    print json.dumps(results, sort_keys=True)
+
+    stats = aggregation.get_stats()
+    logger.info("Aggregated %d files (%d read, %d from the cache)" %
+                (len(partial_results), stats['files_read'], stats['files_cached']))
+
+
+def get_default_results(aggregators):
+    """
+    Returns a dictionary with the results of the aggregators created
+    by make_default_aggregators(), and the retweet ratio
+    """
+    results = get_results(aggregators)
+    if results['tweets']:
+        results['retweet_ratio'] = float(results['retweets']) / results['tweets']
+    else:
+        results['retweet_ratio'] = None
+    return results
+
+
+def get_results(aggregators):
+    """
+    Returns a dictionary mapping the name of each aggregator in a
+    dictionary of aggregators to its result
+    """
+    return dict([(name, aggregator.get_result()) for name, aggregator in aggregators.items()])
+
+
+def make_default_aggregators(top_k=DEFAULT_TOP_K):
+    """
+    Returns a dictionary of aggregators for the number of Tweets and
+    retweets, distinct users and active days, the most common hashtags
+    and languages, and the number of Tweets posted in each hour of
+    the day
+    """
+    return {
+        'tweets': CountAggregator(),
+        'retweets': CountAggregator(is_retweet),
+        'users': HyperLogLogAggregator(get_screen_name),
+        'active_days': HyperLogLogAggregator(get_tweet_day),
+        'hashtags': TopKAggregator(get_hashtags, top_k),
+        'languages': TopKAggregator(get_language, top_k),
+        'hour_of_day': HistogramAggregator(get_tweet_hour),
+    }
+
+
+def get_hashtags(tweet):
+    """
+    Returns the lowercased hashtags of a Tweet
+    """
+    return [hashtag['text'].lower() for hashtag in tweet.get('entities', {}).get('hashtags', [])]
+
+
+def get_language(tweet):
+    """
+    Returns the language code that Twitter detected for a Tweet
+    ('und' if undetermined or missing)
+    """
+    return tweet.get('lang') or 'und'
+
+
+def get_screen_name(tweet):
+    """
+    Returns the lowercased screen name of the user who posted a Tweet
+    """
+    return tweet['user']['screen_name'].lower()
+
+
+def get_tweet_day(tweet):
+    """
+    Returns the UTC date ('YYYY-MM-DD') that a Tweet was posted on, or
+    None if the time is unknown
+    """
+    tweet_time = _get_tweet_time(tweet)
+    if tweet_time is None:
+        return None
+    return time.strftime('%Y-%m-%d', time.gmtime(tweet_time))
+
+
+def get_tweet_hour(tweet):
+    """
+    Returns the hour of the day (0-23, UTC) that a Tweet was posted
+    in, or None if the time is unknown
+    """
+    tweet_time = _get_tweet_time(tweet)
+    if tweet_time is None:
+        return None
+    return time.gmtime(tweet_time).tm_hour
+
+
+def is_retweet(tweet):
+    """
+    Returns True if a Tweet is a retweet, using the same rules as
+    TweetFilterNotARetweet
+    """
+    return 'retweeted_status' in tweet or re.match(r'\s*RT\b', tweet['text']) is not None
+
+
+def _aggregate_file(task):
+    """
+    Adds every Tweet in a JSON Tweet file to a copy of a dictionary
+    of aggregators, and returns the filename and the aggregators.
+    Runs in the worker processes of TweetAggregation.
+    """
+    filename, aggregators = task
+    aggregators = aggregators.items()
+    valid_json_filter = TweetFilterValidJSON(logging.getLogger('tweet_aggregation'))
+    tweet_file = open_tweet_file(filename)
+    for json_tweet_string in tweet_file:
+        tweet = valid_json_filter.parse(json_tweet_string)
+        if tweet is None:
+            continue
+        for name, aggregator in aggregators:
+            aggregator.add_tweet(tweet)
+    tweet_file.close()
+    return filename, dict(aggregators)
+
+
+def _get_tweet_time(tweet):
+    tweet_time = get_time_for_tweet_id(tweet['id'])
+    if tweet_time is None and tweet.get('created_at'):
+        # Tweets older than snowflake IDs
+        tweet_time = calendar.timegm(time.strptime(tweet['created_at'], '%a %b %d %H:%M:%S +0000 %Y'))
+    return tweet_time
+
+
+
+###  Classes  ###
+
+class TweetAggregation:
+    """
+    Aggregates JSON Tweet files (one JSON Tweet object per line,
+    optionally gzip or zstd compressed) in parallel.
+
+    aggregators is a dictionary mapping names to Aggregator instances
+    (see make_default_aggregators()).  Each file is read by one of
+    processes worker processes, which adds every valid Tweet in the
+    file to its own copy of the aggregators.  The per-file copies are
+    returned by aggregate_files() and can be combined with merge().
+    Because [screen_name].tweets files hold one user's timeline, the
+    per-file results of a crawl are per-user results.
+
+    If cache_filename is given, the per-file aggregators are stored in
+    an SQLite database, with the size and modification time of the
+    file.  Files that haven't changed since they were aggregated are
+    not read again, so re-aggregating after an incremental crawl only
+    reads the timelines that the crawl updated.  A file is only
+    reused for the same aggregators - the cache is keyed by each
+    aggregator's name and signature.
+
+    Aggregators are sent to the worker processes (and stored in the
+    cache) with pickle, so their value functions must be module level
+    functions, not lambdas or closures.
+
+    Usage:
+      aggregation = TweetAggregation(make_default_aggregators(), cache_filename='aggregates.cache')
+      partial_results = aggregation.aggregate_files(glob.glob('*.tweets'))
+      aggregation.close()
+      for filename, aggregators in partial_results.items():
+          do_something(filename, get_results(aggregators))
+      totals = get_results(aggregation.merge(partial_results.values()))
+    """
+    def __init__(self, aggregators, cache_filename=None, processes=None, logger=None):
+        """
+        processes -- the number of worker processes, defaulting to
+        the number of CPUs.  With one process, or a single file to
+        read, files are read in the calling process.
+        """
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        self._aggregators = aggregators
+        self._signature = json.dumps(sorted([[name, aggregator.get_signature()]
+                                             for name, aggregator in aggregators.items()]))
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self._processes = processes
+        self._files_read = 0
+        self._files_cached = 0
+
+        if cache_filename:
+            self._db = sqlite3.connect(cache_filename)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS partial_results (
+                                  filename TEXT NOT NULL,
+                                  signature TEXT NOT NULL,
+                                  size INTEGER NOT NULL,
+                                  mtime REAL NOT NULL,
+                                  aggregators BLOB NOT NULL,
+                                  PRIMARY KEY (filename, signature))""")
+            self._db.commit()
+        else:
+            self._db = None
+
+    def aggregate_files(self, filenames):
+        """
+        Returns a dictionary mapping each filename to a dictionary of
+        aggregators holding the Tweets in that file
+        """
+        partial_results = {}
+        # Absolute path -> (size, mtime) of the files that need to be read
+        file_stats = {}
+        for filename in filenames:
+            path = os.path.abspath(filename)
+            file_stat = os.stat(path)
+            aggregators = self._get_cached_aggregators(path, file_stat)
+            if aggregators is None:
+                file_stats[path] = (file_stat.st_size, file_stat.st_mtime)
+            else:
+                self._files_cached += 1
+                partial_results[filename] = aggregators
+
+        if file_stats:
+            self._logger.info("Aggregating %d files" % len(file_stats))
+            # Files that were given twice, or by relative and absolute paths, are only read once
+            aggregators_by_path = {}
+            for path, aggregators in self._iter_aggregate_files(sorted(file_stats)):
+                aggregators_by_path[path] = aggregators
+                self._files_read += 1
+                if self._db is not None:
+                    self._put_cached_aggregators(path, file_stats[path], aggregators)
+                    if self._files_read % CACHE_COMMIT_INTERVAL == 0:
+                        self._db.commit()
+            if self._db is not None:
+                self._db.commit()
+            for filename in filenames:
+                if filename not in partial_results:
+                    partial_results[filename] = aggregators_by_path[os.path.abspath(filename)]
+        return partial_results
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of files read
+        ('files_read') and found in the cache ('files_cached')
+        """
+        return {'files_read': self._files_read, 'files_cached': self._files_cached}
+
+    def merge(self, partial_results):
+        """
+        Returns a new dictionary of aggregators, holding the Tweets of
+        every dictionary of aggregators in partial_results
+        """
+        merged_aggregators = copy.deepcopy(self._aggregators)
+        for aggregators in partial_results:
+            for name, aggregator in merged_aggregators.items():
+                aggregator.merge(aggregators[name])
+        return merged_aggregators
+
+    def _get_cached_aggregators(self, path, file_stat):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT size, mtime, aggregators FROM partial_results WHERE filename=? AND signature=?",
+                               (path, self._signature)).fetchone()
+        if row is None or row[0] != file_stat.st_size or row[1] != file_stat.st_mtime:
+            return None
+        try:
+            return pickle.loads(str(row[2]))
+        except Exception:
+            # Results pickled by an incompatible version of this module are recomputed
+            return None
+
+    def _iter_aggregate_files(self, paths):
+        tasks = [(path, self._aggregators) for path in paths]
+        if self._processes <= 1 or len(tasks) == 1:
+            for path, aggregators in tasks:
+                # Worker processes get copies of the aggregators when the tasks are pickled
+                yield _aggregate_file((path, copy.deepcopy(aggregators)))
+            return
+
+        pool = multiprocessing.Pool(min(self._processes, len(tasks)))
+        try:
+            # Files differ a lot in size, so they are handed out one at a time
+            for result in pool.imap_unordered(_aggregate_file, tasks, chunksize=1):
+                yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _put_cached_aggregators(self, path, file_stat, aggregators):
+        size, mtime = file_stat
+        self._db.execute("INSERT OR REPLACE INTO partial_results (filename, signature, size, mtime, aggregators) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (path, self._signature, size, mtime,
+                          sqlite3.Binary(pickle.dumps(aggregators, pickle.HIGHEST_PROTOCOL))))
+
+
+class Aggregator:
+    """
+    Base class for mergeable aggregators.
+
+    value_function maps a parsed Tweet to the value that is added to
+    the aggregator, to a list of values (e.g. a Tweet's hashtags), or
+    to None to skip the Tweet.  Two aggregators of the same kind can
+    be merged, so that files can be aggregated separately (and in
+    parallel) and combined afterwards.
+
+    get_signature() describes the aggregator's settings, and is used
+    by TweetAggregation to check that cached results were computed by
+    the same aggregators.
+    """
+    def __init__(self, value_function=None):
+        self._value_function = value_function
+
+    def add(self, value):
+        raise NotImplementedError
+
+    def add_tweet(self, tweet):
+        value = self._value_function(tweet)
+        if value is None:
+            return
+        if isinstance(value, list):
+            for item in value:
+                self.add(item)
+        else:
+            self.add(value)
+
+    def get_result(self):
+        raise NotImplementedError
+
+    def get_signature(self):
+        raise NotImplementedError
+
+    def merge(self, other):
+        """
+        Adds the values of another aggregator of the same kind and
+        with the same settings to this aggregator
+        """
+        raise NotImplementedError
+
+    def _get_function_name(self):
+        if self._value_function is None:
+            return ''
+        return self._value_function.__name__
+
+
+class CountAggregator(Aggregator):
+    """
+    Counts the Tweets for which value_function returns a true value,
+    or every Tweet if value_function is None
+    """
+    def __init__(self, value_function=None):
+        Aggregator.__init__(self, value_function)
+        self._count = 0
+
+    def add(self, value):
+        if value:
+            self._count += 1
+
+    def add_tweet(self, tweet):
+        if self._value_function is None or self._value_function(tweet):
+            self._count += 1
+
+    def get_result(self):
+        return self._count
+
+    def get_signature(self):
+        return 'count(%s)' % self._get_function_name()
+
+    def merge(self, other):
+        self._count += other._count
+
+
+class HistogramAggregator(Aggregator):
+    """
+    Counts the numeric values in each bucket of bucket_width, e.g.
+    the hour of the day that Tweets were posted in
+    """
+    def __init__(self, value_function, bucket_width=1):
+        Aggregator.__init__(self, value_function)
+        self._bucket_width = bucket_width
+        # bucket start -> count
+        self._counts = {}
+
+    def add(self, value):
+        bucket = int(math.floor(value / float(self._bucket_width))) * self._bucket_width
+        self._counts[bucket] = self._counts.get(bucket, 0) + 1
+
+    def get_result(self):
+        """
+        Returns a list of [bucket start, count] pairs, sorted by bucket
+        """
+        return [[bucket, count] for bucket, count in sorted(self._counts.items())]
+
+    def get_signature(self):
+        return 'histogram(%s,%s)' % (self._get_function_name(), self._bucket_width)
+
+    def merge(self, other):
+        for bucket, count in other._counts.items():
+            self._counts[bucket] = self._counts.get(bucket, 0) + count
+
+
+class HyperLogLogAggregator(Aggregator):
+    """
+    Estimates the number of distinct values (e.g. users or days) with
+    a HyperLogLog sketch (Flajolet et al., 2007) of 2**precision
+    registers.  The standard error of the estimate is about
+    1.04 / sqrt(2**precision) - 1.6% with the default precision - and
+    merging two sketches gives the sketch of the union of their values.
+
+    Small sets (like the active days of one user) are estimated with
+    linear counting, which is close to exact.  Until a quarter of the
+    registers are in use, only those registers are stored, so that the
+    per-file sketches in a TweetAggregation cache stay small.
+    """
+    def __init__(self, value_function, precision=12):
+        if not 4 <= precision <= 16:
+            raise ValueError("The precision must be between 4 and 16, not %d" % precision)
+        Aggregator.__init__(self, value_function)
+        self._precision = precision
+        self._register_count = 1 << precision
+        self._value_bits = 64 - precision
+        # register index -> rank, until the sketch is converted to a bytearray of every register
+        self._sparse_registers = {}
+        self._registers = None
+
+    def add(self, value):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        else:
+            value = str(value)
+        hash_value = struct.unpack('>Q', hashlib.sha1(value).digest()[:8])[0]
+        index = hash_value >> self._value_bits
+        # Position of the first 1 bit of the rest of the hash
+        rank = self._value_bits - (hash_value & ((1 << self._value_bits) - 1)).bit_length() + 1
+        self._set_register(index, rank)
+
+    def get_result(self):
+        """
+        Returns the estimated number of distinct values
+        """
+        register_count = self._register_count
+        if self._registers is None:
+            zero_count = register_count - len(self._sparse_registers)
+            harmonic_sum = zero_count + sum([2.0 ** -rank for rank in self._sparse_registers.values()])
+        else:
+            zero_count = self._registers.count(chr(0))
+            harmonic_sum = sum([2.0 ** -rank for rank in self._registers])
+
+        if register_count == 16:
+            alpha = 0.673
+        elif register_count == 32:
+            alpha = 0.697
+        elif register_count == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / register_count)
+        estimate = alpha * register_count * register_count / harmonic_sum
+        if estimate <= 2.5 * register_count and zero_count > 0:
+            estimate = register_count * math.log(float(register_count) / zero_count)
+        # 64 bit hashes don't need the large range correction of the 32 bit original
+        return int(round(estimate))
+
+    def get_signature(self):
+        return 'hyperloglog(%s,%d)' % (self._get_function_name(), self._precision)
+
+    def merge(self, other):
+        if other._precision != self._precision:
+            raise ValueError("Can't merge HyperLogLog sketches with precisions %d and %d" %
+                             (self._precision, other._precision))
+        if other._registers is None:
+            for index, rank in other._sparse_registers.items():
+                self._set_register(index, rank)
+        else:
+            if self._registers is None:
+                self._make_dense()
+            self._registers = bytearray(map(max, self._registers, other._registers))
+
+    def _make_dense(self):
+        self._registers = bytearray(self._register_count)
+        for index, rank in self._sparse_registers.items():
+            self._registers[index] = rank
+        self._sparse_registers = {}
+
+    def _set_register(self, index, rank):
+        if self._registers is None:
+            if rank > self._sparse_registers.get(index, 0):
+                self._sparse_registers[index] = rank
+                if len(self._sparse_registers) > self._register_count / 4:
+                    self._make_dense()
+        elif rank > self._registers[index]:
+            self._registers[index] = rank
+
+
+class TopKAggregator(Aggregator):
+    """
+    Finds the k most common values (e.g. hashtags) with the
+    Space-Saving algorithm (Metwally et al., 2005), which keeps counts
+    for at most capacity values (10 * k by default).
+
+    While there are no more than capacity distinct values, the counts
+    are exact.  After that, a new value replaces the value with the
+    smallest count and inherits its count, so counts can be
+    overestimated - by no more than the total count divided by
+    capacity - but a value that is more common than that is never
+    dropped.  Merged sketches give each value missing from one sketch
+    that sketch's smallest count (Agarwal et al., 2012), keeping the
+    same guarantee for the union of the values.
+    """
+    def __init__(self, value_function, k, capacity=None):
+        if k < 1:
+            raise ValueError("k must be at least 1, not %d" % k)
+        Aggregator.__init__(self, value_function)
+        self._k = k
+        if capacity is None:
+            capacity = 10 * k
+        self._capacity = max(capacity, k)
+        # value -> count
+        self._counts = {}
+
+    def add(self, value):
+        count = self._counts.get(value)
+        if count is not None:
+            self._counts[value] = count + 1
+        elif len(self._counts) < self._capacity:
+            self._counts[value] = 1
+        else:
+            # Scanning for the minimum is slower than a stream-summary structure for very
+            # long streams, but files are small and are combined with merge()
+            min_value = min(self._counts, key=self._counts.get)
+            self._counts[value] = self._counts.pop(min_value) + 1
+
+    def get_result(self):
+        """
+        Returns a list of up to k [value, count] pairs, most common
+        first
+        """
+        return [[value, count] for value, count in self._get_top(self._k)]
+
+    def get_signature(self):
+        return 'top_k(%s,%d,%d)' % (self._get_function_name(), self._k, self._capacity)
+
+    def merge(self, other):
+        min_count = self._get_min_count()
+        other_min_count = other._get_min_count()
+        merged_counts = {}
+        for value in set(self._counts) | set(other._counts):
+            merged_counts[value] = self._counts.get(value, min_count) + other._counts.get(value, other_min_count)
+        self._counts = merged_counts
+        self._counts = dict(self._get_top(self._capacity))
+
+    def _get_min_count(self):
+        """
+        Returns the largest count that a value missing from the sketch
+        could have
+        """
+        if len(self._counts) < self._capacity:
+            return 0
+        return min(self._counts.values())
+
+    def _get_top(self, n):
+        # Ties are broken by value, so that results don't depend on the order values were added in
+        return heapq.nsmallest(n, self._counts.items(), key=lambda (value, count): (-count, value))
+
+
+if __name__ == "__main__":
+    main()
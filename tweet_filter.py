@@ -2,13 +2,19 @@
 """
 
 import codecs
+import collections
+import itertools
 import json
 import logging
 import re
 
-# Chromium Compact Language Detector
-#   https://pypi.python.org/pypi/chromium_compact_language_detector/ 
-import cld
+# NumPy and the local modules are only imported by the classes and
+# methods that use them, so that loading this module (e.g. for
+# TweetFilterValidJSON) stays cheap
+
+
+# A block size that amortizes per-call overhead without holding many Tweets in memory
+DEFAULT_BLOCK_SIZE = 4096
 
 
 class FilteredTweetReader:
@@ -22,15 +28,47 @@ class FilteredTweetReader:
       filtered_reader.open('tweet_filename')
       for json_tweet_string in filtered_reader:
           do_something(json_tweet_string)
+
+    If lookahead is greater than zero, the reader reads up to that
+    many Tweets ahead of the Tweet being filtered, and passes each
+    Tweet read ahead to the prefetch() method of every filter that
+    supports prefetching (such as TweetFilterTimelineDownloadable), so
+    that slow filters can start work on upcoming Tweets in the
+    background.  Filters before the first prefetching filter are
+    applied as Tweets are read ahead, so Tweets they reject are never
+    prefetched.  Tweets are returned in the same order, and pass or
+    fail the same filters, with or without lookahead.
+
+    If block_size is greater than zero, the reader reads blocks of up
+    to block_size Tweets, parses each Tweet once, and passes each
+    block to the filter_block() method of each filter in turn, so that
+    filters can work on whole blocks (e.g. with NumPy arrays) instead
+    of being called once per Tweet.  Each filter only sees the Tweets
+    that passed the filters before it.  Prefetching filters are sent
+    every Tweet of a block that reaches them before filtering it, so
+    lookahead is ignored when block_size is set.  Tweets are returned
+    in the same order, and pass or fail the same filters, with or
+    without blocks.
+
+    Reading, parsing (by TweetFilterValidJSON) and filtering are
+    recorded as the 'read', 'parse' and 'filter' stages of the
+    crawl_profiler default profiler, when it is running.
     """
     def __del__(self):
         if self._tweet_file:
             self._tweet_file.close()
 
-    def __init__(self, filters=[], logger=None):
+    def __init__(self, filters=[], logger=None, lookahead=0, block_size=0):
         # First filter is always a TweetFilterValidJSON instance
-        self._filters = [TweetFilterValidJSON(logger)] + filters
+        self._valid_json_filter = TweetFilterValidJSON(logger)
+        self._filters = [self._valid_json_filter] + filters
         self._tweet_file = None
+        self._lookahead = lookahead
+        self._lookahead_buffer = collections.deque()
+        self._block_size = block_size
+        self._block_buffer = collections.deque()
+        from crawl_profiler import get_default_profiler
+        self._profiler = get_default_profiler()
 
     def __iter__(self):
         return self
@@ -39,29 +77,144 @@ class FilteredTweetReader:
         self._filters.append(filter)
 
     def open(self, tweet_filename):
-        self._tweet_file = codecs.open(tweet_filename, 'r', 'utf-8')
+        # Files ending in '.gz' or '.zst' are decompressed on the fly
+        from tweet_writer import open_tweet_file
+        self._tweet_file = open_tweet_file(tweet_filename)
+
+    def open_file(self, tweet_file):
+        """
+        Reads Tweets from an already opened file-like object, such as
+        the reader returned by TweetSegmentStore.open().  The object
+        must support next() and close().
+        """
+        self._tweet_file = tweet_file
 
     def close(self):
         self._tweet_file.close()
 
     def next(self):
+         if self._block_size > 0:
+             return self._next_from_block()
+         if self._lookahead > 0:
+             return self._next_with_lookahead()
+
          while 1:
              # _tweet_file.__next__() will throw a StopIteration if EOF reached
-             json_tweet_string = self._tweet_file.next()
+             with self._profiler.span('read'):
+                 json_tweet_string = self._tweet_file.next()
 
              # Filters will stop being applied after the first filter fails
              for filter in self._filters:
-                 if not filter.filter(json_tweet_string):
+                 with self._profiler.span(self._get_filter_stage(filter)):
+                     passed = filter.filter(json_tweet_string)
+                 if not passed:
                      break
              # The else clause runs when no break occurs before the 'for' loop completes
              else:
                  return json_tweet_string
 
+    def _filter_next_block(self):
+        """
+        Reads the next block of Tweets, and adds the Tweets that pass
+        every filter to the block buffer.  Returns False at EOF.
+        """
+        json_tweet_strings = []
+        with self._profiler.span('read'):
+            while len(json_tweet_strings) < self._block_size:
+                try:
+                    json_tweet_strings.append(self._tweet_file.next())
+                except StopIteration:
+                    break
+        if not json_tweet_strings:
+            return False
+
+        # Each Tweet is parsed once, and the parsed Tweets are shared by the filters
+        with self._profiler.span('parse'):
+            tweets = [self._valid_json_filter.parse(json_tweet_string) for json_tweet_string in json_tweet_strings]
+        passed = [tweet is not None for tweet in tweets]
+        json_tweet_strings = list(itertools.compress(json_tweet_strings, passed))
+        tweets = list(itertools.compress(tweets, passed))
+
+        for filter in self._filters:
+            if filter is self._valid_json_filter:
+                continue
+            # Filters stop being applied once every Tweet in the block has been rejected
+            if not json_tweet_strings:
+                break
+            with self._profiler.span('filter'):
+                if filter.prefetches:
+                    for json_tweet_string in json_tweet_strings:
+                        filter.prefetch(json_tweet_string)
+                passed = filter.filter_block(json_tweet_strings, tweets)
+            json_tweet_strings = list(itertools.compress(json_tweet_strings, passed))
+            tweets = list(itertools.compress(tweets, passed))
+
+        self._block_buffer.extend(json_tweet_strings)
+        return True
+
+    def _get_filter_stage(self, filter):
+        if filter is self._valid_json_filter:
+            return 'parse'
+        return 'filter'
+
+    def _next_from_block(self):
+        while not self._block_buffer:
+            if not self._filter_next_block():
+                raise StopIteration
+        return self._block_buffer.popleft()
+
+    def _next_with_lookahead(self):
+        # Filters before the first prefetching filter are applied as Tweets are read ahead
+        first_prefetching_filter = len(self._filters)
+        for filter_index, filter in enumerate(self._filters):
+            if filter.prefetches:
+                first_prefetching_filter = filter_index
+                break
+        early_filters = self._filters[:first_prefetching_filter]
+        late_filters = self._filters[first_prefetching_filter:]
+
+        while 1:
+            self._fill_lookahead_buffer(early_filters, late_filters)
+            if not self._lookahead_buffer:
+                raise StopIteration
+            json_tweet_string = self._lookahead_buffer.popleft()
+            for filter in late_filters:
+                with self._profiler.span('filter'):
+                    passed = filter.filter(json_tweet_string)
+                if not passed:
+                    break
+            else:
+                return json_tweet_string
+
+    def _fill_lookahead_buffer(self, early_filters, late_filters):
+        while len(self._lookahead_buffer) < self._lookahead:
+            try:
+                with self._profiler.span('read'):
+                    json_tweet_string = self._tweet_file.next()
+            except StopIteration:
+                return
+            for filter in early_filters:
+                with self._profiler.span(self._get_filter_stage(filter)):
+                    passed = filter.filter(json_tweet_string)
+                if not passed:
+                    break
+            else:
+                for filter in late_filters:
+                    if filter.prefetches:
+                        filter.prefetch(json_tweet_string)
+                self._lookahead_buffer.append(json_tweet_string)
+
 
 class TweetFilter:
     """
     Base class for other TweetFilters
+
+    Filters that are slow to evaluate (e.g. because they make API
+    calls) can set prefetches to True and implement prefetch(), which
+    FilteredTweetReader calls for Tweets that will be filtered soon.
     """
+    prefetches = False
+
     def __init__(self, logger=None):
         if logger is None:
             # Log INFO and above to stderr
@@ -76,17 +229,47 @@ class TweetFilter:
     def filter(self, json_tweet_string):
         raise NotImplementedError
 
+    def filter_block(self, json_tweet_strings, tweets):
+        """
+        Filters a block of Tweets.  json_tweet_strings is a list of JSON
+        Tweet strings, and tweets is a list of the same Tweets parsed
+        into dictionaries, which must not be modified.  Returns a
+        sequence of booleans (e.g. a NumPy boolean array) that are True
+        for the Tweets that pass the filter.
+
+        By default, filter() is called for each Tweet.  Filters that
+        are cheap per Tweet override this method to work on the parsed
+        Tweets of the whole block at once.
+        """
+        return [self.filter(json_tweet_string) for json_tweet_string in json_tweet_strings]
+
+    def prefetch(self, json_tweet_string):
+        """
+        Starts any slow work needed to filter json_tweet_string, which
+        will be passed to filter() later
+        """
+        pass
+
 
 class TweetFilterReliablyEnglish(TweetFilter):
     """
     Returns true IFF Chromium Compact Language Detector claims that Tweet is English.
     """
+    def __init__(self, logger=None):
+        # Chromium Compact Language Detector
+        #   https://pypi.python.org/pypi/chromium_compact_language_detector/
+        # is only imported when this filter is used, so pipelines that don't
+        # detect languages don't pay for loading it (or need it installed)
+        import cld
+        self._cld = cld
+        TweetFilter.__init__(self, logger=logger)
+
     def filter(self, json_tweet_string):
         tweet = json.loads(json_tweet_string)
         # CLD expects a bytestring encoded as UTF-8, and not a unicode string
         tweet_text = codecs.encode(tweet['text'], 'utf-8')
         # Per the CLD docs, "isReliable is True if the top language is much better than 2nd best language."
-        topLanguageName, topLanguageCode, isReliable, textBytesFound, details = cld.detect(tweet_text)
+        topLanguageName, topLanguageCode, isReliable, textBytesFound, details = self._cld.detect(tweet_text)
         if topLanguageName == "ENGLISH" and isReliable:
             return True
         else:
@@ -101,6 +284,11 @@ class TweetFilterNoURLs(TweetFilter):
         else:
             return True
 
+    def filter_block(self, json_tweet_strings, tweets):
+        import numpy as np
+        texts = _get_tweet_texts(tweets)
+        return (np.char.find(texts, u'http://') < 0) & (np.char.find(texts, u'https://') < 0)
+
 
 class TweetFilterOneTweetPerScreenName(TweetFilter):
     def __init__(self, logger=None):
@@ -116,6 +304,20 @@ class TweetFilterOneTweetPerScreenName(TweetFilter):
         else:
             return False
 
+    def filter_block(self, json_tweet_strings, tweets):
+        import numpy as np
+        passed = np.zeros(len(tweets), dtype=bool)
+        if not tweets:
+            return passed
+        screen_names = np.array([tweet['user']['screen_name'] for tweet in tweets], dtype=np.unicode_)
+        # Only the first Tweet in the block from each screen name can pass
+        unique_screen_names, first_indices = np.unique(screen_names, return_index=True)
+        for screen_name, first_index in itertools.izip(unique_screen_names, first_indices):
+            if screen_name not in self._screen_name_set:
+                self._screen_name_set.add(unicode(screen_name))
+                passed[first_index] = True
+        return passed
+
 
 class TweetFilterFieldMatchesRegEx(TweetFilter):
     def __init__(self, tweet_field, regex, logger=None):
@@ -134,6 +336,10 @@ class TweetFilterFieldMatchesRegEx(TweetFilter):
         else:
             return False
 
+    def filter_block(self, json_tweet_strings, tweets):
+        regex = re.compile(self._regex)
+        return [regex.search(tweet[self._tweet_field]) is not None for tweet in tweets]
+
 
 class TweetFilterIDSet(TweetFilter):
     """
@@ -141,11 +347,14 @@ class TweetFilterIDSet(TweetFilter):
     """
     def __init__(self, logger=None):
         self._tweet_id_set = set()
+        # TweetIDSet copy of the IDs for filter_block(), made when first needed after the set changes
+        self._tweet_id_array = None
         TweetFilter.__init__(self, logger=logger)
 
     def add_tweet(self, json_tweet_string):
         tweet = json.loads(json_tweet_string)
         self._tweet_id_set.add(tweet['id'])
+        self._tweet_id_array = None
 
     def add_tweets(self, json_tweet_string_list):
         for json_tweet_string in json_tweet_string_list:
@@ -153,9 +362,23 @@ class TweetFilterIDSet(TweetFilter):
 
     def add_tweet_id(self, tweet_id):
         self._tweet_id_set.add(tweet_id)
+        self._tweet_id_array = None
 
     def add_tweet_ids(self, tweet_ids):
         self._tweet_id_set.update(tweet_ids)
+        self._tweet_id_array = None
+
+    def contains_block(self, tweets):
+        """
+        Returns a NumPy boolean array that is True for each parsed
+        Tweet whose ID (as an int or as an ID string) is in the set
+        """
+        if self._tweet_id_array is None:
+            from tweet_id_set import TweetIDSet
+            # IDs can be added as ints or as strings, but 'id_str' is always str('id')
+            self._tweet_id_array = TweetIDSet([int(tweet_id) for tweet_id in self._tweet_id_set
+                                               if isinstance(tweet_id, (int, long)) or tweet_id.isdigit()])
+        return self._tweet_id_array.contains(_get_tweet_ids(tweets))
 
     def filter(self, json_tweet_string):
         raise NotImplementedError
@@ -169,6 +392,9 @@ class TweetFilterTweetIDInSet(TweetFilterIDSet):
         tweet = json.loads(json_tweet_string)
         return (tweet['id'] in self._tweet_id_set) or (tweet['id_str'] in self._tweet_id_set)
 
+    def filter_block(self, json_tweet_strings, tweets):
+        return self.contains_block(tweets)
+
 
 class TweetFilterTweetIDNotInSet(TweetFilterIDSet):
     def filter(self, json_tweet_string):
@@ -178,6 +404,58 @@ class TweetFilterTweetIDNotInSet(TweetFilterIDSet):
         tweet = json.loads(json_tweet_string)
         return (tweet['id'] not in self._tweet_id_set) and (tweet['id_str'] not in self._tweet_id_set)
 
+    def filter_block(self, json_tweet_strings, tweets):
+        return ~self.contains_block(tweets)
+
+
+class TweetFilterTweetIDTimeRange(TweetFilter):
+    """
+    Returns True if a Tweet was posted in the time range [start_time,
+    end_time), where the times are in seconds since the UNIX epoch and
+    either can be None for an open-ended range.
+
+    The time a Tweet was posted is taken from its snowflake ID (see
+    snowflake.py), so the range check is an integer comparison instead
+    of a parse of the 'created_at' string.  Tweets with pre-snowflake
+    IDs (posted before November 2010) are treated as older than any
+    start_time.
+    """
+    def __init__(self, start_time=None, end_time=None, logger=None):
+        from snowflake import get_min_tweet_id_for_time
+        if start_time is None:
+            self._min_id = None
+        else:
+            self._min_id = get_min_tweet_id_for_time(start_time)
+        if end_time is None:
+            self._end_id = None
+        else:
+            self._end_id = get_min_tweet_id_for_time(end_time)
+        TweetFilter.__init__(self, logger=logger)
+
+    def filter(self, json_tweet_string):
+        tweet = json.loads(json_tweet_string)
+        return self.filter_tweet_id(tweet['id'])
+
+    def filter_block(self, json_tweet_strings, tweets):
+        import numpy as np
+        tweet_ids = _get_tweet_ids(tweets)
+        passed = np.ones(len(tweet_ids), dtype=bool)
+        if self._min_id is not None:
+            passed &= tweet_ids >= self._min_id
+        if self._end_id is not None:
+            passed &= tweet_ids < self._end_id
+        return passed
+
+    def filter_tweet_id(self, tweet_id):
+        """
+        Returns True if tweet_id is in the time range
+        """
+        if self._min_id is not None and tweet_id < self._min_id:
+            return False
+        if self._end_id is not None and tweet_id >= self._end_id:
+            return False
+        return True
+
 
 class TweetFilterNotARetweet(TweetFilter):
     def filter(self, json_tweet_string):
@@ -194,27 +472,55 @@ class TweetFilterNotARetweet(TweetFilter):
             return False
         else:
             return True
-        
+
+    def filter_block(self, json_tweet_strings, tweets):
+        import numpy as np
+        is_retweet = np.array(['retweeted_status' in tweet for tweet in tweets], dtype=bool)
+        # Only the few Tweets whose text starts with 'RT' need the regex
+        starts_with_rt = np.char.startswith(np.char.lstrip(_get_tweet_texts(tweets)), u'RT')
+        for index in np.flatnonzero(starts_with_rt & ~is_retweet):
+            if re.match(r'\s*RT\b', tweets[index]['text']):
+                is_retweet[index] = True
+        return ~is_retweet
+
 
 class TweetFilterValidJSON(TweetFilter):
     def filter(self, json_tweet_string):
         """
         Returns True if json_tweet_string is a parsable JSON Tweet object
         """
+        return self.parse(json_tweet_string) is not None
+
+    def parse(self, json_tweet_string):
+        """
+        Returns json_tweet_string parsed into a dictionary, or None if
+        it isn't a parsable JSON Tweet object
+        """
         try:
             tweet = json.loads(json_tweet_string)
         except ValueError:
 #            self._logger.warning("JSON Tweet object could not be parsed")
-            return False
+            return None
         else:
             if type(tweet) is dict:
                 for tweet_field in ['id', 'id_str', 'text', 'user']:
                     if tweet_field not in tweet:
 #                        self._logger.warning("JSON Tweet object did not have a '%s' field" % tweet_field)
-                        return False
+                        return None
                 if 'screen_name' not in tweet['user']:
-                    return False
-                return True
+                    return None
+                return tweet
             else:
 #                self._logger.warning("JSON Tweet object evalauted to a %s instead of a dict" % type(tweet))
-                return False
+                return None
+
+
+
+def _get_tweet_ids(tweets):
+    import numpy as np
+    return np.fromiter((tweet['id'] for tweet in tweets), dtype=np.int64, count=len(tweets))
+
+
+def _get_tweet_texts(tweets):
+    import numpy as np
+    return np.array([tweet['text'] for tweet in tweets], dtype=np.unicode_)
@@ -7,59 +7,165 @@ import logging
 import os
 import re
 import sys
+from multiprocessing.pool import ThreadPool
 
 # Third party modules
 from twython import TwythonError
 
 # Local modules
+from crawl_manifest import CrawlManifest
 from tweet_filter import TweetFilter
 from twitter_crawler import RateLimitedTwitterEndpoint, save_tweets_to_json_file
 
 
 class TweetFilterTimelineDownloadable(TweetFilter):
-    def __init__(self, twython, download_path, minimum_tweet_threshold, logger=None):
-        self._crawler = RateLimitedTwitterEndpoint(twython, "statuses/user_timeline", logger)
+    """
+    Passes Tweets from users who have at least minimum_tweet_threshold
+    Tweets in their timeline, and saves the (first 200) Tweets of each
+    such user to [download_path]/[screen_name].tweets.
+
+    The verdict for each user is cached in memory, so each user's
+    timeline is downloaded - or each user's Tweet file or manifest
+    entry is checked - at most once.
+
+    If prefetch_threads is greater than zero, timelines are downloaded
+    by a pool of background threads.  When the filter is used with a
+    FilteredTweetReader with lookahead, the reader calls prefetch() for
+    upcoming Tweets, so the timelines of upcoming users are downloaded
+    while earlier Tweets are being filtered.  All files and manifest
+    entries are still written by the thread calling filter(), in the
+    order the Tweets are filtered.  Call close() to stop the pool.
+    """
+    # Seconds to wait for a prefetched timeline.  Waiting with a timeout keeps
+    # the wait interruptible with Ctrl-C, and downloads can take up to 15
+    # minutes when the rate limit has been reached.
+    PREFETCH_TIMEOUT_SECONDS = 24 * 60 * 60
+
+    def __init__(self, twython, download_path, minimum_tweet_threshold, logger=None, manifest=None,
+                 prefetch_threads=0, response_cache=None):
+        """
+        manifest -- an optional crawl_manifest.CrawlManifest instance.
+        If specified, the manifest (instead of the presence and size
+        of [screen_name].tweets files) is used to decide which users
+        have already been scraped, and no empty files are created for
+        users whose timelines are not downloadable.
+
+        prefetch_threads -- number of background threads used to
+        download the timelines of users passed to prefetch().
+
+        response_cache -- an optional api_response_cache.ApiResponseCache
+        instance (see RateLimitedTwitterEndpoint).
+        """
+        self._crawler = RateLimitedTwitterEndpoint(twython, "statuses/user_timeline", logger,
+                                                   response_cache=response_cache)
         self._download_path = download_path
+        self._manifest = manifest
         self._minimum_tweet_threshold = minimum_tweet_threshold
         self._twython = twython
         TweetFilter.__init__(self, logger=logger)
 
+        # screen_name.lower() -> True or False
+        self._verdicts = {}
+
+        # screen_name.lower() -> multiprocessing.pool.AsyncResult for the user's timeline
+        self._pending_timelines = {}
+
+        if prefetch_threads > 0:
+            self._pool = ThreadPool(prefetch_threads)
+            self.prefetches = True
+        else:
+            self._pool = None
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
     def filter(self, json_tweet_string):
         tweet = json.loads(json_tweet_string)
         screen_name = tweet['user']['screen_name']
+        screen_name_key = screen_name.lower()
 
-        path_to_tweetfile = os.path.join(self._download_path, "%s.tweets" % screen_name)
+        if screen_name_key not in self._verdicts:
+            self._verdicts[screen_name_key] = self._get_verdict(screen_name)
+        return self._verdicts[screen_name_key]
+
+    def prefetch(self, json_tweet_string):
+        tweet = json.loads(json_tweet_string)
+        screen_name = tweet['user']['screen_name']
+        screen_name_key = screen_name.lower()
+
+        if screen_name_key in self._verdicts or screen_name_key in self._pending_timelines:
+            return
+        verdict = self._get_stored_verdict(screen_name)
+        if verdict is not None:
+            self._verdicts[screen_name_key] = verdict
+            return
+        self._pending_timelines[screen_name_key] = self._pool.apply_async(self._download_timeline, (screen_name,))
+
+    def _download_timeline(self, screen_name):
+        self._logger.info("Retrieving Tweets for user '%s'" % screen_name)
+        return self._crawler.get_data(screen_name=screen_name, count=200)
+
+    def _get_stored_verdict(self, screen_name):
+        """
+        Returns the verdict for a user who was scraped by an earlier
+        run (according to the manifest or the user's Tweet file), or
+        None if the user has not been scraped
+        """
+        if self._manifest is not None:
+            # If user is already in the manifest, don't try to rescrape their timeline
+            if self._manifest.has_user(screen_name):
+                return self._manifest.get_status(screen_name) == CrawlManifest.STATUS_CRAWLED
+            return None
 
         # If file already exists for user, don't try to rescrape their timeline
+        path_to_tweetfile = os.path.join(self._download_path, "%s.tweets" % screen_name)
         if os.path.exists(path_to_tweetfile):
             self._logger.info("Timeline file for '%s' already exists - will not rescrape" % screen_name)
-            if os.path.getsize(path_to_tweetfile) > 0:
-                return True
-            else:
-                return False
+            return os.path.getsize(path_to_tweetfile) > 0
+        return None
+
+    def _get_verdict(self, screen_name):
+        pending_timeline = self._pending_timelines.pop(screen_name.lower(), None)
+        if pending_timeline is None:
+            verdict = self._get_stored_verdict(screen_name)
+            if verdict is not None:
+                return verdict
 
+        path_to_tweetfile = os.path.join(self._download_path, "%s.tweets" % screen_name)
         try:
-            self._logger.info("Retrieving Tweets for user '%s'" % screen_name)
-            tweets = self._crawler.get_data(screen_name=screen_name, count=200)
+            if pending_timeline is not None:
+                # Re-raises any exception raised by the background thread
+                tweets = pending_timeline.get(self.PREFETCH_TIMEOUT_SECONDS)
+            else:
+                tweets = self._download_timeline(screen_name)
         except TwythonError as e:
             print "TwythonError: %s" % e
             if e.error_code == 404:
                 self._logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
-                open(path_to_tweetfile, "w").close()   # Create empty file
-                return False
             elif e.error_code == 401:
                 self._logger.warn("HTTP 401 error - Most likely, Twitter user '%s' no longer publicly accessible" % screen_name)
-                open(path_to_tweetfile, "w").close()   # Create empty file
-                return False
             else:
                 # Unhandled exception
                 raise e
+            if self._manifest is not None:
+                self._manifest.record_error(screen_name, e.error_code)
+            else:
+                open(path_to_tweetfile, "w").close()   # Create empty file
+            return False
         else:
             if len(tweets) < self._minimum_tweet_threshold:
                 self._logger.info("User '%s' has only %d Tweets, threshold is %d" % \
                                       (screen_name, len(tweets), self._minimum_tweet_threshold))
-                open(path_to_tweetfile, "w").close()   # Create empty file
+                if self._manifest is not None:
+                    self._manifest.record_tweets(screen_name, tweets, CrawlManifest.STATUS_TOO_FEW_TWEETS)
+                else:
+                    open(path_to_tweetfile, "w").close()   # Create empty file
                 return False
             else:
                 save_tweets_to_json_file(tweets, path_to_tweetfile)
+                if self._manifest is not None:
+                    self._manifest.record_tweets(screen_name, tweets)
                 return True
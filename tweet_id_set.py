@@ -0,0 +1,146 @@
+"""
+Compact sets of Tweet IDs, for deduplicating very large ID lists
+"""
+
+# Third party modules
+import numpy as np
+
+# Local modules
+from tweet_writer import open_tweet_file
+
+
+class TweetIDSet:
+    """
+    A set of 64-bit Tweet IDs that uses 8 bytes of memory per ID,
+    instead of the ~70 bytes per ID of a Python set of ints, so that
+    hundreds of millions of IDs fit in memory.
+
+    IDs are stored in a few sorted NumPy arrays ("runs") that don't
+    share any IDs.  Newly added IDs are collected in a small Python
+    set, and sorted into a new run once merge_threshold IDs have been
+    added, so adding IDs one at a time stays cheap.  Whenever the
+    newest run is at least as large as the run before it, the two runs
+    are merged in linear time.  The runs' sizes roughly double from
+    newest to oldest, so there are only O(log n) runs to search, and
+    each ID is merged O(log n) times while building a set of n IDs.
+
+    Usage:
+      tweet_id_set = TweetIDSet()
+      tweet_id_set.add_ids_from_file('hydrated.ids')
+      if tweet_id not in tweet_id_set:
+          tweet_id_set.add(tweet_id)
+    """
+    def __init__(self, tweet_ids=None, merge_threshold=2**16):
+        self._merge_threshold = merge_threshold
+        # Sorted arrays of IDs, oldest (and largest) first
+        self._runs = []
+        self._pending_ids = set()
+        if tweet_ids is not None:
+            self.update(tweet_ids)
+
+    def __contains__(self, tweet_id):
+        tweet_id = int(tweet_id)
+        if tweet_id in self._pending_ids:
+            return True
+        for run in self._runs:
+            index = np.searchsorted(run, tweet_id)
+            if index < len(run) and run[index] == tweet_id:
+                return True
+        return False
+
+    def __len__(self):
+        self._merge_pending_ids()
+        return sum([len(run) for run in self._runs])
+
+    def add(self, tweet_id):
+        self._pending_ids.add(int(tweet_id))
+        if len(self._pending_ids) >= self._merge_threshold:
+            self._merge_pending_ids()
+
+    def update(self, tweet_ids):
+        tweet_ids = np.asarray(tweet_ids, dtype=np.int64)
+        if len(tweet_ids) >= self._merge_threshold:
+            self._merge_pending_ids()
+            self._add_run(np.unique(tweet_ids))
+        else:
+            for tweet_id in tweet_ids:
+                self.add(tweet_id)
+
+    def contains(self, tweet_ids):
+        """
+        Returns a NumPy boolean array with one element per ID in
+        tweet_ids, which is True if the ID is in the set
+        """
+        self._merge_pending_ids()
+        tweet_ids = np.asarray(tweet_ids, dtype=np.int64)
+        found = np.zeros(len(tweet_ids), dtype=bool)
+        for run in self._runs:
+            found |= _run_contains(run, tweet_ids)
+        return found
+
+    def add_ids_from_file(self, id_filename, chunk_size=2**20):
+        """
+        Adds every ID in a (possibly compressed) text file containing
+        one Tweet ID per line.  Returns the number of IDs read.
+        """
+        id_count = 0
+        chunk = []
+        for tweet_id in iter_tweet_ids_from_file(id_filename):
+            chunk.append(tweet_id)
+            if len(chunk) >= chunk_size:
+                self.update(chunk)
+                id_count += len(chunk)
+                chunk = []
+        self.update(chunk)
+        return id_count + len(chunk)
+
+    def _add_run(self, sorted_ids):
+        """
+        Adds a sorted array of unique IDs as the newest run
+        """
+        # IDs already in the set are dropped, so that the runs stay disjoint
+        sorted_ids = sorted_ids[~self.contains(sorted_ids)]
+        while self._runs and len(self._runs[-1]) <= len(sorted_ids):
+            sorted_ids = _merge_runs(self._runs.pop(), sorted_ids)
+        if len(sorted_ids):
+            self._runs.append(sorted_ids)
+
+    def _merge_pending_ids(self):
+        if self._pending_ids:
+            pending_ids = np.fromiter(self._pending_ids, dtype=np.int64, count=len(self._pending_ids))
+            self._pending_ids = set()
+            pending_ids.sort()
+            self._add_run(pending_ids)
+
+
+
+def _merge_runs(run, other_run):
+    """
+    Returns the sorted union of two sorted arrays that share no IDs,
+    in time linear in their total length
+    """
+    if len(run) < len(other_run):
+        run, other_run = other_run, run
+    return np.insert(run, np.searchsorted(run, other_run), other_run)
+
+
+def _run_contains(run, tweet_ids):
+    indices = np.searchsorted(run, tweet_ids)
+    found = indices < len(run)
+    found[found] = run[indices[found]] == tweet_ids[found]
+    return found
+
+
+def iter_tweet_ids_from_file(id_filename):
+    """
+    Generates the Tweet IDs in a (possibly compressed) text file
+    containing one Tweet ID per line.  Blank lines are skipped.
+    """
+    id_file = open_tweet_file(id_filename)
+    try:
+        for line in id_file:
+            line = line.strip()
+            if line:
+                yield int(line)
+    finally:
+        id_file.close()
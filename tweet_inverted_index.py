@@ -0,0 +1,513 @@
+#!/usr/bin/env python
+
+"""
+Inverted index of the hashtags, @mentions, URL hosts and words in JSON
+Tweet files, for finding Tweets without reading every file.
+
+Usage:
+  tweet_inverted_index.py tweets.search --add *.tweets
+  tweet_inverted_index.py tweets.search --query '#python @charman' > matches.tweets
+  tweet_inverted_index.py tweets.search --query 'jhu OR hopkins -from:jhu' --count
+
+Queries are made of terms separated by spaces, which must all match.
+Groups of terms can be combined with OR, and a term starting with '-'
+must not match.  The indexed terms are:
+
+  #hashtag     - a hashtag
+  @screen_name - a user mentioned in the Tweet
+  from:name    - the screen name of the user who posted the Tweet
+  url:host     - the host of a URL in the Tweet (without 'www.')
+  word         - a word in the Tweet's text
+
+Terms are case insensitive.
+"""
+
+# Standard Library modules
+import argparse
+import bisect
+import codecs
+import json
+import os
+import re
+import sqlite3
+import sys
+import urlparse
+
+# Local modules
+from tweet_segment_store import TweetSegmentReader
+from tweet_writer import get_compression_for_filename, open_compressed_file, read_byte_ranges
+from twitter_crawler import get_console_info_logger
+
+
+ENTITY_RE = re.compile(r'[#@]\w+', re.UNICODE)
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+URL_RE = re.compile(r'https?://\S+', re.UNICODE)
+
+
+
+###  Functions  ###
+
+def main(argv=None):
+    # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
+    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+
+    parser = argparse.ArgumentParser(description="Index the hashtags, mentions, URLs and words in JSON Tweet files, "
+                                     "and find the Tweets that match a query")
+    parser.add_argument('index_file')
+    parser.add_argument('--add', dest='tweet_files', nargs='+', default=[], metavar='TWEET_FILE',
+                        help="Add (or reindex, if they have changed) JSON Tweet files")
+    parser.add_argument('--query', help="Print the Tweets matching a query, e.g. '#python @charman -from:jhu'")
+    parser.add_argument('--count', action='store_true', help="Print the number of Tweets matching the query instead")
+    parser.add_argument('--optimize', action='store_true',
+                        help="Merge each term's postings into one list, and drop the postings of reindexed Tweets")
+    args = parser.parse_args(argv)
+
+    logger = get_console_info_logger()
+    inverted_index = TweetInvertedIndex(args.index_file, logger=logger)
+
+    try:
+        if args.tweet_files:
+            inverted_index.add_files(args.tweet_files)
+        if args.optimize:
+            inverted_index.optimize()
+        if args.query:
+            query = args.query.decode('utf-8')
+            if args.count:
+                print len(inverted_index.search(query))
+            else:
+                for json_tweet_string in inverted_index.iter_tweet_lines(query):
+                    sys.stdout.write(json_tweet_string)
+    finally:
+        inverted_index.close()
+
+
+def decode_postings(data):
+    """
+    Returns the list of document IDs encoded by encode_postings()
+    """
+    doc_ids = []
+    doc_id = 0
+    delta = 0
+    shift = 0
+    for byte in bytearray(data):
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            doc_id += delta
+            doc_ids.append(doc_id)
+            delta = 0
+            shift = 0
+    return doc_ids
+
+
+def difference_postings(doc_ids, excluded_doc_ids):
+    """
+    Returns the sorted document IDs in doc_ids but not in excluded_doc_ids
+    """
+    excluded_doc_ids = set(excluded_doc_ids)
+    return [doc_id for doc_id in doc_ids if doc_id not in excluded_doc_ids]
+
+
+def encode_postings(doc_ids):
+    """
+    Encodes a sorted list of document IDs as the differences between
+    consecutive IDs, with each difference stored as a variable length
+    integer (7 bits per byte, with the high bit set on every byte but
+    the last).  Postings for a term are usually dense, so most
+    differences fit in one byte.
+    """
+    data = bytearray()
+    previous_doc_id = 0
+    for doc_id in doc_ids:
+        delta = doc_id - previous_doc_id
+        previous_doc_id = doc_id
+        while delta >= 0x80:
+            data.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return str(data)
+
+
+def get_tweet_terms(tweet):
+    """
+    Returns the set of index terms for a Tweet (see the module
+    docstring for the kinds of terms)
+    """
+    terms = set()
+    text = tweet.get('full_text') or tweet.get('text') or u''
+
+    if 'entities' in tweet:
+        entities = tweet['entities']
+        for hashtag in entities.get('hashtags', []):
+            terms.add(u'#' + hashtag['text'].lower())
+        for user_mention in entities.get('user_mentions', []):
+            terms.add(u'@' + user_mention['screen_name'].lower())
+        for url in entities.get('urls', []):
+            host = urlparse.urlparse(url.get('expanded_url') or url['url']).netloc.lower()
+            if host.startswith('www.'):
+                host = host[4:]
+            if host:
+                terms.add(u'url:' + host)
+    else:
+        for entity in ENTITY_RE.findall(text):
+            terms.add(entity.lower())
+
+    if 'user' in tweet and 'screen_name' in tweet['user']:
+        terms.add(u'from:' + tweet['user']['screen_name'].lower())
+
+    # Hashtags, mentions and URLs are only indexed as entities, not as words
+    text = ENTITY_RE.sub(u' ', URL_RE.sub(u' ', text))
+    for token in TOKEN_RE.findall(text.lower()):
+        terms.add(token)
+    return terms
+
+
+def intersect_postings(doc_ids_a, doc_ids_b):
+    """
+    Returns the sorted document IDs in both of two sorted lists.  The
+    IDs in the shorter list are looked up in the longer list with a
+    binary search that starts from the previous match, so intersecting
+    a rare term with a common term doesn't read the whole common list.
+    """
+    if len(doc_ids_a) > len(doc_ids_b):
+        doc_ids_a, doc_ids_b = doc_ids_b, doc_ids_a
+    intersection = []
+    position = 0
+    for doc_id in doc_ids_a:
+        position = bisect.bisect_left(doc_ids_b, doc_id, position)
+        if position == len(doc_ids_b):
+            break
+        if doc_ids_b[position] == doc_id:
+            intersection.append(doc_id)
+    return intersection
+
+
+def normalize_term(term):
+    return term.lower()
+
+
+def parse_query(query):
+    """
+    Parses a query into a list of (required terms, excluded terms)
+    tuples, one tuple for each group of terms separated by OR.
+    Raises ValueError if a group has no required terms.
+    """
+    groups = []
+    for group_query in re.split(r'\s+OR\s+', query.strip()):
+        required_terms = []
+        excluded_terms = []
+        for term in group_query.split():
+            if term.startswith('-') and len(term) > 1:
+                excluded_terms.append(normalize_term(term[1:]))
+            else:
+                required_terms.append(normalize_term(term))
+        if not required_terms:
+            raise ValueError("Query '%s' has a group of terms without any required terms" % query)
+        groups.append((required_terms, excluded_terms))
+    return groups
+
+
+def union_postings(doc_ids_a, doc_ids_b):
+    """
+    Returns the sorted document IDs in either of two sorted lists
+    """
+    return sorted(set(doc_ids_a).union(doc_ids_b))
+
+
+
+###  Classes  ###
+
+class TweetInvertedIndex:
+    """
+    An SQLite inverted index that maps terms (hashtags, @mentions,
+    screen names, URL hosts and words - see get_tweet_terms()) to the
+    Tweets that contain them, in JSON Tweet files (one JSON Tweet
+    object per line, optionally gzip or zstd compressed).
+
+    Each indexed Tweet is a "document" with an integer ID, and the
+    index stores the file, byte range (in the uncompressed file) and
+    Tweet ID of every document.  The postings list of each term - the
+    sorted IDs of the documents that contain it - is stored compressed
+    with encode_postings().
+
+    Indexing is incremental: add_file() skips files that haven't
+    changed since they were indexed, and each call to add_files()
+    appends one new postings "chunk" per term, for the new documents.
+    Changed files are reindexed as new documents, and the documents
+    of the old version are deleted; postings that point to deleted
+    documents are skipped by queries, and removed by optimize(), which
+    also merges each term's chunks into one.
+
+    Usage:
+      inverted_index = TweetInvertedIndex('tweets.search')
+      inverted_index.add_files(glob.glob('*.tweets'))
+      for json_tweet_string in inverted_index.iter_tweet_lines('#python -from:charman'):
+          do_something(json_tweet_string)
+      inverted_index.close()
+    """
+    def __init__(self, index_filename, batch_size=100000, logger=None):
+        """
+        batch_size -- the number of Tweets add_files() indexes in
+        memory before writing their postings to the database
+        """
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        self._batch_size = batch_size
+        self._pending_postings = {}
+        self._pending_document_count = 0
+
+        self._db = sqlite3.connect(index_filename)
+        self._db.text_factory = str
+        self._db.execute("""CREATE TABLE IF NOT EXISTS files (
+                              file_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              filename TEXT NOT NULL UNIQUE,
+                              size INTEGER NOT NULL,
+                              mtime REAL NOT NULL)""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS documents (
+                              doc_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              file_id INTEGER NOT NULL,
+                              offset INTEGER NOT NULL,
+                              length INTEGER NOT NULL,
+                              tweet_id INTEGER NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS documents_by_file ON documents (file_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS documents_by_tweet_id ON documents (tweet_id)")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS postings (
+                              term TEXT NOT NULL,
+                              first_doc_id INTEGER NOT NULL,
+                              doc_count INTEGER NOT NULL,
+                              data BLOB NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS postings_by_term ON postings (term, first_doc_id)")
+        self._db.commit()
+
+        # Document IDs are never reused (AUTOINCREMENT), so that postings for deleted documents can't match new documents
+        row = self._db.execute("SELECT seq FROM sqlite_sequence WHERE name='documents'").fetchone()
+        if row is None:
+            self._next_doc_id = 1
+        else:
+            self._next_doc_id = row[0] + 1
+
+    def add_file(self, filename):
+        """
+        Indexes a JSON Tweet file.  Returns False if the file is
+        already indexed and hasn't changed, and True otherwise.
+        """
+        indexed = self._index_file(filename)
+        self._write_pending_postings()
+        return indexed
+
+    def add_files(self, filenames):
+        """
+        Indexes a list of JSON Tweet files, skipping files that are
+        already indexed and haven't changed
+        """
+        indexed_count = 0
+        for filename in filenames:
+            if self._index_file(filename):
+                indexed_count += 1
+            if self._pending_document_count >= self._batch_size:
+                self._write_pending_postings()
+        self._write_pending_postings()
+        self._logger.info("Indexed %d of %d Tweet files" % (indexed_count, len(filenames)))
+
+    def get_doc_ids_for_tweet_ids(self, tweet_ids):
+        """
+        Returns the sorted list of IDs of the documents for a list of
+        Tweet IDs.  A Tweet that appears in several files has several
+        documents.
+        """
+        doc_ids = []
+        tweet_ids = [int(tweet_id) for tweet_id in tweet_ids]
+        # SQLite limits the number of parameters in a query
+        for start in range(0, len(tweet_ids), 500):
+            tweet_id_subset = tweet_ids[start:start+500]
+            doc_ids += [row[0] for row in self._db.execute("SELECT doc_id FROM documents WHERE tweet_id IN (%s)" %
+                                                           ','.join(['?'] * len(tweet_id_subset)), tweet_id_subset)]
+        return sorted(doc_ids)
+
+    def get_doc_ids_for_tweet_id_range(self, min_tweet_id=None, end_tweet_id=None):
+        """
+        Returns the sorted list of IDs of the documents for Tweets with
+        IDs in the range [min_tweet_id, end_tweet_id).  Since Tweet IDs
+        are snowflakes, this selects a time range (see snowflake.py).
+        """
+        conditions = ["1"]
+        params = ()
+        if min_tweet_id is not None:
+            conditions.append("tweet_id >= ?")
+            params += (min_tweet_id,)
+        if end_tweet_id is not None:
+            conditions.append("tweet_id < ?")
+            params += (end_tweet_id,)
+        return sorted([row[0] for row in self._db.execute("SELECT doc_id FROM documents WHERE %s" % " AND ".join(conditions),
+                                                          params)])
+
+    def get_document_count(self):
+        return self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def get_last_doc_id(self):
+        """
+        Returns the largest document ID ever assigned.  The ID changes
+        whenever files are added or reindexed, so it can be used to
+        invalidate cached query results, even when the files are added
+        by another process.
+        """
+        row = self._db.execute("SELECT seq FROM sqlite_sequence WHERE name='documents'").fetchone()
+        if row is None:
+            return 0
+        return row[0]
+
+    def get_postings(self, term):
+        """
+        Returns the sorted list of document IDs for a term, which can
+        include the IDs of deleted documents
+        """
+        doc_ids = []
+        for (data,) in self._db.execute("SELECT data FROM postings WHERE term=? ORDER BY first_doc_id",
+                                        (normalize_term(term).encode('utf-8'),)):
+            # Chunks are written in document ID order, so they can simply be concatenated
+            doc_ids += decode_postings(data)
+        return doc_ids
+
+    def search(self, query):
+        """
+        Returns the sorted list of IDs of the documents that match a
+        query (see the module docstring for the query syntax)
+        """
+        matching_doc_ids = []
+        for required_terms, excluded_terms in parse_query(query):
+            # Intersect the shortest postings lists first, so the intermediate results stay small
+            postings_lists = sorted([self.get_postings(term) for term in required_terms], key=len)
+            doc_ids = postings_lists[0]
+            for postings in postings_lists[1:]:
+                if not doc_ids:
+                    break
+                doc_ids = intersect_postings(doc_ids, postings)
+            for term in excluded_terms:
+                if not doc_ids:
+                    break
+                doc_ids = difference_postings(doc_ids, self.get_postings(term))
+            matching_doc_ids = union_postings(matching_doc_ids, doc_ids)
+        return [doc_id for doc_id, file_id, offset, length in self._get_documents(matching_doc_ids)]
+
+    def iter_tweet_lines(self, query):
+        """
+        Generates the JSON Tweet strings that match a query, file by
+        file, in the order they appear in each file
+        """
+        return self.iter_document_lines(self.search(query))
+
+    def iter_document_lines(self, doc_ids):
+        """
+        Generates the JSON Tweet strings for a list of document IDs,
+        file by file, in the order they appear in each file
+        """
+        documents = self._get_documents(doc_ids)
+        filenames = dict(self._db.execute("SELECT file_id, filename FROM files"))
+        documents.sort(key=lambda document: (filenames[document[1]], document[2]))
+
+        position = 0
+        while position < len(documents):
+            file_id = documents[position][1]
+            byte_ranges = []
+            while position < len(documents) and documents[position][1] == file_id:
+                byte_ranges.append((documents[position][2], documents[position][3]))
+                position += 1
+            for line_bytes in read_byte_ranges(filenames[file_id], byte_ranges):
+                yield line_bytes.decode('utf-8')
+
+    def open(self, query):
+        """
+        Returns a TweetSegmentReader for the Tweets that match a query,
+        which can be passed to FilteredTweetReader.open_file()
+        """
+        return TweetSegmentReader(self.iter_tweet_lines(query))
+
+    def optimize(self):
+        """
+        Rewrites the postings of every term as a single chunk, without
+        the IDs of deleted documents
+        """
+        doc_ids = set([row[0] for row in self._db.execute("SELECT doc_id FROM documents")])
+        terms = [row[0] for row in self._db.execute("SELECT DISTINCT term FROM postings")]
+        for term in terms:
+            term_doc_ids = [doc_id for doc_id in self.get_postings(term.decode('utf-8')) if doc_id in doc_ids]
+            self._db.execute("DELETE FROM postings WHERE term=?", (term,))
+            if term_doc_ids:
+                self._db.execute("INSERT INTO postings (term, first_doc_id, doc_count, data) VALUES (?, ?, ?, ?)",
+                                 (term, term_doc_ids[0], len(term_doc_ids), buffer(encode_postings(term_doc_ids))))
+        self._db.commit()
+        self._db.execute("VACUUM")
+        self._logger.info("Optimized the postings for %d terms" % len(terms))
+
+    def close(self):
+        self._write_pending_postings()
+        self._db.close()
+
+    def _get_documents(self, doc_ids):
+        """
+        Returns a list of (doc_id, file_id, offset, length) tuples for
+        the documents in doc_ids that haven't been deleted
+        """
+        documents = []
+        # SQLite limits the number of parameters in a query
+        for start in range(0, len(doc_ids), 500):
+            doc_id_subset = doc_ids[start:start+500]
+            documents += self._db.execute("SELECT doc_id, file_id, offset, length FROM documents WHERE doc_id IN (%s) "
+                                          "ORDER BY doc_id" % ','.join(['?'] * len(doc_id_subset)),
+                                          doc_id_subset).fetchall()
+        return documents
+
+    def _index_file(self, filename):
+        filename = os.path.abspath(filename)
+        file_stat = os.stat(filename)
+        row = self._db.execute("SELECT file_id, size, mtime FROM files WHERE filename=?", (filename,)).fetchone()
+        if row is not None:
+            file_id, size, mtime = row
+            if size == file_stat.st_size and mtime == file_stat.st_mtime:
+                return False
+            self._db.execute("DELETE FROM documents WHERE file_id=?", (file_id,))
+            self._db.execute("UPDATE files SET size=?, mtime=? WHERE file_id=?",
+                             (file_stat.st_size, file_stat.st_mtime, file_id))
+        else:
+            file_id = self._db.execute("INSERT INTO files (filename, size, mtime) VALUES (?, ?, ?)",
+                                       (filename, file_stat.st_size, file_stat.st_mtime)).lastrowid
+
+        documents = []
+        offset = 0
+        tweet_file = open_compressed_file(filename, 'rb', get_compression_for_filename(filename))
+        for line in tweet_file:
+            try:
+                tweet = json.loads(line)
+                tweet_id = int(tweet['id'])
+            except (ValueError, KeyError, TypeError):
+                if line.strip():
+                    self._logger.warning("Skipping unparsable line at byte %d of Tweet file '%s'" % (offset, filename))
+            else:
+                doc_id = self._next_doc_id
+                self._next_doc_id += 1
+                documents.append((doc_id, file_id, offset, len(line), tweet_id))
+                for term in get_tweet_terms(tweet):
+                    self._pending_postings.setdefault(term, []).append(doc_id)
+            offset += len(line)
+        tweet_file.close()
+
+        self._db.executemany("INSERT INTO documents (doc_id, file_id, offset, length, tweet_id) VALUES (?, ?, ?, ?, ?)",
+                             documents)
+        self._pending_document_count += len(documents)
+        return True
+
+    def _write_pending_postings(self):
+        self._db.executemany("INSERT INTO postings (term, first_doc_id, doc_count, data) VALUES (?, ?, ?, ?)",
+                             [(term.encode('utf-8'), doc_ids[0], len(doc_ids), buffer(encode_postings(doc_ids)))
+                              for term, doc_ids in self._pending_postings.iteritems()])
+        self._db.commit()
+        self._pending_postings = {}
+        self._pending_document_count = 0
+
+
+if __name__ == "__main__":
+    main()
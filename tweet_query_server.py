@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+"""
+Long-running HTTP service for querying crawled Tweets, so that
+lookups don't need a pass over every .tweets file.
+
+The service answers queries from a TweetInvertedIndex (see
+tweet_inverted_index.py), which is built once - and updated with
+--add as new crawl output arrives - instead of for every query:
+
+  tweet_query_server.py tweets.search --add *.tweets --port 8090
+
+  curl 'http://127.0.0.1:8090/tweets?user=charman&start=2015-03-01&filter=not_retweet'
+
+Results are streamed as JSON lines (one JSON Tweet object per line).
+The query parameters are:
+
+  q        - a tweet_inverted_index.py query, e.g. '#python -@jhu'
+  user     - screen name of the user who posted the Tweets (can be repeated)
+  ids      - comma separated list of Tweet IDs
+  start    - only Tweets posted at or after this UTC time (YYYY-MM-DD [HH:MM[:SS]])
+  end      - only Tweets posted before this UTC time
+  pattern  - regular expression the Tweet's text (or 'field') must match
+  field    - Tweet field matched by 'pattern' (default: text)
+  filter   - name of a TweetFilter the Tweets must pass (can be repeated):
+             not_retweet, no_urls, one_per_user, reliably_english, valid_json
+  limit    - maximum number of Tweets to return
+
+At least one of q, user, ids, start and end is required.  GET /stats
+returns the number of indexed Tweets and the result cache statistics.
+"""
+
+# Standard Library modules
+import argparse
+import BaseHTTPServer
+import collections
+import json
+import Queue
+import re
+import threading
+import time
+import urlparse
+
+# Local modules
+from crawler_metrics import get_default_registry
+from snowflake import get_min_tweet_id_for_time, parse_utc_time
+from tweet_filter import (TweetFilterFieldMatchesRegEx, TweetFilterNoURLs, TweetFilterNotARetweet,
+                          TweetFilterOneTweetPerScreenName, TweetFilterReliablyEnglish, TweetFilterValidJSON)
+from tweet_inverted_index import TweetInvertedIndex, intersect_postings, union_postings
+from twitter_crawler import get_console_info_logger
+
+
+# Names of the TweetFilters that can be passed with the 'filter' query parameter
+FILTERS = {
+    'no_urls': TweetFilterNoURLs,
+    'not_retweet': TweetFilterNotARetweet,
+    'one_per_user': TweetFilterOneTweetPerScreenName,
+    'reliably_english': TweetFilterReliablyEnglish,
+    'valid_json': TweetFilterValidJSON,
+}
+
+
+
+###  Functions  ###
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve queries over crawled Tweets as streams of JSON lines")
+    parser.add_argument('index_file', help="Inverted index file (see tweet_inverted_index.py)")
+    parser.add_argument('--add', dest='tweet_files', nargs='+', default=[], metavar='TWEET_FILE',
+                        help="Add (or reindex, if they have changed) JSON Tweet files before serving")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--workers', type=int, default=8, help="Number of threads serving queries (default: %(default)s)")
+    parser.add_argument('--cache-entries', dest='cache_entries', type=int, default=1000,
+                        help="Number of query results kept in the result cache (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    logger = get_console_info_logger()
+    if args.tweet_files:
+        inverted_index = TweetInvertedIndex(args.index_file, logger=logger)
+        inverted_index.add_files(args.tweet_files)
+        inverted_index.close()
+
+    service = TweetQueryService(args.index_file, cache_entries=args.cache_entries, logger=logger)
+    server = TweetQueryServer(service, host=args.host, port=args.port, worker_count=args.workers)
+    logger.info("Serving Tweet queries at http://%s:%d/tweets" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _parse_time(time_string):
+    """
+    Parses a UTC time string (see snowflake.parse_utc_time()) or a
+    number of seconds since the UNIX epoch
+    """
+    try:
+        return float(time_string)
+    except ValueError:
+        return parse_utc_time(time_string)
+
+
+
+###  Classes  ###
+
+class TweetQueryService:
+    """
+    Answers queries over the Tweets in a TweetInvertedIndex.  The
+    query parameters are described in the module docstring.
+
+    Queries are answered in two steps.  First, the IDs of the
+    candidate documents are found by intersecting the postings for
+    the 'q' and 'user' parameters with the documents for the 'ids'
+    and 'start'/'end' parameters; these document ID lists are kept in
+    an LRU cache, which is invalidated whenever files are added to the
+    index.  Then the candidate Tweets are read (with a seek per Tweet
+    for uncompressed files) and the 'pattern' and 'filter' predicates
+    are applied while the results are streamed.
+
+    The service is thread safe - each thread opens its own connection
+    to the index.
+    """
+    def __init__(self, index_filename, cache_entries=1000, logger=None, metrics=None):
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        if metrics is None:
+            metrics = get_default_registry()
+        self._cache_requests_metric = metrics.counter('trawler_query_cache_requests_total',
+                                                      "Tweet queries looked up in the result cache", ['result'])
+        self._query_seconds_metric = metrics.histogram('trawler_query_seconds',
+                                                       "Seconds spent finding the candidate Tweets for a query").labels()
+
+        self._index_filename = index_filename
+        self._thread_data = threading.local()
+        self._cache = _LRUCache(cache_entries)
+
+    def get_doc_ids(self, params):
+        """
+        Returns the sorted IDs of the candidate documents for a query,
+        from the result cache if possible.  params is a dictionary
+        mapping parameter names to lists of values, as returned by
+        urlparse.parse_qs().  Raises ValueError for invalid queries.
+        """
+        inverted_index = self._get_inverted_index()
+        cache_key = json.dumps([inverted_index.get_last_doc_id(), params.get('q'), sorted(params.get('user', [])),
+                                params.get('ids'), params.get('start'), params.get('end')])
+        doc_ids = self._cache.get(cache_key)
+        if doc_ids is not None:
+            self._cache_requests_metric.labels('hit').inc()
+            return doc_ids
+        self._cache_requests_metric.labels('miss').inc()
+
+        start = time.time()
+        doc_id_lists = []
+        if 'q' in params:
+            doc_id_lists.append(inverted_index.search(params['q'][0]))
+        if 'user' in params:
+            user_doc_ids = []
+            for screen_name in params['user']:
+                user_doc_ids = union_postings(user_doc_ids, inverted_index.search(u'from:' + screen_name))
+            doc_id_lists.append(user_doc_ids)
+        if 'ids' in params:
+            tweet_ids = []
+            for tweet_id_list in params['ids']:
+                tweet_ids += [tweet_id for tweet_id in tweet_id_list.split(',') if tweet_id]
+            doc_id_lists.append(inverted_index.get_doc_ids_for_tweet_ids(tweet_ids))
+        if 'start' in params or 'end' in params:
+            min_tweet_id = end_tweet_id = None
+            if 'start' in params:
+                min_tweet_id = get_min_tweet_id_for_time(_parse_time(params['start'][0]))
+            if 'end' in params:
+                end_tweet_id = get_min_tweet_id_for_time(_parse_time(params['end'][0]))
+            doc_id_lists.append(inverted_index.get_doc_ids_for_tweet_id_range(min_tweet_id, end_tweet_id))
+        if not doc_id_lists:
+            raise ValueError("At least one of the 'q', 'user', 'ids', 'start' and 'end' parameters is required")
+
+        doc_id_lists.sort(key=len)
+        doc_ids = doc_id_lists[0]
+        for other_doc_ids in doc_id_lists[1:]:
+            doc_ids = intersect_postings(doc_ids, other_doc_ids)
+        self._query_seconds_metric.observe(time.time() - start)
+
+        self._cache.put(cache_key, doc_ids)
+        return doc_ids
+
+    def get_stats(self):
+        inverted_index = self._get_inverted_index()
+        stats = self._cache.get_stats()
+        stats['tweets'] = inverted_index.get_document_count()
+        return stats
+
+    def iter_tweet_lines(self, params):
+        """
+        Generates the JSON Tweet strings that match a query.  The
+        query is validated (and can raise ValueError) before the first
+        Tweet is generated.
+        """
+        doc_ids = self.get_doc_ids(params)
+        tweet_filters = self._get_tweet_filters(params)
+        limit = None
+        if 'limit' in params:
+            limit = int(params['limit'][0])
+        return self._iter_filtered_lines(doc_ids, tweet_filters, limit)
+
+    def _get_inverted_index(self):
+        # SQLite connections can't be shared between threads
+        if not hasattr(self._thread_data, 'inverted_index'):
+            self._thread_data.inverted_index = TweetInvertedIndex(self._index_filename, logger=self._logger)
+        return self._thread_data.inverted_index
+
+    def _get_tweet_filters(self, params):
+        tweet_filters = []
+        if 'pattern' in params:
+            try:
+                re.compile(params['pattern'][0])
+            except re.error as e:
+                raise ValueError("Invalid pattern '%s': %s" % (params['pattern'][0], e))
+            tweet_field = params.get('field', ['text'])[0]
+            tweet_filters.append(TweetFilterFieldMatchesRegEx(tweet_field, params['pattern'][0], logger=self._logger))
+        for filter_name in params.get('filter', []):
+            if filter_name not in FILTERS:
+                raise ValueError("Unknown filter '%s' - expected one of: %s" % (filter_name, ', '.join(sorted(FILTERS))))
+            tweet_filters.append(FILTERS[filter_name](logger=self._logger))
+        return tweet_filters
+
+    def _iter_filtered_lines(self, doc_ids, tweet_filters, limit):
+        if limit == 0:
+            return
+        line_count = 0
+        for json_tweet_string in self._get_inverted_index().iter_document_lines(doc_ids):
+            passed = True
+            for tweet_filter in tweet_filters:
+                if not tweet_filter.filter(json_tweet_string):
+                    passed = False
+                    break
+            if passed:
+                yield json_tweet_string
+                line_count += 1
+                if line_count == limit:
+                    return
+
+
+class TweetQueryServer(BaseHTTPServer.HTTPServer):
+    """
+    HTTP server for a TweetQueryService.  Requests are handled by a
+    fixed pool of worker threads, so a burst of expensive queries
+    can't start an unbounded number of threads.  Pass port=0 to pick
+    any free port.
+    """
+    allow_reuse_address = True
+
+    def __init__(self, service, host='127.0.0.1', port=8090, worker_count=8):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), _QueryRequestHandler)
+        self.service = service
+        self._requests = Queue.Queue()
+        self._thread = None
+        self._workers = []
+        for worker_number in range(worker_count):
+            worker = threading.Thread(target=self._run_worker, name="query-worker-%d" % worker_number)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def get_url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def process_request(self, request, client_address):
+        # Called by serve_forever() for each connection
+        self._requests.put((request, client_address))
+
+    def server_close(self):
+        BaseHTTPServer.HTTPServer.server_close(self)
+        for worker in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def start(self):
+        """
+        Starts serving requests on a background thread
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def _run_worker(self):
+        while 1:
+            job = self._requests.get()
+            if job is None:
+                return
+            request, client_address = job
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+class _LRUCache:
+    """
+    Thread safe dictionary that keeps the max_entries most recently
+    used entries
+    """
+    def __init__(self, max_entries):
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self._misses += 1
+                return None
+            self._hits += 1
+            value = self._entries.pop(key)
+            self._entries[key] = value
+            return value
+
+    def get_stats(self):
+        with self._lock:
+            return {'cache_entries': len(self._entries), 'cache_hits': self._hits, 'cache_misses': self._misses}
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+
+class _QueryRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse.urlparse(self.path)
+        params = dict([(name, [value.decode('utf-8') for value in values])
+                       for name, values in urlparse.parse_qs(url.query).items()])
+
+        if url.path == '/stats':
+            self._send_json(200, self.server.service.get_stats())
+        elif url.path == '/tweets':
+            try:
+                tweet_lines = self.server.service.iter_tweet_lines(params)
+            except ValueError as e:
+                self._send_json(400, {'error': unicode(e)})
+                return
+            # The response is streamed, and its end is marked by closing the connection
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson;charset=utf-8')
+            self.end_headers()
+            for json_tweet_string in tweet_lines:
+                self.wfile.write(json_tweet_string.encode('utf-8'))
+        else:
+            self._send_json(404, {'error': "Unknown path '%s'" % url.path})
+
+    def log_message(self, format, *args):
+        # Don't log every request to stderr
+        pass
+
+    def _send_json(self, status, response):
+        body = json.dumps(response)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json;charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+
+"""
+Single-pass random sampling of JSON Tweets.
+
+Usage:
+  tweet_sampler.py --size 10000 --seed 1 *.tweets > sample.tweets
+  tweet_sampler.py --size 5 --stratify user *.tweets > five_per_user.tweets
+  tweet_sampler.py --size 1000 --stratify lang --not-retweet *.tweets > by_language.tweets
+  tweet_sampler.py --size 100 --stratify time --bucket-seconds 86400 *.tweets > per_day.tweets
+
+With --stratify, --size is the sample size for each user, language
+or time bucket.
+"""
+
+# Standard Library modules
+import argparse
+import codecs
+import json
+import math
+import random
+import sys
+
+# Local modules
+from crawl_profiler import add_profiler_arguments, start_profiler
+from snowflake import get_time_for_tweet_id
+from tweet_filter import DEFAULT_BLOCK_SIZE, FilteredTweetReader, TweetFilterNotARetweet
+from twitter_crawler import get_console_info_logger
+
+
+
+###  Functions  ###
+
+def main(argv=None):
+    # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
+    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+
+    parser = argparse.ArgumentParser(description="Write a random sample of the Tweets in JSON Tweet files to stdout")
+    parser.add_argument('tweet_files', nargs='+', metavar='TWEET_FILE')
+    parser.add_argument('--size', type=int, required=True, help="Number of Tweets to sample (for each stratum, with --stratify)")
+    parser.add_argument('--stratify', choices=['user', 'lang', 'time'],
+                        help="Sample --size Tweets from each user, language or time bucket")
+    parser.add_argument('--bucket-seconds', dest='bucket_seconds', type=int, default=24*60*60,
+                        help="Width of the time buckets for '--stratify time' (default: %(default)s)")
+    parser.add_argument('--seed', type=int, help="Random seed, for reproducible samples")
+    parser.add_argument('--not-retweet', dest='not_retweet', action='store_true', help="Only sample Tweets that aren't retweets")
+    parser.add_argument('--block-size', dest='block_size', type=int, default=DEFAULT_BLOCK_SIZE,
+                        help="Number of Tweets filtered at a time, or 0 to filter one Tweet at a time (default: %(default)s)")
+    add_profiler_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logger = get_console_info_logger()
+    profiler = start_profiler(args, logger=logger)
+    if args.stratify == 'user':
+        sampler = StratifiedReservoirSampler(args.size, get_screen_name_key, seed=args.seed)
+    elif args.stratify == 'lang':
+        sampler = StratifiedReservoirSampler(args.size, get_language_key, seed=args.seed)
+    elif args.stratify == 'time':
+        sampler = StratifiedReservoirSampler(args.size, make_time_bucket_key(args.bucket_seconds), seed=args.seed)
+    else:
+        sampler = ReservoirSampler(args.size, seed=args.seed)
+
+    filters = []
+    if args.not_retweet:
+        filters.append(TweetFilterNotARetweet(logger=logger))
+    for tweet_filename in args.tweet_files:
+        filtered_reader = FilteredTweetReader(filters, logger=logger, block_size=args.block_size)
+        filtered_reader.open(tweet_filename)
+        sampler.add_tweets(filtered_reader)
+        filtered_reader.close()
+
+    logger.info("Sampled %d of %d Tweets" % (len(sampler.get_sample()), sampler.get_seen_count()))
+    for json_tweet_string in sampler.get_sample():
+        sys.stdout.write(json_tweet_string)
+    profiler.close()
+
+
+def get_language_key(json_tweet_string):
+    """
+    Returns the language code that Twitter detected for a Tweet
+    ('und' if undetermined or missing)
+    """
+    return json.loads(json_tweet_string).get('lang') or 'und'
+
+
+def get_screen_name_key(json_tweet_string):
+    """
+    Returns the lowercased screen name of the user who posted a Tweet
+    """
+    return json.loads(json_tweet_string)['user']['screen_name'].lower()
+
+
+def make_time_bucket_key(bucket_seconds):
+    """
+    Returns a key function for StratifiedReservoirSampler that maps a
+    Tweet to the start time of the bucket it was posted in, using the
+    time encoded in its snowflake ID.  Tweets with pre-snowflake IDs
+    have a key of None.
+    """
+    def get_time_bucket_key(json_tweet_string):
+        tweet_time = get_time_for_tweet_id(json.loads(json_tweet_string)['id'])
+        if tweet_time is None:
+            return None
+        return int(tweet_time // bucket_seconds) * bucket_seconds
+    return get_time_bucket_key
+
+
+
+###  Classes  ###
+
+class ReservoirSampler:
+    """
+    Keeps a uniform random sample of sample_size of the Tweets added
+    to it, in a single pass and in memory proportional to the sample
+    size rather than to the number of Tweets.
+
+    Unlike TweetFilterOneTweetPerScreenName, which keeps the first
+    Tweet it sees, every Tweet added is equally likely to be in the
+    sample.  Samples are reproducible: the same seed and the same
+    Tweets, in the same order, give the same sample.
+
+    The sampler uses "Algorithm L" (Li, 1994), which computes how many
+    Tweets to skip before the next replacement, so that adding a Tweet
+    that isn't sampled costs a counter increment rather than a random
+    number.
+
+    Usage:
+      sampler = ReservoirSampler(1000, seed=1)
+      filtered_reader = FilteredTweetReader([TweetFilterNotARetweet()])
+      filtered_reader.open('tweet_filename')
+      sampler.add_tweets(filtered_reader)
+      for json_tweet_string in sampler.get_sample():
+          do_something(json_tweet_string)
+    """
+    def __init__(self, sample_size, seed=None, random_generator=None):
+        """
+        random_generator -- an optional random.Random instance, used
+        instead of a new generator seeded with seed
+        """
+        if sample_size < 1:
+            raise ValueError("The sample size must be at least 1, not %d" % sample_size)
+        if random_generator is None:
+            random_generator = random.Random(seed)
+        self._random = random_generator
+        self._sample_size = sample_size
+        # Reservoir of (position, json_tweet_string) tuples
+        self._reservoir = []
+        self._seen_count = 0
+        self._weight = None
+        self._next_replacement = None
+
+    def add_tweet(self, json_tweet_string):
+        position = self._seen_count
+        self._seen_count += 1
+        if position < self._sample_size:
+            self._reservoir.append((position, json_tweet_string))
+            if position == self._sample_size - 1:
+                self._weight = math.exp(math.log(self._random_fraction()) / self._sample_size)
+                self._next_replacement = position + self._get_skip_count() + 1
+        elif position == self._next_replacement:
+            self._reservoir[self._random.randrange(self._sample_size)] = (position, json_tweet_string)
+            self._weight *= math.exp(math.log(self._random_fraction()) / self._sample_size)
+            self._next_replacement = position + self._get_skip_count() + 1
+
+    def add_tweets(self, json_tweet_strings):
+        """
+        Adds every Tweet from an iterable, such as a FilteredTweetReader
+        """
+        for json_tweet_string in json_tweet_strings:
+            self.add_tweet(json_tweet_string)
+
+    def get_sample(self):
+        """
+        Returns the sampled Tweets, in the order they were added
+        """
+        return [json_tweet_string for position, json_tweet_string in sorted(self._reservoir)]
+
+    def get_seen_count(self):
+        """
+        Returns the number of Tweets added to the sampler
+        """
+        return self._seen_count
+
+    def _get_skip_count(self):
+        return int(math.floor(math.log(self._random_fraction()) / math.log(1 - self._weight)))
+
+    def _random_fraction(self):
+        # random() can return 0.0, whose log is undefined
+        fraction = self._random.random()
+        while fraction == 0.0:
+            fraction = self._random.random()
+        return fraction
+
+
+class StratifiedReservoirSampler:
+    """
+    Keeps a uniform random sample of sample_size Tweets for each
+    stratum - e.g. for each user, language or time bucket - in a
+    single pass.  key_function maps a JSON Tweet string to its
+    stratum (see get_screen_name_key(), get_language_key() and
+    make_time_bucket_key()).
+
+    Memory use is proportional to sample_size times the number of
+    strata.  As with ReservoirSampler, the same seed and the same
+    Tweets in the same order give the same sample.
+
+    Usage:
+      sampler = StratifiedReservoirSampler(5, get_screen_name_key, seed=1)
+      sampler.add_tweets(filtered_reader)
+      for screen_name, json_tweet_strings in sampler.get_samples_by_stratum().items():
+          do_something(screen_name, json_tweet_strings)
+    """
+    def __init__(self, sample_size, key_function, seed=None):
+        if sample_size < 1:
+            raise ValueError("The sample size must be at least 1, not %d" % sample_size)
+        self._sample_size = sample_size
+        self._key_function = key_function
+        # Shared by the reservoirs, so the sample only depends on the seed and the order of the Tweets
+        self._random = random.Random(seed)
+        self._reservoirs = {}
+        self._seen_count = 0
+
+    def add_tweet(self, json_tweet_string):
+        key = self._key_function(json_tweet_string)
+        if key not in self._reservoirs:
+            self._reservoirs[key] = ReservoirSampler(self._sample_size, random_generator=self._random)
+        self._reservoirs[key].add_tweet((self._seen_count, json_tweet_string))
+        self._seen_count += 1
+
+    def add_tweets(self, json_tweet_strings):
+        """
+        Adds every Tweet from an iterable, such as a FilteredTweetReader
+        """
+        for json_tweet_string in json_tweet_strings:
+            self.add_tweet(json_tweet_string)
+
+    def get_sample(self):
+        """
+        Returns the sampled Tweets of every stratum, in the order they
+        were added
+        """
+        sample = []
+        for reservoir in self._reservoirs.values():
+            sample += reservoir.get_sample()
+        return [json_tweet_string for position, json_tweet_string in sorted(sample)]
+
+    def get_samples_by_stratum(self):
+        """
+        Returns a dictionary mapping each stratum's key to a list of
+        its sampled Tweets, in the order they were added
+        """
+        return dict([(key, [json_tweet_string for position, json_tweet_string in reservoir.get_sample()])
+                     for key, reservoir in self._reservoirs.items()])
+
+    def get_seen_count(self):
+        """
+        Returns the number of Tweets added to the sampler
+        """
+        return self._seen_count
+
+    def get_seen_counts_by_stratum(self):
+        """
+        Returns a dictionary mapping each stratum's key to the number
+        of Tweets added to the stratum
+        """
+        return dict([(key, reservoir.get_seen_count()) for key, reservoir in self._reservoirs.items()])
+
+
+if __name__ == "__main__":
+    main()
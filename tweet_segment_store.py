@@ -0,0 +1,291 @@
+"""
+Append-only storage that packs many users' timelines into large segment files
+"""
+
+# Standard Library modules
+import codecs
+import json
+import os
+import re
+import sqlite3
+
+# Local modules
+from crawl_profiler import get_default_profiler
+from twitter_crawler import get_console_info_logger
+
+
+class TweetSegmentStore:
+    """
+    Stores the Tweets for many Twitter users in a small number of
+    large, append-only segment files, instead of one
+    [screen_name].tweets file per user.
+
+    Segment files use the same format as [screen_name].tweets files
+    (one JSON Tweet object per line).  Each call to append_tweets()
+    writes one contiguous "record" of Tweets for one user to the end
+    of the active segment, and an SQLite index maps each user to the
+    (segment, offset, length) ranges of their records.  When the
+    active segment grows past max_segment_size bytes, a new segment
+    is started.
+
+    Incremental crawls (e.g. by save_recent_tweets_to_json.py) simply
+    append a new, newer record for a user.  Readers see all of a
+    user's records, newest record first, so the Tweets are returned
+    newest to oldest just like a [screen_name].tweets file.  Calling
+    compact() rewrites the store so that each user has a single
+    record with duplicate Tweets removed.
+
+    Usage:
+      store = TweetSegmentStore('tweet_store')
+      store.append_tweets(screen_name, tweets)
+      ...
+      filtered_reader = FilteredTweetReader()
+      filtered_reader.open_file(store.open(screen_name))
+      for json_tweet_string in filtered_reader:
+          do_something(json_tweet_string)
+    """
+    SEGMENT_FILENAME_FORMAT = "segment-%06d.tweets"
+    SEGMENT_FILENAME_PATTERN = r'segment-(\d+)\.tweets$'
+
+    def __init__(self, store_path, max_segment_size=2**30, logger=None):
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        if not os.path.exists(store_path):
+            os.makedirs(store_path)
+        self._store_path = store_path
+        self._max_segment_size = max_segment_size
+
+        self._db = sqlite3.connect(os.path.join(store_path, 'index.sqlite'))
+        self._db.execute("""CREATE TABLE IF NOT EXISTS records (
+                              record_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              screen_name_key TEXT NOT NULL,
+                              screen_name TEXT NOT NULL,
+                              segment INTEGER NOT NULL,
+                              offset INTEGER NOT NULL,
+                              length INTEGER NOT NULL,
+                              tweet_count INTEGER NOT NULL,
+                              max_id INTEGER)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS records_by_user ON records (screen_name_key)")
+        self._db.commit()
+
+        segments = self._get_segment_numbers_on_disk()
+        if segments:
+            self._active_segment = segments[-1]
+        else:
+            self._active_segment = 0
+        self._active_segment_file = None
+
+    def append_tweets(self, screen_name, tweets):
+        """
+        Appends a record containing the list of Tweets (as returned by
+        the Twython API) for screen_name.  Tweets should be ordered
+        newest to oldest.
+        """
+        with get_default_profiler().span('write'):
+            record_bytes = "".join(["%s\n" % json.dumps(tweet) for tweet in tweets])
+            if tweets:
+                max_id = max(tweet['id'] for tweet in tweets)
+            else:
+                max_id = None
+            self._append_record(screen_name, record_bytes, len(tweets), max_id)
+            self._db.commit()
+
+    def import_tweet_file(self, screen_name, json_filename):
+        """
+        Appends the contents of an existing [screen_name].tweets file
+        as a record for screen_name
+        """
+        record_bytes = codecs.open(json_filename, 'r', 'utf-8').read().encode('utf-8')
+        if record_bytes and not record_bytes.endswith("\n"):
+            record_bytes += "\n"
+        tweet_count = record_bytes.count("\n")
+        self._append_record(screen_name, record_bytes, tweet_count, _max_tweet_id(record_bytes))
+        self._db.commit()
+
+    def has_user(self, screen_name):
+        return self._db.execute("SELECT 1 FROM records WHERE screen_name_key=? LIMIT 1",
+                                (screen_name.lower(),)).fetchone() is not None
+
+    def get_screen_names(self):
+        return [row[0] for row in self._db.execute("SELECT screen_name FROM records GROUP BY screen_name_key")]
+
+    def get_max_id(self, screen_name):
+        """
+        Returns the largest Tweet ID stored for screen_name, or None
+        """
+        return self._db.execute("SELECT MAX(max_id) FROM records WHERE screen_name_key=?",
+                                (screen_name.lower(),)).fetchone()[0]
+
+    def get_tweet_count(self, screen_name):
+        """
+        Returns the number of Tweet lines stored for screen_name.  This
+        can include duplicates until the store is compacted.
+        """
+        return self._db.execute("SELECT COALESCE(SUM(tweet_count), 0) FROM records WHERE screen_name_key=?",
+                                (screen_name.lower(),)).fetchone()[0]
+
+    def open(self, screen_name):
+        """
+        Returns a TweetSegmentReader for the Tweets of screen_name,
+        which can be passed to FilteredTweetReader.open_file()
+        """
+        return TweetSegmentReader(self.iter_tweet_lines(screen_name))
+
+    def iter_tweet_lines(self, screen_name):
+        """
+        Generates the JSON Tweet strings for screen_name, newest
+        record first
+        """
+        records = self._db.execute("SELECT segment, offset, length FROM records WHERE screen_name_key=? "
+                                   "ORDER BY record_id DESC", (screen_name.lower(),)).fetchall()
+        for segment, offset, length in records:
+            for line in self._read_record(segment, offset, length).splitlines(True):
+                yield line
+
+    def compact(self):
+        """
+        Rewrites the store into new segments, merging all of the
+        records for each user into a single record.  Tweets that
+        appear in more than one record are only kept once, and each
+        user's Tweets are ordered newest to oldest.
+        """
+        self._close_active_segment()
+        old_segments = self._get_segment_numbers_on_disk()
+        screen_names = self.get_screen_names()
+
+        # New segments are numbered after every existing segment
+        self._active_segment = self._active_segment + 1
+        new_segment_start = self._active_segment
+        new_records = []
+        for screen_name in screen_names:
+            tweets_by_id = {}
+            for line in self.iter_tweet_lines(screen_name):
+                # Lines from newer records are seen first, and take precedence
+                tweet_id = _get_tweet_id(line)
+                if tweet_id is None:
+                    self._logger.warning("Dropping unparsable Tweet line for user '%s' during compaction" % screen_name)
+                elif tweet_id not in tweets_by_id:
+                    tweets_by_id[tweet_id] = line
+            tweet_ids = sorted(tweets_by_id.keys(), reverse=True)
+            record_bytes = "".join([tweets_by_id[tweet_id] for tweet_id in tweet_ids]).encode('utf-8')
+            if tweet_ids:
+                max_id = tweet_ids[0]
+            else:
+                max_id = None
+            new_records.append(self._write_record(screen_name, record_bytes, len(tweet_ids), max_id))
+        self._close_active_segment()
+
+        # Swap in the new index in a single transaction, then remove the old segments
+        self._db.execute("DELETE FROM records")
+        self._db.executemany("INSERT INTO records (screen_name_key, screen_name, segment, offset, length, tweet_count, max_id) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", new_records)
+        self._db.commit()
+        for segment in old_segments:
+            if segment < new_segment_start:
+                os.remove(self._get_segment_filename(segment))
+        self._logger.info("Compacted %d users from %d segments into %d segments" % \
+                              (len(screen_names), len(old_segments), len(self._get_segment_numbers_on_disk())))
+
+    def close(self):
+        self._close_active_segment()
+        self._db.close()
+
+    def _append_record(self, screen_name, record_bytes, tweet_count, max_id):
+        row = self._write_record(screen_name, record_bytes, tweet_count, max_id)
+        self._db.execute("INSERT INTO records (screen_name_key, screen_name, segment, offset, length, tweet_count, max_id) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+
+    def _write_record(self, screen_name, record_bytes, tweet_count, max_id):
+        """
+        Writes record_bytes to the end of the active segment, and
+        returns the index row for the record
+        """
+        if self._active_segment_file is None:
+            self._active_segment_file = open(self._get_segment_filename(self._active_segment), 'ab')
+        segment_file = self._active_segment_file
+        segment_file.seek(0, os.SEEK_END)
+        offset = segment_file.tell()
+
+        # Start a new segment if this record would push the active segment over the size limit
+        if offset > 0 and offset + len(record_bytes) > self._max_segment_size:
+            self._close_active_segment()
+            self._active_segment += 1
+            self._active_segment_file = open(self._get_segment_filename(self._active_segment), 'ab')
+            segment_file = self._active_segment_file
+            offset = 0
+
+        segment_file.write(record_bytes)
+        # Flush before the index row is committed, so that indexed bytes are always on disk
+        segment_file.flush()
+        return (screen_name.lower(), screen_name, self._active_segment, offset, len(record_bytes), tweet_count, max_id)
+
+    def _read_record(self, segment, offset, length):
+        if self._active_segment_file is not None:
+            self._active_segment_file.flush()
+        segment_file = open(self._get_segment_filename(segment), 'rb')
+        segment_file.seek(offset)
+        record_bytes = segment_file.read(length)
+        segment_file.close()
+        return record_bytes.decode('utf-8')
+
+    def _close_active_segment(self):
+        if self._active_segment_file is not None:
+            self._active_segment_file.close()
+            self._active_segment_file = None
+
+    def _get_segment_filename(self, segment):
+        return os.path.join(self._store_path, self.SEGMENT_FILENAME_FORMAT % segment)
+
+    def _get_segment_numbers_on_disk(self):
+        segments = []
+        for filename in os.listdir(self._store_path):
+            match = re.match(self.SEGMENT_FILENAME_PATTERN, filename)
+            if match:
+                segments.append(int(match.group(1)))
+        return sorted(segments)
+
+
+
+class TweetSegmentReader:
+    """
+    File-like iterator over the JSON Tweet strings of one user in a
+    TweetSegmentStore.  Supports the subset of the file interface
+    used by FilteredTweetReader (next() and close()).
+    """
+    def __init__(self, tweet_lines):
+        self._tweet_lines = tweet_lines
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self._tweet_lines.next()
+
+    def close(self):
+        self._tweet_lines.close()
+
+
+
+def _get_tweet_id(json_tweet_string):
+    """
+    Returns the ID of a JSON Tweet string, or None if the string is
+    not a parsable Tweet
+    """
+    try:
+        return json.loads(json_tweet_string)['id']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _max_tweet_id(record_bytes):
+    """
+    Returns the largest Tweet ID in a block of JSON Tweet lines, or None
+    """
+    tweet_ids = [_get_tweet_id(line) for line in record_bytes.splitlines()]
+    tweet_ids = [tweet_id for tweet_id in tweet_ids if tweet_id is not None]
+    if tweet_ids:
+        return max(tweet_ids)
+    return None
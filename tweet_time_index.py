@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+
+"""
+Index of the time ranges covered by JSON Tweet files, for selecting
+the Tweets posted in a time range without parsing every Tweet.
+
+Usage:
+  tweet_time_index.py tweets.index --add *.tweets
+  tweet_time_index.py tweets.index --start 2015-03-01 --end 2015-04-01 > march.tweets
+  tweet_time_index.py tweets.index --counts
+
+The times given with --start and --end are in UTC.  --start is
+inclusive and --end is exclusive.
+"""
+
+# Standard Library modules
+import argparse
+import codecs
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# Local modules
+from snowflake import get_min_tweet_id_for_time, get_time_for_tweet_id, parse_utc_time
+from tweet_filter import TweetFilterTweetIDTimeRange
+from tweet_segment_store import TweetSegmentReader
+from tweet_writer import get_compression_for_filename, open_compressed_file, read_byte_ranges
+from twitter_crawler import get_console_info_logger
+
+
+# Width of the time buckets that files are partitioned into, in seconds
+DEFAULT_BUCKET_SECONDS = 24*60*60
+
+
+
+###  Functions  ###
+
+def main(argv=None):
+    # Make stdout output UTF-8, preventing "'ascii' codec can't encode" errors
+    sys.stdout = codecs.getwriter('utf8')(sys.stdout)
+
+    parser = argparse.ArgumentParser(description="Index JSON Tweet files by time, and select the Tweets posted in a time range")
+    parser.add_argument('index_file')
+    parser.add_argument('--add', dest='tweet_files', nargs='+', default=[], metavar='TWEET_FILE',
+                        help="Add (or reindex, if they have changed) JSON Tweet files")
+    parser.add_argument('--bucket-seconds', dest='bucket_seconds', type=int,
+                        help="Width of the time buckets for a new index (default: %d)" % DEFAULT_BUCKET_SECONDS)
+    parser.add_argument('--start', help="Print the Tweets posted at or after this UTC time (YYYY-MM-DD [HH:MM[:SS]])")
+    parser.add_argument('--end', help="Print the Tweets posted before this UTC time (YYYY-MM-DD [HH:MM[:SS]])")
+    parser.add_argument('--counts', action='store_true', help="Print the number of Tweets in each time bucket")
+    args = parser.parse_args(argv)
+
+    logger = get_console_info_logger()
+    time_index = TweetTimeIndex(args.index_file, bucket_seconds=args.bucket_seconds, logger=logger)
+
+    try:
+        if args.tweet_files:
+            time_index.add_files(args.tweet_files)
+
+        if args.counts:
+            for bucket, tweet_count in time_index.get_bucket_counts():
+                if bucket is None:
+                    print "%-20s %d" % ("pre-snowflake", tweet_count)
+                else:
+                    print "%-20s %d" % (_format_utc_time(bucket), tweet_count)
+
+        if args.start or args.end:
+            start_time = parse_utc_time(args.start) if args.start else None
+            end_time = parse_utc_time(args.end) if args.end else None
+            for json_tweet_string in time_index.iter_tweet_lines(start_time, end_time):
+                sys.stdout.write(json_tweet_string)
+    finally:
+        time_index.close()
+
+
+def _format_utc_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(timestamp))
+
+
+def _get_tweet_id(json_tweet_string):
+    """
+    Returns the ID of a JSON Tweet string, or None if the string is
+    not a parsable Tweet
+    """
+    try:
+        return int(json.loads(json_tweet_string)['id'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+
+###  Classes  ###
+
+class TweetTimeIndex:
+    """
+    An SQLite index that partitions JSON Tweet files (one JSON Tweet
+    object per line, optionally gzip or zstd compressed) into time
+    buckets, so that range queries like "all Tweets from March" skip
+    the files - and the parts of files - that can't contain matching
+    Tweets.
+
+    The time a Tweet was posted is taken from its snowflake ID (see
+    snowflake.py).  Each file is split into "blocks": runs of
+    consecutive lines whose Tweets fall in the same time bucket.  The
+    index stores the byte range (in the uncompressed file), Tweet
+    count and smallest and largest Tweet ID of each block.  Because
+    [screen_name].tweets files are ordered newest to oldest, each
+    timeline has about one block per bucket it covers.
+
+    When Tweets are selected by time, blocks that are entirely inside
+    the time range are returned without parsing any JSON, and only the
+    Tweets in the blocks at the edges of the range are parsed.  Blocks
+    of uncompressed files are read with a seek; compressed files are
+    decompressed up to the last matching block.
+
+    Files are indexed by their absolute path, and are reindexed by
+    add_file() when their size or modification time changes.
+
+    Usage:
+      time_index = TweetTimeIndex('tweets.index')
+      time_index.add_files(glob.glob('*.tweets'))
+      for json_tweet_string in time_index.iter_tweet_lines(start_time, end_time):
+          do_something(json_tweet_string)
+      time_index.close()
+    """
+    def __init__(self, index_filename, bucket_seconds=None, logger=None):
+        """
+        bucket_seconds -- width of the time buckets, in seconds.  Only
+        used when creating a new index, and defaults to
+        DEFAULT_BUCKET_SECONDS.  Raises ValueError if an existing
+        index uses a different bucket width.
+        """
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        self._db = sqlite3.connect(index_filename)
+        self._db.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS files (
+                              filename TEXT PRIMARY KEY,
+                              size INTEGER NOT NULL,
+                              mtime REAL NOT NULL,
+                              tweet_count INTEGER NOT NULL,
+                              min_id INTEGER,
+                              max_id INTEGER)""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS blocks (
+                              filename TEXT NOT NULL,
+                              bucket INTEGER,
+                              offset INTEGER NOT NULL,
+                              length INTEGER NOT NULL,
+                              tweet_count INTEGER NOT NULL,
+                              min_id INTEGER NOT NULL,
+                              max_id INTEGER NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS blocks_by_file ON blocks (filename, offset)")
+
+        row = self._db.execute("SELECT value FROM settings WHERE name='bucket_seconds'").fetchone()
+        if row is None:
+            if bucket_seconds is None:
+                bucket_seconds = DEFAULT_BUCKET_SECONDS
+            self._db.execute("INSERT INTO settings (name, value) VALUES ('bucket_seconds', ?)", (bucket_seconds,))
+        elif bucket_seconds is not None and bucket_seconds != row[0]:
+            raise ValueError("Index '%s' uses %d second buckets, not %d second buckets" %
+                             (index_filename, row[0], bucket_seconds))
+        else:
+            bucket_seconds = row[0]
+        self._bucket_seconds = bucket_seconds
+        self._db.commit()
+
+    def add_file(self, filename):
+        """
+        Indexes a JSON Tweet file.  Returns False if the file is
+        already indexed and hasn't changed, and True otherwise.
+        """
+        filename = os.path.abspath(filename)
+        file_stat = os.stat(filename)
+        row = self._db.execute("SELECT size, mtime FROM files WHERE filename=?", (filename,)).fetchone()
+        if row is not None and row[0] == file_stat.st_size and row[1] == file_stat.st_mtime:
+            return False
+
+        blocks = self._get_blocks(filename)
+        tweet_count = sum([block[3] for block in blocks])
+        if blocks:
+            min_id = min([block[4] for block in blocks])
+            max_id = max([block[5] for block in blocks])
+        else:
+            min_id = max_id = None
+
+        self._db.execute("DELETE FROM blocks WHERE filename=?", (filename,))
+        self._db.executemany("INSERT INTO blocks (filename, bucket, offset, length, tweet_count, min_id, max_id) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", [(filename,) + block for block in blocks])
+        self._db.execute("INSERT OR REPLACE INTO files (filename, size, mtime, tweet_count, min_id, max_id) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (filename, file_stat.st_size, file_stat.st_mtime, tweet_count, min_id, max_id))
+        self._db.commit()
+        return True
+
+    def add_files(self, filenames):
+        """
+        Indexes a list of JSON Tweet files, skipping files that are
+        already indexed and haven't changed
+        """
+        indexed_count = 0
+        for filename in filenames:
+            if self.add_file(filename):
+                indexed_count += 1
+        self._logger.info("Indexed %d of %d Tweet files" % (indexed_count, len(filenames)))
+
+    def get_bucket_counts(self):
+        """
+        Returns a list of (bucket start time, Tweet count) tuples,
+        ordered by time.  Tweets with pre-snowflake IDs are counted in
+        a bucket with a start time of None.
+        """
+        return self._db.execute("SELECT bucket, SUM(tweet_count) FROM blocks GROUP BY bucket ORDER BY bucket").fetchall()
+
+    def get_filenames(self, start_time=None, end_time=None):
+        """
+        Returns the (absolute) filenames of the indexed files that
+        contain Tweets posted in the time range [start_time, end_time)
+        """
+        where_clause, params = self._get_id_range_clause(start_time, end_time)
+        return [row[0] for row in self._db.execute("SELECT filename FROM files WHERE %s ORDER BY filename" % where_clause,
+                                                    params)]
+
+    def iter_tweet_lines(self, start_time=None, end_time=None):
+        """
+        Generates the JSON Tweet strings posted in the time range
+        [start_time, end_time), where the times are in seconds since
+        the UNIX epoch and either can be None for an open-ended range.
+        Tweets are generated file by file, in the order they appear in
+        each file.
+        """
+        tweet_filter = TweetFilterTweetIDTimeRange(start_time, end_time, logger=self._logger)
+        where_clause, params = self._get_id_range_clause(start_time, end_time)
+        if start_time is None:
+            start_id = None
+        else:
+            start_id = get_min_tweet_id_for_time(start_time)
+        if end_time is None:
+            end_id = None
+        else:
+            end_id = get_min_tweet_id_for_time(end_time)
+
+        for filename in self.get_filenames(start_time, end_time):
+            blocks = self._db.execute("SELECT offset, length, min_id, max_id FROM blocks WHERE filename=? AND %s "
+                                      "ORDER BY offset" % where_clause, (filename,) + params).fetchall()
+            if not os.path.exists(filename):
+                self._logger.warning("Indexed Tweet file '%s' no longer exists - skipping" % filename)
+                continue
+            if not self._is_unchanged(filename):
+                self._logger.warning("Tweet file '%s' has changed since it was indexed - reindexing" % filename)
+                self.add_file(filename)
+                blocks = self._db.execute("SELECT offset, length, min_id, max_id FROM blocks WHERE filename=? AND %s "
+                                          "ORDER BY offset" % where_clause, (filename,) + params).fetchall()
+
+            byte_ranges = [(offset, length) for offset, length, min_id, max_id in blocks]
+            for block, block_bytes in zip(blocks, read_byte_ranges(filename, byte_ranges)):
+                offset, length, min_id, max_id = block
+                block_lines = block_bytes.decode('utf-8').splitlines(True)
+                if (start_id is None or min_id >= start_id) and (end_id is None or max_id < end_id):
+                    # Every Tweet in the block is in the time range
+                    for line in block_lines:
+                        yield line
+                else:
+                    for line in block_lines:
+                        tweet_id = _get_tweet_id(line)
+                        if tweet_id is not None and tweet_filter.filter_tweet_id(tweet_id):
+                            yield line
+
+    def open(self, start_time=None, end_time=None):
+        """
+        Returns a TweetSegmentReader for the Tweets posted in the time
+        range [start_time, end_time), which can be passed to
+        FilteredTweetReader.open_file()
+        """
+        return TweetSegmentReader(self.iter_tweet_lines(start_time, end_time))
+
+    def close(self):
+        self._db.close()
+
+    def _get_blocks(self, filename):
+        """
+        Returns a list of (bucket, offset, length, tweet_count, min_id,
+        max_id) tuples for the blocks of a Tweet file.  Lines that
+        aren't parsable Tweets end the current block, and aren't part
+        of any block.
+        """
+        blocks = []
+        block = None
+        offset = 0
+        tweet_file = open_compressed_file(filename, 'rb', get_compression_for_filename(filename))
+        for line in tweet_file:
+            tweet_id = _get_tweet_id(line)
+            if tweet_id is None:
+                if line.strip():
+                    self._logger.warning("Skipping unparsable line at byte %d of Tweet file '%s'" % (offset, filename))
+                block = None
+            else:
+                bucket = self._get_bucket(tweet_id)
+                if block is not None and block[0] == bucket and block[1] + block[2] == offset:
+                    block[2] += len(line)
+                    block[3] += 1
+                    block[4] = min(block[4], tweet_id)
+                    block[5] = max(block[5], tweet_id)
+                else:
+                    block = [bucket, offset, len(line), 1, tweet_id, tweet_id]
+                    blocks.append(block)
+            offset += len(line)
+        tweet_file.close()
+        return [tuple(block) for block in blocks]
+
+    def _get_bucket(self, tweet_id):
+        tweet_time = get_time_for_tweet_id(tweet_id)
+        if tweet_time is None:
+            return None
+        return int(tweet_time // self._bucket_seconds) * self._bucket_seconds
+
+    def _get_id_range_clause(self, start_time, end_time):
+        """
+        Returns an SQL condition, and its parameters, that matches
+        files and blocks whose Tweet ID range overlaps the time range
+        """
+        conditions = ["max_id IS NOT NULL"]
+        params = ()
+        if start_time is not None:
+            conditions.append("max_id >= ?")
+            params += (get_min_tweet_id_for_time(start_time),)
+        if end_time is not None:
+            conditions.append("min_id < ?")
+            params += (get_min_tweet_id_for_time(end_time),)
+        return " AND ".join(conditions), params
+
+    def _is_unchanged(self, filename):
+        row = self._db.execute("SELECT size, mtime FROM files WHERE filename=?", (filename,)).fetchone()
+        file_stat = os.stat(filename)
+        return row is not None and row[0] == file_stat.st_size and row[1] == file_stat.st_mtime
+
+
+if __name__ == "__main__":
+    main()
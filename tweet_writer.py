@@ -0,0 +1,315 @@
+"""
+Buffered, optionally compressed writers for JSON Tweet files
+"""
+
+# Standard Library modules
+import codecs
+import collections
+import gzip
+import json
+import Queue
+import threading
+
+# Local modules
+from crawl_profiler import get_default_profiler
+
+
+# File extension added to Tweet filenames for each compression type
+COMPRESSION_EXTENSIONS = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+JSON_ENCODERS = ['json', 'simplejson', 'ujson']
+
+
+
+###  Functions  ###
+
+def add_compression_extension(filename, compression):
+    """
+    Returns filename with the file extension for the compression type
+    appended, e.g. 'charman.tweets' -> 'charman.tweets.gz'
+    """
+    return filename + COMPRESSION_EXTENSIONS[compression]
+
+
+def add_tweet_writer_arguments(parser):
+    """
+    Adds the command line arguments used by create_tweet_writer() to
+    an argparse.ArgumentParser
+    """
+    parser.add_argument('--compression', choices=['gzip', 'zstd'],
+                        help="Compress Tweet files (default: no compression)")
+    parser.add_argument('--compression-level', dest='compression_level', type=int, default=6,
+                        help="Compression level (default: %(default)s)")
+    parser.add_argument('--json-encoder', dest='json_encoder', choices=JSON_ENCODERS, default='json',
+                        help="Library used to serialize Tweets (default: %(default)s)")
+
+
+def create_tweet_writer(args, logger=None):
+    """
+    Returns a BackgroundTweetWriter configured from the command line
+    arguments added by add_tweet_writer_arguments()
+    """
+    return BackgroundTweetWriter(compression=args.compression,
+                                 compression_level=args.compression_level,
+                                 json_encoder=args.json_encoder,
+                                 logger=logger)
+
+
+def get_compression_for_filename(filename):
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if extension and filename.endswith(extension):
+            return compression
+    return None
+
+
+def get_json_encoder(json_encoder):
+    """
+    Returns a function that serializes a Tweet to a JSON string using
+    the specified library.  The 'simplejson' and 'ujson' libraries
+    are optional, and are only imported when requested.
+    """
+    if json_encoder == 'json':
+        return json.dumps
+    elif json_encoder == 'simplejson':
+        import simplejson
+        return simplejson.dumps
+    elif json_encoder == 'ujson':
+        import ujson
+        return ujson.dumps
+    else:
+        raise ValueError("Unknown JSON encoder '%s'" % json_encoder)
+
+
+def open_compressed_file(filename, mode, compression=None, compression_level=6):
+    """
+    Opens a binary file for reading ('rb') or writing ('wb'), with
+    transparent gzip or zstd (de)compression.  The 'zstandard'
+    library is only imported when zstd compression is requested.
+    """
+    if compression is None:
+        return open(filename, mode)
+    elif compression == 'gzip':
+        return gzip.open(filename, mode, compression_level)
+    elif compression == 'zstd':
+        import zstandard
+        raw_file = open(filename, mode)
+        if mode.startswith('r'):
+            return zstandard.ZstdDecompressor().stream_reader(raw_file)
+        else:
+            return zstandard.ZstdCompressor(level=compression_level).stream_writer(raw_file)
+    else:
+        raise ValueError("Unknown compression type '%s'" % compression)
+
+
+def open_tweet_file(filename):
+    """
+    Opens a (possibly compressed) JSON Tweet file for reading, and
+    returns a file-like object that yields unicode lines.  The
+    compression type is determined from the file extension.
+    """
+    compression = get_compression_for_filename(filename)
+    if compression is None:
+        return codecs.open(filename, 'r', 'utf-8')
+    return codecs.getreader('utf-8')(open_compressed_file(filename, 'rb', compression))
+
+
+def read_byte_ranges(filename, byte_ranges):
+    """
+    Generates the bytes of each (offset, length) range of a (possibly
+    compressed) file.  Offsets are in the uncompressed file, and the
+    ranges must be ordered by offset.  Uncompressed files are read
+    with a seek per range; compressed files are decompressed up to the
+    last range.
+    """
+    compression = get_compression_for_filename(filename)
+    tweet_file = open_compressed_file(filename, 'rb', compression)
+    position = 0
+    try:
+        for offset, length in byte_ranges:
+            if compression is None:
+                tweet_file.seek(offset)
+            else:
+                # Decompressed streams can't seek, so skip ahead by reading
+                skip_count = offset - position
+                while skip_count > 0:
+                    chunk = tweet_file.read(min(skip_count, 2**20))
+                    if not chunk:
+                        break
+                    skip_count -= len(chunk)
+            yield tweet_file.read(length)
+            position = offset + length
+    finally:
+        tweet_file.close()
+
+
+
+###  Classes  ###
+
+class TweetWriter:
+    """
+    Writes Tweets to a file, one JSON object per line.
+
+    Serialized Tweets are collected in memory and written to the file
+    in chunks of at least buffer_size bytes, instead of with one small
+    write() per Tweet.  The file can be gzip or zstd compressed.
+    """
+    def __init__(self, json_filename, compression=None, compression_level=6, buffer_size=2**20, json_encoder='json'):
+        self._file = open_compressed_file(json_filename, 'wb', compression, compression_level)
+        self._encode = get_json_encoder(json_encoder)
+        self._buffer_size = buffer_size
+        self._buffered_lines = []
+        self._buffered_bytes = 0
+        self._profiler = get_default_profiler()
+
+    def write_tweet(self, tweet):
+        with self._profiler.span('write'):
+            self._write_tweet(tweet)
+
+    def write_tweets(self, tweets):
+        with self._profiler.span('write'):
+            for tweet in tweets:
+                self._write_tweet(tweet)
+
+    def flush(self):
+        with self._profiler.span('write'):
+            self._flush()
+
+    def close(self):
+        with self._profiler.span('write'):
+            self._flush()
+            self._file.close()
+
+    def _flush(self):
+        if self._buffered_lines:
+            self._file.write("".join(self._buffered_lines))
+            self._buffered_lines = []
+            self._buffered_bytes = 0
+
+    def _write_tweet(self, tweet):
+        line = "%s\n" % self._encode(tweet)
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        self._buffered_lines.append(line)
+        self._buffered_bytes += len(line)
+        if self._buffered_bytes >= self._buffer_size:
+            self._flush()
+
+
+class BackgroundTweetWriter(threading.Thread):
+    """
+    Saves lists of Tweets to files on a background thread, so that
+    serialization, compression and disk writes don't block the thread
+    that is crawling the Twitter API.
+
+    save_tweets() returns as soon as the Tweets are queued.  At most
+    max_queued_files lists of Tweets are queued at once; if the disk
+    can't keep up, save_tweets() blocks until there is room.  If the
+    background thread fails, the exception is re-raised by the next
+    call to save_tweets(), flush() or close(), and no more files are
+    written.
+
+    To record that a file has been written (e.g. in a CrawlManifest),
+    pass an on_saved callback to save_tweets().  Callbacks are called
+    on the thread that calls save_tweets(), flush() and close(), once
+    the file has been written, and are never called for files that
+    couldn't be written.
+
+    Usage:
+      tweet_writer = BackgroundTweetWriter(compression='gzip')
+      tweet_writer.save_tweets(tweets, 'charman.tweets',  # Saved as 'charman.tweets.gz'
+                               on_saved=functools.partial(manifest.record_tweets, 'charman', tweets))
+      tweet_writer.close()
+    """
+    def __init__(self, compression=None, compression_level=6, buffer_size=2**20, json_encoder='json',
+                 max_queued_files=16, logger=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self._compression = compression
+        self._compression_level = compression_level
+        self._buffer_size = buffer_size
+        self._json_encoder = json_encoder
+        self._logger = logger
+
+        # Fail fast if an optional encoder isn't installed
+        get_json_encoder(json_encoder)
+
+        self._queue = Queue.Queue(max_queued_files)
+        self._exception = None
+        # on_saved callbacks of files that have been written, waiting to be called by the calling thread
+        self._saved_callbacks = collections.deque()
+        self.start()
+
+    def get_filename(self, json_filename):
+        """
+        Returns the name of the file that save_tweets() will actually
+        write for json_filename
+        """
+        return add_compression_extension(json_filename, self._compression)
+
+    def save_tweets(self, tweets, json_filename, on_saved=None):
+        """
+        Queues a list of Tweets to be saved to json_filename (plus the
+        extension for the compression type, if any).  on_saved is an
+        optional function, called with no arguments after the file has
+        been written.
+        """
+        self._call_saved_callbacks()
+        self._raise_background_exception()
+        self._queue.put((tweets, self.get_filename(json_filename), on_saved))
+
+    def close(self):
+        """
+        Waits for all queued Tweets to be written
+        """
+        self._queue.put(None)
+        self.join()
+        self._call_saved_callbacks()
+        self._raise_background_exception()
+
+    def flush(self):
+        """
+        Waits for all queued Tweets to be written, without stopping
+        the background thread
+        """
+        self._queue.join()
+        self._call_saved_callbacks()
+        self._raise_background_exception()
+
+    def run(self):
+        while 1:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                if self._exception is None:
+                    self._write_job(job)
+            finally:
+                self._queue.task_done()
+
+    def _call_saved_callbacks(self):
+        while self._saved_callbacks:
+            self._saved_callbacks.popleft()()
+
+    def _write_job(self, job):
+        tweets, json_filename, on_saved = job
+        try:
+            writer = TweetWriter(json_filename, self._compression, self._compression_level,
+                                 self._buffer_size, self._json_encoder)
+            writer.write_tweets(tweets)
+            writer.close()
+        except Exception as e:
+            if self._logger:
+                self._logger.error("Unable to save Tweets to '%s': %s" % (json_filename, e))
+            self._exception = e
+        else:
+            if on_saved is not None:
+                self._saved_callbacks.append(on_saved)
+
+    def _raise_background_exception(self):
+        if self._exception is not None:
+            raise self._exception
@@ -8,15 +8,55 @@ import datetime
 import itertools
 import json
 import logging
+import os
+import threading
 import time
 
 # Third party modules
-from twython import Twython, TwythonError
+from requests_oauthlib import OAuth2
+from twython import Twython, TwythonAuthError, TwythonError
+
+# Local modules
+from crawl_profiler import get_default_profiler
+from crawler_metrics import DEFAULT_DURATION_BUCKETS, get_default_registry
+from retry_policy import RetryPolicy
+from tweet_writer import TweetWriter
+from twitter_transport import DEFAULT_POOL_SIZE, configure_twython_transport
+
+
+# Bearer tokens for application-only authentication are cached in this file
+DEFAULT_BEARER_TOKEN_CACHE_FILENAME = os.path.expanduser(os.path.join('~', '.trawler', 'bearer_tokens.json'))
 
 
 
 ###  Functions  ###
 
+def get_app_auth_twython(consumer_key, consumer_secret, token_cache_filename=DEFAULT_BEARER_TOKEN_CACHE_FILENAME,
+                         pool_size=DEFAULT_POOL_SIZE):
+    """
+    Returns a Twython instance that uses application-only (OAuth 2)
+    authentication.
+
+    Obtaining a bearer token takes an extra HTTPS round trip, so the
+    token is cached in token_cache_filename (a JSON file mapping
+    consumer keys to bearer tokens, readable only by the current user)
+    and reused by later runs.  Pass token_cache_filename=None to
+    always obtain a new token.  A cache file that can't be read or
+    parsed is replaced.  If Twitter rejects a cached token (e.g.
+    because it was invalidated), RateLimitedTwitterEndpoint drops it
+    from the cache and obtains a new token (see
+    AppAuthTwython.renew_access_token()).
+
+    The Twython instance keeps up to pool_size connections to the API
+    open for reuse and asks for compressed responses (see
+    configure_twython_transport()).  pool_size should be at least the
+    number of threads that share the instance.
+    """
+    twython = AppAuthTwython(consumer_key, consumer_secret, token_cache_filename)
+    configure_twython_transport(twython, pool_size=pool_size)
+    return twython
+
+
 def get_console_info_logger():
     """
     Return a logger that logs INFO and above to stderr
@@ -63,29 +103,151 @@ def save_screen_names_to_file(screen_names, filename, logger):
     f.close()
 
 
-def save_tweets_to_json_file(tweets, json_filename):
+def save_tweets_to_json_file(tweets, json_filename, compression=None, compression_level=6, json_encoder='json'):
     """
     Takes a Python dictionary of Tweets from the Twython API, and
     saves the Tweets to a JSON file, storing one JSON object per
     line.
+
+    The file can optionally be gzip or zstd compressed; see
+    tweet_writer.TweetWriter.
+    """
+    json_file = TweetWriter(json_filename, compression, compression_level, json_encoder=json_encoder)
+    json_file.write_tweets(tweets)
+    json_file.close()
+
+
+def _get_bearer_token(consumer_key, consumer_secret, token_cache_filename):
+    """
+    Returns the cached bearer token for consumer_key, or obtains and
+    caches a new bearer token
+    """
+    bearer_tokens = _read_bearer_tokens(token_cache_filename)
+    access_token = bearer_tokens.get(consumer_key)
+    if access_token is None:
+        access_token = _obtain_bearer_token(consumer_key, consumer_secret)
+        if token_cache_filename:
+            bearer_tokens[consumer_key] = access_token
+            _write_bearer_tokens(bearer_tokens, token_cache_filename)
+    return access_token
+
+
+def _obtain_bearer_token(consumer_key, consumer_secret):
+    return Twython(consumer_key, consumer_secret, oauth_version=2).obtain_access_token()
+
+
+def _read_bearer_tokens(token_cache_filename):
+    """
+    Returns the dictionary of cached bearer tokens, which is empty if
+    the cache file doesn't exist or can't be read or parsed
+    """
+    if not token_cache_filename or not os.path.exists(token_cache_filename):
+        return {}
+    try:
+        bearer_tokens = json.load(open(token_cache_filename))
+    except (IOError, ValueError):
+        return {}
+    if not isinstance(bearer_tokens, dict):
+        return {}
+    return bearer_tokens
+
+
+def _write_bearer_tokens(bearer_tokens, token_cache_filename):
+    try:
+        _write_private_json_file(bearer_tokens, token_cache_filename)
+    except (IOError, OSError):
+        # The cache only saves a round trip per run, so a cache file
+        # that can't be written is not an error
+        pass
+
+
+def _write_private_json_file(data, json_filename):
     """
-    json_file = codecs.open(json_filename, "w", "utf-8")
-    for tweet in tweets:
-        json_file.write("%s\n" % json.dumps(tweet))
+    Atomically writes data to a JSON file that only the current user
+    can read
+    """
+    json_path = os.path.dirname(json_filename)
+    if json_path and not os.path.exists(json_path):
+        os.makedirs(json_path, 0700)
+    temporary_filename = json_filename + '.tmp'
+    json_file = os.fdopen(os.open(temporary_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600), 'w')
+    json.dump(data, json_file)
     json_file.close()
+    os.rename(temporary_filename, json_filename)
 
 
 
 ###  Classes  ###
 
+class AppAuthTwython(Twython):
+    """
+    A Twython instance that uses application-only (OAuth 2)
+    authentication with a bearer token, which is cached in
+    token_cache_filename.  Use get_app_auth_twython() to create
+    instances.
+    """
+    def __init__(self, consumer_key, consumer_secret, token_cache_filename=DEFAULT_BEARER_TOKEN_CACHE_FILENAME):
+        self.token_cache_filename = token_cache_filename
+        access_token = _get_bearer_token(consumer_key, consumer_secret, token_cache_filename)
+        Twython.__init__(self, consumer_key, consumer_secret, access_token=access_token)
+
+    def renew_access_token(self):
+        """
+        Replaces a bearer token that Twitter rejected.  The rejected
+        token is dropped from the token cache, and a new token is
+        obtained and cached - unless another process has already
+        cached a new token.
+        """
+        bearer_tokens = _read_bearer_tokens(self.token_cache_filename)
+        if bearer_tokens.get(self.app_key) == self.access_token:
+            del bearer_tokens[self.app_key]
+            _write_bearer_tokens(bearer_tokens, self.token_cache_filename)
+        self.access_token = _get_bearer_token(self.app_key, self.app_secret, self.token_cache_filename)
+        self.client.auth = OAuth2(self.app_key, token={'token_type': 'bearer', 'access_token': self.access_token})
+
+
 class CrawlTwitterTimelines:
-    def __init__(self, twython, logger=None):
+    def __init__(self, twython, logger=None, metrics=None, pacing=False, response_cache=None, retry_policy=None):
+        """
+        metrics -- an optional crawler_metrics.MetricsRegistry instance.
+        If not specified, the default registry is used.
+
+        pacing -- if True, API calls are spread evenly over each rate
+        limit window (see RateLimitedTwitterEndpoint).
+
+        response_cache -- an optional api_response_cache.ApiResponseCache
+        instance (see RateLimitedTwitterEndpoint).
+
+        retry_policy -- an optional retry_policy.RetryPolicy instance
+        (see RateLimitedTwitterEndpoint).
+        """
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._twitter_endpoint = RateLimitedTwitterEndpoint(twython, "statuses/user_timeline", logger=self._logger)
+        if metrics is None:
+            metrics = get_default_registry()
+        self._timelines_metric = metrics.counter('trawler_timelines_crawled_total',
+                                                 "User timelines crawled").labels()
+        self._tweets_metric = metrics.counter('trawler_tweets_retrieved_total',
+                                              "Tweets retrieved from user timelines").labels()
+        self._tweets_per_second_metric = metrics.gauge('trawler_timeline_tweets_per_second',
+                                                       "Tweets per second for the most recent timeline crawl").labels()
+        self._crawl_seconds_metric = metrics.histogram('trawler_timeline_crawl_seconds',
+                                                       "Time taken to crawl one user timeline",
+                                                       buckets=DEFAULT_DURATION_BUCKETS).labels()
+
+        self._twitter_endpoint = RateLimitedTwitterEndpoint(twython, "statuses/user_timeline", logger=self._logger,
+                                                            metrics=metrics, pacing=pacing,
+                                                            response_cache=response_cache, retry_policy=retry_policy)
+
+
+    def get_endpoints(self):
+        """
+        Returns the RateLimitedTwitterEndpoint instances used by this class
+        """
+        return [self._twitter_endpoint]
 
 
     def get_all_timeline_tweets_for_screen_name(self, screen_name):
@@ -106,12 +268,14 @@ class CrawlTwitterTimelines:
         MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS = 100
 
         self._logger.info("Retrieving Tweets for user '%s'" % screen_name)
+        start_time = time.time()
 
         # Retrieve first batch of Tweets
         tweets = self._twitter_endpoint.get_data(screen_name=screen_name, count=200)
         self._logger.info("  Retrieved first %d Tweets for user '%s'" % (len(tweets), screen_name))
 
         if len(tweets) < MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS:
+            self._record_timeline_metrics(tweets, start_time)
             return tweets
 
         # Retrieve rest of Tweets
@@ -122,6 +286,7 @@ class CrawlTwitterTimelines:
             self._logger.info("  Retrieved %d Tweets for user '%s' with max_id='%d'" % (len(more_tweets), screen_name, max_id))
 
             if len(more_tweets) < MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS:
+                self._record_timeline_metrics(tweets, start_time)
                 return tweets
 
     def get_all_timeline_tweets_for_screen_name_since(self, screen_name, since_id):
@@ -143,12 +308,14 @@ class CrawlTwitterTimelines:
         MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS = 100
 
         self._logger.info("Retrieving Tweets for user '%s'" % screen_name)
+        start_time = time.time()
 
         # Retrieve first batch of Tweets
         tweets = self._twitter_endpoint.get_data(screen_name=screen_name, count=200, since_id=since_id)
         self._logger.info("  Retrieved first %d Tweets for user '%s'" % (len(tweets), screen_name))
 
         if len(tweets) < MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS:
+            self._record_timeline_metrics(tweets, start_time)
             return tweets
 
         # Retrieve rest of Tweets
@@ -159,34 +326,107 @@ class CrawlTwitterTimelines:
             self._logger.info("  Retrieved %d Tweets for user '%s' with max_id='%d'" % (len(more_tweets), screen_name, since_id))
 
             if len(more_tweets) < MINIMUM_TWEETS_REQUIRED_FOR_MORE_API_CALLS:
+                self._record_timeline_metrics(tweets, start_time)
                 return tweets
 
+    def _record_timeline_metrics(self, tweets, start_time):
+        elapsed_seconds = time.time() - start_time
+        self._timelines_metric.inc()
+        self._tweets_metric.inc(len(tweets))
+        self._crawl_seconds_metric.observe(elapsed_seconds)
+        if elapsed_seconds > 0:
+            self._tweets_per_second_metric.set(len(tweets) / elapsed_seconds)
+
 
 
 class FindFriendFollowers:
-    def __init__(self, twython, logger=None):
+    def __init__(self, twython, logger=None, ff_graph=None, metrics=None, pacing=False, response_cache=None,
+                 retry_policy=None):
+        """
+        ff_graph -- an optional twitter_graph.FriendFollowerGraph
+        instance.  The complete Friends and Followers lists of every
+        user crawled are added to the graph, and users already in the
+        graph are answered from the graph without any API calls.
+
+        metrics -- an optional crawler_metrics.MetricsRegistry instance.
+        If not specified, the default registry is used.
+
+        pacing -- if True, API calls are spread evenly over each rate
+        limit window (see RateLimitedTwitterEndpoint).
+
+        response_cache -- an optional api_response_cache.ApiResponseCache
+        instance (see RateLimitedTwitterEndpoint).
+
+        retry_policy -- an optional retry_policy.RetryPolicy instance
+        (see RateLimitedTwitterEndpoint).
+        """
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._friend_endpoint = RateLimitedTwitterEndpoint(twython, "friends/ids", logger=self._logger)
-        self._follower_endpoint = RateLimitedTwitterEndpoint(twython, "followers/ids", logger=self._logger)
-        self._user_lookup_endpoint = RateLimitedTwitterEndpoint(twython, "users/lookup", logger=self._logger)
+        self._ff_graph = ff_graph
+
+        if metrics is None:
+            metrics = get_default_registry()
+        ff_users_metric = metrics.counter('trawler_ff_users_total',
+                                          "Users whose Friends and Followers were found", ['source'])
+        self._ff_users_crawled_metric = ff_users_metric.labels(source='api')
+        self._ff_users_from_graph_metric = ff_users_metric.labels(source='graph')
+        self._ff_ids_metric = metrics.counter('trawler_ff_ids_retrieved_total',
+                                              "Friend and Follower IDs retrieved from the API").labels()
+
+        self._friend_endpoint = RateLimitedTwitterEndpoint(twython, "friends/ids", logger=self._logger,
+                                                           metrics=metrics, pacing=pacing,
+                                                           response_cache=response_cache, retry_policy=retry_policy)
+        self._follower_endpoint = RateLimitedTwitterEndpoint(twython, "followers/ids", logger=self._logger,
+                                                             metrics=metrics, pacing=pacing,
+                                                             response_cache=response_cache, retry_policy=retry_policy)
+        self._user_lookup_endpoint = RateLimitedTwitterEndpoint(twython, "users/lookup", logger=self._logger,
+                                                                metrics=metrics, pacing=pacing,
+                                                                response_cache=response_cache, retry_policy=retry_policy)
+
+
+    def get_endpoints(self):
+        """
+        Returns the RateLimitedTwitterEndpoint instances used by this class
+        """
+        return [self._friend_endpoint, self._follower_endpoint, self._user_lookup_endpoint]
+
+
+    def get_friend_ids_for_screen_name(self, screen_name):
+        """
+        Returns the Twitter user IDs of all users the specified
+        screen_name follows, following the 'next_cursor' links
+        until every page has been retrieved.
+        """
+        return self._get_all_ids_with_cursor(self._friend_endpoint, screen_name)
+
+
+    def get_follower_ids_for_screen_name(self, screen_name):
+        """
+        Returns the Twitter user IDs of all users who follow the
+        specified screen_name, following the 'next_cursor' links
+        until every page has been retrieved.
+        """
+        return self._get_all_ids_with_cursor(self._follower_endpoint, screen_name)
 
 
     def get_ff_ids_for_screen_name(self, screen_name):
         """
         Returns Twitter user IDs for users who are both Friends and Followers
         for the specified screen_name.
-
-        The 'friends/ids' and 'followers/ids' endpoints return at most 5000 IDs,
-        so IF a user has more than 5000 friends or followers, this function WILL
-        NOT RETURN THE CORRECT ANSWER
         """
+        if self._ff_graph is not None:
+            user_id = self._ff_graph.get_user_id(screen_name)
+            if user_id is not None:
+                self._logger.info("Friends and Followers for '%s' already crawled - will not refetch" % screen_name)
+                self._ff_users_from_graph_metric.inc()
+                return [int(ff_id) for ff_id in self._ff_graph.get_reciprocal_ids(user_id)]
+
         try:
-            friend_ids = self._friend_endpoint.get_data(screen_name=screen_name)[u'ids']
-            follower_ids = self._follower_endpoint.get_data(screen_name=screen_name)[u'ids']
+            friend_ids = self.get_friend_ids_for_screen_name(screen_name)
+            follower_ids = self.get_follower_ids_for_screen_name(screen_name)
         except TwythonError as e:
             if e.error_code == 404:
                 self._logger.warn("HTTP 404 error - Most likely, Twitter user '%s' no longer exists" % screen_name)
@@ -195,8 +435,16 @@ class FindFriendFollowers:
             else:
                 # Unhandled exception
                 raise e
-            friend_ids = []
-            follower_ids = []
+            return []
+
+        self._ff_users_crawled_metric.inc()
+        self._ff_ids_metric.inc(len(friend_ids) + len(follower_ids))
+
+        if self._ff_graph is not None:
+            # The ids endpoints don't return the ID of the user being crawled
+            user = self._user_lookup_endpoint.get_data(screen_name=screen_name, entities=False)[0]
+            self._ff_graph.add_user(user[u'id'], friend_ids, follower_ids, screen_name=user[u'screen_name'])
+            return [int(ff_id) for ff_id in self._ff_graph.get_reciprocal_ids(user[u'id'])]
 
         return list(set(friend_ids).intersection(set(follower_ids)))
 
@@ -206,16 +454,128 @@ class FindFriendFollowers:
         Returns Twitter screen names for users who are both Friends and Followers
         for the specified screen_name.
         """
+        return [user[u'screen_name'] for user in self.get_ff_users_for_screen_name(screen_name)]
+
+
+    def get_ff_users_for_screen_name(self, screen_name):
+        """
+        Returns Twitter user objects (as returned by 'users/lookup')
+        for users who are both Friends and Followers for the specified
+        screen_name.
+        """
         ff_ids = self.get_ff_ids_for_screen_name(screen_name)
 
-        ff_screen_names = []
+        ff_users = []
         # The Twitter API allows us to look up info for 100 users at a time
         for ff_id_subset in grouper(ff_ids, 100):
             user_ids = ','.join([str(id) for id in ff_id_subset if id is not None])
-            users = self._user_lookup_endpoint.get_data(user_id=user_ids, entities=False)
-            for user in users:
-                ff_screen_names.append(user[u'screen_name'])
-        return ff_screen_names
+            ff_users += self._user_lookup_endpoint.get_data(user_id=user_ids, entities=False)
+        return ff_users
+
+
+    def _get_all_ids_with_cursor(self, endpoint, screen_name):
+        """
+        The 'friends/ids' and 'followers/ids' endpoints return at most
+        5000 IDs per call, along with a cursor for the next page:
+          https://dev.twitter.com/docs/misc/cursoring
+        """
+        ids = []
+        cursor = -1
+        while cursor != 0:
+            response = endpoint.get_data(screen_name=screen_name, cursor=cursor, count=5000)
+            ids += response[u'ids']
+            cursor = response[u'next_cursor']
+            if cursor != 0:
+                self._logger.info("  Retrieved %d IDs so far for user '%s', requesting next page" % (len(ids), screen_name))
+        return ids
+
+
+class HydrateTweets:
+    """
+    Retrieves complete Tweet objects for lists of Tweet IDs (e.g. from
+    a shared dataset), using the 'statuses/lookup' endpoint, which
+    accepts up to 100 Tweet IDs per call:
+
+      https://dev.twitter.com/docs/api/1.1/get/statuses/lookup
+    """
+    MAX_IDS_PER_CALL = 100
+
+    def __init__(self, twython, logger=None, metrics=None, pacing=False, response_cache=None, retry_policy=None):
+        """
+        metrics -- an optional crawler_metrics.MetricsRegistry instance.
+        If not specified, the default registry is used.
+
+        pacing -- if True, API calls are spread evenly over each rate
+        limit window (see RateLimitedTwitterEndpoint).
+
+        response_cache -- an optional api_response_cache.ApiResponseCache
+        instance (see RateLimitedTwitterEndpoint).
+
+        retry_policy -- an optional retry_policy.RetryPolicy instance
+        (see RateLimitedTwitterEndpoint).
+        """
+        if logger is None:
+            self._logger = get_console_info_logger()
+        else:
+            self._logger = logger
+
+        if metrics is None:
+            metrics = get_default_registry()
+        hydrated_ids_metric = metrics.counter('trawler_hydrated_tweet_ids_total',
+                                              "Tweet IDs looked up with 'statuses/lookup'", ['result'])
+        self._found_metric = hydrated_ids_metric.labels(result='found')
+        self._missing_metric = hydrated_ids_metric.labels(result='missing')
+
+        self._lookup_endpoint = RateLimitedTwitterEndpoint(twython, "statuses/lookup", logger=self._logger,
+                                                           metrics=metrics, pacing=pacing,
+                                                           response_cache=response_cache, retry_policy=retry_policy)
+
+
+    def get_endpoints(self):
+        """
+        Returns the RateLimitedTwitterEndpoint instances used by this class
+        """
+        return [self._lookup_endpoint]
+
+
+    def get_tweets_for_ids(self, tweet_ids):
+        """
+        Looks up at most 100 Tweet IDs with a single API call.  Returns
+        a (tweets, missing_ids) tuple, where tweets is a list of the
+        Tweets that were found (in the same order as tweet_ids), and
+        missing_ids is a list of the IDs of Tweets that have been
+        deleted, or that belong to suspended or protected users.
+        """
+        if len(tweet_ids) > self.MAX_IDS_PER_CALL:
+            raise ValueError("At most %d Tweet IDs can be looked up per API call" % self.MAX_IDS_PER_CALL)
+
+        # With map=true, the response maps every requested ID to either a Tweet or null
+        response = self._lookup_endpoint.get_data(id=','.join([str(tweet_id) for tweet_id in tweet_ids]),
+                                                  map=True, include_entities=True)
+        tweets_by_id = response[u'id']
+
+        tweets = []
+        missing_ids = []
+        for tweet_id in tweet_ids:
+            tweet = tweets_by_id.get(str(tweet_id))
+            if tweet is None:
+                missing_ids.append(tweet_id)
+            else:
+                tweets.append(tweet)
+        self._found_metric.inc(len(tweets))
+        self._missing_metric.inc(len(missing_ids))
+        return tweets, missing_ids
+
+
+    def hydrate_tweet_ids(self, tweet_ids):
+        """
+        Takes any iterable of Tweet IDs (which can be a generator that
+        streams IDs from a file), and generates a (tweets, missing_ids)
+        tuple for each group of 100 IDs.  See get_tweets_for_ids().
+        """
+        for tweet_id_subset in grouper(tweet_ids, self.MAX_IDS_PER_CALL):
+            tweet_id_subset = [tweet_id for tweet_id in tweet_id_subset if tweet_id is not None]
+            yield self.get_tweets_for_ids(tweet_id_subset)
 
 
 
@@ -233,14 +593,69 @@ class RateLimitedTwitterEndpoint:
     get_data(), that is a thin wrapper around the Twitter API.  If the
     rate limit for the current window has been reached, the get_data()
     function will block for up to 15 minutes until the next rate limit
-    window starts.
+    window starts.  The endpoint's rate limit status is first requested
+    by the first call to get_data(), so creating an instance that is
+    never used costs no API calls.
+
+    By default, get_data() makes API calls as fast as it is called
+    until the window's allotment is used up, and then sleeps until the
+    window ends.  In pacing mode, the calls remaining in the current
+    window are instead spread evenly over the rest of the window using
+    a token bucket: tokens accumulate at a rate of (calls remaining /
+    seconds remaining), up to PACING_BURST_SIZE tokens, and each call
+    spends one token.  Bursts of up to PACING_BURST_SIZE calls are
+    still made without waiting, and each new window starts with a
+    full bucket.  Both modes make the same number of
+    calls per window, but pacing mode delivers data at a steady rate
+    instead of in bursts separated by long sleeps.
 
     Only one RateLimitedTwitterEndpoint instance should be running
     anywhere in the world per (Twitter API key, Twitter API endpoint)
     pair.  Each class instance assumes it is the only program using up
-    the API calls available for the current rate limit window.
+    the API calls available for the current rate limit window.  An
+    instance can be shared by several threads; the rate limit
+    bookkeeping is protected by a lock, and API calls are made
+    concurrently.
+
+    The timing constants below are tuned for the real Twitter API.
+    They can be overridden (e.g. by load tests that run against a
+    local mock server with much shorter rate limit windows).
+
+    Every API call, error, sleep and retry is recorded in a
+    crawler_metrics.MetricsRegistry, labelled with the endpoint name.
+
+    If a response cache is given, get_data() returns cached responses
+    (see api_response_cache.py) without making an API call.
+
+    Calls that fail with a transient error (a rate limit, server or
+    connection error) are retried, with the waits and the errors that
+    are retried decided by a retry_policy.RetryPolicy.  Each instance
+    also has a retry_policy.CircuitBreaker, so that while the endpoint
+    is failing, the threads sharing the instance wait together and
+    only one of them probes the endpoint.
     """
-    def __init__(self, twython, twitter_api_endpoint, logger=None):
+    # Default retry policy: retries wait a random time of up to INITIAL_BACKOFF_SECONDS,
+    # doubled after each retry up to MAX_BACKOFF_SECONDS
+    INITIAL_BACKOFF_SECONDS = 60
+    MAX_BACKOFF_SECONDS = 900
+
+    # Default circuit breaker: opened by this many consecutive transient errors...
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+
+    # ...for this many seconds
+    CIRCUIT_BREAKER_RESET_SECONDS = 60
+
+    # Padding added to the end of a rate limit window to compensate for clock skew
+    RATE_LIMIT_PADDING_SECONDS = 15
+
+    # Time to sleep if the rate limit window has expired but the limit hasn't been reset yet
+    RATE_LIMIT_EXPIRED_SLEEP_SECONDS = 60
+
+    # Number of calls that can be made back-to-back in pacing mode
+    PACING_BURST_SIZE = 5
+
+    def __init__(self, twython, twitter_api_endpoint, logger=None, metrics=None, pacing=False, response_cache=None,
+                 retry_policy=None):
         """
         twython -- an instance of a twython.Twython object that has
         been initialized with a valid set of Twitter API credentials.
@@ -254,18 +669,54 @@ class RateLimitedTwitterEndpoint:
           https://dev.twitter.com/docs/api/1.1
 
         logger -- an optional instance of a logging.Logger class.
+
+        metrics -- an optional crawler_metrics.MetricsRegistry instance.
+        If not specified, the default registry is used.
+
+        pacing -- if True, spread the API calls for each rate limit
+        window evenly over the window, instead of making them as fast
+        as possible and then sleeping until the window ends.
+
+        response_cache -- an optional api_response_cache.ApiResponseCache
+        instance.  Responses served from the cache don't count against
+        the rate limit.
+
+        retry_policy -- an optional retry_policy.RetryPolicy instance.
+        If not specified, a policy using the class's backoff and
+        circuit breaker constants is used.
         """
         self._twython = twython
         self._twitter_api_endpoint = twitter_api_endpoint
         self._twitter_api_endpoint_with_prefix = '/' + twitter_api_endpoint
         self._twitter_api_resource = twitter_api_endpoint.split('/')[0]
+        self._seconds_slept = 0.0
+        self._lock = threading.Lock()
+        self._response_cache = response_cache
+
+        if retry_policy is None:
+            retry_policy = RetryPolicy(initial_backoff=self.INITIAL_BACKOFF_SECONDS, max_backoff=self.MAX_BACKOFF_SECONDS,
+                                       failure_threshold=self.CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                                       reset_seconds=self.CIRCUIT_BREAKER_RESET_SECONDS)
+        self._retry_policy = retry_policy
+        self._circuit_breaker = retry_policy.make_circuit_breaker()
+
+        self._pacing = pacing
+        self._pacing_tokens = float(self.PACING_BURST_SIZE)
+        self._pacing_tokens_updated = time.time()
 
         if logger is None:
             self._logger = get_console_info_logger()
         else:
             self._logger = logger
 
-        self._update_rate_limit_status()
+        if metrics is None:
+            metrics = get_default_registry()
+        self._init_metrics(metrics)
+        self._profiler = get_default_profiler()
+
+        # The rate limit status is requested by the first call to get_data()
+        self._api_calls_remaining_for_current_window = None
+        self._current_rate_limit_window_ends = None
 
 
     def get_data(self, **twitter_api_parameters):
@@ -276,67 +727,105 @@ class RateLimitedTwitterEndpoint:
         This function can block for up to 15 minutes if the rate limit
         for this endpoint's window has already been reached.
         """
-        return self._get_data_with_backoff(60, **twitter_api_parameters)
+        if self._response_cache is not None:
+            return self._response_cache.get_or_fetch(self._twitter_api_endpoint, twitter_api_parameters,
+                                                     self._get_data_from_api)
+        return self._get_data_from_api(**twitter_api_parameters)
 
 
-    def _get_data_with_backoff(self, backoff, **twitter_api_parameters):
-        self._sleep_if_rate_limit_reached()
-        self._api_calls_remaining_for_current_window -= 1
+    def get_seconds_slept(self):
+        """
+        Returns the total number of seconds this instance has spent
+        sleeping, either waiting for a new rate limit window or backing
+        off after an error
+        """
+        return self._seconds_slept
+
+
+    def _get_data_from_api(self, **twitter_api_parameters):
+        attempt = 0
+        try:
+            while 1:
+                seconds_to_wait = self._circuit_breaker.acquire()
+                if seconds_to_wait > 0:
+                    self._sleep(seconds_to_wait, self._circuit_open_slept_metric)
+                    continue
+
+                try:
+                    data = self._call_api(twitter_api_parameters)
+                except Exception as e:
+                    retry_reason = self._retry_policy.get_retry_reason(e)
+                    if retry_reason is None:
+                        # The API responded, e.g. with an HTTP 404 error for a missing user
+                        self._circuit_breaker.record_success()
+                        raise
+                    if self._circuit_breaker.record_failure():
+                        self._logger.error("Circuit breaker opened for '%s' after repeated errors - pausing calls for %d seconds" %
+                                           (self._twitter_api_endpoint, self._retry_policy.reset_seconds))
+                    if not self._retry_policy.should_retry(attempt):
+                        raise
+
+                    backoff = self._retry_policy.get_backoff_seconds(attempt)
+                    self._logger.error("Retrying '%s' after %s (attempt %d) - sleeping for %.2f seconds" %
+                                       (self._twitter_api_endpoint, retry_reason.replace('_', ' '), attempt + 1, backoff))
+                    self._retries_metric.labels(self._twitter_api_endpoint, retry_reason).inc()
+                    self._sleep(backoff, self._backoff_slept_metric)
+                    if retry_reason == 'rate_limit':
+                        # Our count of the calls remaining was wrong, so ask Twitter for the real count
+                        self._lock.acquire()
+                        try:
+                            self._update_rate_limit_status()
+                        finally:
+                            self._lock.release()
+                    attempt += 1
+                    self._backoff_depth_metric.set(attempt)
+                else:
+                    self._circuit_breaker.record_success()
+                    return data
+        finally:
+            self._backoff_depth_metric.set(0)
+
+
+    def _call_api(self, twitter_api_parameters):
+        # Other threads wait while this thread sleeps for the rate limit
+        self._lock.acquire()
         try:
-            return self._twython.get(self._twitter_api_endpoint, params=twitter_api_parameters)
+            if self._api_calls_remaining_for_current_window is None:
+                self._update_rate_limit_status()
+            self._sleep_if_rate_limit_reached()
+            if self._pacing:
+                self._wait_for_pacing_token()
+            self._api_calls_remaining_for_current_window -= 1
+            self._calls_remaining_metric.set(self._api_calls_remaining_for_current_window)
+        finally:
+            self._lock.release()
+        self._calls_metric.inc()
+        start_time = time.time()
+        try:
+            with self._profiler.span('network'):
+                data = self._twython.get(self._twitter_api_endpoint, params=twitter_api_parameters)
+            self._latency_metric.observe(time.time() - start_time)
+            return data
         except TwythonError as e:
-            self._logger.error("TwythonError: %s" % e)
-            
             # Twitter error codes:
             #    https://dev.twitter.com/docs/error-codes-responses
-
-            # Update rate limit status if exception is 'Too Many Requests'
+            self._latency_metric.observe(time.time() - start_time)
+            self._logger.error("TwythonError: %s" % e)
+            self._errors_metric.labels(self._twitter_api_endpoint, e.error_code).inc()
             if e.error_code == 429:
                 self._logger.error("Rate limit exceeded for '%s'. Number of expected remaining API calls for current window: %d" %
                                   (self._twitter_api_endpoint, self._api_calls_remaining_for_current_window + 1))
-                time.sleep(backoff)
-                self._update_rate_limit_status()
-                return self._get_data_with_backoff(backoff*2, **twitter_api_parameters)
-            # Sleep if Twitter servers are misbehaving 
-            elif e.error_code in [502, 503, 504]:
-                self._logger.error("Twitter servers are misbehaving - sleeping for %d seconds" % backoff)
-                time.sleep(backoff)
-                return self._get_data_with_backoff(backoff*2, **twitter_api_parameters)
-            # Sleep if Twitter servers returned an empty HTTPS response
-            elif "Caused by <class 'httplib.BadStatusLine'>: ''" in str(e):
-                # Twitter servers can sometimes return an empty HTTP response, e.g.:
-                #   https://dev.twitter.com/discussions/20832
-                # 
-                # The code currently detects empty HTTPS responses by checking for a particular
-                # string:
-                #   Caused by <class 'httplib.BadStatusLine'>: ''"
-                # in the exception message text, which is fragile and definitely not ideal.  Twython
-                # uses the Requests library, and the "Caused by %s: %s" string comes from the
-                # version of urllib3 that is bundled with the Requests library.  Upgrading to a
-                # newer version of the Requests library (this code tested with requests 2.0.0) may
-                # break the detection of empty HTTPS responses.
-                #
-                # The httplib library (which is part of the Python Standard Library) throws the
-                # httplib.BadStatusLine exception, which is caught by urllib3, and then re-thrown
-                # (with the "Caused by" text) as a urllib3.MaxRetryError.  The Requests library
-                # catches the urllib3.MaxRetryError and throws a requests.ConnectionError, and
-                # Twython catches the requests.ConnectionError and throws a TwythonError exception -
-                # which we catch in this function.
-                self._logger.error("Received an empty HTTPS response from Twitter servers - sleeping for %d seconds" % backoff)
-                time.sleep(backoff)
-                return self._get_data_with_backoff(backoff*2, **twitter_api_parameters)
-            # For all other TwythonErrors, reraise the exception
-            else:
-                raise e
+            raise
 
 
     def _sleep_if_rate_limit_reached(self):
-        if self._api_calls_remaining_for_current_window < 1:
+        # Sleep some more if necessary after updating the rate limit status
+        while self._api_calls_remaining_for_current_window < 1:
             current_time = time.time()
             seconds_to_sleep = self._current_rate_limit_window_ends - current_time
 
             # Pad the sleep time by 15 seconds to compensate for possible clock skew
-            seconds_to_sleep += 15
+            seconds_to_sleep += self.RATE_LIMIT_PADDING_SECONDS
 
             # If the number of calls available is 0 and the rate limit window has already
             # expired, we sleep for 60 seconds before calling self._update_rate_limit_status()
@@ -347,26 +836,110 @@ class RateLimitedTwitterEndpoint:
             # an updated window expiration timestamp and an updated (non-zero) count for
             # the number of API calls available.
             if seconds_to_sleep < 0:
-                seconds_to_sleep = 60
+                seconds_to_sleep = self.RATE_LIMIT_EXPIRED_SLEEP_SECONDS
 
             sleep_until = datetime.datetime.fromtimestamp(current_time + seconds_to_sleep).strftime("%Y-%m-%d %H:%M:%S")
             self._logger.info("Rate limit reached for '%s', sleeping for %.2f seconds (until %s)" % \
                                  (self._twitter_api_endpoint, seconds_to_sleep, sleep_until))
-            time.sleep(seconds_to_sleep)
+            self._sleep(seconds_to_sleep, self._rate_limit_slept_metric)
 
             self._update_rate_limit_status()
+            # The calls in the new window can start with a burst
+            self._pacing_tokens = float(self.PACING_BURST_SIZE)
+            self._pacing_tokens_updated = time.time()
+
+
+    def _init_metrics(self, metrics):
+        # Look up the labelled metrics once, so that recording them is cheap
+        endpoint = self._twitter_api_endpoint
+        self._calls_metric = metrics.counter('trawler_api_calls_total',
+                                             "Twitter API calls made", ['endpoint']).labels(endpoint)
+        self._errors_metric = metrics.counter('trawler_api_errors_total',
+                                              "Twitter API calls that failed, by HTTP status code", ['endpoint', 'status'])
+        seconds_slept_metric = metrics.counter('trawler_api_seconds_slept_total',
+                                               "Seconds spent sleeping before Twitter API calls", ['endpoint', 'reason'])
+        self._rate_limit_slept_metric = seconds_slept_metric.labels(endpoint, 'rate_limit')
+        self._backoff_slept_metric = seconds_slept_metric.labels(endpoint, 'backoff')
+        self._circuit_open_slept_metric = seconds_slept_metric.labels(endpoint, 'circuit_open')
+        self._pacing_slept_metric = seconds_slept_metric.labels(endpoint, 'pacing')
+        self._retries_metric = metrics.counter('trawler_api_retries_total',
+                                               "Twitter API calls retried after a transient error", ['endpoint', 'reason'])
+        self._backoff_depth_metric = metrics.gauge('trawler_api_backoff_depth',
+                                                   "Number of retries so far for the current Twitter API call",
+                                                   ['endpoint']).labels(endpoint)
+        self._calls_remaining_metric = metrics.gauge('trawler_api_calls_remaining',
+                                                     "Expected Twitter API calls remaining in the current rate limit window",
+                                                     ['endpoint']).labels(endpoint)
+        self._latency_metric = metrics.histogram('trawler_api_latency_seconds',
+                                                 "Twitter API call latency", ['endpoint']).labels(endpoint)
+
+
+    def _wait_for_pacing_token(self):
+        """
+        Sleeps until the token bucket has a token for the next API
+        call, and then spends the token
+        """
+        current_time = time.time()
+        seconds_left_in_window = self._current_rate_limit_window_ends - current_time
+        if seconds_left_in_window <= 0:
+            # The window is about to be reset, so the remaining calls can't be paced
+            return
 
-            # Recursion! Sleep some more if necessary after updating rate limit status
-            self._sleep_if_rate_limit_reached()
+        tokens_per_second = self._api_calls_remaining_for_current_window / seconds_left_in_window
+        self._pacing_tokens = min(float(self.PACING_BURST_SIZE),
+                                  self._pacing_tokens + (current_time - self._pacing_tokens_updated) * tokens_per_second)
+        self._pacing_tokens_updated = current_time
+
+        if self._pacing_tokens < 1:
+            seconds_to_sleep = (1 - self._pacing_tokens) / tokens_per_second
+            self._sleep(seconds_to_sleep, self._pacing_slept_metric)
+            self._pacing_tokens = 1.0
+            self._pacing_tokens_updated = time.time()
+        self._pacing_tokens -= 1
+
+
+    def _sleep(self, seconds, seconds_slept_metric):
+        self._seconds_slept += seconds
+        seconds_slept_metric.inc(seconds)
+        with self._profiler.span('sleep'):
+            time.sleep(seconds)
+
+
+    def _get_rate_limit_status(self):
+        with self._profiler.span('network'):
+            return self._twython.get_application_rate_limit_status(resources=self._twitter_api_resource)
+
+
+    def _make_auth_error(self, e):
+        # The error has no HTTP status code, so that callers don't mistake an invalid
+        # bearer token for an unavailable Twitter user.  The TwythonAuthError type
+        # stops RetryPolicy from treating it as a connection error.
+        token_cache_filename = getattr(self._twython, 'token_cache_filename', None)
+        if token_cache_filename:
+            return TwythonAuthError("Unable to authenticate with Twitter (%s) - check the consumer key and secret, "
+                                    "or delete the token cache file '%s'" % (e, token_cache_filename))
+        return TwythonAuthError("Unable to authenticate with Twitter (%s)" % e)
 
 
     def _update_rate_limit_status(self):
         #  https://dev.twitter.com/docs/api/1.1/get/application/rate_limit_status
-        rate_limit_status = self._twython.get_application_rate_limit_status(resources=self._twitter_api_resource)
+        try:
+            rate_limit_status = self._get_rate_limit_status()
+        except TwythonAuthError as e:
+            if not isinstance(self._twython, AppAuthTwython):
+                raise self._make_auth_error(e)
+            # The cached bearer token may have been invalidated
+            self._logger.warn("Twitter rejected the bearer token (%s), obtaining a new token" % e)
+            self._twython.renew_access_token()
+            try:
+                rate_limit_status = self._get_rate_limit_status()
+            except TwythonAuthError as e:
+                raise self._make_auth_error(e)
 
         self._current_rate_limit_window_ends = rate_limit_status['resources'][self._twitter_api_resource][self._twitter_api_endpoint_with_prefix]['reset']
 
         self._api_calls_remaining_for_current_window = rate_limit_status['resources'][self._twitter_api_resource][self._twitter_api_endpoint_with_prefix]['remaining']
+        self._calls_remaining_metric.set(self._api_calls_remaining_for_current_window)
 
         dt = int(self._current_rate_limit_window_ends - time.time())
         rate_limit_ends = datetime.datetime.fromtimestamp(self._current_rate_limit_window_ends).strftime("%Y-%m-%d %H:%M:%S")
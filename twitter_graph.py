@@ -0,0 +1,326 @@
+"""
+Compact storage for the friend/follower graph of crawled Twitter users
+"""
+
+# Standard Library modules
+import os
+
+# Third party modules
+import numpy as np
+
+
+class FriendFollowerGraph:
+    """
+    Stores the directed "follows" edges discovered while crawling the
+    'friends/ids' and 'followers/ids' endpoints.
+
+    An edge (a, b) means that user a follows user b, so the Friends of
+    a user are its out-neighbors and the Followers of a user are its
+    in-neighbors.  Twitter user IDs are 64-bit integers.
+
+    Edges are kept in compressed sparse row (CSR) form: every user ID
+    seen is mapped to a dense node index, and the out-edges and
+    in-edges of each node are stored as sorted int64 arrays of node
+    indices.  Queries are answered with vectorized operations on the
+    sorted arrays, so the graph never needs to be re-fetched from the
+    Twitter API once a user has been crawled.
+
+    New edges are appended to a buffer, and are only merged into the
+    CSR arrays once the buffer holds as many edges as the CSR arrays
+    (and at least COMPACT_MIN_PENDING_EDGES), so the cost of merging
+    is amortized over the crawl.  Queries about a single user combine
+    the user's CSR row with a vectorized scan of the buffer.
+
+    Usage:
+      graph = FriendFollowerGraph()
+      graph.add_user(user_id, friend_ids, follower_ids, screen_name)
+      graph.save('crawl.graph.npz')
+      ...
+      graph = FriendFollowerGraph()
+      graph.load('crawl.graph.npz')
+      reciprocal_ids = graph.get_reciprocal_ids(user_id)
+    """
+    # Smallest number of buffered edges that are merged into the CSR arrays at once
+    COMPACT_MIN_PENDING_EDGES = 100000
+
+    def __init__(self):
+        # Dense node index -> Twitter user ID (sorted, so searchsorted maps IDs to indices)
+        self._node_ids = np.zeros(0, dtype=np.int64)
+
+        # CSR arrays for out-edges (Friends) and in-edges (Followers)
+        self._out_indptr = np.zeros(1, dtype=np.int64)
+        self._out_indices = np.zeros(0, dtype=np.int64)
+        self._in_indptr = np.zeros(1, dtype=np.int64)
+        self._in_indices = np.zeros(0, dtype=np.int64)
+
+        # Users whose Friends and Followers lists have been fully crawled: user ID -> screen name
+        self._crawled_screen_names = {}
+        # Lowercased screen name -> user ID
+        self._screen_name_ids = {}
+
+        # Edges added since the CSR arrays were last rebuilt.  The arrays grow by doubling, and
+        # only the first _pending_count entries are used.
+        self._pending_sources = np.zeros(0, dtype=np.int64)
+        self._pending_targets = np.zeros(0, dtype=np.int64)
+        self._pending_count = 0
+
+    def add_user(self, user_id, friend_ids, follower_ids, screen_name=None):
+        """
+        Record the complete Friends and Followers lists for user_id.
+
+        The edges are buffered, and are merged into the compact CSR
+        arrays when enough edges have been buffered, or when the whole
+        graph is queried or saved.
+        """
+        user_id = int(user_id)
+        friend_ids = np.asarray(friend_ids, dtype=np.int64)
+        follower_ids = np.asarray(follower_ids, dtype=np.int64)
+
+        self._add_pending_edges(np.repeat(np.int64(user_id), len(friend_ids)), friend_ids)
+        self._add_pending_edges(follower_ids, np.repeat(np.int64(user_id), len(follower_ids)))
+        self._add_crawled_user(user_id, screen_name or u'')
+        if self._pending_count >= max(self.COMPACT_MIN_PENDING_EDGES, len(self._out_indices)):
+            self._compact()
+
+    def has_user(self, user_id):
+        """
+        Returns True if the Friends and Followers of user_id have been crawled
+        """
+        return int(user_id) in self._crawled_screen_names
+
+    def get_user_id(self, screen_name):
+        """
+        Returns the user ID of a crawled user with the specified
+        screen_name, or None if no such user has been crawled.
+        """
+        return self._screen_name_ids.get(screen_name.lower())
+
+    def get_friend_ids(self, user_id):
+        """
+        Returns a sorted int64 array of the IDs of users that user_id follows
+        """
+        return self._get_neighbor_ids(self._out_indptr, self._out_indices, self._pending_sources, self._pending_targets,
+                                      user_id)
+
+    def get_follower_ids(self, user_id):
+        """
+        Returns a sorted int64 array of the IDs of users that follow user_id
+        """
+        return self._get_neighbor_ids(self._in_indptr, self._in_indices, self._pending_targets, self._pending_sources,
+                                      user_id)
+
+    def get_reciprocal_ids(self, user_id):
+        """
+        Returns a sorted int64 array of the IDs of users who are both
+        Friends and Followers of user_id
+        """
+        return np.intersect1d(self.get_friend_ids(user_id), self.get_follower_ids(user_id), assume_unique=True)
+
+    def get_friend_overlap(self, user_id_a, user_id_b):
+        """
+        Returns a sorted int64 array of the IDs of users followed by
+        both user_id_a and user_id_b
+        """
+        return np.intersect1d(self.get_friend_ids(user_id_a), self.get_friend_ids(user_id_b), assume_unique=True)
+
+    def get_follower_overlap(self, user_id_a, user_id_b):
+        """
+        Returns a sorted int64 array of the IDs of users who follow
+        both user_id_a and user_id_b
+        """
+        return np.intersect1d(self.get_follower_ids(user_id_a), self.get_follower_ids(user_id_b), assume_unique=True)
+
+    def get_friend_jaccard_similarity(self, user_id_a, user_id_b):
+        """
+        Returns |F(a) & F(b)| / |F(a) | F(b)|, where F(x) is the set of
+        Friends of user x
+        """
+        friends_a = self.get_friend_ids(user_id_a)
+        friends_b = self.get_friend_ids(user_id_b)
+        union_size = len(np.union1d(friends_a, friends_b))
+        if union_size == 0:
+            return 0.0
+        return len(np.intersect1d(friends_a, friends_b, assume_unique=True)) / float(union_size)
+
+    def get_reciprocal_k_core_ids(self, k):
+        """
+        Returns a sorted int64 array of the IDs of users in the k-core
+        of the reciprocal (Friend-and-Follower) graph.
+
+        The k-core is the largest subgraph in which every user has at
+        least k reciprocal relationships with other users in the
+        subgraph.  Users are peeled away in vectorized rounds, removing
+        every user whose degree is below k at once.
+        """
+        self._compact()
+        sources, targets = self._get_reciprocal_edges()
+        num_nodes = len(self._node_ids)
+        alive = np.ones(num_nodes, dtype=bool)
+
+        while len(sources):
+            degree = np.bincount(sources, minlength=num_nodes)
+            below_k = alive & (degree < k)
+            if not below_k.any():
+                break
+            alive &= ~below_k
+            keep = alive[sources] & alive[targets]
+            sources = sources[keep]
+            targets = targets[keep]
+
+        if len(sources) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return self._node_ids[np.unique(sources)]
+
+    def num_edges(self):
+        self._compact()
+        return len(self._out_indices)
+
+    def num_users(self):
+        self._compact()
+        return len(self._node_ids)
+
+    def save(self, filename):
+        """
+        Saves the graph to a NumPy .npz file.  The graph is written to
+        a temporary file that is then renamed, so an interrupted save
+        leaves the previous version of the file intact.
+        """
+        self._compact()
+        crawled_ids = np.array(sorted(self._crawled_screen_names), dtype=np.int64)
+        crawled_screen_names = np.array([self._crawled_screen_names[user_id] for user_id in crawled_ids],
+                                        dtype=np.unicode_)
+        # np.savez appends '.npz' to filenames that don't have it, so
+        # write through a file object to keep the caller's filename
+        temporary_filename = filename + '.tmp'
+        npz_file = open(temporary_filename, 'wb')
+        np.savez(npz_file,
+                 node_ids=self._node_ids,
+                 out_indptr=self._out_indptr,
+                 out_indices=self._out_indices,
+                 crawled_ids=crawled_ids,
+                 crawled_screen_names=crawled_screen_names)
+        npz_file.close()
+        os.rename(temporary_filename, filename)
+
+    def load(self, filename):
+        """
+        Loads a graph saved by save(), merging it with any edges that
+        have already been added to this instance
+        """
+        npz_file = np.load(filename)
+        node_ids = npz_file['node_ids']
+        out_indptr = npz_file['out_indptr']
+        out_indices = npz_file['out_indices']
+
+        self._add_pending_edges(np.repeat(node_ids, np.diff(out_indptr)), node_ids[out_indices])
+        for user_id, screen_name in zip(npz_file['crawled_ids'], npz_file['crawled_screen_names']):
+            self._add_crawled_user(int(user_id), unicode(screen_name))
+        npz_file.close()
+        self._compact()
+
+    def load_if_exists(self, filename):
+        if os.path.exists(filename):
+            self.load(filename)
+
+    def _add_crawled_user(self, user_id, screen_name):
+        # Keep the first screen name recorded for each crawled user
+        if user_id not in self._crawled_screen_names:
+            self._crawled_screen_names[user_id] = screen_name
+            if screen_name:
+                self._screen_name_ids.setdefault(screen_name.lower(), user_id)
+
+    def _add_pending_edges(self, sources, targets):
+        count = self._pending_count + len(sources)
+        if count > len(self._pending_sources):
+            capacity = max(count, 2 * len(self._pending_sources), 1024)
+            self._pending_sources = np.resize(self._pending_sources, capacity)
+            self._pending_targets = np.resize(self._pending_targets, capacity)
+        self._pending_sources[self._pending_count:count] = sources
+        self._pending_targets[self._pending_count:count] = targets
+        self._pending_count = count
+
+    def _compact(self):
+        """
+        Merges any pending edges and crawled users into the CSR arrays
+        """
+        crawled_ids = np.array(self._crawled_screen_names.keys(), dtype=np.int64)
+        if self._pending_count == 0 and _sorted_contains(self._node_ids, crawled_ids).all():
+            return
+
+        # Recover the current edge list as (user ID, user ID) pairs
+        current_sources = np.repeat(self._node_ids, np.diff(self._out_indptr))
+        current_targets = self._node_ids[self._out_indices]
+
+        sources = np.concatenate([current_sources, self._pending_sources[:self._pending_count]])
+        targets = np.concatenate([current_targets, self._pending_targets[:self._pending_count]])
+        self._pending_sources = np.zeros(0, dtype=np.int64)
+        self._pending_targets = np.zeros(0, dtype=np.int64)
+        self._pending_count = 0
+
+        # Crawled users are graph nodes even if they have no edges
+        self._node_ids = np.unique(np.concatenate([sources, targets, crawled_ids]))
+        source_indices = np.searchsorted(self._node_ids, sources)
+        target_indices = np.searchsorted(self._node_ids, targets)
+
+        # Deduplicate edges by encoding each (source, target) pair as a single int64
+        num_nodes = np.int64(len(self._node_ids))
+        edge_keys = np.unique(source_indices * num_nodes + target_indices)
+        source_indices = edge_keys // num_nodes
+        target_indices = edge_keys % num_nodes
+        self._out_indptr, self._out_indices = _build_csr(source_indices, target_indices, len(self._node_ids))
+
+        in_order = np.lexsort((source_indices, target_indices))
+        self._in_indptr, self._in_indices = _build_csr(target_indices[in_order], source_indices[in_order], len(self._node_ids))
+
+    def _get_reciprocal_edges(self):
+        """
+        Returns (sources, targets) arrays of node indices for every edge
+        whose reverse edge also exists
+        """
+        num_nodes = np.int64(len(self._node_ids))
+        sources = np.repeat(np.arange(num_nodes, dtype=np.int64), np.diff(self._out_indptr))
+        targets = self._out_indices
+        edge_keys = sources * num_nodes + targets
+        reverse_keys = targets * num_nodes + sources
+        # edge_keys is sorted because the CSR rows and their columns are sorted
+        is_reciprocal = _sorted_contains(edge_keys, reverse_keys)
+        return sources[is_reciprocal], targets[is_reciprocal]
+
+    def _get_neighbor_ids(self, indptr, indices, pending_keys, pending_values, user_id):
+        """
+        Returns a sorted int64 array of the IDs of the neighbors of
+        user_id in the CSR arrays and in the pending edges
+        """
+        user_id = int(user_id)
+        if bool(_sorted_contains(self._node_ids, user_id)):
+            node = np.searchsorted(self._node_ids, user_id)
+            neighbor_ids = self._node_ids[indices[indptr[node]:indptr[node+1]]]
+        else:
+            neighbor_ids = np.zeros(0, dtype=np.int64)
+        if self._pending_count:
+            is_match = pending_keys[:self._pending_count] == user_id
+            if is_match.any():
+                neighbor_ids = np.union1d(neighbor_ids, pending_values[:self._pending_count][is_match])
+        return neighbor_ids
+
+
+
+def _build_csr(row_indices, column_indices, num_rows):
+    """
+    Builds CSR (indptr, indices) arrays from row_indices and
+    column_indices, which must already be sorted by (row, column)
+    """
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_indices, minlength=num_rows), out=indptr[1:])
+    return indptr, np.asarray(column_indices, dtype=np.int64)
+
+
+def _sorted_contains(sorted_array, values):
+    """
+    Vectorized membership test of values in sorted_array
+    """
+    if len(sorted_array) == 0:
+        return np.zeros(np.shape(values), dtype=bool)
+    positions = np.searchsorted(sorted_array, values)
+    positions = np.minimum(positions, len(sorted_array) - 1)
+    return sorted_array[positions] == values
@@ -0,0 +1,134 @@
+"""
+Pooled, keep-alive HTTP transport with compressed responses for Twython
+"""
+
+# Standard Library modules
+import threading
+import weakref
+
+# Third party modules
+from requests.adapters import HTTPAdapter
+
+# Local modules
+from crawler_metrics import get_default_registry
+
+
+# Connections kept open per host - enough for one thread per endpoint of a pipelined crawler
+DEFAULT_POOL_SIZE = 10
+
+
+
+###  Functions  ###
+
+def configure_twython_transport(twython, pool_size=DEFAULT_POOL_SIZE, compression=True, metrics=None):
+    """
+    Replaces the connection handling of a Twython instance's Requests
+    session with a TwitterTransport, and returns the transport.
+
+    pool_size -- the number of connections kept open to each host.
+    This should be at least the number of threads sharing the Twython
+    instance; with fewer connections, the threads open (and do TLS
+    handshakes for) new connections that are closed after one request.
+
+    compression -- if True, ask for gzip compressed responses.  Tweets
+    compress to about a fifth of their size.
+    """
+    transport = TwitterTransport(pool_size=pool_size, metrics=metrics)
+    twython.client.mount('https://', transport)
+    twython.client.mount('http://', transport)
+    if compression:
+        twython.client.headers['Accept-Encoding'] = 'gzip, deflate'
+    else:
+        twython.client.headers['Accept-Encoding'] = 'identity'
+    twython.client.headers['Connection'] = 'keep-alive'
+    return transport
+
+
+
+###  Classes  ###
+
+class TwitterTransport(HTTPAdapter):
+    """
+    A Requests transport adapter that keeps up to pool_size
+    connections to each host open for reuse, and counts the requests
+    made, the connections opened and the bytes received, so that
+    connection reuse and compression can be measured (e.g. with
+    load_test_crawler.py).
+
+    Responses are read completely by send(), so that the number of
+    compressed bytes received can be recorded.  Twython never streams
+    responses, so this doesn't change when the bytes are read.
+    """
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, metrics=None):
+        self._stats_lock = threading.Lock()
+        self._request_count = 0
+        self._bytes_received = 0
+        self._bytes_decoded = 0
+        self._connections_opened = 0
+        # Weak references, so that closed pools (and their sockets) can be freed
+        self._pool_connection_counts = weakref.WeakKeyDictionary()
+
+        if metrics is None:
+            metrics = get_default_registry()
+        self._requests_metric = metrics.counter('trawler_http_requests_total',
+                                                "HTTP requests made to the Twitter API").labels()
+        bytes_metric = metrics.counter('trawler_http_response_bytes_total',
+                                       "Bytes of Twitter API responses, as received and after decompression",
+                                       ['encoding'])
+        self._bytes_received_metric = bytes_metric.labels('received')
+        self._bytes_decoded_metric = bytes_metric.labels('decoded')
+        self._connections_metric = metrics.counter('trawler_http_connections_opened_total',
+                                                   "HTTP connections opened to the Twitter API").labels()
+
+        # pool_connections is the number of hosts with pools; the crawler only talks to the API host
+        HTTPAdapter.__init__(self, pool_connections=4, pool_maxsize=pool_size)
+
+    def get_stats(self):
+        """
+        Returns a dictionary with the number of requests made
+        ('requests'), connections opened ('connections_opened'),
+        requests that reused an open connection ('connections_reused'),
+        and response bytes received ('bytes_received') and after
+        decompression ('bytes_decoded')
+        """
+        with self._stats_lock:
+            return {
+                'requests': self._request_count,
+                'connections_opened': self._connections_opened,
+                'connections_reused': max(self._request_count - self._connections_opened, 0),
+                'bytes_received': self._bytes_received,
+                'bytes_decoded': self._bytes_decoded,
+            }
+
+    def send(self, request, **kwargs):
+        response = HTTPAdapter.send(self, request, **kwargs)
+        content = response.content
+        bytes_received = response.raw.tell()
+        bytes_decoded = len(content) if content else 0
+
+        with self._stats_lock:
+            self._request_count += 1
+            self._bytes_received += bytes_received
+            self._bytes_decoded += bytes_decoded
+            new_connections = self._count_new_connections()
+        self._requests_metric.inc()
+        self._bytes_received_metric.inc(bytes_received)
+        self._bytes_decoded_metric.inc(bytes_decoded)
+        if new_connections:
+            self._connections_metric.inc(new_connections)
+        return response
+
+    def _count_new_connections(self):
+        # urllib3 counts the connections each pool opens, but pools are
+        # discarded when the session is closed, so the increase since
+        # the last request is added to a running total instead
+        pools = self.poolmanager.pools
+        new_connections = 0
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            new_connections += pool.num_connections - self._pool_connection_counts.get(pool, 0)
+            self._pool_connection_counts[pool] = pool.num_connections
+        self._connections_opened += new_connections
+        return new_connections